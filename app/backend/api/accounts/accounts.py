@@ -1,22 +1,43 @@
 from datetime import datetime
+from typing import List
 
 from fastapi import APIRouter, Body, Depends, HTTPException, status
 from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 
 from api.accounts import crud
+from api.accounts.last_login import last_login_writer
+from api.accounts.password_rehash import password_rehasher
 from models.accounts.pydantic import (AccountPayloadSchema,
-                                      AccountResponseSchema, LoginSchema)
+                                      AccountResponseSchema,
+                                      ApiKeyCreatedSchema, ApiKeyPayloadSchema,
+                                      ApiKeyResponseSchema,
+                                      BulkAccountResultSchema, LoginSchema,
+                                      RefreshTokenSchema, RolesUpdateSchema)
 from models.accounts.tortoise import UsersAccount
 from models.requests.authentication import AuthHandler
+from models.requests.rate_limit import rate_limiter
 
 router = APIRouter()
 
+# Upper bound for one bulk registration call
+BULK_REGISTER_MAX_ACCOUNTS = 1000
+
 # instantiate the Auth Handler
 auth_handler = AuthHandler()
 
+# Checked before the account lookup and bcrypt
+login_limit = rate_limiter.limit("login_ip", "login_username")
+password_limit = rate_limiter.limit("login_ip")
+
 
-@router.post("/register", response_model=AccountResponseSchema, status_code=201)
+@router.post(
+    "/register",
+    response_model=AccountResponseSchema,
+    status_code=201,
+    dependencies=[Depends(password_limit)],
+)
 async def create_account(payload: AccountPayloadSchema) -> AccountResponseSchema:
     """Create a new user account.
 
@@ -36,7 +57,42 @@ async def create_account(payload: AccountPayloadSchema) -> AccountResponseSchema
     return JSONResponse(status_code=status.HTTP_201_CREATED, content=response_object)
 
 
-@router.post("/login", status_code=200)
+@router.post(
+    "/register/bulk", response_model=List[BulkAccountResultSchema], status_code=200
+)
+async def create_accounts_bulk(
+    payload: List[AccountPayloadSchema],
+    auth_details=Depends(auth_handler.auth_wrapper),
+) -> JSONResponse:
+    """Create many user accounts in one call.
+
+    Args:
+        payload (List[AccountPayloadSchema]): The accounts to create.
+        auth_details (dict, optional): The authentication details.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If the user is not an ADMIN.
+        HTTPException: If the batch is empty or too large.
+
+    Returns:
+        JSONResponse: One result per account, in request order.
+    """
+    if "ADMIN" not in auth_details["list_of_roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only ADMIN can register accounts in bulk.",
+        )
+    if not payload or len(payload) > BULK_REGISTER_MAX_ACCOUNTS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Provide between 1 and {BULK_REGISTER_MAX_ACCOUNTS} accounts.",
+        )
+    results = await crud.create_accounts_bulk(payload)
+    return JSONResponse(status_code=status.HTTP_200_OK, content=results)
+
+
+@router.post("/login", status_code=200, dependencies=[Depends(login_limit)])
 async def login_account(payload: LoginSchema) -> JSONResponse:
     """Log in a user account.
 
@@ -55,19 +111,109 @@ async def login_account(payload: LoginSchema) -> JSONResponse:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
         )
-    if not auth_handler.verify_password(payload.password, account["password"]):
+    # bcrypt is CPU bound, keep it off the event loop
+    if not await run_in_threadpool(
+        auth_handler.verify_password, payload.password, account["password"]
+    ):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
         )
-    # Update last login time
-    current_time = datetime.utcnow()  # Use datetime object, not string
-    await UsersAccount.filter(username=payload.username).update(last_login=current_time)
+    # last_login is written behind in batches, not on the request path
+    last_login_writer.touch(account["username"], datetime.utcnow())
+    # Upgrade hashes made with an old scheme or cost, also off the request path
+    if auth_handler.needs_rehash(account["password"]):
+        password_rehasher.schedule(
+            account["username"], payload.password, account["password"]
+        )
     # Generate token
     token = auth_handler.encode_token(account["username"], account["list_of_roles"])
-    return JSONResponse(status_code=status.HTTP_200_OK, content={"token": token})
+    refresh_token = await crud.create_refresh_token(account["username"])
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"token": token, "refresh_token": refresh_token},
+    )
+
+
+@router.post("/refresh", status_code=200)
+async def refresh_session(payload: RefreshTokenSchema) -> JSONResponse:
+    """Exchange a refresh token for a new access token.
+
+    The refresh token is rotated: the presented one is revoked and a new one
+    is returned alongside the access token. No password hashing is involved.
+
+    Args:
+        payload (RefreshTokenSchema): The refresh token.
+
+    Raises:
+        HTTPException: If the refresh token is unknown, expired or revoked.
+
+    Returns:
+        JSONResponse: The new access token and refresh token.
+    """
+    rotated = await crud.rotate_refresh_token(payload.refresh_token)
+    if not rotated:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token"
+        )
+    account, refresh_token = rotated
+    token = auth_handler.encode_token(account["username"], account["list_of_roles"])
+    return JSONResponse(
+        status_code=status.HTTP_200_OK,
+        content={"token": token, "refresh_token": refresh_token},
+    )
+
+
+@router.post("/logout", status_code=200)
+async def logout(payload: RefreshTokenSchema) -> JSONResponse:
+    """Revoke a refresh token.
+
+    Args:
+        payload (RefreshTokenSchema): The refresh token to revoke.
+
+    Returns:
+        JSONResponse: The response indicating the result of the logout.
+    """
+    await crud.revoke_refresh_token(payload.refresh_token)
+    return JSONResponse(
+        status_code=status.HTTP_200_OK, content={"message": "Logged out"}
+    )
+
+
+@router.post("/tokens/revoke", status_code=200)
+async def revoke_current_token(
+    auth_details=Depends(auth_handler.auth_wrapper),
+) -> JSONResponse:
+    """Revoke the access token used for this request.
+
+    Args:
+        auth_details (dict, optional): Authentication details containing the token id.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If the token carries no id (issued before revocation existed).
+
+    Returns:
+        JSONResponse: The response indicating the result of the revocation.
+    """
+    if not auth_details.get("jti"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Token cannot be revoked",
+        )
+    await crud.revoke_access_token(
+        auth_details["jti"], auth_details["username"], auth_details["exp"]
+    )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK, content={"message": "Token revoked"}
+    )
 
 
-@router.post("/reset-password", response_description="Reset password", status_code=200)
+@router.post(
+    "/reset-password",
+    response_description="Reset password",
+    status_code=200,
+    dependencies=[Depends(password_limit)],
+)
 async def reset_password(
     token: str = Body(...), new_password: str = Body(...)
 ) -> JSONResponse:
@@ -186,3 +332,135 @@ async def get_users_by_role(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error retrieving users: {str(e)}"
         )
+
+
+@router.put(
+    "/users/{username}/roles", response_model=AccountResponseSchema, status_code=200
+)
+async def update_user_roles(
+    username: str,
+    payload: RolesUpdateSchema,
+    auth_details=Depends(auth_handler.auth_wrapper),
+) -> JSONResponse:
+    """Replace the roles of a user account.
+
+    Args:
+        username (str): The username of the account to update.
+        payload (RolesUpdateSchema): The new list of roles.
+        auth_details (dict, optional): The authentication details.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If the user is not an ADMIN.
+        HTTPException: If the account is not found.
+
+    Returns:
+        JSONResponse: The response containing the updated account details.
+    """
+    if "ADMIN" not in auth_details["list_of_roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only ADMIN can change user roles.",
+        )
+    account = await crud.update_roles(username, payload.list_of_roles)
+    if not account:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
+        )
+    response_object = {
+        "username": account["username"],
+        "email": account["email"],
+        "list_of_roles": account["list_of_roles"],
+        "is_verified": account["is_verified"],
+    }
+    return JSONResponse(status_code=status.HTTP_200_OK, content=response_object)
+
+
+@router.post("/api-keys", response_model=ApiKeyCreatedSchema, status_code=201)
+async def create_api_key(
+    payload: ApiKeyPayloadSchema,
+    auth_details=Depends(auth_handler.auth_wrapper),
+) -> ApiKeyCreatedSchema:
+    """Issue an API key for an instrument or integration (ADMIN only).
+
+    Args:
+        payload (ApiKeyPayloadSchema): The key name, account, scopes and limits.
+        auth_details (dict, optional): The authentication details.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If the user is not an ADMIN.
+        HTTPException: If the account does not exist.
+
+    Returns:
+        ApiKeyCreatedSchema: The key details, including the key itself.
+    """
+    if "ADMIN" not in auth_details["list_of_roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only ADMIN can issue API keys.",
+        )
+    created = await crud.create_api_key(payload, auth_details["username"])
+    if not created:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Account not found"
+        )
+    key, api_key = created
+    return {**key, "api_key": api_key}
+
+
+@router.get("/api-keys", response_model=List[ApiKeyResponseSchema], status_code=200)
+async def list_api_keys(
+    auth_details=Depends(auth_handler.auth_wrapper),
+) -> List[ApiKeyResponseSchema]:
+    """List all API keys (ADMIN only).
+
+    Args:
+        auth_details (dict, optional): The authentication details.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If the user is not an ADMIN.
+
+    Returns:
+        List[ApiKeyResponseSchema]: The keys, without the secrets.
+    """
+    if "ADMIN" not in auth_details["list_of_roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only ADMIN can list API keys.",
+        )
+    return await crud.get_api_keys()
+
+
+@router.delete("/api-keys/{prefix}", status_code=200)
+async def revoke_api_key(
+    prefix: str,
+    auth_details=Depends(auth_handler.auth_wrapper),
+) -> JSONResponse:
+    """Revoke an API key (ADMIN only).
+
+    Args:
+        prefix (str): The key prefix.
+        auth_details (dict, optional): The authentication details.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If the user is not an ADMIN.
+        HTTPException: If no active key has this prefix.
+
+    Returns:
+        JSONResponse: The response indicating the result of the revocation.
+    """
+    if "ADMIN" not in auth_details["list_of_roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only ADMIN can revoke API keys.",
+        )
+    if not await crud.revoke_api_key(prefix):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="API key not found"
+        )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK, content={"message": "API key revoked"}
+    )
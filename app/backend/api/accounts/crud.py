@@ -1,15 +1,123 @@
-from typing import List, Union
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 
 from fastapi import HTTPException, status
+from tortoise.transactions import in_transaction
 
-from models.accounts.pydantic import AccountPayloadSchema
-from models.accounts.tortoise import UsersAccount
-from models.requests.authentication import AuthHandler
-from datetime import datetime
+from models.accounts.pydantic import AccountPayloadSchema, ApiKeyPayloadSchema
+from models.accounts.tortoise import (ApiKey, RefreshToken, RevokedToken,
+                                     UserRole, UsersAccount)
+from models.requests.api_keys import API_KEY_RATE_LIMIT, api_key_handler
+from models.requests.authentication import REFRESH_EXPIRE_DAYS, AuthHandler
+from models.requests.revocation import revocation_list
+from datetime import datetime, timedelta, timezone
 
 # instantiate the Auth Handler
 auth_handler = AuthHandler()
 
+# role -> (expiry, accounts); invalidated after every role write in this
+# worker commits, the TTL bounds staleness for writes made by other workers
+ROLE_CACHE_TTL_SECONDS = 60
+_users_by_role_cache: Dict[str, Tuple[float, List]] = {}
+# Bumped by every invalidation, so a lookup that raced a write is not cached
+_role_cache_generation = 0
+
+
+# Worker processes for bcrypt during bulk registration, forked by
+# start_hash_pool at startup before any request is served
+_hash_pool: Optional[ProcessPoolExecutor] = None
+
+# Username conflicts are skipped by the primary key, email has no unique
+# constraint so it is re-checked here; RETURNING tells which rows went in
+BULK_INSERT_ACCOUNTS_SQL = (
+    'INSERT INTO "usersaccount" ("username", "email", "password", "list_of_roles", '
+    '"created_at", "is_verified", "last_login") '
+    "SELECT v.* FROM unnest($1::varchar[], $2::varchar[], $3::varchar[], $4::jsonb[], "
+    "$5::timestamptz[], $6::bool[], $7::timestamptz[]) "
+    "AS v(username, email, password, list_of_roles, created_at, is_verified, last_login) "
+    'WHERE NOT EXISTS (SELECT 1 FROM "usersaccount" AS u WHERE u."email" = v.email) '
+    'ON CONFLICT ("username") DO NOTHING RETURNING "username"'
+)
+
+# Everything but the hash is safe to show to admins
+API_KEY_FIELDS = (
+    "prefix",
+    "name",
+    "username",
+    "scopes",
+    "rate_limit_per_minute",
+    "created_at",
+    "created_by",
+    "expires_at",
+    "revoked_at",
+)
+
+
+def hash_password(password: str) -> str:
+    """Hash a password; module level so it can run in a worker process."""
+    return AuthHandler.pwd_context.hash(password)
+
+
+def start_hash_pool() -> None:
+    """Fork the bcrypt worker processes; call once at application startup."""
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        # Workers are forked on the first submit, do it before serving
+        _hash_pool.submit(os.getpid).result()
+
+
+def get_hash_pool() -> Optional[ProcessPoolExecutor]:
+    """The bcrypt worker pool, or None to hash in the thread pool instead."""
+    return _hash_pool
+
+
+def _utc(when: Optional[datetime]) -> Optional[datetime]:
+    # asyncpg reads naive datetimes as local time, ours are UTC
+    if when is None or when.tzinfo:
+        return when
+    return when.replace(tzinfo=timezone.utc)
+
+
+def shutdown_hash_pool() -> None:
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+
+def invalidate_role_cache() -> None:
+    """Drop all cached role -> users mappings.
+
+    Call it after the transaction that changed the roles has committed.
+    """
+    global _role_cache_generation
+    _role_cache_generation += 1
+    _users_by_role_cache.clear()
+
+
+async def sync_roles(username: str, list_of_roles: List, connection=None) -> None:
+    """Rewrite the UserRole rows of an account from its list_of_roles.
+
+    The caller invalidates the role cache once its transaction commits.
+
+    Args:
+        username (str): The username of the account.
+        list_of_roles (List): The roles stored in UsersAccount.list_of_roles.
+        connection (optional): The transaction to run in. Defaults to None.
+    """
+    roles = {getattr(role, "value", role) for role in list_of_roles or []}
+    await UserRole.filter(username=username).using_db(connection).delete()
+    if roles:
+        await UserRole.bulk_create(
+            [UserRole(username=username, role=role) for role in sorted(roles)],
+            using_db=connection,
+        )
+
 
 async def create_account(payload: AccountPayloadSchema) -> int:
     """Create a new user account.
@@ -46,10 +154,118 @@ async def create_account(payload: AccountPayloadSchema) -> int:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already exists"
         )
-    await account.save()
+    async with in_transaction() as connection:
+        await account.save(using_db=connection)
+        await sync_roles(account.username, account.list_of_roles, connection)
+    invalidate_role_cache()
     return account.username
 
 
+async def create_accounts_bulk(payloads: List[AccountPayloadSchema]) -> List[dict]:
+    """Create many user accounts at once.
+
+    Uniqueness is checked for the whole batch with one query on usernames and
+    one on emails, passwords are hashed in parallel in worker processes so the
+    event loop stays responsive, and all valid rows are inserted with a
+    single INSERT ... ON CONFLICT DO NOTHING in one transaction. Accounts
+    created concurrently after the checks are skipped by that insert and
+    reported as errors.
+
+    Args:
+        payloads (List[AccountPayloadSchema]): The accounts to create.
+
+    Returns:
+        List[dict]: One result per payload, in order, with the index,
+            username, status ("created" or "error") and an error detail.
+    """
+    usernames = [payload.username.lower() for payload in payloads]
+    emails = [payload.email.lower() for payload in payloads]
+    existing_usernames = set(
+        await UsersAccount.filter(username__in=set(usernames)).values_list(
+            "username", flat=True
+        )
+    )
+    existing_emails = set(
+        await UsersAccount.filter(email__in=set(emails)).values_list(
+            "email", flat=True
+        )
+    )
+
+    results = []
+    valid = []
+    seen_usernames, seen_emails = set(), set()
+    for index, (payload, username, email) in enumerate(
+        zip(payloads, usernames, emails)
+    ):
+        detail = None
+        if username in existing_usernames:
+            detail = "Username already exists"
+        elif email in existing_emails:
+            detail = "Email already exists"
+        elif username in seen_usernames:
+            detail = "Duplicate username in batch"
+        elif email in seen_emails:
+            detail = "Duplicate email in batch"
+        seen_usernames.add(username)
+        seen_emails.add(email)
+        results.append(
+            {
+                "index": index,
+                "username": username,
+                "status": "error" if detail else "created",
+                "detail": detail,
+            }
+        )
+        if not detail:
+            valid.append((payload, username, email))
+
+    if not valid:
+        return results
+
+    loop = asyncio.get_running_loop()
+    pool = get_hash_pool()
+    hashes = await asyncio.gather(
+        *[
+            loop.run_in_executor(pool, hash_password, payload.password)
+            for payload, _, _ in valid
+        ]
+    )
+
+    now = datetime.utcnow()
+    params = [
+        [username for _, username, _ in valid],
+        [email for _, _, email in valid],
+        list(hashes),
+        [
+            json.dumps([getattr(r, "value", r) for r in payload.list_of_roles or []])
+            for payload, _, _ in valid
+        ],
+        [_utc(payload.created_at or now) for payload, _, _ in valid],
+        [payload.is_verified for payload, _, _ in valid],
+        [_utc(payload.last_login) for payload, _, _ in valid],
+    ]
+    async with in_transaction() as connection:
+        rows = await connection.execute_query_dict(BULK_INSERT_ACCOUNTS_SQL, params)
+        inserted = {row["username"] for row in rows}
+        roles = [
+            UserRole(username=username, role=role)
+            for payload, username, _ in valid
+            if username in inserted
+            for role in sorted(
+                {getattr(r, "value", r) for r in payload.list_of_roles or []}
+            )
+        ]
+        if roles:
+            await UserRole.bulk_create(roles, using_db=connection)
+    invalidate_role_cache()
+
+    for result in results:
+        if result["status"] == "created" and result["username"] not in inserted:
+            result["status"] = "error"
+            result["detail"] = "Username or email already exists"
+    return results
+
+
 async def get(username: str) -> Union[dict, None]:
     """Retrieve a user account by username.
 
@@ -75,14 +291,233 @@ async def get_all() -> List:
     return accounts
 
 
+async def update_roles(username: str, list_of_roles: List) -> Union[dict, None]:
+    """Replace the roles of a user account.
+
+    The JSON list_of_roles (used for the JWT claim) and the UserRole rows are
+    written in one transaction so both views stay consistent. Tokens issued
+    before the change keep their old claim until they expire.
+
+    Args:
+        username (str): The username of the account to update.
+        list_of_roles (List): The new roles.
+
+    Returns:
+        Union[dict, None]: The updated account or None if not found.
+    """
+    roles = [getattr(role, "value", role) for role in list_of_roles]
+    async with in_transaction() as connection:
+        updated = await UsersAccount.filter(username=username).using_db(
+            connection
+        ).update(list_of_roles=roles)
+        if not updated:
+            return None
+        await sync_roles(username, roles, connection)
+    invalidate_role_cache()
+    api_key_handler.invalidate_user(username)
+    return await get(username)
+
+
 async def get_users_by_role(role: str) -> List:
     """Retrieve all user accounts with a specific role.
 
+    Looks the role up in the indexed UserRole table and caches the result
+    per worker for ROLE_CACHE_TTL_SECONDS.
+
     Args:
         role (str): The role to filter by (e.g., "PRODUCER").
 
     Returns:
-        List: A list of user accounts with the specified role.
+        List: A list of user accounts with the specified role, a copy the
+            caller may modify.
     """
-    accounts = await UsersAccount.filter(list_of_roles__contains=[role]).values()
+    cached = _users_by_role_cache.get(role)
+    if cached and cached[0] > time.monotonic():
+        return [dict(account) for account in cached[1]]
+    generation = _role_cache_generation
+    usernames = await UserRole.filter(role=role).values_list("username", flat=True)
+    accounts = []
+    if usernames:
+        accounts = await UsersAccount.filter(username__in=list(usernames)).values()
+    if generation == _role_cache_generation:
+        _users_by_role_cache[role] = (
+            time.monotonic() + ROLE_CACHE_TTL_SECONDS,
+            [dict(account) for account in accounts],
+        )
     return accounts
+
+
+async def create_refresh_token(username: str, connection=None) -> str:
+    """Issue a new refresh token for a user.
+
+    Args:
+        username (str): The username the token belongs to.
+        connection (optional): The transaction to run in. Defaults to None.
+
+    Returns:
+        str: The opaque refresh token; only its hash is stored.
+    """
+    token, token_hash = auth_handler.generate_refresh_token()
+    await RefreshToken.create(
+        token_hash=token_hash,
+        username=username,
+        expires_at=datetime.utcnow() + timedelta(days=REFRESH_EXPIRE_DAYS),
+        using_db=connection,
+    )
+    return token
+
+
+async def rotate_refresh_token(token: str) -> Union[Tuple[dict, str], None]:
+    """Exchange a refresh token for a new one.
+
+    The presented token is revoked with a conditional UPDATE, so two
+    concurrent refreshes with the same token cannot both succeed. Presenting
+    an already revoked token is treated as theft and revokes every active
+    token of that user.
+
+    Args:
+        token (str): The refresh token presented by the client.
+
+    Returns:
+        Union[Tuple[dict, str], None]: The account (username and roles) and
+            the new refresh token, or None if the token is not valid.
+    """
+    token_hash = auth_handler.hash_refresh_token(token)
+    now = datetime.utcnow()
+    async with in_transaction() as connection:
+        stored = await RefreshToken.filter(token_hash=token_hash).using_db(
+            connection
+        ).first()
+        if not stored:
+            return None
+        if stored.revoked_at is not None:
+            await revoke_user_refresh_tokens(stored.username, connection)
+            return None
+        new_token, new_hash = auth_handler.generate_refresh_token()
+        rotated = await RefreshToken.filter(
+            token_hash=token_hash, revoked_at__isnull=True, expires_at__gt=now
+        ).using_db(connection).update(revoked_at=now, replaced_by=new_hash)
+        if not rotated:
+            return None
+        account = await UsersAccount.filter(username=stored.username).using_db(
+            connection
+        ).first().values("username", "list_of_roles")
+        if not account:
+            return None
+        await RefreshToken.create(
+            token_hash=new_hash,
+            username=stored.username,
+            expires_at=now + timedelta(days=REFRESH_EXPIRE_DAYS),
+            using_db=connection,
+        )
+    return account, new_token
+
+
+async def revoke_refresh_token(token: str) -> bool:
+    """Revoke a single refresh token, e.g. on logout.
+
+    Args:
+        token (str): The refresh token presented by the client.
+
+    Returns:
+        bool: True if an active token was revoked.
+    """
+    revoked = await RefreshToken.filter(
+        token_hash=auth_handler.hash_refresh_token(token), revoked_at__isnull=True
+    ).update(revoked_at=datetime.utcnow())
+    return bool(revoked)
+
+
+async def revoke_user_refresh_tokens(username: str, connection=None) -> int:
+    """Revoke every active refresh token of a user.
+
+    Args:
+        username (str): The username whose sessions are ended.
+        connection (optional): The transaction to run in. Defaults to None.
+
+    Returns:
+        int: The number of revoked tokens.
+    """
+    return await RefreshToken.filter(
+        username=username, revoked_at__isnull=True
+    ).using_db(connection).update(revoked_at=datetime.utcnow())
+
+
+async def revoke_access_token(jti: str, username: str, exp: int) -> bool:
+    """Revoke an access token before it expires.
+
+    The row is picked up by every worker's revocation list on its next
+    refresh; this worker rejects the token immediately.
+
+    Args:
+        jti (str): The token id claim.
+        username (str): The user the token was issued to.
+        exp (int): The token expiry as a unix timestamp.
+
+    Returns:
+        bool: True if the token was not revoked before.
+    """
+    _, created = await RevokedToken.get_or_create(
+        jti=jti,
+        defaults={
+            "username": username,
+            "expires_at": datetime.fromtimestamp(exp, tz=timezone.utc),
+        },
+    )
+    revocation_list.add(jti, exp)
+    return created
+
+
+async def create_api_key(
+    payload: ApiKeyPayloadSchema, created_by: str
+) -> Union[Tuple[dict, str], None]:
+    """Issue an API key that acts as an existing account.
+
+    Args:
+        payload (ApiKeyPayloadSchema): The key name, account, scopes and limits.
+        created_by (str): The admin issuing the key.
+
+    Returns:
+        Union[Tuple[dict, str], None]: The stored key details and the key
+            itself, or None if the account does not exist.
+    """
+    account = await UsersAccount.filter(username=payload.username).first().values("username")
+    if not account:
+        return None
+    api_key, prefix, key_hash = api_key_handler.generate_api_key()
+    key = await ApiKey.create(
+        key_hash=key_hash,
+        prefix=prefix,
+        name=payload.name,
+        username=account["username"],
+        scopes=[scope.value for scope in payload.scopes],
+        rate_limit_per_minute=payload.rate_limit_per_minute or API_KEY_RATE_LIMIT,
+        created_by=created_by,
+        expires_at=payload.expires_at,
+    )
+    return {field: getattr(key, field) for field in API_KEY_FIELDS}, api_key
+
+
+async def get_api_keys() -> List:
+    """Get all API keys, without their hashes."""
+    return await ApiKey.all().order_by("-created_at").values(*API_KEY_FIELDS)
+
+
+async def revoke_api_key(prefix: str) -> bool:
+    """Revoke an API key by its prefix.
+
+    Other workers stop accepting the key once their cached copy expires,
+    at most API_KEY_CACHE_SECONDS later.
+
+    Args:
+        prefix (str): The key prefix shown when it was created.
+
+    Returns:
+        bool: True if an active key was revoked.
+    """
+    key = await ApiKey.filter(prefix=prefix, revoked_at__isnull=True).first()
+    if not key:
+        return False
+    await ApiKey.filter(key_hash=key.key_hash).update(revoked_at=datetime.utcnow())
+    api_key_handler.invalidate(key.key_hash)
+    return True
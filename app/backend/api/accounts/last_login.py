@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from decouple import config
+from tortoise import connections
+
+from models.requests.periodic import WriteBehindBuffer
+
+LAST_LOGIN_FLUSH_SECONDS = config("LAST_LOGIN_FLUSH_SECONDS", default=5, cast=float)
+
+# One statement for the whole batch; never moves last_login backwards
+FLUSH_SQL = (
+    'UPDATE "usersaccount" AS u SET "last_login" = v.last_login '
+    "FROM unnest($1::varchar[], $2::timestamptz[]) AS v(username, last_login) "
+    'WHERE u."username" = v.username '
+    'AND (u."last_login" IS NULL OR u."last_login" < v.last_login)'
+)
+
+
+class LastLoginWriter(WriteBehindBuffer[str, datetime]):
+    """Write-behind buffer for UsersAccount.last_login.
+
+    Logins only record the timestamp in memory; a background task writes
+    all pending timestamps every ``interval`` seconds in a single UPDATE.
+    Repeated logins of the same user between flushes coalesce into one row.
+    """
+
+    description = "flush last_login updates"
+
+    def __init__(self, interval: float = LAST_LOGIN_FLUSH_SECONDS):
+        super().__init__(interval)
+
+    def touch(self, username: str, when: Optional[datetime] = None) -> None:
+        """Record a login, keeping the latest timestamp per user."""
+        when = when or datetime.utcnow()
+        current = self._pending.get(username)
+        if current is None or current < when:
+            self._pending[username] = when
+
+    def restore(self, username: str, when: datetime) -> None:
+        # Newer logins recorded meanwhile win
+        self.touch(username, when)
+
+    async def write(self, pending: Dict[str, datetime]) -> None:
+        # asyncpg reads naive datetimes as local time, ours are UTC
+        timestamps = [
+            when if when.tzinfo else when.replace(tzinfo=timezone.utc)
+            for when in pending.values()
+        ]
+        await connections.get("default").execute_query(
+            FLUSH_SQL, [list(pending.keys()), timestamps]
+        )
+
+
+last_login_writer = LastLoginWriter()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from typing import Dict, Set, Tuple
+
+from decouple import config
+from fastapi.concurrency import run_in_threadpool
+from tortoise import connections
+
+from models.requests.authentication import AuthHandler
+from models.requests.periodic import WriteBehindBuffer
+
+log = logging.getLogger("uvicorn")
+
+PASSWORD_REHASH_FLUSH_SECONDS = config(
+    "PASSWORD_REHASH_FLUSH_SECONDS", default=5, cast=float
+)
+
+# Only replaces the hash the login verified, so a password reset made in
+# the meantime is never overwritten
+FLUSH_SQL = (
+    'UPDATE "usersaccount" AS u SET "password" = v.new_password '
+    "FROM unnest($1::varchar[], $2::varchar[], $3::varchar[]) "
+    "AS v(username, old_password, new_password) "
+    'WHERE u."username" = v.username AND u."password" = v.old_password'
+)
+
+
+class PasswordRehasher(WriteBehindBuffer[str, Tuple[str, str]]):
+    """Upgrade outdated password hashes after a successful login.
+
+    The new hash is computed in the thread pool after the login response
+    has been sent, and the results, username -> (verified hash, new hash),
+    are written every ``interval`` seconds in a single UPDATE.
+    """
+
+    description = "write rehashed passwords"
+
+    def __init__(self, interval: float = PASSWORD_REHASH_FLUSH_SECONDS):
+        super().__init__(interval)
+        self.auth_handler = AuthHandler()
+        self._hashing: Set[str] = set()
+        self._hash_tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, username: str, password: str, old_hash: str) -> None:
+        """Rehash a verified password in the background.
+
+        Args:
+            username (str): The account that logged in.
+            password (str): The plain text password that was just verified.
+            old_hash (str): The stored hash it was verified against.
+        """
+        if username in self._hashing or username in self._pending:
+            return
+        self._hashing.add(username)
+        task = asyncio.create_task(self._rehash(username, password, old_hash))
+        self._hash_tasks.add(task)
+        task.add_done_callback(self._hash_tasks.discard)
+
+    async def _rehash(self, username: str, password: str, old_hash: str) -> None:
+        try:
+            new_hash = await run_in_threadpool(
+                self.auth_handler.get_password_hash, password
+            )
+            self._pending[username] = (old_hash, new_hash)
+        except Exception as e:
+            log.warning(f"Failed to rehash password of {username}: {e}")
+        finally:
+            self._hashing.discard(username)
+
+    async def write(self, pending: Dict[str, Tuple[str, str]]) -> None:
+        await connections.get("default").execute_query(
+            FLUSH_SQL,
+            [
+                list(pending.keys()),
+                [old for old, _ in pending.values()],
+                [new for _, new in pending.values()],
+            ],
+        )
+
+    async def on_stop(self) -> None:
+        """Wait for running hashes, then write what is still pending."""
+        if self._hash_tasks:
+            await asyncio.gather(*self._hash_tasks, return_exceptions=True)
+        await super().on_stop()
+
+
+password_rehasher = PasswordRehasher()
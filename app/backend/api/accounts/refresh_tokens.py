@@ -0,0 +1,44 @@
+from datetime import datetime, timezone
+
+from decouple import config
+from tortoise import connections
+
+from models.requests.periodic import PeriodicTask
+
+REFRESH_TOKEN_SWEEP_SECONDS = config(
+    "REFRESH_TOKEN_SWEEP_SECONDS", default=3600, cast=float
+)
+
+# Revoked tokens are kept until they expire, rotate_refresh_token needs them
+# to recognise a replayed token; after that they are useless either way
+SWEEP_SQL = 'DELETE FROM "refreshtoken" WHERE "expires_at" < $1'
+
+
+class RefreshTokenSweeper(PeriodicTask):
+    """Delete expired refresh tokens every ``interval`` seconds.
+
+    Every login and every refresh adds a row, so without the sweep the
+    table grows by the number of sessions times the rotations per session.
+    """
+
+    description = "sweep expired refresh tokens"
+
+    def __init__(self, interval: float = REFRESH_TOKEN_SWEEP_SECONDS):
+        super().__init__(interval)
+
+    async def sweep(self) -> int:
+        """Delete expired tokens, revoked or not.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        count, _ = await connections.get("default").execute_query(
+            SWEEP_SQL, [datetime.now(timezone.utc)]
+        )
+        return count
+
+    async def tick(self) -> None:
+        await self.sweep()
+
+
+refresh_token_sweeper = RefreshTokenSweeper()
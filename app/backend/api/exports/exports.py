@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from api.exports.writer import EXPORT_DIR, MEDIA_TYPES, TableExport
+from models.exports.pydantic import (ExportFormat, ExportResultSchema,
+                                     ExportTable)
+from models.requests.authentication import AuthHandler
+
+router = APIRouter()
+auth_handler = AuthHandler()
+EXPORT_ROLES = {"ADMIN", "PRODUCTION_MANAGER"}
+
+
+def check_exporter(auth_details: dict) -> None:
+    """Require the ADMIN or PRODUCTION_MANAGER role."""
+    if not EXPORT_ROLES.intersection(auth_details["list_of_roles"]):
+        raise HTTPException(
+            status_code=403,
+            detail="You do not have permission to export data. Only ADMIN or PRODUCTION_MANAGER roles are allowed.",
+        )
+
+
+@router.get("/{table}")
+async def stream_export_endpoint(
+    table: ExportTable,
+    format: ExportFormat = ExportFormat.PARQUET,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    Stream a whole table as Parquet or an Arrow IPC stream.
+    
+    Args:
+        table (ExportTable): product_inventory, product_details or request_details.
+        format (ExportFormat, optional): parquet or arrow. Defaults to parquet.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to export data.
+    
+    Returns:
+        StreamingResponse: The file, sent while it is being written.
+    """
+    check_exporter(auth_details)
+    export = TableExport(table, format)
+    return StreamingResponse(
+        export.chunks(),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{export.filename}"',
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@router.post("/{table}", response_model=ExportResultSchema)
+async def write_export_endpoint(
+    table: ExportTable,
+    format: ExportFormat = ExportFormat.PARQUET,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    Write a whole table as Parquet or an Arrow IPC stream into EXPORT_DIR.
+    
+    Args:
+        table (ExportTable): product_inventory, product_details or request_details.
+        format (ExportFormat, optional): parquet or arrow. Defaults to parquet.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to export data.
+        HTTPException: If the export directory cannot be written (500).
+    
+    Returns:
+        ExportResultSchema: Where the file was written, its rows and size.
+    """
+    check_exporter(auth_details)
+    try:
+        return await TableExport(table, format).to_file(EXPORT_DIR)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"Export to {EXPORT_DIR} failed: {e}")
@@ -0,0 +1,274 @@
+"""Columnar exports of inventory, requests and product details.
+
+Run from app/backend:
+
+    python -m api.exports.writer product_inventory [--format parquet] [--output /mnt/data]
+"""
+import argparse
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple, Type
+
+from decouple import config
+from fastapi.concurrency import run_in_threadpool
+from tortoise import Model, Tortoise, connections, fields, run_async
+
+from models.exports.pydantic import (ExportFormat, ExportResultSchema,
+                                     ExportTable)
+from models.productlog.tortoise import ProductDetails, ProductInventory
+from models.productrequests.tortoise import RequestDetails
+
+EXPORT_DIR = config("EXPORT_DIR", default="/mnt/data")
+EXPORT_BATCH_ROWS = config("EXPORT_BATCH_ROWS", default=65536, cast=int)
+
+MEDIA_TYPES = {
+    ExportFormat.PARQUET: "application/vnd.apache.parquet",
+    ExportFormat.ARROW: "application/vnd.apache.arrow.stream",
+}
+EXTENSIONS = {ExportFormat.PARQUET: "parquet", ExportFormat.ARROW: "arrows"}
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    model: Type[Model]
+    # Low-cardinality enum columns, written as dictionary-encoded strings
+    dictionary: Tuple[str, ...] = ()
+
+
+SPECS = {
+    ExportTable.PRODUCT_INVENTORY: ExportSpec(ProductInventory, ("status",)),
+    ExportTable.PRODUCT_DETAILS: ExportSpec(
+        ProductDetails, ("category", "setsubcategory", "source", "unit")
+    ),
+    ExportTable.REQUEST_DETAILS: ExportSpec(RequestDetails, ("status",)),
+}
+
+
+def _pyarrow():
+    # Imported on first export, only exports need it and it is heavy
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    return pyarrow
+
+
+def arrow_type(field: fields.Field):
+    pa = _pyarrow()
+    if isinstance(field, fields.BigIntField):
+        return pa.int64()
+    if isinstance(field, fields.SmallIntField):
+        return pa.int16()
+    if isinstance(field, fields.IntField):
+        return pa.int32()
+    if isinstance(field, fields.FloatField):
+        return pa.float64()
+    if isinstance(field, fields.BooleanField):
+        return pa.bool_()
+    if isinstance(field, fields.DatetimeField):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(field, fields.DateField):
+        return pa.date32()
+    # Char, text, and JSON as its text
+    return pa.string()
+
+
+def columns(model: Type[Model]) -> List[Tuple[str, fields.Field]]:
+    meta = model._meta
+    return [(column, meta.fields_map[name]) for name, column in meta.fields_db_projection.items()]
+
+
+def select_sql(model: Type[Model]) -> str:
+    selected = ", ".join(
+        f'"{column}"::text' if isinstance(field, fields.JSONField) else f'"{column}"'
+        for column, field in columns(model)
+    )
+    return f'SELECT {selected} FROM "{model._meta.db_table}"'
+
+
+class DictionaryEncoder:
+    """Dictionary-encode one column across batches.
+
+    The dictionary only ever grows, so each batch's dictionary extends the
+    previous one and the IPC stream carries deltas, not replacements.
+    """
+
+    def __init__(self):
+        pa = _pyarrow()
+        self.dictionary = pa.array([], pa.string())
+
+    def encode(self, values: list):
+        pa = _pyarrow()
+        pc = pa.compute
+        array = pa.array(values, pa.string())
+        unique = pc.unique(array).drop_null()
+        new = unique.filter(pc.invert(pc.is_in(unique, value_set=self.dictionary)))
+        if len(new):
+            self.dictionary = pa.concat_arrays([self.dictionary, new])
+        indices = pc.index_in(array, value_set=self.dictionary).cast(pa.int32())
+        return pa.DictionaryArray.from_arrays(indices, self.dictionary)
+
+
+class _Chunks:
+    """A write-only sink that hands out what was written so far."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+class TableExport:
+    """Export one table as Parquet or an Arrow IPC stream.
+
+    Rows are read through a server-side cursor in a read-only snapshot,
+    ``batch_rows`` at a time. A batch is encoded while the next is fetched
+    and written out before another is read, so memory stays bounded by two
+    batches whatever the table size.
+    """
+
+    def __init__(
+        self,
+        table: ExportTable,
+        format: ExportFormat = ExportFormat.PARQUET,
+        batch_rows: int = EXPORT_BATCH_ROWS,
+    ):
+        self.table = table
+        self.format = format
+        self.batch_rows = batch_rows
+        self.spec = SPECS[table]
+        self.rows = 0
+
+    @property
+    def filename(self) -> str:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        return f"{self.table.value}-{stamp}.{EXTENSIONS[self.format]}"
+
+    def schema(self):
+        pa = _pyarrow()
+        return pa.schema(
+            [
+                pa.field(
+                    column,
+                    pa.dictionary(pa.int32(), pa.string())
+                    if column in self.spec.dictionary
+                    else arrow_type(field),
+                    nullable=field.null,
+                )
+                for column, field in columns(self.spec.model)
+            ]
+        )
+
+    def _open(self, sink, schema):
+        pa = _pyarrow()
+        if self.format == ExportFormat.PARQUET:
+            return pa.parquet.ParquetWriter(sink, schema, compression="zstd")
+        return pa.ipc.new_stream(
+            sink, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        )
+
+    def _write_batch(self, writer, schema, encoders, rows) -> None:
+        pa = _pyarrow()
+        arrays = []
+        for field, values in zip(schema, zip(*rows)):
+            encoder = encoders.get(field.name)
+            if encoder is not None:
+                arrays.append(encoder.encode(list(values)))
+            else:
+                arrays.append(pa.array(values, field.type))
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the encoded file piece by piece, one piece per batch."""
+        schema = self.schema()
+        encoders = {column: DictionaryEncoder() for column in self.spec.dictionary}
+        sink = _Chunks()
+        writer = self._open(sink, schema)
+        connection = connections.get("default")
+        async with connection.acquire_connection() as con:
+            async with con.transaction(isolation="repeatable_read", readonly=True):
+                cursor = await con.cursor(select_sql(self.spec.model))
+                rows = await cursor.fetch(self.batch_rows)
+                while rows:
+                    # Encode this batch in a thread while the next one is fetched
+                    encoding = asyncio.ensure_future(
+                        run_in_threadpool(self._write_batch, writer, schema, encoders, rows)
+                    )
+                    try:
+                        following = await cursor.fetch(self.batch_rows)
+                    finally:
+                        await encoding
+                    self.rows += len(rows)
+                    rows = following
+                    yield sink.take()
+        writer.close()
+        yield sink.take()
+
+    async def to_file(self, directory: str = EXPORT_DIR) -> ExportResultSchema:
+        """Write the export into ``directory``; readers never see a partial file."""
+        path = os.path.join(directory, self.filename)
+        partial = f"{path}.partial"
+        size = 0
+        try:
+            with open(partial, "wb") as f:
+                async for chunk in self.chunks():
+                    f.write(chunk)
+                    size += len(chunk)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return ExportResultSchema(
+            table=self.table, format=self.format, path=path, rows=self.rows, bytes=size
+        )
+
+
+async def _main(args) -> None:
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_URL"),
+        modules={
+            "models": [
+                "models.productlog.tortoise",
+                "models.productrequests.tortoise",
+            ]
+        },
+    )
+    try:
+        export = TableExport(ExportTable(args.table), ExportFormat(args.format), args.batch_rows)
+        result = await export.to_file(args.output)
+        print(f"Exported {result.rows} rows to {result.path} ({result.bytes} bytes)")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("table", choices=[t.value for t in ExportTable])
+    parser.add_argument("--format", choices=[f.value for f in ExportFormat], default="parquet")
+    parser.add_argument("--output", default=EXPORT_DIR, help="directory to write into")
+    parser.add_argument("--batch-rows", type=int, default=EXPORT_BATCH_ROWS)
+    run_async(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
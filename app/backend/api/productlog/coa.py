@@ -0,0 +1,293 @@
+"""Check batches' COA results against their product's specification.
+
+Run from app/backend:
+
+    python -m api.productlog.coa [--product P12345] [--dry-run]
+"""
+import argparse
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime, time, timezone
+from typing import List, Optional, Sequence
+
+import numpy as np
+from decouple import config
+from fastapi.concurrency import run_in_threadpool
+from tortoise import Tortoise, connections, run_async
+
+from api.productlog.partitions import CLOSED_STATUSES
+from models.productlog.pydantic import (COA_BOOLEAN_FIELDS, COA_RANGE_FIELDS,
+                                        CoaCheckResultSchema, CoaFailureSchema,
+                                        InventoryStatus)
+from models.requests.periodic import DailyTask
+
+log = logging.getLogger("uvicorn")
+
+# UTC time of day of the nightly check
+COA_CHECK_AT = config("COA_CHECK_AT", default="03:00", cast=time.fromisoformat)
+COA_CHECK_BATCH = config("COA_CHECK_BATCH", default=50000, cast=int)
+# Failures listed in a check result; all of them are counted and quarantined
+COA_CHECK_MAX_FAILURES = config("COA_CHECK_MAX_FAILURES", default=1000, cast=int)
+# Recorded as lastupdatedby on batches the check quarantines
+QUARANTINED_BY = "system"
+
+FIELDS = COA_RANGE_FIELDS + COA_BOOLEAN_FIELDS
+# Closed and already quarantined batches are not checked
+SKIPPED_STATUSES = CLOSED_STATUSES + [InventoryStatus.QUARANTINE.value]
+
+SPECS_SQL = (
+    'SELECT "productid", "field", "minvalue", "maxvalue", "expected" FROM "coa_specification" '
+    'WHERE $1::varchar IS NULL OR "productid" = $1'
+)
+# The specifications of the products of new batches
+PRODUCT_SPECS_SQL = (
+    'SELECT "productid", "field", "minvalue", "maxvalue", "expected" FROM "coa_specification" '
+    'WHERE "productid" = ANY($1::varchar[])'
+)
+# One chunk of batches after $1 in batchid order, as one array per column
+# so a chunk decodes straight into NumPy. Untested results are NaN, and
+# pass/fail results -1, 0 or 1. Only products with a specification are read.
+BATCHES_SQL = (
+    'SELECT count(*)::int AS "count", max("batchid_internal") AS "last", '
+    'array_agg("batchid_internal") AS "batchid_internal", '
+    'array_agg("productiondate") AS "productiondate", array_agg("productid") AS "productid", '
+    + ", ".join(f'array_agg("{field.value}") AS "{field.value}"' for field in COA_RANGE_FIELDS)
+    + ", "
+    + ", ".join(
+        f'array_agg(COALESCE("{field.value}"::int, -1)) AS "{field.value}"'
+        for field in COA_BOOLEAN_FIELDS
+    )
+    + ' FROM (SELECT * FROM "product_inventory" WHERE "batchid_internal" > $1 '
+    'AND "productid" = ANY($2::varchar[]) AND "status" <> ALL($3::varchar[]) '
+    'ORDER BY "batchid_internal" LIMIT $4) b'
+)
+# One statement per chunk of failed batches. The status is checked again,
+# as a batch may have been closed since it was read.
+QUARANTINE_SQL = (
+    'UPDATE "product_inventory" p SET "status" = $3, "version" = p."version" + 1, '
+    '"lastupdated" = $4, "lastupdatedby" = $5 '
+    "FROM unnest($1::varchar[], $2::date[]) AS v(batchid, productiondate) "
+    'WHERE p."batchid_internal" = v.batchid AND p."productiondate" = v.productiondate '
+    'AND p."status" <> ALL($6::varchar[]) RETURNING p."batchid_internal"'
+)
+
+
+@dataclass
+class CoaRules:
+    """Specifications compiled into one row of bounds per product.
+
+    ``productids`` is sorted; the rows of ``lower``, ``upper`` and
+    ``expected`` follow it, plus a last row for products without a
+    specification that nothing fails. Columns follow COA_RANGE_FIELDS and
+    COA_BOOLEAN_FIELDS.
+    """
+
+    productids: np.ndarray
+    lower: np.ndarray
+    upper: np.ndarray
+    expected: np.ndarray
+
+    def __len__(self):
+        return len(self.productids)
+
+
+def compile_rules(specs: Sequence[dict]) -> CoaRules:
+    """Compile coa_specification rows into bound arrays.
+
+    A missing bound is -inf or inf and a missing required outcome -1, so
+    a range rule with one bound, or a product without a rule for a field,
+    needs no special case when evaluated.
+    """
+    productids = np.array(sorted({spec["productid"] for spec in specs}), dtype=object)
+    row = {productid: i for i, productid in enumerate(productids)}
+    column = {field.value: i for i, field in enumerate(FIELDS)}
+    lower = np.full((len(productids) + 1, len(COA_RANGE_FIELDS)), -np.inf)
+    upper = np.full((len(productids) + 1, len(COA_RANGE_FIELDS)), np.inf)
+    expected = np.full((len(productids) + 1, len(COA_BOOLEAN_FIELDS)), -1, dtype=np.int8)
+    for spec in specs:
+        i, j = row[spec["productid"]], column[spec["field"]]
+        if j < len(COA_RANGE_FIELDS):
+            if spec["minvalue"] is not None:
+                lower[i, j] = spec["minvalue"]
+            if spec["maxvalue"] is not None:
+                upper[i, j] = spec["maxvalue"]
+        elif spec["expected"] is not None:
+            expected[i, j - len(COA_RANGE_FIELDS)] = spec["expected"]
+    return CoaRules(productids, lower, upper, expected)
+
+
+def evaluate(
+    rules: CoaRules, productids: np.ndarray, measured: np.ndarray, outcomes: np.ndarray
+) -> np.ndarray:
+    """Which results of which batches fail their product's specification.
+
+    Args:
+        rules (CoaRules): The compiled specifications.
+        productids (np.ndarray): The product of each batch.
+        measured (np.ndarray): batches x COA_RANGE_FIELDS floats, NaN if untested.
+        outcomes (np.ndarray): batches x COA_BOOLEAN_FIELDS of 1, 0 or -1 if untested.
+
+    Returns:
+        np.ndarray: batches x FIELDS booleans, True where a result fails.
+            An untested result never fails.
+    """
+    row = np.searchsorted(rules.productids, productids)
+    found = row < len(rules)
+    found[found] = rules.productids[row[found]] == productids[found]
+    row[~found] = len(rules)
+    # NaN compares false both ways, so untested results pass
+    out_of_range = (measured < rules.lower[row]) | (measured > rules.upper[row])
+    required = rules.expected[row]
+    wrong = (required >= 0) & (outcomes >= 0) & (outcomes != required)
+    return np.hstack([out_of_range, wrong])
+
+
+def check_chunk(rules: CoaRules, chunk: dict) -> np.ndarray:
+    """Evaluate one chunk as read by BATCHES_SQL."""
+    productids = np.array(chunk["productid"], dtype=object)
+    measured = np.column_stack(
+        [np.array(chunk[field.value], dtype=np.float64) for field in COA_RANGE_FIELDS]
+    )
+    outcomes = np.column_stack(
+        [np.array(chunk[field.value], dtype=np.int8) for field in COA_BOOLEAN_FIELDS]
+    )
+    return evaluate(rules, productids, measured, outcomes)
+
+
+async def failing_batches(batches: Sequence[dict]) -> np.ndarray:
+    """Which of the given batches, e.g. of a bulk import not yet written,
+    fail their product's specification.
+
+    Args:
+        batches (Sequence[dict]): Rows with productid and the COA columns.
+
+    Returns:
+        np.ndarray: One boolean per batch.
+    """
+    productids = sorted({batch["productid"] for batch in batches})
+    specs = await connections.get("default").execute_query_dict(PRODUCT_SPECS_SQL, [productids])
+    if not specs:
+        return np.zeros(len(batches), dtype=bool)
+    chunk = {"productid": [batch["productid"] for batch in batches]}
+    for field in COA_RANGE_FIELDS:
+        chunk[field.value] = [batch.get(field.value) for batch in batches]
+    for field in COA_BOOLEAN_FIELDS:
+        chunk[field.value] = [
+            -1 if batch.get(field.value) is None else int(batch[field.value]) for batch in batches
+        ]
+    return check_chunk(compile_rules(specs), chunk).any(axis=1)
+
+
+async def check_inventory(
+    product_id: Optional[str] = None,
+    quarantine: bool = True,
+    batch_size: int = COA_CHECK_BATCH,
+    max_failures: int = COA_CHECK_MAX_FAILURES,
+) -> CoaCheckResultSchema:
+    """Check open batches against the COA specifications, ``batch_size`` at a time.
+
+    Args:
+        product_id (Optional[str]): Only check this product's batches. Defaults to all.
+        quarantine (bool): Move failed batches to QUARANTINE. Defaults to True.
+        batch_size (int): Batches per read and per quarantine statement.
+        max_failures (int): Failures listed in the result.
+
+    Returns:
+        CoaCheckResultSchema: Counts of checked, failed and quarantined batches.
+    """
+    connection = connections.get("default")
+    rules = compile_rules(await connection.execute_query_dict(SPECS_SQL, [product_id]))
+    checked = failed = quarantined = 0
+    failures: List[CoaFailureSchema] = []
+    if not len(rules):
+        return CoaCheckResultSchema(checked=0, failed=0, quarantined=0, failures=[])
+    products = rules.productids.tolist()
+    now = datetime.now(timezone.utc)
+    last = ""
+    while True:
+        rows = await connection.execute_query_dict(
+            BATCHES_SQL, [last, products, SKIPPED_STATUSES, batch_size]
+        )
+        chunk = rows[0]
+        if not chunk["count"]:
+            break
+        result = await run_in_threadpool(check_chunk, rules, chunk)
+        bad = np.flatnonzero(result.any(axis=1))
+        checked += chunk["count"]
+        failed += len(bad)
+        for i in bad[:max(max_failures - len(failures), 0)]:
+            failures.append(
+                CoaFailureSchema(
+                    batchid_internal=chunk["batchid_internal"][i],
+                    productid=chunk["productid"][i],
+                    fields=[field for field, fails in zip(FIELDS, result[i]) if fails],
+                )
+            )
+        if quarantine and len(bad):
+            moved = await connection.execute_query_dict(
+                QUARANTINE_SQL,
+                [
+                    [chunk["batchid_internal"][i] for i in bad],
+                    [chunk["productiondate"][i] for i in bad],
+                    InventoryStatus.QUARANTINE.value,
+                    now,
+                    QUARANTINED_BY,
+                    SKIPPED_STATUSES,
+                ],
+            )
+            quarantined += len(moved)
+        if chunk["count"] < batch_size:
+            break
+        last = chunk["last"]
+    return CoaCheckResultSchema(
+        checked=checked, failed=failed, quarantined=quarantined, failures=failures
+    )
+
+
+class CoaChecker(DailyTask):
+    """Check every open batch against its COA specification every night."""
+
+    name = "coa_check"
+    description = "check COA results"
+
+    def __init__(self, at: time = COA_CHECK_AT, batch_size: int = COA_CHECK_BATCH):
+        super().__init__(at)
+        self.batch_size = batch_size
+
+    async def tick(self) -> None:
+        result = await check_inventory(batch_size=self.batch_size)
+        if result.quarantined:
+            log.info(f"Quarantined {result.quarantined} batches failing their COA specification")
+
+
+coa_checker = CoaChecker()
+
+
+async def _main(args) -> None:
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_URL"),
+        modules={"models": ["models.productlog.tortoise"]},
+    )
+    try:
+        result = await check_inventory(args.product, quarantine=not args.dry_run)
+        print(
+            f"Checked {result.checked} batches: {result.failed} failed, "
+            f"{result.quarantined} quarantined"
+        )
+        for failure in result.failures:
+            fields = ", ".join(field.value for field in failure.fields)
+            print(f"  {failure.batchid_internal} ({failure.productid}): {fields}")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--product", help="only check this product's batches")
+    parser.add_argument("--dry-run", action="store_true", help="report, do not quarantine")
+    run_async(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
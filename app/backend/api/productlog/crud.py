@@ -1,10 +1,310 @@
-from models.productlog.pydantic import \
+import json
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from itertools import accumulate
+from typing import Dict, Iterable, List, Optional
+
+from tortoise import connections, timezone
+from tortoise.transactions import in_transaction
+
+from api.productlog import coa, spc
+from api.productlog.partitions import CLOSED_STATUSES
+from db import insert_values, update_assignments
+from models.productlog.batchids import batch_ids
+from models.productlog.pydantic import AvailableToPromiseSchema, \
+    COA_RANGE_FIELDS, CoaField, CoaSpecificationSchema, \
+    CoaSpecificationUpdateSchema, ControlChartPointSchema, ControlChartSchema, \
     ProductDetailsSchema as ProductDetailsCreateSchema, \
     ProductInventoryCreateSchema, \
-    ProductInventoryWithDetailsSchema
+    ProductInventorySchema as ProductInventoryReadSchema, \
+    ProductInventoryWithDetailsSchema, InventoryStatus, LedgerEntryKind, \
+    ReservationCreateSchema, ReservationSchema, ReservationStatus, \
+    StockAdjustmentItemSchema, StockAdjustmentSchema, StockAtSchema
 from models.productlog.tortoise import (ProductDetails, ProductDetailsSchema,
                                         ProductInventory,
-                                        ProductInventorySchema)
+                                        ProductInventoryArchive,
+                                        ProductInventorySchema, Reservation)
+from models.productlog.shelflife import parse_shelf_life_days
+from models.productrequests.pydantic import RequestStatus
+from models.requests.versioning import VersionConflictError
+
+# Writes are single statements that return the changed row, so responses
+# need no read-back. $2 is the expected version, NULL for unconditional.
+# A changed shelf life moves the expirydate of the product's batches.
+PRODUCT_DETAILS_UPDATE_SQL = (
+    'WITH updated AS (UPDATE "productdetails" SET {assignments}"version" = "version" + 1 '
+    'WHERE "productid" = $1 AND ($2::int IS NULL OR "version" = $2) RETURNING *), '
+    'expiry AS (UPDATE "product_inventory" p '
+    'SET "expirydate" = p."productiondate" + u."shelflifedays", "version" = p."version" + 1 '
+    'FROM updated u WHERE p."productid" = u."productid" '
+    'AND p."expirydate" IS DISTINCT FROM p."productiondate" + u."shelflifedays") '
+    "SELECT * FROM updated"
+)
+PRODUCT_DETAILS_VERSION_SQL = 'SELECT "version" FROM "productdetails" WHERE "productid" = $1'
+# The product's COA specification goes with it
+PRODUCT_DETAILS_DELETE_SQL = (
+    'WITH deleted AS (DELETE FROM "productdetails" WHERE "productid" = $1 RETURNING "productid"), '
+    'specs AS (DELETE FROM "coa_specification" s USING deleted d WHERE s."productid" = d."productid") '
+    'SELECT "productid" FROM deleted'
+)
+PRODUCT_EXISTS_SQL = 'SELECT 1 FROM "productdetails" WHERE "productid" = $1'
+PRODUCT_SHELF_LIFE_SQL = 'SELECT "shelflifedays" FROM "productdetails" WHERE "productid" = $1'
+PRODUCTS_SHELF_LIFE_SQL = (
+    'SELECT "productid", "shelflifedays" FROM "productdetails" '
+    'WHERE "productid" = ANY($1::varchar[])'
+)
+# Every stock change appends to the ledger in the same statement, and every
+# change of a measured COA result is merged into coa_statistics
+LEDGER_INSERT = (
+    'INSERT INTO "inventory_transaction" ("productid", "batchid_internal", "delta", '
+    '"quantity_after", "kind", "reason", "createdby", "createdat") '
+)
+# {rows} is VALUES of one batch or SELECT from unnest of many. The batch IDs
+# are claimed in inventory_batch_id, whose primary key rejects an ID that
+# another partition, or the archive, already has.
+INVENTORY_INSERT_SQL = (
+    'WITH created AS (INSERT INTO "product_inventory" ({columns}) '
+    "{rows} RETURNING *), "
+    'claimed AS (INSERT INTO "inventory_batch_id" ("batchid_internal") '
+    'SELECT "batchid_internal" FROM created), '
+    f"ledger AS ({LEDGER_INSERT}"
+    'SELECT "productid", "batchid_internal", "quantityinstock", "quantityinstock", '
+    f"'{LedgerEntryKind.CREATED.value}', NULL, \"lastupdatedby\", \"lastupdated\" "
+    'FROM created WHERE "quantityinstock" <> 0), '
+    + spc.record(spc.added("created"))
+    + " SELECT * FROM created"
+)
+# Every column of a batch, in the order of the arrays of a bulk insert
+BULK_COLUMNS = {
+    column: ProductInventory._meta.fields_map[name].get_for_dialect("postgres", "SQL_TYPE")
+    for name, column in ProductInventory._meta.fields_db_projection.items()
+}
+INVENTORY_BULK_ROWS = "SELECT * FROM unnest({})".format(
+    ", ".join(f"${i}::{sql_type}[]" for i, sql_type in enumerate(BULK_COLUMNS.values(), 1))
+)
+# $3 is the new productid, which must exist in productdetails, and $4 the
+# new productiondate; with either the expirydate is computed again. $5, the
+# new quantityinstock, may not drop below what is reserved. The row
+# is locked first to read the stock and product it had; a batch moved to
+# another product leaves the old one's stock and enters the new one's.
+INVENTORY_UPDATE_SQL = (
+    'WITH old AS (SELECT "batchid_internal", "productid", "quantityinstock", '
+    '"coa_ph", "coa_osmoticpressure" '
+    'FROM "product_inventory" WHERE "batchid_internal" = $1 FOR UPDATE), '
+    'updated AS (UPDATE "product_inventory" p SET {assignments}'
+    '"expirydate" = CASE WHEN $3::varchar IS NULL AND $4::date IS NULL THEN p."expirydate" '
+    'ELSE COALESCE($4::date, p."productiondate") + (SELECT "shelflifedays" '
+    'FROM "productdetails" WHERE "productid" = COALESCE($3, p."productid")) END, '
+    '"version" = p."version" + 1 '
+    'FROM old o WHERE p."batchid_internal" = o."batchid_internal" '
+    'AND ($2::int IS NULL OR p."version" = $2) '
+    'AND ($3::varchar IS NULL OR EXISTS '
+    '(SELECT 1 FROM "productdetails" WHERE "productid" = $3)) '
+    'AND ($5::int IS NULL OR $5::int >= p."quantityreserved") '
+    'RETURNING p.*, o."productid" AS "old_productid", o."quantityinstock" AS "old_quantity", '
+    'o."coa_ph" AS "old_coa_ph", o."coa_osmoticpressure" AS "old_coa_osmoticpressure"), '
+    f"ledger AS ({LEDGER_INSERT}"
+    'SELECT m.productid, u."batchid_internal", m.delta, m.quantity_after, '
+    f"'{LedgerEntryKind.EDITED.value}', NULL, u.\"lastupdatedby\", u.\"lastupdated\" "
+    "FROM updated u CROSS JOIN LATERAL (VALUES "
+    '(u."old_productid", -u."old_quantity", 0), '
+    '(u."productid", u."quantityinstock", u."quantityinstock")) '
+    "AS m(productid, delta, quantity_after) "
+    'WHERE u."productid" <> u."old_productid" AND m.delta <> 0 '
+    'UNION ALL SELECT u."productid", u."batchid_internal", '
+    'u."quantityinstock" - u."old_quantity", u."quantityinstock", '
+    f"'{LedgerEntryKind.EDITED.value}', NULL, u.\"lastupdatedby\", u.\"lastupdated\" "
+    'FROM updated u WHERE u."productid" = u."old_productid" '
+    'AND u."quantityinstock" <> u."old_quantity"), '
+    + spc.record(spc.replaced("updated"))
+    + " SELECT * FROM updated"
+)
+# Explains why an inventory update matched no row
+INVENTORY_STATE_SQL = (
+    'SELECT "version", "quantityreserved", ($2::varchar IS NULL OR EXISTS '
+    '(SELECT 1 FROM "productdetails" WHERE "productid" = $2)) AS "product_exists" '
+    'FROM "product_inventory" WHERE "batchid_internal" = $1'
+)
+INVENTORY_DELETE_SQL = (
+    'WITH deleted AS (DELETE FROM "product_inventory" WHERE "batchid_internal" = $1 '
+    'RETURNING "batchid_internal", "productid", "quantityinstock", '
+    '"coa_ph", "coa_osmoticpressure"), '
+    f"ledger AS ({LEDGER_INSERT}"
+    'SELECT "productid", "batchid_internal", -"quantityinstock", 0, '
+    f"'{LedgerEntryKind.DELETED.value}', NULL, $2, $3 "
+    'FROM deleted WHERE "quantityinstock" <> 0), '
+    'released AS (DELETE FROM "inventory_batch_id" i USING deleted d '
+    'WHERE i."batchid_internal" = d."batchid_internal"), '
+    + spc.record(spc.removed("deleted"))
+    + ' SELECT "batchid_internal" FROM deleted'
+)
+
+# The guard in the WHERE clause is evaluated against the row under its lock,
+# so concurrent adjustments queue on the row and none can overdraw it or
+# take stock that is reserved. The
+# UPDATE and the audit row are one statement and commit together.
+STOCK_ADJUST_SQL = (
+    'WITH adjusted AS (UPDATE "product_inventory" SET '
+    '"quantityinstock" = "quantityinstock" + $2, "version" = "version" + 1, '
+    '"lastupdated" = $5, "lastupdatedby" = $6 '
+    'WHERE "batchid_internal" = $1 AND "quantityinstock" + $2 >= "quantityreserved" '
+    "RETURNING *), "
+    'logged AS (INSERT INTO "stock_adjustment" ("batchid_internal", "delta", '
+    '"quantity_after", "reason", "note", "adjustedby", "adjustedat") '
+    'SELECT "batchid_internal", $2, "quantityinstock", $3::varchar, $4::varchar, $6, $5 '
+    "FROM adjusted), "
+    f"ledger AS ({LEDGER_INSERT}"
+    'SELECT "productid", "batchid_internal", $2, "quantityinstock", '
+    f"'{LedgerEntryKind.ADJUSTED.value}', $3::varchar, $6, $5 FROM adjusted) "
+    "SELECT * FROM adjusted"
+)
+# Items of one batch apply in request order and every running total must
+# cover the reserved stock, so each audit row's quantity_after is a real
+# stock level. Rows are locked in batchid order, so two batches touching the same
+# rows cannot deadlock.
+STOCK_ADJUST_BATCH_SQL = (
+    "WITH items AS (SELECT * FROM unnest($1::varchar[], $2::int[], $3::varchar[], "
+    "$4::varchar[]) WITH ORDINALITY AS i(batchid, delta, reason, note, position)), "
+    "running AS (SELECT *, sum(delta) OVER "
+    "(PARTITION BY batchid ORDER BY position)::int AS running FROM items), "
+    "totals AS (SELECT batchid, sum(delta)::int AS delta, min(running) AS lowest "
+    "FROM running GROUP BY batchid), "
+    'locked AS (SELECT p."batchid_internal" FROM "product_inventory" p '
+    'JOIN totals t ON t.batchid = p."batchid_internal" '
+    'ORDER BY p."batchid_internal" FOR UPDATE OF p), '
+    'adjusted AS (UPDATE "product_inventory" p SET '
+    '"quantityinstock" = p."quantityinstock" + t.delta, "version" = p."version" + 1, '
+    '"lastupdated" = $5, "lastupdatedby" = $6 '
+    'FROM totals t JOIN locked l ON l."batchid_internal" = t.batchid '
+    'WHERE p."batchid_internal" = t.batchid '
+    'AND p."quantityinstock" + t.lowest >= p."quantityreserved" '
+    "RETURNING p.*), "
+    'logged AS (INSERT INTO "stock_adjustment" ("batchid_internal", "delta", '
+    '"quantity_after", "reason", "note", "adjustedby", "adjustedat") '
+    'SELECT r.batchid, r.delta, a."quantityinstock" - t.delta + r.running, '
+    "r.reason, r.note, $6, $5 "
+    "FROM running r JOIN totals t ON t.batchid = r.batchid "
+    'JOIN adjusted a ON a."batchid_internal" = r.batchid ORDER BY r.position), '
+    f"ledger AS ({LEDGER_INSERT}"
+    'SELECT a."productid", r.batchid, r.delta, a."quantityinstock" - t.delta + r.running, '
+    f"'{LedgerEntryKind.ADJUSTED.value}', r.reason, $6, $5 "
+    "FROM running r JOIN totals t ON t.batchid = r.batchid "
+    'JOIN adjusted a ON a."batchid_internal" = r.batchid ORDER BY r.position) '
+    "SELECT * FROM adjusted"
+)
+# Explains why an adjustment matched no row
+STOCK_LEVEL_SQL = (
+    'SELECT "batchid_internal", "quantityinstock", "quantityreserved" FROM "product_inventory" '
+    'WHERE "batchid_internal" = ANY($1::varchar[])'
+)
+
+# The hold is taken under the batch's row lock against its unreserved
+# stock, and the reservation row is written in the same statement.
+RESERVE_SQL = (
+    'WITH reserved AS (UPDATE "product_inventory" SET '
+    '"quantityreserved" = "quantityreserved" + $3, "version" = "version" + 1, '
+    '"lastupdated" = $5, "lastupdatedby" = $6 '
+    'WHERE "batchid_internal" = $1 AND "status" = $7 '
+    'AND "quantityinstock" - "quantityreserved" >= $3 AND EXISTS '
+    '(SELECT 1 FROM "requestdetails" WHERE "requestid" = $2 AND "status" = $8) '
+    'RETURNING "batchid_internal") '
+    'INSERT INTO "reservation" ("batchid_internal", "requestid", "quantity", '
+    '"status", "reservedby", "reservedat", "expiresat") '
+    "SELECT \"batchid_internal\", $2, $3, $9, $6, $5, $5 + make_interval(mins => $4) "
+    "FROM reserved RETURNING *"
+)
+# Explains why a reservation was refused
+RESERVE_STATE_SQL = (
+    'SELECT "status", "quantityinstock" - "quantityreserved" AS "unreserved", '
+    '(SELECT "status" FROM "requestdetails" WHERE "requestid" = $2) AS "request_status" '
+    'FROM "product_inventory" WHERE "batchid_internal" = $1'
+)
+# Only an ACTIVE hold is released, so a release racing the sweeper gives
+# the stock back once
+RELEASE_SQL = (
+    'WITH released AS (UPDATE "reservation" SET "status" = $2, "releasedat" = $3 '
+    'WHERE "id" = $1 AND "status" = $4 RETURNING *), '
+    'restored AS (UPDATE "product_inventory" p SET '
+    '"quantityreserved" = GREATEST(p."quantityreserved" - r."quantity", 0), '
+    '"version" = p."version" + 1 '
+    'FROM released r WHERE p."batchid_internal" = r."batchid_internal") '
+    "SELECT * FROM released"
+)
+RESERVATION_EXISTS_SQL = 'SELECT "status" FROM "reservation" WHERE "id" = $1'
+# One pass over the (productid, lastupdated) index of the product
+AVAILABLE_TO_PROMISE_SQL = (
+    'SELECT COALESCE(sum("quantityinstock"), 0)::int AS "quantityinstock", '
+    'COALESCE(sum("quantityreserved"), 0)::int AS "quantityreserved", '
+    'COALESCE(sum(GREATEST("quantityinstock" - "quantityreserved", 0)), 0)::int '
+    'AS "available", count(*) FILTER (WHERE "quantityinstock" > "quantityreserved")::int '
+    'AS "batches" FROM "product_inventory" WHERE "productid" = $1 AND "status" = $2'
+)
+COA_SPEC_SQL = (
+    'SELECT "field", "minvalue", "maxvalue", "expected" FROM "coa_specification" '
+    'WHERE "productid" = $1 ORDER BY "field"'
+)
+# Replaces a product's rules in one statement: fields left out are dropped,
+# the others upserted. Nothing is written if the product does not exist.
+COA_SPEC_REPLACE_SQL = (
+    'WITH product AS (SELECT "productid" FROM "productdetails" WHERE "productid" = $1), '
+    'removed AS (DELETE FROM "coa_specification" WHERE "productid" = $1 '
+    'AND "field" <> ALL($2::varchar[])), '
+    'saved AS (INSERT INTO "coa_specification" ("productid", "field", "minvalue", "maxvalue", '
+    '"expected", "updatedby", "updatedat") SELECT p."productid", v.*, $6, $7 FROM product p '
+    "CROSS JOIN unnest($2::varchar[], $3::float8[], $4::float8[], $5::bool[]) AS v "
+    'ON CONFLICT ("productid", "field") DO UPDATE SET "minvalue" = EXCLUDED."minvalue", '
+    '"maxvalue" = EXCLUDED."maxvalue", "expected" = EXCLUDED."expected", '
+    '"updatedby" = EXCLUDED."updatedby", "updatedat" = EXCLUDED."updatedat") '
+    'SELECT count(*)::int AS "found" FROM product'
+)
+COA_STATISTICS_SQL = (
+    'SELECT "count", "mean", "m2" FROM "coa_statistics" WHERE "productid" = $1 AND "field" = $2'
+)
+# The newest $2 measured batches of the product, through the
+# (productid, productiondatetime) index
+CONTROL_CHART_POINTS_SQL = {
+    field: (
+        f'SELECT "batchid_internal", "productiondatetime", "{field.value}" AS "value" '
+        f'FROM "product_inventory" WHERE "productid" = $1 AND "{field.value}" IS NOT NULL '
+        'ORDER BY "productiondatetime" DESC LIMIT $2'
+    )
+    for field in COA_RANGE_FIELDS
+}
+# Open batches expiring between $1 and $2, through the expirydate index
+EXPIRING_SQL = (
+    'SELECT * FROM "product_inventory" WHERE "expirydate" >= $1 AND "expirydate" <= $2 '
+    'AND "status" <> ALL($3::varchar[]) AND "quantityinstock" > 0 '
+    'AND ($4::varchar IS NULL OR "productid" = $4) '
+    'ORDER BY "expirydate", "batchid_internal"'
+)
+# The newest checkpoint at or before $2, plus the ledger rows after it
+STOCK_AT_SQL = (
+    'WITH cp AS (SELECT "asof", "quantity" FROM "inventory_checkpoint" '
+    'WHERE "productid" = $1 AND "asof" <= $2 ORDER BY "asof" DESC LIMIT 1) '
+    'SELECT (SELECT "asof" FROM cp) AS "checkpoint_at", '
+    '(COALESCE((SELECT "quantity" FROM cp), 0) + COALESCE(sum("delta"), 0))::int '
+    'AS "quantity", count(*)::int AS "entries" FROM "inventory_transaction" '
+    "WHERE \"productid\" = $1 AND \"createdat\" > COALESCE((SELECT \"asof\" FROM cp), "
+    "'-infinity') AND \"createdat\" <= $2"
+)
+
+
+class InsufficientStockError(Exception):
+    """A change would take a batch's quantityinstock below zero or below
+    its quantityreserved."""
+
+
+class NotReservableError(Exception):
+    """The batch is not AVAILABLE or the request is not APPROVED."""
+
+
+def _product_details_from_row(row) -> ProductDetailsCreateSchema:
+    row = dict(row)
+    # asyncpg hands jsonb back as text
+    if isinstance(row["components"], str):
+        row["components"] = json.loads(row["components"])
+    return ProductDetailsCreateSchema(**row)
 
 
 async def get_all_product_details():
@@ -18,7 +318,10 @@ async def create_product_details(data: ProductDetailsCreateSchema):
     """
     Create a new ProductDetails record in the database.
     """
-    obj = await ProductDetails.create(**data.dict())
+    data_dict = data.dict(exclude={"version"})
+    if data_dict["shelflifedays"] is None:
+        data_dict["shelflifedays"] = parse_shelf_life_days(data.storage_temperature_duration)
+    obj = await ProductDetails.create(**data_dict)
     return await ProductDetailsSchema.from_tortoise_orm(obj)
 
 
@@ -64,19 +367,42 @@ async def get_product_inventory_by_product_id(product_id: str):
     return await ProductInventorySchema.from_queryset(ProductInventory.filter(productid=product_id))
 
 
-async def update_product_details(product_id: str, data: ProductDetailsCreateSchema):
+async def update_product_details(
+    product_id: str, data: ProductDetailsCreateSchema, expected_version: Optional[int] = None
+):
     """
     Update an existing ProductDetails record in the database.
+
+    The row is changed by a single UPDATE ... RETURNING that also bumps its
+    version, and only if it still has ``expected_version`` when one is given.
+    A new storage_temperature_duration is parsed into shelflifedays unless
+    one is given, and the same statement moves the batches' expirydate.
+
+    Raises:
+        ValueError: If the product is not found.
+        VersionConflictError: If the product was changed since ``expected_version``.
     """
-    product = await ProductDetails.get_or_none(productid=product_id)
-    if not product:
-        raise ValueError(f"Product with ID {product_id} not found")
-    
-    # Update the product with new data
-    await product.update_from_dict(data.dict(exclude_unset=True))
-    await product.save()
-    
-    return await ProductDetailsSchema.from_tortoise_orm(product)
+    data_dict = data.dict(exclude_unset=True, exclude={"productid", "version"})
+    if "storage_temperature_duration" in data_dict and data_dict.get("shelflifedays") is None:
+        data_dict["shelflifedays"] = parse_shelf_life_days(data.storage_temperature_duration)
+    if "components" in data_dict:
+        data_dict["components"] = json.dumps(data_dict["components"])
+    assignments, params = update_assignments(data_dict, first_param=3)
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(
+        PRODUCT_DETAILS_UPDATE_SQL.format(assignments=assignments + ", " if assignments else ""),
+        [product_id, expected_version, *params],
+    )
+    if rows:
+        return _product_details_from_row(rows[0])
+
+    if expected_version is not None and await connection.execute_query_dict(
+        PRODUCT_DETAILS_VERSION_SQL, [product_id]
+    ):
+        raise VersionConflictError(
+            f"Product {product_id} was modified, it is no longer at version {expected_version}"
+        )
+    raise ValueError(f"Product with ID {product_id} not found")
 
 
 async def get_product_details_by_id(product_id: str):
@@ -103,11 +429,12 @@ async def delete_product_details(product_id: str):
     Returns:
         dict: Success message with deleted product ID.
     """
-    product = await ProductDetails.get_or_none(productid=product_id)
-    if not product:
+    rows = await connections.get("default").execute_query_dict(
+        PRODUCT_DETAILS_DELETE_SQL, [product_id]
+    )
+    if not rows:
         raise ValueError(f"Product with ID {product_id} not found")
     
-    await product.delete()
     return {"message": f"Product {product_id} deleted successfully", "product_id": product_id}
 
 
@@ -116,66 +443,199 @@ async def create_product_inventory(data: ProductInventoryCreateSchema):
     """
     Create a new ProductInventory record in the database.
     Validates that the referenced productid exists in ProductDetails.
+
+    Costs three statements, the check, which also reads the shelf life for
+    the expirydate, the product's COA specification and an INSERT ...
+    RETURNING. A batch failing its specification is created in
+    QUARANTINE(隔离), as in a bulk import.
     """
+    connection = connections.get("default")
     # Validate that the productid exists in ProductDetails
-    product_details = await ProductDetails.get_or_none(productid=data.productid)
-    if not product_details:
+    product = await connection.execute_query_dict(PRODUCT_SHELF_LIFE_SQL, [data.productid])
+    if not product:
         raise ValueError(f"Product with ID {data.productid} not found in ProductDetails. Please create the product details first.")
     
     # Exclude None values and auto-generated fields
-    data_dict = data.dict(exclude_unset=True, exclude_none=True)
+    data_dict = data.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
     # Remove auto-generated fields if they are present as None or empty
     data_dict.pop('batchid_internal', None)
     data_dict.pop('batchid_external', None)
-    
-    obj = await ProductInventory.create(**data_dict)
-    return await ProductInventorySchema.from_tortoise_orm(obj)
+
+    inventory = ProductInventory(**data_dict)
+    await inventory.assign_batch_ids()
+    data_dict["batchid_internal"] = inventory.batchid_internal
+    data_dict["batchid_external"] = inventory.batchid_external
+    data_dict["lastupdated"] = timezone.now()
+    if product[0]["shelflifedays"] is not None:
+        data_dict["expirydate"] = data.productiondate + timedelta(days=product[0]["shelflifedays"])
+    if data.status.value not in coa.SKIPPED_STATUSES and (await coa.failing_batches([data_dict]))[0]:
+        data_dict["status"] = InventoryStatus.QUARANTINE.value
+    columns, placeholders, params = insert_values(data_dict)
+    rows = await connection.execute_query_dict(
+        INVENTORY_INSERT_SQL.format(columns=columns, rows=f"VALUES ({placeholders})"), params
+    )
+    return ProductInventoryReadSchema(**rows[0])
+
+
+async def create_product_inventory_bulk(
+    items: List[ProductInventoryCreateSchema],
+) -> List[ProductInventoryReadSchema]:
+    """
+    Create many ProductInventory records with one INSERT, e.g. an import.
+
+    Batch IDs are allocated per basicmediumid-addictiveid prefix, one
+    reservation for the whole import. A batch failing its product's COA
+    specification is created in QUARANTINE(隔离) instead of its status.
+    Costs three statements, plus two per prefix that needs a new block of IDs.
+
+    Raises:
+        ValueError: If a referenced product is not found.
+
+    Returns:
+        List[ProductInventoryReadSchema]: The created batches, in the order of ``items``.
+    """
+    connection = connections.get("default")
+    productids = sorted({item.productid for item in items})
+    products = await connection.execute_query_dict(PRODUCTS_SHELF_LIFE_SQL, [productids])
+    shelf_lives = {row["productid"]: row["shelflifedays"] for row in products}
+    missing = [productid for productid in productids if productid not in shelf_lives]
+    if missing:
+        raise ValueError(
+            f"Products with IDs {', '.join(missing)} not found in ProductDetails. "
+            "Please create the product details first."
+        )
+
+    now = timezone.now()
+    rows = []
+    prefixes = defaultdict(list)
+    for item in items:
+        row = item.dict(exclude={"version"})
+        shelf_life = shelf_lives[item.productid]
+        row.update(
+            status=item.status.value,
+            batchid_external=f"{item.basicmediumid}-{item.addictiveid}",
+            quantityreserved=0,
+            expirydate=None if shelf_life is None else item.productiondate + timedelta(days=shelf_life),
+            lastupdated=now,
+            version=1,
+        )
+        rows.append(row)
+        prefixes[(item.basicmediumid, item.addictiveid)].append(row)
+    for (basicmediumid, addictiveid), group in prefixes.items():
+        allocated = await batch_ids.allocate(basicmediumid, addictiveid, len(group))
+        for row, batch_id in zip(group, allocated):
+            row["batchid_internal"] = batch_id
+    for row, failed in zip(rows, await coa.failing_batches(rows)):
+        if failed and row["status"] not in coa.SKIPPED_STATUSES:
+            row["status"] = InventoryStatus.QUARANTINE.value
+
+    created = await connection.execute_query_dict(
+        INVENTORY_INSERT_SQL.format(
+            columns=", ".join(f'"{column}"' for column in BULK_COLUMNS), rows=INVENTORY_BULK_ROWS
+        ),
+        [[row[column] for row in rows] for column in BULK_COLUMNS],
+    )
+    order = {row["batchid_internal"]: i for i, row in enumerate(rows)}
+    created.sort(key=lambda row: order[row["batchid_internal"]])
+    return [ProductInventoryReadSchema(**row) for row in created]
 
 
 async def get_product_inventory_by_id(batch_id: str):
     """
-    Get a single product inventory record by batch ID.
+    Get a single product inventory record by batch ID, live or archived.
     """
     inventory = await ProductInventory.get_or_none(batchid_internal=batch_id)
-    if not inventory:
+    if inventory:
+        return await ProductInventorySchema.from_tortoise_orm(inventory)
+
+    # Archived batches are still found, as read-only history
+    archived = await ProductInventoryArchive.filter(batchid_internal=batch_id).values()
+    if not archived:
         raise ValueError(f"Product inventory with batch ID {batch_id} not found")
-    
-    return await ProductInventorySchema.from_tortoise_orm(inventory)
+    return ProductInventoryReadSchema(**archived[0])
+
+
+async def _quarantine_if_failing(connection, row: dict) -> dict:
+    """Quarantine a just written batch that fails its product's COA specification.
+
+    Returns:
+        dict: The row, as it is after the check.
+    """
+    if row["status"] in coa.SKIPPED_STATUSES or not (await coa.failing_batches([row]))[0]:
+        return row
+    now = timezone.now()
+    quarantined = await connection.execute_query_dict(
+        coa.QUARANTINE_SQL,
+        [[row["batchid_internal"]], [row["productiondate"]], InventoryStatus.QUARANTINE.value,
+         now, coa.QUARANTINED_BY, coa.SKIPPED_STATUSES],
+    )
+    if not quarantined:
+        return row
+    return {**row, "status": InventoryStatus.QUARANTINE.value, "version": row["version"] + 1,
+            "lastupdated": now, "lastupdatedby": coa.QUARANTINED_BY}
 
 
-async def update_product_inventory(batch_id: str, data: ProductInventoryCreateSchema):
+async def update_product_inventory(
+    batch_id: str, data: ProductInventoryCreateSchema, expected_version: Optional[int] = None
+):
     """
     Update an existing ProductInventory record in the database.
     Validates that the referenced productid exists in ProductDetails if it's being updated.
+
+    The productid check is part of the UPDATE ... RETURNING, so a successful
+    update is one statement and a failed one two. The updated batch is then
+    checked against its product's COA specification and, if it fails,
+    moved to QUARANTINE(隔离) as the nightly check does, in up to two more
+    statements.
+
+    Raises:
+        ValueError: If the inventory or the referenced product is not found.
+        InsufficientStockError: If the new quantityinstock is below the reserved stock.
+        VersionConflictError: If the inventory was changed since ``expected_version``.
     """
-    inventory = await ProductInventory.get_or_none(batchid_internal=batch_id)
-    if not inventory:
-        raise ValueError(f"Product inventory with batch ID {batch_id} not found")
-    
-    # If productid is being updated, validate that it exists in ProductDetails
-    if hasattr(data, 'productid') and data.productid:
-        product_details = await ProductDetails.get_or_none(productid=data.productid)
-        if not product_details:
-            raise ValueError(f"Product with ID {data.productid} not found in ProductDetails. Please create the product details first.")
-    
     # Update the inventory with new data, excluding auto-generated fields
-    data_dict = data.dict(exclude_unset=True, exclude_none=True)
+    data_dict = data.dict(exclude_unset=True, exclude_none=True, exclude={"version"})
     # Remove auto-generated fields if they are present
     data_dict.pop('batchid_internal', None)
     data_dict.pop('batchid_external', None)
-    
-    await inventory.update_from_dict(data_dict)
-    await inventory.save()
-    
-    return await ProductInventorySchema.from_tortoise_orm(inventory)
+    # lastupdated is auto_now, which only the ORM applies
+    data_dict['lastupdated'] = timezone.now()
+    productid = data_dict.get('productid')
+    quantity = data_dict.get('quantityinstock')
 
+    assignments, params = update_assignments(data_dict, first_param=6)
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(
+        INVENTORY_UPDATE_SQL.format(assignments=assignments + ", "),
+        [batch_id, expected_version, productid, data_dict.get('productiondate'), quantity, *params],
+    )
+    if rows:
+        return ProductInventoryReadSchema(**await _quarantine_if_failing(connection, rows[0]))
 
-async def delete_product_inventory(batch_id: str):
+    state = await connection.execute_query_dict(INVENTORY_STATE_SQL, [batch_id, productid])
+    if not state:
+        raise ValueError(f"Product inventory with batch ID {batch_id} not found")
+    # If productid is being updated, validate that it exists in ProductDetails
+    if not state[0]["product_exists"]:
+        raise ValueError(f"Product with ID {productid} not found in ProductDetails. Please create the product details first.")
+    if quantity is not None and quantity < state[0]["quantityreserved"]:
+        raise InsufficientStockError(
+            f"Batch {batch_id} has {state[0]['quantityreserved']} reserved, "
+            f"more than the new quantity in stock {quantity}"
+        )
+    raise VersionConflictError(
+        f"Product inventory {batch_id} was modified, it is no longer at version {expected_version}"
+    )
+
+
+async def delete_product_inventory(batch_id: str, deletedby: Optional[str] = None):
     """
     Delete a ProductInventory record from the database.
     
     Args:
         batch_id (str): The internal batch ID of the inventory to delete.
+        deletedby (Optional[str]): Recorded on the ledger entry taking its
+            stock out. Defaults to None.
         
     Raises:
         ValueError: If the inventory is not found.
@@ -183,9 +643,349 @@ async def delete_product_inventory(batch_id: str):
     Returns:
         dict: Success message with deleted batch ID.
     """
-    inventory = await ProductInventory.get_or_none(batchid_internal=batch_id)
-    if not inventory:
+    rows = await connections.get("default").execute_query_dict(
+        INVENTORY_DELETE_SQL, [batch_id, deletedby, timezone.now()]
+    )
+    if not rows:
         raise ValueError(f"Product inventory with batch ID {batch_id} not found")
     
-    await inventory.delete()
     return {"message": f"Product inventory {batch_id} deleted successfully", "batch_id": batch_id}
+
+
+async def _adjustment_error(connection, deltas: Dict[str, List[int]]) -> Exception:
+    rows = await connection.execute_query_dict(STOCK_LEVEL_SQL, [list(deltas)])
+    in_stock = {row["batchid_internal"]: row["quantityinstock"] for row in rows}
+    reserved = {row["batchid_internal"]: row["quantityreserved"] for row in rows}
+    missing = sorted(set(deltas) - set(in_stock))
+    if missing:
+        return ValueError(
+            f"Product inventory with batch ID {', '.join(missing)} not found"
+        )
+    # The lowest running total of each batch is the stock it needs
+    needed = {batch_id: -min(accumulate(d)) for batch_id, d in deltas.items()}
+    short = ", ".join(
+        f"{batch_id} ({in_stock[batch_id]} in stock, {reserved[batch_id]} reserved, "
+        f"needs {needed[batch_id]})"
+        for batch_id in sorted(deltas)
+        if in_stock[batch_id] - reserved[batch_id] < needed[batch_id]
+    )
+    # Without a row lock the stock may have been topped up since
+    return InsufficientStockError(
+        f"Insufficient stock in batch {short or ', '.join(sorted(deltas))}"
+    )
+
+
+async def adjust_product_inventory(
+    batch_id: str, adjustment: StockAdjustmentSchema, adjustedby: str
+) -> dict:
+    """
+    Apply a signed delta to the quantity in stock of one batch.
+
+    One statement updates the row and records the adjustment, and only if
+    the stock still covers what is reserved. A failed adjustment costs a second
+    statement to tell the two causes apart.
+
+    Raises:
+        ValueError: If the inventory is not found.
+        InsufficientStockError: If the delta would take the stock below the reserved stock.
+
+    Returns:
+        ProductInventorySchema: The adjusted inventory.
+    """
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(
+        STOCK_ADJUST_SQL,
+        [
+            batch_id,
+            adjustment.delta,
+            adjustment.reason.value,
+            adjustment.note,
+            timezone.now(),
+            adjustedby,
+        ],
+    )
+    if rows:
+        return ProductInventoryReadSchema(**rows[0])
+    raise await _adjustment_error(connection, {batch_id: [adjustment.delta]})
+
+
+async def adjust_product_inventory_batch(
+    adjustments: Iterable[StockAdjustmentItemSchema], adjustedby: str
+) -> List[dict]:
+    """
+    Apply several adjustments in one statement, all or none.
+
+    Adjustments of the same batch apply in order and are each recorded,
+    and the stock must cover what is reserved after every one of them.
+
+    Raises:
+        ValueError: If any inventory is not found.
+        InsufficientStockError: If any batch would go below its reserved stock.
+
+    Returns:
+        List[ProductInventorySchema]: The adjusted inventories, ordered by
+            batch ID.
+    """
+    adjustments = list(adjustments)
+    deltas: Dict[str, List[int]] = defaultdict(list)
+    for adjustment in adjustments:
+        deltas[adjustment.batchid_internal].append(adjustment.delta)
+
+    async with in_transaction() as connection:
+        rows = await connection.execute_query_dict(
+            STOCK_ADJUST_BATCH_SQL,
+            [
+                [a.batchid_internal for a in adjustments],
+                [a.delta for a in adjustments],
+                [a.reason.value for a in adjustments],
+                [a.note for a in adjustments],
+                timezone.now(),
+                adjustedby,
+            ],
+        )
+        if len(rows) < len(deltas):
+            # Raising rolls back the batches that were adjusted
+            raise await _adjustment_error(connection, deltas)
+    rows.sort(key=lambda row: row["batchid_internal"])
+    return [ProductInventoryReadSchema(**row) for row in rows]
+
+
+async def reserve_product_inventory(
+    batch_id: str, data: ReservationCreateSchema, reservedby: str, ttl_minutes: int
+) -> ReservationSchema:
+    """
+    Hold part of a batch's stock for an approved request.
+
+    The batch must be AVAILABLE and have at least ``data.quantity`` of
+    unreserved stock. The hold expires after ``data.ttl_minutes``, or
+    ``ttl_minutes`` if not given, and is then released by the sweeper.
+
+    Raises:
+        ValueError: If the inventory or the request is not found.
+        NotReservableError: If the batch is not AVAILABLE or the request is
+            not APPROVED.
+        InsufficientStockError: If too little stock is unreserved.
+
+    Returns:
+        ReservationSchema: The new reservation.
+    """
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(
+        RESERVE_SQL,
+        [
+            batch_id,
+            data.requestid,
+            data.quantity,
+            data.ttl_minutes or ttl_minutes,
+            timezone.now(),
+            reservedby,
+            InventoryStatus.AVAILABLE.value,
+            RequestStatus.APPROVED.value,
+            ReservationStatus.ACTIVE.value,
+        ],
+    )
+    if rows:
+        return ReservationSchema(**rows[0])
+
+    state = await connection.execute_query_dict(
+        RESERVE_STATE_SQL, [batch_id, data.requestid]
+    )
+    if not state:
+        raise ValueError(f"Product inventory with batch ID {batch_id} not found")
+    state = state[0]
+    if state["request_status"] is None:
+        raise ValueError(f"Request with ID {data.requestid} not found")
+    if state["request_status"] != RequestStatus.APPROVED.value:
+        raise NotReservableError(
+            f"Request {data.requestid} is {state['request_status']}, not APPROVED"
+        )
+    if state["status"] != InventoryStatus.AVAILABLE.value:
+        raise NotReservableError(f"Batch {batch_id} is {state['status']}")
+    # Without a row lock the stock may have been released since
+    raise InsufficientStockError(
+        f"Insufficient stock in batch {batch_id} "
+        f"({state['unreserved']} unreserved, needs {data.quantity})"
+    )
+
+
+async def release_reservation(reservation_id: int) -> ReservationSchema:
+    """
+    Release an ACTIVE reservation and give its stock back to the batch.
+
+    Raises:
+        ValueError: If the reservation is not found.
+        NotReservableError: If it was already released or has expired.
+
+    Returns:
+        ReservationSchema: The released reservation.
+    """
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(
+        RELEASE_SQL,
+        [
+            reservation_id,
+            ReservationStatus.RELEASED.value,
+            timezone.now(),
+            ReservationStatus.ACTIVE.value,
+        ],
+    )
+    if rows:
+        return ReservationSchema(**rows[0])
+    state = await connection.execute_query_dict(RESERVATION_EXISTS_SQL, [reservation_id])
+    if not state:
+        raise ValueError(f"Reservation {reservation_id} not found")
+    raise NotReservableError(f"Reservation {reservation_id} is {state[0]['status']}")
+
+
+async def get_reservations_by_request_id(request_id: str) -> List[ReservationSchema]:
+    rows = await Reservation.filter(requestid=request_id).order_by("reservedat").values()
+    return [ReservationSchema(**row) for row in rows]
+
+
+async def get_available_to_promise(product_id: str) -> AvailableToPromiseSchema:
+    """
+    Sum the unreserved stock of a product's AVAILABLE batches.
+
+    Raises:
+        ValueError: If the product is not found.
+    """
+    connection = connections.get("default")
+    if not await connection.execute_query_dict(PRODUCT_EXISTS_SQL, [product_id]):
+        raise ValueError(f"Product details with ID {product_id} not found")
+    rows = await connection.execute_query_dict(
+        AVAILABLE_TO_PROMISE_SQL, [product_id, InventoryStatus.AVAILABLE.value]
+    )
+    return AvailableToPromiseSchema(productid=product_id, **rows[0])
+
+
+async def get_expiring_product_inventory(
+    days: int, product_id: Optional[str] = None, today: Optional[date] = None
+) -> List[ProductInventoryReadSchema]:
+    """
+    Get the open batches with stock that expire within ``days`` days.
+
+    Batches already past their expirydate are not included; the nightly
+    expiry job marks them EXPIRED.
+
+    Args:
+        days (int): How far ahead to look, 0 for batches expiring today.
+        product_id (Optional[str]): Only batches of this product. Defaults to None.
+        today (Optional[date]): Defaults to today in UTC.
+
+    Returns:
+        List[ProductInventorySchema]: The batches, soonest expiry first.
+    """
+    today = today or datetime.now(dt_timezone.utc).date()
+    rows = await connections.get("default").execute_query_dict(
+        EXPIRING_SQL, [today, today + timedelta(days=days), CLOSED_STATUSES, product_id]
+    )
+    return [ProductInventoryReadSchema(**row) for row in rows]
+
+
+async def get_product_stock_at(product_id: str, at: datetime) -> StockAtSchema:
+    """
+    Get the stock of a product at a point in time from the ledger.
+
+    Costs one checkpoint lookup and a range scan over the ledger rows
+    written since that checkpoint. Products that no longer exist still
+    have their history.
+
+    Args:
+        product_id (str): The ID of the product.
+        at (datetime): The point in time, UTC if naive.
+
+    Returns:
+        StockAtSchema: The stock, and the checkpoint and ledger rows it was summed from.
+    """
+    # asyncpg reads naive datetimes as local time
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=dt_timezone.utc)
+    rows = await connections.get("default").execute_query_dict(
+        STOCK_AT_SQL, [product_id, at]
+    )
+    return StockAtSchema(productid=product_id, at=at, **rows[0])
+
+
+async def get_coa_specification(product_id: str) -> CoaSpecificationSchema:
+    """
+    Get the COA rules of a product, empty if it has none.
+
+    Raises:
+        ValueError: If the product is not found.
+    """
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(COA_SPEC_SQL, [product_id])
+    if not rows and not await connection.execute_query_dict(PRODUCT_EXISTS_SQL, [product_id]):
+        raise ValueError(f"Product with ID {product_id} not found")
+    return CoaSpecificationSchema(productid=product_id, rules=rows)
+
+
+async def set_coa_specification(
+    product_id: str, data: CoaSpecificationUpdateSchema, updatedby: str
+) -> CoaSpecificationSchema:
+    """
+    Replace the COA rules of a product.
+
+    Batches are checked against the new rules by the next COA check.
+
+    Raises:
+        ValueError: If the product is not found.
+    """
+    rules = sorted(data.rules, key=lambda rule: rule.field.value)
+    rows = await connections.get("default").execute_query_dict(
+        COA_SPEC_REPLACE_SQL,
+        [
+            product_id,
+            [rule.field.value for rule in rules],
+            [rule.minvalue for rule in rules],
+            [rule.maxvalue for rule in rules],
+            [rule.expected for rule in rules],
+            updatedby,
+            timezone.now(),
+        ],
+    )
+    if not rows[0]["found"]:
+        raise ValueError(f"Product with ID {product_id} not found")
+    return CoaSpecificationSchema(productid=product_id, rules=rules)
+
+
+async def get_control_chart(product_id: str, field: CoaField, points: int) -> ControlChartSchema:
+    """
+    Chart a measured COA result of the newest ``points`` batches of a product.
+
+    The center line and the ±3σ limits come from coa_statistics, which
+    covers every batch of the product, so only the charted batches are read.
+
+    Raises:
+        ValueError: If the product is not found.
+    """
+    connection = connections.get("default")
+    stats = await connection.execute_query_dict(COA_STATISTICS_SQL, [product_id, field.value])
+    rows = await connection.execute_query_dict(
+        CONTROL_CHART_POINTS_SQL[field], [product_id, points]
+    )
+    if not stats and not rows and not await connection.execute_query_dict(
+        PRODUCT_EXISTS_SQL, [product_id]
+    ):
+        raise ValueError(f"Product with ID {product_id} not found")
+    rows.reverse()
+    count = stats[0]["count"] if stats else 0
+    mean = stats[0]["mean"] if count else None
+    sigma = spc.sigma(count, stats[0]["m2"]) if count else None
+    violations = [[] for _ in rows]
+    if sigma:
+        for rule, broken in spc.western_electric([row["value"] for row in rows], mean, sigma).items():
+            for i in broken.nonzero()[0]:
+                violations[i].append(rule)
+    return ControlChartSchema(
+        productid=product_id,
+        field=field,
+        count=count,
+        mean=mean,
+        sigma=sigma,
+        ucl=mean + 3 * sigma if sigma is not None else None,
+        lcl=mean - 3 * sigma if sigma is not None else None,
+        points=[
+            ControlChartPointSchema(**row, violations=found) for row, found in zip(rows, violations)
+        ],
+    )
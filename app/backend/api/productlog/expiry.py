@@ -0,0 +1,172 @@
+"""Shelf life back-fill and nightly expiry of product_inventory batches.
+
+Run from app/backend:
+
+    python -m api.productlog.expiry backfill [--batch-size 1000]
+    python -m api.productlog.expiry expire [--batch-size 1000]
+"""
+import argparse
+import logging
+import os
+from datetime import date, datetime, time, timezone
+from typing import Optional
+
+from decouple import config
+from tortoise import Tortoise, connections, run_async
+
+from api.productlog.partitions import CLOSED_STATUSES
+from models.productlog.pydantic import InventoryStatus
+from models.productlog.shelflife import parse_shelf_life_days
+from models.requests.periodic import DailyTask
+
+log = logging.getLogger("uvicorn")
+
+# UTC time of day of the nightly run
+INVENTORY_EXPIRY_AT = config(
+    "INVENTORY_EXPIRY_AT", default="02:00", cast=time.fromisoformat
+)
+INVENTORY_EXPIRY_BATCH = config("INVENTORY_EXPIRY_BATCH", default=1000, cast=int)
+# Recorded as lastupdatedby on batches the job expires
+EXPIRED_BY = "system"
+
+# Products whose shelf life was never parsed; an explicit one is kept
+UNPARSED_PRODUCTS_SQL = (
+    'SELECT "productid", "storage_temperature_duration" FROM "productdetails" '
+    'WHERE "shelflifedays" IS NULL'
+)
+FILL_SHELF_LIFE_SQL = (
+    'UPDATE "productdetails" d SET "shelflifedays" = v.days '
+    "FROM unnest($1::varchar[], $2::int[]) AS v(productid, days) "
+    'WHERE d."productid" = v.productid AND d."shelflifedays" IS NULL'
+)
+# One chunk of batches after $1 in batchid order per statement. Keyset
+# paging walks the primary key once, however many batches have no shelf
+# life and stay NULL.
+BACKFILL_EXPIRY_SQL = (
+    'WITH picked AS (SELECT "batchid_internal", "productiondate" FROM "product_inventory" '
+    'WHERE "batchid_internal" > $1 ORDER BY "batchid_internal" LIMIT $2), '
+    'filled AS (UPDATE "product_inventory" p SET "expirydate" = p."productiondate" + d."shelflifedays" '
+    'FROM picked k, "productdetails" d WHERE p."batchid_internal" = k."batchid_internal" '
+    'AND p."productiondate" = k."productiondate" AND d."productid" = p."productid" '
+    'AND p."expirydate" IS DISTINCT FROM p."productiondate" + d."shelflifedays" RETURNING 1) '
+    'SELECT max("batchid_internal") AS "last", count(*)::int AS "count", '
+    '(SELECT count(*) FROM filled)::int AS "filled" FROM picked'
+)
+# One chunk per statement: open batches past their expiry date become
+# EXPIRED, read through the expirydate index. Rows being written are
+# skipped and picked up the next night.
+EXPIRE_SQL = (
+    'WITH picked AS (SELECT "batchid_internal", "productiondate" FROM "product_inventory" '
+    'WHERE "expirydate" < $1 AND "status" <> ALL($2::varchar[]) '
+    'ORDER BY "expirydate" LIMIT $3 FOR UPDATE SKIP LOCKED), '
+    'expired AS (UPDATE "product_inventory" p SET "status" = $4, "version" = p."version" + 1, '
+    '"lastupdated" = $5, "lastupdatedby" = $6 FROM picked k '
+    'WHERE p."batchid_internal" = k."batchid_internal" '
+    'AND p."productiondate" = k."productiondate" RETURNING 1) '
+    'SELECT count(*)::int AS "count" FROM expired'
+)
+
+
+async def backfill_shelf_life(batch_size: int = INVENTORY_EXPIRY_BATCH) -> int:
+    """Parse missing shelf lives, then set the expirydate of every batch.
+
+    Returns:
+        int: The number of batches whose expirydate changed.
+    """
+    connection = connections.get("default")
+    products = await connection.execute_query_dict(UNPARSED_PRODUCTS_SQL)
+    parsed = {
+        row["productid"]: parse_shelf_life_days(row["storage_temperature_duration"])
+        for row in products
+    }
+    parsed = {productid: days for productid, days in parsed.items() if days is not None}
+    if parsed:
+        await connection.execute_query(
+            FILL_SHELF_LIFE_SQL, [list(parsed), list(parsed.values())]
+        )
+    log.info(f"Parsed the shelf life of {len(parsed)} of {len(products)} products")
+
+    last, total = "", 0
+    while True:
+        rows = await connection.execute_query_dict(BACKFILL_EXPIRY_SQL, [last, batch_size])
+        total += rows[0]["filled"]
+        if rows[0]["count"] < batch_size:
+            return total
+        last = rows[0]["last"]
+
+
+async def expire_inventory(
+    batch_size: int = INVENTORY_EXPIRY_BATCH, today: Optional[date] = None
+) -> int:
+    """Mark open batches whose expirydate has passed as EXPIRED.
+
+    A batch is usable up to and including its expirydate.
+
+    Returns:
+        int: The number of expired batches.
+    """
+    connection = connections.get("default")
+    today = today or datetime.now(timezone.utc).date()
+    now = datetime.now(timezone.utc)
+    total = 0
+    while True:
+        rows = await connection.execute_query_dict(
+            EXPIRE_SQL,
+            [today, CLOSED_STATUSES, batch_size, InventoryStatus.EXPIRED.value, now, EXPIRED_BY],
+        )
+        count = rows[0]["count"]
+        total += count
+        if count < batch_size:
+            return total
+
+
+class InventoryExpirer(DailyTask):
+    """Expire batches past their expirydate every night."""
+
+    name = "inventory_expiry"
+    description = "expire inventory"
+
+    def __init__(
+        self,
+        at: time = INVENTORY_EXPIRY_AT,
+        batch_size: int = INVENTORY_EXPIRY_BATCH,
+    ):
+        super().__init__(at)
+        self.batch_size = batch_size
+
+    async def tick(self) -> None:
+        count = await expire_inventory(self.batch_size)
+        if count:
+            log.info(f"Expired {count} inventory batches")
+
+
+inventory_expirer = InventoryExpirer()
+
+
+async def _main(args) -> None:
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_URL"),
+        modules={"models": ["models.productlog.tortoise"]},
+    )
+    try:
+        if args.command == "backfill":
+            filled = await backfill_shelf_life(batch_size=args.batch_size)
+            print(f"Set the expiry date of {filled} batches")
+        else:
+            print(f"Expired {await expire_inventory(batch_size=args.batch_size)} batches")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill", help="parse shelf lives and set expiry dates")
+    expire = commands.add_parser("expire", help="mark batches past their expiry date EXPIRED")
+    for command in (backfill, expire):
+        command.add_argument("--batch-size", type=int, default=INVENTORY_EXPIRY_BATCH)
+    run_async(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
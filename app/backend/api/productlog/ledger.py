@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+from decouple import config
+from tortoise import connections
+
+from models.requests.periodic import PeriodicTask
+
+INVENTORY_CHECKPOINT_SECONDS = config(
+    "INVENTORY_CHECKPOINT_SECONDS", default=3600, cast=float
+)
+# Ledger rows are stamped before their statement commits, so a checkpoint
+# only covers rows older than this, which have long been committed
+INVENTORY_CHECKPOINT_LAG_SECONDS = config(
+    "INVENTORY_CHECKPOINT_LAG_SECONDS", default=300, cast=float
+)
+
+# Every product that moved since the newest checkpoint gets a new one, its
+# last checkpoint plus what moved since. Products that did not move keep
+# their last checkpoint, which is still exact. Only the ledger rows after
+# the newest checkpoint are read, through the BRIN index on createdat.
+CHECKPOINT_SQL = (
+    "WITH since AS (SELECT COALESCE(max(\"asof\"), '-infinity') AS \"asof\" "
+    'FROM "inventory_checkpoint"), '
+    'moved AS (SELECT "productid", sum("delta")::int AS "delta" '
+    'FROM "inventory_transaction" WHERE "createdat" > (SELECT "asof" FROM since) '
+    'AND "createdat" <= $1 GROUP BY "productid"), '
+    'latest AS (SELECT DISTINCT ON (c."productid") c."productid", c."quantity" '
+    'FROM "inventory_checkpoint" c JOIN moved m ON m."productid" = c."productid" '
+    'ORDER BY c."productid", c."asof" DESC) '
+    'INSERT INTO "inventory_checkpoint" ("productid", "asof", "quantity", "createdat") '
+    'SELECT m."productid", $1, COALESCE(l."quantity", 0) + m."delta", $2 '
+    'FROM moved m LEFT JOIN latest l ON l."productid" = m."productid" '
+    'ON CONFLICT ("productid", "asof") DO NOTHING RETURNING "productid"'
+)
+
+
+class InventoryCheckpointer(PeriodicTask):
+    """Write per-product stock checkpoints every ``interval`` seconds.
+
+    Stock at a point in time is the checkpoint before it plus the ledger
+    rows in between, so the rows read per query are bounded by how much a
+    product moves in one interval, however long the ledger gets.
+    """
+
+    description = "write inventory checkpoints"
+
+    def __init__(
+        self,
+        interval: float = INVENTORY_CHECKPOINT_SECONDS,
+        lag: float = INVENTORY_CHECKPOINT_LAG_SECONDS,
+    ):
+        super().__init__(interval)
+        self.lag = timedelta(seconds=lag)
+
+    async def checkpoint(self, asof: datetime = None) -> int:
+        """Checkpoint every product that moved up to ``asof``.
+
+        Args:
+            asof (datetime, optional): Defaults to now minus the lag.
+
+        Returns:
+            int: The number of checkpoints written.
+        """
+        now = datetime.now(timezone.utc)
+        rows = await connections.get("default").execute_query_dict(
+            CHECKPOINT_SQL, [asof or now - self.lag, now]
+        )
+        return len(rows)
+
+    async def tick(self) -> None:
+        await self.checkpoint()
+
+
+inventory_checkpointer = InventoryCheckpointer()
@@ -0,0 +1,207 @@
+"""Monthly partitions and archival of product_inventory.
+
+Run from app/backend:
+
+    python -m api.productlog.partitions ensure [--ahead 3]
+    python -m api.productlog.partitions archive [--months 24]
+"""
+import argparse
+import logging
+import os
+from datetime import date, datetime, time, timezone
+from typing import List, Optional
+
+from decouple import config
+from tortoise import Tortoise, connections, run_async
+from tortoise.transactions import in_transaction
+
+from models.productlog.pydantic import InventoryStatus
+from models.productlog.tortoise import ProductInventory
+from models.requests.periodic import DailyTask
+
+log = logging.getLogger("uvicorn")
+
+INVENTORY_PARTITION_MONTHS_AHEAD = config(
+    "INVENTORY_PARTITION_MONTHS_AHEAD", default=3, cast=int
+)
+INVENTORY_ARCHIVE_MONTHS = config("INVENTORY_ARCHIVE_MONTHS", default=24, cast=int)
+# UTC time of day of the nightly run
+INVENTORY_ARCHIVE_AT = config(
+    "INVENTORY_ARCHIVE_AT", default="01:00", cast=time.fromisoformat
+)
+INVENTORY_ARCHIVE_BATCH = config("INVENTORY_ARCHIVE_BATCH", default=1000, cast=int)
+
+# Batches in these states, or with nothing left, are done with once old
+CLOSED_STATUSES = [
+    InventoryStatus.OUT_OF_STOCK.value,
+    InventoryStatus.EXPIRED.value,
+    InventoryStatus.DAMAGED.value,
+]
+
+# A database built by generate_schemas has a plain table, left alone
+IS_PARTITIONED_SQL = (
+    "SELECT relkind = 'p' AS \"partitioned\" FROM pg_class "
+    "WHERE oid = to_regclass('product_inventory')"
+)
+PARTITIONS_SQL = (
+    'SELECT c.relname AS "name" FROM pg_inherits i '
+    "JOIN pg_class c ON c.oid = i.inhrelid "
+    "WHERE i.inhparent = to_regclass('product_inventory')"
+)
+# Batches dated outside every partition land in the default partition
+DEFAULT_MONTHS_SQL = (
+    "SELECT DISTINCT date_trunc('month', \"productiondate\")::date AS \"month\" "
+    'FROM "product_inventory_default"'
+)
+# DDL takes no parameters; the dates are ours. Rows of the month already in
+# the default partition are moved first, or ATTACH would refuse.
+CREATE_PARTITION_SQL = (
+    'LOCK TABLE "product_inventory_default" IN EXCLUSIVE MODE; '
+    'CREATE TABLE "{name}" (LIKE "product_inventory" INCLUDING DEFAULTS); '
+    'WITH moved AS (DELETE FROM "product_inventory_default" '
+    "WHERE \"productiondate\" >= '{start}' AND \"productiondate\" < '{end}' RETURNING *) "
+    'INSERT INTO "{name}" SELECT * FROM moved; '
+    'ALTER TABLE "product_inventory" ATTACH PARTITION "{name}" '
+    "FOR VALUES FROM ('{start}') TO ('{end}')"
+)
+
+COLUMNS = ", ".join(
+    f'"{column}"' for column in ProductInventory._meta.fields_db_projection.values()
+)
+# One chunk per statement: closed batches produced before $1 leave the live
+# table and enter the archive together. Rows being written are skipped.
+ARCHIVE_SQL = (
+    'WITH picked AS (SELECT "batchid_internal", "productiondate" FROM "product_inventory" '
+    'WHERE "productiondate" < $1 AND "quantityreserved" = 0 '
+    'AND ("status" = ANY($2::varchar[]) OR "quantityinstock" = 0) '
+    'ORDER BY "productiondate" LIMIT $3 FOR UPDATE SKIP LOCKED), '
+    'moved AS (DELETE FROM "product_inventory" p USING picked k '
+    'WHERE p."batchid_internal" = k."batchid_internal" '
+    'AND p."productiondate" = k."productiondate" RETURNING p.*), '
+    f'archived AS (INSERT INTO "product_inventory_archive" ({COLUMNS}, "archivedat") '
+    f'SELECT {COLUMNS}, $4 FROM moved RETURNING 1) '
+    'SELECT count(*)::int AS "count" FROM archived'
+)
+
+
+def month_start(day: date, months: int = 0) -> date:
+    """The first day of the month ``months`` after the one of ``day``."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"product_inventory_p{month:%Y%m}"
+
+
+async def ensure_partitions(
+    today: Optional[date] = None, ahead: int = INVENTORY_PARTITION_MONTHS_AHEAD
+) -> List[str]:
+    """Create the monthly partitions that are missing.
+
+    Covers last month to ``ahead`` months from now, and every month with
+    batches in the default partition.
+
+    Returns:
+        List[str]: The names of the created partitions.
+    """
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(IS_PARTITIONED_SQL)
+    if not rows or not rows[0]["partitioned"]:
+        return []
+    existing = {row["name"] for row in await connection.execute_query_dict(PARTITIONS_SQL)}
+    today = today or date.today()
+    months = {month_start(today, n) for n in range(-1, ahead + 1)}
+    months.update(row["month"] for row in await connection.execute_query_dict(DEFAULT_MONTHS_SQL))
+
+    created = []
+    for month in sorted(months):
+        name = partition_name(month)
+        if name in existing:
+            continue
+        async with in_transaction() as transaction:
+            await transaction.execute_script(
+                CREATE_PARTITION_SQL.format(name=name, start=month, end=month_start(month, 1))
+            )
+        created.append(name)
+    if created:
+        log.info(f"Created inventory partitions {', '.join(created)}")
+    return created
+
+
+async def archive_inventory(
+    months: int = INVENTORY_ARCHIVE_MONTHS,
+    batch_size: int = INVENTORY_ARCHIVE_BATCH,
+    today: Optional[date] = None,
+) -> int:
+    """Move closed batches produced more than ``months`` ago to the archive.
+
+    Returns:
+        int: The number of archived batches.
+    """
+    connection = connections.get("default")
+    cutoff = month_start(today or date.today(), -months)
+    now = datetime.now(timezone.utc)
+    total = 0
+    while True:
+        rows = await connection.execute_query_dict(
+            ARCHIVE_SQL, [cutoff, CLOSED_STATUSES, batch_size, now]
+        )
+        count = rows[0]["count"]
+        total += count
+        if count < batch_size:
+            return total
+
+
+async def ensure_partitions_on_startup() -> None:
+    try:
+        await ensure_partitions()
+    except Exception as e:
+        log.warning(f"Failed to create inventory partitions: {e}")
+
+
+class InventoryArchiver(DailyTask):
+    """Create next months' partitions and archive closed batches every night."""
+
+    name = "inventory_archive"
+    description = "maintain inventory partitions"
+
+    def __init__(self, at: time = INVENTORY_ARCHIVE_AT):
+        super().__init__(at)
+
+    async def tick(self) -> None:
+        await ensure_partitions()
+        await archive_inventory()
+
+
+inventory_archiver = InventoryArchiver()
+
+
+async def _main(args) -> None:
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_URL"),
+        modules={"models": ["models.productlog.tortoise"]},
+    )
+    try:
+        if args.command == "ensure":
+            created = await ensure_partitions(ahead=args.ahead)
+            print(f"Created {len(created)} partitions: {', '.join(created) or '-'}")
+        else:
+            archived = await archive_inventory(months=args.months)
+            print(f"Archived {archived} batches")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    ensure = commands.add_parser("ensure", help="create missing monthly partitions")
+    ensure.add_argument("--ahead", type=int, default=INVENTORY_PARTITION_MONTHS_AHEAD)
+    archive = commands.add_parser("archive", help="archive old closed batches")
+    archive.add_argument("--months", type=int, default=INVENTORY_ARCHIVE_MONTHS)
+    run_async(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,13 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import Annotated, List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
 
-from api.productlog.crud import (create_product_details,
+from api.productlog.crud import (InsufficientStockError,
+                                 NotReservableError,
+                                 adjust_product_inventory,
+                                 adjust_product_inventory_batch,
+                                 create_product_details,
                                  get_all_product_details,
                                  get_all_product_inventory,
                                  get_product_inventory_by_product_id,
@@ -9,17 +15,78 @@ from api.productlog.crud import (create_product_details,
                                  get_product_details_by_id,
                                  delete_product_details,
                                  create_product_inventory,
+                                 create_product_inventory_bulk,
                                  get_product_inventory_by_id,
                                  update_product_inventory,
-                                 delete_product_inventory)
-from models.productlog.pydantic import (ProductDetailsSchema,
+                                 delete_product_inventory,
+                                 get_available_to_promise,
+                                 get_coa_specification,
+                                 get_control_chart,
+                                 get_expiring_product_inventory,
+                                 get_product_stock_at,
+                                 get_reservations_by_request_id,
+                                 release_reservation,
+                                 reserve_product_inventory,
+                                 set_coa_specification)
+from api.productlog.coa import check_inventory
+from api.productlog.reservations import RESERVATION_TTL_MINUTES
+from models.productlog.pydantic import (COA_RANGE_FIELDS,
+                                        AvailableToPromiseSchema,
+                                        CoaCheckResultSchema,
+                                        CoaField,
+                                        CoaSpecificationSchema,
+                                        CoaSpecificationUpdateSchema,
+                                        ControlChartSchema,
+                                        ProductDetailsSchema,
+                                        ProductInventoryBulkCreateSchema,
                                         ProductInventorySchema,
                                         ProductInventoryCreateSchema,
-                                        ProductInventoryWithDetailsSchema)
+                                        ProductInventoryWithDetailsSchema,
+                                        ReservationCreateSchema,
+                                        ReservationSchema,
+                                        StockAdjustmentBatchSchema,
+                                        StockAdjustmentResultSchema,
+                                        StockAdjustmentSchema,
+                                        StockAtSchema)
+from api.realtime.hub import INVENTORY_CHANNEL, hub
+from models.requests.api_keys import api_key_handler
 from models.requests.authentication import AuthHandler
+from models.requests.idempotency import idempotency_store
+from models.requests.rate_limit import rate_limiter
+from models.requests.versioning import (VersionConflictError, expected_version,
+                                        set_etag, version_conflict)
 
 router = APIRouter()
 auth_handler = AuthHandler()
+write_limit = rate_limiter.limit("write")
+# Inventory writes also accept instrument and LIMS API keys
+inventory_writer = api_key_handler.auth_or_api_key("inventory:write")
+INVENTORY_WRITER_ROLES = {"ADMIN", "PRODUCTION_MANAGER", "PRODUCER"}
+COA_MANAGER_ROLES = {"ADMIN", "PRODUCTION_MANAGER"}
+
+
+def check_inventory_writer(auth_details: dict, action: str) -> None:
+    """Require the ADMIN, PRODUCTION_MANAGER or PRODUCER role."""
+    if not INVENTORY_WRITER_ROLES.intersection(auth_details["list_of_roles"]):
+        raise HTTPException(
+            status_code=403,
+            detail=(
+                f"You do not have permission to {action} inventory. "
+                "Only ADMIN, PRODUCTION_MANAGER, or PRODUCER roles are allowed."
+            ),
+        )
+
+
+def check_coa_manager(auth_details: dict, action: str) -> None:
+    """Require the ADMIN or PRODUCTION_MANAGER role."""
+    if not COA_MANAGER_ROLES.intersection(auth_details["list_of_roles"]):
+        raise HTTPException(
+            status_code=403,
+            detail=(
+                f"You do not have permission to {action}. "
+                "Only ADMIN or PRODUCTION_MANAGER roles are allowed."
+            ),
+        )
 
 
 @router.get("/product-details", response_model=List[ProductDetailsSchema])
@@ -30,9 +97,11 @@ async def read_all_product_details():
     return await get_all_product_details()
 
 
-@router.post("/product-details", response_model=ProductDetailsSchema)
+@router.post("/product-details", response_model=ProductDetailsSchema, dependencies=[Depends(write_limit)])
 async def create_product_details_endpoint(
-    data: ProductDetailsSchema, auth_details=Depends(auth_handler.auth_wrapper)
+    data: ProductDetailsSchema,
+    auth_details=Depends(auth_handler.auth_wrapper),
+    response: Response = None,
 ):
     """
     Create a new product details record.
@@ -41,6 +110,7 @@ async def create_product_details_endpoint(
         data (ProductDetailsSchema): The product details to create.
         auth_details (dict, optional): Authentication details containing user roles and username. 
             Defaults to Depends(auth_handler.auth_wrapper).
+        response (Response, optional): Carries the row version as its ETag.
     
     Raises:
         HTTPException: If the user does not have permission to create products.
@@ -59,9 +129,11 @@ async def create_product_details_endpoint(
         )
     
     try:
-        return await create_product_details(data)
+        created = await create_product_details(data)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    set_etag(response, created)
+    return created
 
 
 @router.get("/product-inventory", response_model=List[ProductInventoryWithDetailsSchema])
@@ -73,12 +145,13 @@ async def read_all_product_inventory():
 
 
 @router.get("/product-details/{product_id}", response_model=ProductDetailsSchema)
-async def get_product_details_endpoint(product_id: str):
+async def get_product_details_endpoint(product_id: str, response: Response = None):
     """
     Get a single product details record by product ID.
     
     Args:
         product_id (str): The ID of the product to retrieve.
+        response (Response, optional): Carries the row version as its ETag.
     
     Raises:
         HTTPException: If the product is not found.
@@ -87,16 +160,20 @@ async def get_product_details_endpoint(product_id: str):
         ProductDetailsSchema: The product details.
     """
     try:
-        return await get_product_details_by_id(product_id)
+        product = await get_product_details_by_id(product_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    set_etag(response, product)
+    return product
 
 
-@router.put("/product-details/{product_id}", response_model=ProductDetailsSchema)
+@router.put("/product-details/{product_id}", response_model=ProductDetailsSchema, dependencies=[Depends(write_limit)])
 async def update_product_details_endpoint(
     product_id: str,
     data: ProductDetailsSchema, 
-    auth_details=Depends(auth_handler.auth_wrapper)
+    auth_details=Depends(auth_handler.auth_wrapper),
+    if_match: Annotated[Optional[str], Header(alias="If-Match")] = None,
+    response: Response = None,
 ):
     """
     Update an existing product details record.
@@ -106,10 +183,14 @@ async def update_product_details_endpoint(
         data (ProductDetailsSchema): The updated product details.
         auth_details (dict, optional): Authentication details containing user roles and username. 
             Defaults to Depends(auth_handler.auth_wrapper).
+        if_match (Optional[str], optional): The version the client last read. The
+            ``version`` field of the body works too. Defaults to None.
+        response (Response, optional): Carries the row version as its ETag.
     
     Raises:
         HTTPException: If the user does not have permission to update products.
         HTTPException: If the product is not found.
+        HTTPException: If the product was modified since the given version (412).
         HTTPException: If there's an error updating the product.
     
     Returns:
@@ -124,15 +205,20 @@ async def update_product_details_endpoint(
             detail="You do not have permission to update products. Only ADMIN or PRODUCTION_MANAGER roles are allowed."
         )
     
+    version = expected_version(if_match, data.version)
     try:
-        return await update_product_details(product_id, data)
+        updated = await update_product_details(product_id, data, version)
+    except VersionConflictError as e:
+        raise version_conflict(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    set_etag(response, updated)
+    return updated
 
 
-@router.delete("/product-details/{product_id}")
+@router.delete("/product-details/{product_id}", dependencies=[Depends(write_limit)])
 async def delete_product_details_endpoint(
     product_id: str,
     auth_details=Depends(auth_handler.auth_wrapper)
@@ -171,10 +257,12 @@ async def delete_product_details_endpoint(
 
 
 # ProductInventory endpoints
-@router.post("/product-inventory", response_model=ProductInventorySchema)
+@router.post("/product-inventory", response_model=ProductInventorySchema, dependencies=[Depends(write_limit)])
 async def create_product_inventory_endpoint(
     data: ProductInventoryCreateSchema, 
-    auth_details=Depends(auth_handler.auth_wrapper)
+    auth_details=Depends(inventory_writer),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+    response: Response = None,
 ):
     """
     Create a new product inventory record.
@@ -182,7 +270,10 @@ async def create_product_inventory_endpoint(
     Args:
         data (ProductInventoryCreateSchema): The product inventory to create.
         auth_details (dict, optional): Authentication details containing user roles and username. 
-            Defaults to Depends(auth_handler.auth_wrapper).
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+        idempotency_key (Optional[str], optional): Retries with the same key get the
+            first response back instead of creating another batch. Defaults to None.
+        response (Response, optional): Carries the row version as its ETag.
     
     Raises:
         HTTPException: If the user does not have permission to create inventory.
@@ -200,10 +291,65 @@ async def create_product_inventory_endpoint(
             detail="You do not have permission to create inventory. Only ADMIN, PRODUCTION_MANAGER, or PRODUCER roles are allowed."
         )
     
-    try:
-        return await create_product_inventory(data)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    async def execute():
+        try:
+            created = await create_product_inventory(data)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        row = jsonable_encoder(created)
+        hub.publish(INVENTORY_CHANNEL, "created", row["batchid_internal"], row)
+        return created
+
+    created = await idempotency_store.run(
+        "inventory.create", idempotency_key, auth_details["username"], data, execute
+    )
+    set_etag(response, created)
+    return created
+
+
+@router.post(
+    "/product-inventory/bulk",
+    response_model=List[ProductInventorySchema],
+    dependencies=[Depends(write_limit)],
+)
+async def create_product_inventory_bulk_endpoint(
+    data: ProductInventoryBulkCreateSchema,
+    auth_details=Depends(inventory_writer),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+):
+    """
+    Create many product inventory records at once, all or none.
+    
+    Batches failing their product's COA specification are created in QUARANTINE(隔离).
+    
+    Args:
+        data (ProductInventoryBulkCreateSchema): The batches to create.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+        idempotency_key (Optional[str], optional): Retries with the same key get the
+            first response back instead of creating the batches again. Defaults to None.
+    
+    Raises:
+        HTTPException: If the user does not have permission to create inventory.
+        HTTPException: If there's an error creating the inventory.
+    
+    Returns:
+        List[ProductInventorySchema]: The created batches, in the order given.
+    """
+    check_inventory_writer(auth_details, "create")
+    
+    async def execute():
+        try:
+            created = await create_product_inventory_bulk(data.items)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        for row in jsonable_encoder(created):
+            hub.publish(INVENTORY_CHANNEL, "created", row["batchid_internal"], row)
+        return created
+
+    return await idempotency_store.run(
+        "inventory.create_bulk", idempotency_key, auth_details["username"], data, execute
+    )
 
 
 @router.get("/product-inventory/by-product/{product_id}", response_model=List[ProductInventorySchema])
@@ -226,13 +372,58 @@ async def get_product_inventory_by_product_endpoint(product_id: str):
         raise HTTPException(status_code=404, detail=str(e))
 
 
+@router.post("/product-inventory/coa-check", response_model=CoaCheckResultSchema)
+async def check_coa_endpoint(
+    productid: Optional[str] = None,
+    dry_run: bool = False,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    Check open batches against their product's COA specification now.
+    
+    Failed batches are moved to QUARANTINE(隔离), as the nightly check does.
+    
+    Args:
+        productid (Optional[str], optional): Only check this product's batches. Defaults to all.
+        dry_run (bool, optional): Only report failures. Defaults to False.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to check COA results.
+    
+    Returns:
+        CoaCheckResultSchema: Counts of checked, failed and quarantined batches.
+    """
+    check_coa_manager(auth_details, "check COA results")
+    return await check_inventory(productid, quarantine=not dry_run)
+
+
+@router.get("/product-inventory/expiring", response_model=List[ProductInventorySchema])
+async def get_expiring_product_inventory_endpoint(
+    days: int = Query(30, ge=0, le=3650), productid: Optional[str] = None
+):
+    """
+    Get the open batches with stock that expire within ``days`` days.
+    
+    Args:
+        days (int, optional): How far ahead to look, 0 for today. Defaults to 30.
+        productid (Optional[str], optional): Only batches of this product. Defaults to None.
+    
+    Returns:
+        List[ProductInventorySchema]: The batches, soonest expiry first.
+    """
+    return await get_expiring_product_inventory(days, productid)
+
+
 @router.get("/product-inventory/{batch_id}", response_model=ProductInventorySchema)
-async def get_product_inventory_endpoint(batch_id: str):
+async def get_product_inventory_endpoint(batch_id: str, response: Response = None):
     """
     Get a single product inventory record by batch ID.
     
     Args:
         batch_id (str): The internal batch ID of the inventory to retrieve.
+        response (Response, optional): Carries the row version as its ETag.
     
     Raises:
         HTTPException: If the inventory is not found.
@@ -241,16 +432,20 @@ async def get_product_inventory_endpoint(batch_id: str):
         ProductInventorySchema: The product inventory.
     """
     try:
-        return await get_product_inventory_by_id(batch_id)
+        inventory = await get_product_inventory_by_id(batch_id)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    set_etag(response, inventory)
+    return inventory
 
 
-@router.put("/product-inventory/{batch_id}", response_model=ProductInventorySchema)
+@router.put("/product-inventory/{batch_id}", response_model=ProductInventorySchema, dependencies=[Depends(write_limit)])
 async def update_product_inventory_endpoint(
     batch_id: str,
     data: ProductInventoryCreateSchema, 
-    auth_details=Depends(auth_handler.auth_wrapper)
+    auth_details=Depends(inventory_writer),
+    if_match: Annotated[Optional[str], Header(alias="If-Match")] = None,
+    response: Response = None,
 ):
     """
     Update an existing product inventory record.
@@ -259,11 +454,16 @@ async def update_product_inventory_endpoint(
         batch_id (str): The internal batch ID of the inventory to update.
         data (ProductInventoryCreateSchema): The updated product inventory.
         auth_details (dict, optional): Authentication details containing user roles and username. 
-            Defaults to Depends(auth_handler.auth_wrapper).
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+        if_match (Optional[str], optional): The version the client last read. The
+            ``version`` field of the body works too. Defaults to None.
+        response (Response, optional): Carries the row version as its ETag.
     
     Raises:
         HTTPException: If the user does not have permission to update inventory.
         HTTPException: If the inventory is not found.
+        HTTPException: If the inventory was modified since the given version (412).
+        HTTPException: If the new quantity in stock is below the reserved stock (409).
         HTTPException: If there's an error updating the inventory.
     
     Returns:
@@ -278,18 +478,129 @@ async def update_product_inventory_endpoint(
             detail="You do not have permission to update inventory. Only ADMIN, PRODUCTION_MANAGER, or PRODUCER roles are allowed."
         )
     
+    version = expected_version(if_match, data.version)
     try:
-        return await update_product_inventory(batch_id, data)
+        updated = await update_product_inventory(batch_id, data, version)
+    except VersionConflictError as e:
+        raise version_conflict(e)
+    except InsufficientStockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    hub.publish(INVENTORY_CHANNEL, "updated", batch_id, updated)
+    set_etag(response, updated)
+    return updated
+
+
+@router.post(
+    "/product-inventory/adjust",
+    response_model=List[StockAdjustmentResultSchema],
+    dependencies=[Depends(write_limit)],
+)
+async def adjust_product_inventory_batch_endpoint(
+    data: StockAdjustmentBatchSchema,
+    auth_details=Depends(inventory_writer),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+):
+    """
+    Adjust the quantity in stock of several batches at once, all or none.
+    
+    Args:
+        data (StockAdjustmentBatchSchema): The adjustments, each with a batch ID,
+            a signed delta and a reason.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+        idempotency_key (Optional[str], optional): Retries with the same key get the
+            first response back instead of adjusting again. Defaults to None.
+    
+    Raises:
+        HTTPException: If the user does not have permission to adjust inventory.
+        HTTPException: If any inventory is not found.
+        HTTPException: If any batch would go below zero (409).
+    
+    Returns:
+        List[StockAdjustmentResultSchema]: The new quantity in stock of each batch.
+    """
+    check_inventory_writer(auth_details, "adjust")
+    
+    async def execute():
+        try:
+            results = await adjust_product_inventory_batch(
+                data.adjustments, auth_details["username"]
+            )
+        except InsufficientStockError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        for result in results:
+            hub.publish(INVENTORY_CHANNEL, "updated", result.batchid_internal, result)
+        return results
+
+    return await idempotency_store.run(
+        "inventory.adjust_batch", idempotency_key, auth_details["username"], data, execute
+    )
+
+
+@router.post(
+    "/product-inventory/{batch_id}/adjust",
+    response_model=StockAdjustmentResultSchema,
+    dependencies=[Depends(write_limit)],
+)
+async def adjust_product_inventory_endpoint(
+    batch_id: str,
+    data: StockAdjustmentSchema,
+    auth_details=Depends(inventory_writer),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+    response: Response = None,
+):
+    """
+    Add a signed delta to the quantity in stock of one batch.
+    
+    Args:
+        batch_id (str): The internal batch ID of the inventory to adjust.
+        data (StockAdjustmentSchema): The delta and the reason for it.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+        idempotency_key (Optional[str], optional): Retries with the same key get the
+            first response back instead of adjusting again. Defaults to None.
+        response (Response, optional): Carries the row version as its ETag.
+    
+    Raises:
+        HTTPException: If the user does not have permission to adjust inventory.
+        HTTPException: If the inventory is not found.
+        HTTPException: If the batch would go below its reserved stock (409).
+    
+    Returns:
+        StockAdjustmentResultSchema: The new quantity in stock and version.
+    """
+    check_inventory_writer(auth_details, "adjust")
+    
+    async def execute():
+        try:
+            result = await adjust_product_inventory(
+                batch_id, data, auth_details["username"]
+            )
+        except InsufficientStockError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        hub.publish(INVENTORY_CHANNEL, "updated", batch_id, result)
+        return result
+
+    result = await idempotency_store.run(
+        "inventory.adjust", idempotency_key, auth_details["username"],
+        {"batch_id": batch_id, **data.dict()}, execute
+    )
+    set_etag(response, result)
+    return result
 
 
-@router.delete("/product-inventory/{batch_id}")
+@router.delete("/product-inventory/{batch_id}", dependencies=[Depends(write_limit)])
 async def delete_product_inventory_endpoint(
     batch_id: str,
-    auth_details=Depends(auth_handler.auth_wrapper)
+    auth_details=Depends(inventory_writer)
 ):
     """
     Delete an existing product inventory record.
@@ -297,7 +608,7 @@ async def delete_product_inventory_endpoint(
     Args:
         batch_id (str): The internal batch ID of the inventory to delete.
         auth_details (dict, optional): Authentication details containing user roles and username. 
-            Defaults to Depends(auth_handler.auth_wrapper).
+            Defaults to Depends(inventory_writer), a JWT or an API key.
     
     Raises:
         HTTPException: If the user does not have permission to delete inventory.
@@ -317,8 +628,236 @@ async def delete_product_inventory_endpoint(
         )
     
     try:
-        return await delete_product_inventory(batch_id)
+        deleted = await delete_product_inventory(batch_id, auth_details["username"])
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    hub.publish(INVENTORY_CHANNEL, "deleted", batch_id)
+    return deleted
+
+
+@router.post(
+    "/product-inventory/{batch_id}/reservations",
+    response_model=ReservationSchema,
+    dependencies=[Depends(write_limit)],
+)
+async def reserve_product_inventory_endpoint(
+    batch_id: str,
+    data: ReservationCreateSchema,
+    auth_details=Depends(inventory_writer),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+):
+    """
+    Hold part of a batch's stock for an approved product request.
+    
+    Args:
+        batch_id (str): The internal batch ID of the inventory to reserve from.
+        data (ReservationCreateSchema): The request ID, the quantity and
+            optionally how many minutes the hold lasts.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+        idempotency_key (Optional[str], optional): Retries with the same key get the
+            first response back instead of reserving again. Defaults to None.
+    
+    Raises:
+        HTTPException: If the user does not have permission to reserve inventory.
+        HTTPException: If the inventory or the request is not found.
+        HTTPException: If the batch is not AVAILABLE, the request is not
+            APPROVED or too little stock is unreserved (409).
+    
+    Returns:
+        ReservationSchema: The new reservation.
+    """
+    check_inventory_writer(auth_details, "reserve")
+    
+    async def execute():
+        try:
+            return await reserve_product_inventory(
+                batch_id, data, auth_details["username"], RESERVATION_TTL_MINUTES
+            )
+        except (InsufficientStockError, NotReservableError) as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+
+    return await idempotency_store.run(
+        "inventory.reserve", idempotency_key, auth_details["username"],
+        {"batch_id": batch_id, **data.dict()}, execute
+    )
+
+
+@router.delete(
+    "/reservations/{reservation_id}",
+    response_model=ReservationSchema,
+    dependencies=[Depends(write_limit)],
+)
+async def release_reservation_endpoint(
+    reservation_id: int,
+    auth_details=Depends(inventory_writer)
+):
+    """
+    Release a reservation before it expires.
+    
+    Args:
+        reservation_id (int): The ID of the reservation.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(inventory_writer), a JWT or an API key.
+    
+    Raises:
+        HTTPException: If the user does not have permission to release reservations.
+        HTTPException: If the reservation is not found.
+        HTTPException: If it was already released or has expired (409).
+    
+    Returns:
+        ReservationSchema: The released reservation.
+    """
+    check_inventory_writer(auth_details, "release")
+    try:
+        return await release_reservation(reservation_id)
+    except NotReservableError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/reservations", response_model=List[ReservationSchema])
+async def get_reservations_endpoint(requestid: str):
+    """
+    Get the reservations of a product request, oldest first.
+    
+    Args:
+        requestid (str): The request ID.
+    
+    Returns:
+        List[ReservationSchema]: The reservations, including released and expired ones.
+    """
+    return await get_reservations_by_request_id(requestid)
+
+
+@router.get(
+    "/product-details/{product_id}/available-to-promise",
+    response_model=AvailableToPromiseSchema,
+)
+async def get_available_to_promise_endpoint(product_id: str):
+    """
+    Get the unreserved stock of a product across its AVAILABLE batches.
+    
+    Args:
+        product_id (str): The ID of the product.
+    
+    Raises:
+        HTTPException: If the product is not found.
+    
+    Returns:
+        AvailableToPromiseSchema: Stock, reserved stock and what can still be promised.
+    """
+    try:
+        return await get_available_to_promise(product_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get(
+    "/product-details/{product_id}/coa-specification",
+    response_model=CoaSpecificationSchema,
+)
+async def get_coa_specification_endpoint(product_id: str):
+    """
+    Get the COA rules batches of a product are checked against.
+    
+    Args:
+        product_id (str): The ID of the product.
+    
+    Raises:
+        HTTPException: If the product is not found.
+    
+    Returns:
+        CoaSpecificationSchema: The rules, empty if the product has none.
+    """
+    try:
+        return await get_coa_specification(product_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.put(
+    "/product-details/{product_id}/coa-specification",
+    response_model=CoaSpecificationSchema,
+    dependencies=[Depends(write_limit)],
+)
+async def set_coa_specification_endpoint(
+    product_id: str,
+    data: CoaSpecificationUpdateSchema,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    Replace the COA rules of a product.
+    
+    Args:
+        product_id (str): The ID of the product.
+        data (CoaSpecificationUpdateSchema): All rules of the product; a field
+            left out is no longer checked.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to set COA specifications.
+        HTTPException: If the product is not found.
+    
+    Returns:
+        CoaSpecificationSchema: The saved rules.
+    """
+    check_coa_manager(auth_details, "set COA specifications")
+    try:
+        return await set_coa_specification(product_id, data, auth_details["username"])
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get(
+    "/product-details/{product_id}/control-chart",
+    response_model=ControlChartSchema,
+)
+async def get_control_chart_endpoint(
+    product_id: str,
+    field: CoaField = CoaField.PH,
+    points: int = Query(100, ge=1, le=1000),
+):
+    """
+    Get a control chart of a measured COA result of a product's newest batches.
+    
+    Args:
+        product_id (str): The ID of the product.
+        field (CoaField, optional): coa_ph or coa_osmoticpressure. Defaults to coa_ph.
+        points (int, optional): How many of the newest measured batches to chart. Defaults to 100.
+    
+    Raises:
+        HTTPException: If the field is a pass/fail result.
+        HTTPException: If the product is not found.
+    
+    Returns:
+        ControlChartSchema: The center line, ±3σ limits and the points with
+            the Western Electric rules they break.
+    """
+    if field not in COA_RANGE_FIELDS:
+        raise HTTPException(status_code=400, detail=f"{field.value} is a pass/fail result, not a measurement")
+    try:
+        return await get_control_chart(product_id, field, points)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/product-details/{product_id}/stock-at", response_model=StockAtSchema)
+async def get_product_stock_at_endpoint(product_id: str, at: datetime):
+    """
+    Get the stock of a product at a point in time, e.g. at month end.
+    
+    Args:
+        product_id (str): The ID of the product.
+        at (datetime): The point in time, UTC unless it has an offset.
+    
+    Returns:
+        StockAtSchema: The stock across all batches of the product at that time.
+    """
+    return await get_product_stock_at(product_id, at)
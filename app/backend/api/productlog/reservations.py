@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+
+from decouple import config
+from tortoise import connections
+
+from models.productlog.pydantic import ReservationStatus
+from models.productrequests.pydantic import RequestStatus
+from models.requests.periodic import PeriodicTask
+
+RESERVATION_TTL_MINUTES = config("RESERVATION_TTL_MINUTES", default=1440, cast=int)
+RESERVATION_SWEEP_SECONDS = config("RESERVATION_SWEEP_SECONDS", default=60, cast=float)
+RESERVATION_SWEEP_BATCH = config("RESERVATION_SWEEP_BATCH", default=1000, cast=int)
+
+# Expires one batch of stale holds and gives their stock back in a single
+# statement. The ACTIVE literal is inlined so the planner can use the
+# partial index on expiresat; SKIP LOCKED leaves holds that are being
+# released right now to the release. Batches are locked in batchid order
+# like the bulk adjustment, so the two cannot deadlock.
+SWEEP_SQL = (
+    'WITH expired AS (UPDATE "reservation" SET "status" = $2, "releasedat" = $1 '
+    'WHERE "id" IN (SELECT "id" FROM "reservation" '
+    f"WHERE \"status\" = '{ReservationStatus.ACTIVE.value}' AND \"expiresat\" < $1 "
+    'ORDER BY "expiresat" LIMIT $3 FOR UPDATE SKIP LOCKED) '
+    'RETURNING "batchid_internal", "quantity"), '
+    'totals AS (SELECT "batchid_internal", sum("quantity")::int AS "quantity" '
+    'FROM expired GROUP BY "batchid_internal"), '
+    'locked AS (SELECT p."batchid_internal" FROM "product_inventory" p '
+    'JOIN totals t ON t."batchid_internal" = p."batchid_internal" '
+    'ORDER BY p."batchid_internal" FOR UPDATE OF p), '
+    'restored AS (UPDATE "product_inventory" p SET '
+    '"quantityreserved" = GREATEST(p."quantityreserved" - t."quantity", 0), '
+    '"version" = p."version" + 1 '
+    'FROM totals t JOIN locked l ON l."batchid_internal" = t."batchid_internal" '
+    'WHERE p."batchid_internal" = t."batchid_internal") '
+    'SELECT count(*)::int AS "count" FROM expired'
+)
+
+# Request writes release the holds of a request that is fulfilled or
+# rejected in the same statement, rather than leaving them to the sweeper.
+# Takes the written requests as {source}; the CTE names are prefixed so
+# the fragment can be appended to any request statement.
+CLOSED = (RequestStatus.FULLFILLED.value, RequestStatus.REJECTED.value)
+RELEASE_HOLDS_SQL = (
+    'held AS (UPDATE "reservation" h SET "status" = '
+    f"'{ReservationStatus.RELEASED.value}', \"releasedat\" = now() "
+    'FROM {source} s WHERE h."requestid" = s."requestid" '
+    f"AND s.\"status\" IN ('{CLOSED[0]}', '{CLOSED[1]}') "
+    f"AND h.\"status\" = '{ReservationStatus.ACTIVE.value}' "
+    'RETURNING h."batchid_internal", h."quantity"), '
+    'held_totals AS (SELECT "batchid_internal", sum("quantity")::int AS "quantity" '
+    'FROM held GROUP BY "batchid_internal"), '
+    'held_locked AS (SELECT p."batchid_internal" FROM "product_inventory" p '
+    'JOIN held_totals t ON t."batchid_internal" = p."batchid_internal" '
+    'ORDER BY p."batchid_internal" FOR UPDATE OF p), '
+    'held_restored AS (UPDATE "product_inventory" p SET '
+    '"quantityreserved" = GREATEST(p."quantityreserved" - t."quantity", 0), '
+    '"version" = p."version" + 1 '
+    'FROM held_totals t JOIN held_locked l ON l."batchid_internal" = t."batchid_internal" '
+    'WHERE p."batchid_internal" = t."batchid_internal")'
+)
+
+
+class ReservationSweeper(PeriodicTask):
+    """Expire reservations past their expiresat every ``interval`` seconds.
+
+    Until it runs, an expired hold still counts as reserved, so
+    available-to-promise errs on the side of promising too little.
+    """
+
+    description = "sweep expired reservations"
+
+    def __init__(
+        self,
+        interval: float = RESERVATION_SWEEP_SECONDS,
+        batch_size: int = RESERVATION_SWEEP_BATCH,
+    ):
+        super().__init__(interval)
+        self.batch_size = batch_size
+
+    async def sweep(self) -> int:
+        """Expire stale holds, ``batch_size`` per statement, until none are left.
+
+        Returns:
+            int: The number of expired reservations.
+        """
+        connection = connections.get("default")
+        now = datetime.now(timezone.utc)
+        total = 0
+        while True:
+            rows = await connection.execute_query_dict(
+                SWEEP_SQL, [now, ReservationStatus.EXPIRED.value, self.batch_size]
+            )
+            count = rows[0]["count"]
+            total += count
+            if count < self.batch_size:
+                return total
+
+    async def tick(self) -> None:
+        await self.sweep()
+
+
+reservation_sweeper = ReservationSweeper()
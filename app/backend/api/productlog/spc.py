@@ -0,0 +1,198 @@
+"""Running statistics and control chart rules of the measured COA results.
+
+coa_statistics holds, per product and measured field, the count, mean and
+sum of squared deviations (M2) of every batch ever measured, archived ones
+included. Inventory writes merge their changes into it in the same
+statement, so a chart needs only its own points, never the whole history.
+
+Run from app/backend, e.g. after importing batches behind the API's back:
+
+    python -m api.productlog.spc recompute
+"""
+import argparse
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from tortoise import Tortoise, run_async
+from tortoise.transactions import in_transaction
+
+from models.productlog.pydantic import COA_RANGE_FIELDS, WesternElectricRule
+
+FIELDS = [field.value for field in COA_RANGE_FIELDS]
+
+
+def _changes(relation: str, sign: str, productid: str, prefix: str, where: str = "") -> str:
+    removed, added = ('"{}"', "NULL::float8") if sign == "-" else ("NULL::float8", '"{}"')
+    return " UNION ALL ".join(
+        f'SELECT "{productid}" AS "productid", \'{field}\' AS "field", '
+        f'{removed.format(prefix + field)} AS "removed", {added.format(prefix + field)} AS "added" '
+        f'FROM {relation} WHERE "{prefix}{field}" IS NOT NULL{where.format(field=field)}'
+        for field in FIELDS
+    )
+
+
+def added(relation: str) -> str:
+    """The measured results of the rows of ``relation``, as changes adding them."""
+    return _changes(relation, "+", "productid", "")
+
+
+def removed(relation: str) -> str:
+    """The measured results of the rows of ``relation``, as changes removing them."""
+    return _changes(relation, "-", "productid", "")
+
+
+def replaced(relation: str) -> str:
+    """Changes of rows of ``relation`` returned by an UPDATE with their old
+    ``old_productid`` and ``old_<field>``. A result that stayed with the
+    same product is left alone."""
+    moved = ' AND ("productid" <> "old_productid" OR "{field}" IS DISTINCT FROM "old_{field}")'
+    return (
+        _changes(relation, "-", "old_productid", "old_", moved)
+        + " UNION ALL "
+        + _changes(relation, "+", "productid", "", moved)
+    )
+
+
+def _merge(count: str, mean: str, m2: str, dn: str, c: str, s1: str, s2: str) -> str:
+    """Assignments merging a change into count, mean and m2.
+
+    A change adds and removes values v; it is dn, the net number added,
+    and s1 and s2, the signed sums of v - c and (v - c)^2 about a center c
+    near them. Moved to the old mean, they are
+    D1 = s1 + dn e and D2 = s2 + 2 e s1 + dn e^2 with e = c - mean, and
+    the new mean is mean + D1 / n, the new M2 is M2 + D2 - D1^2 / n. One
+    added value is Welford's update and a set of them Chan's; every term
+    is a deviation, so no large sums cancel.
+    """
+    n = f"({count} + {dn})"
+    e = f"({c} - {mean})"
+    d1 = f"({s1} + {dn} * {e})"
+    d2 = f"({s2} + 2 * {e} * {s1} + {dn} * {e} * {e})"
+    return (
+        f'"count" = {n}, '
+        f'"mean" = CASE WHEN {n} > 0 THEN {mean} + {d1} / {n} ELSE 0 END, '
+        f'"m2" = CASE WHEN {n} > 0 THEN GREATEST({m2} + {d2} - {d1} * {d1} / {n}, 0) ELSE 0 END, '
+        '"updatedat" = now()'
+    )
+
+
+def record(changes: str) -> str:
+    """CTEs merging ``changes`` into coa_statistics, to end a write's WITH list.
+
+    ``changes`` selects productid, field, removed and added, one value or
+    NULL each. They are summed per product and field about their average,
+    then merged into the existing rows. A product measured for the first
+    time gets a row; one written concurrently is merged into on conflict.
+    """
+    return (
+        f"spc_changes AS ({changes}), "
+        'spc_deltas AS (SELECT "productid", "field", count("added") - count("removed") AS "dn", "c", '
+        'COALESCE(sum("added" - "c"), 0) - COALESCE(sum("removed" - "c"), 0) AS "s1", '
+        'COALESCE(sum(("added" - "c") ^ 2), 0) - COALESCE(sum(("removed" - "c") ^ 2), 0) AS "s2" '
+        'FROM (SELECT *, avg(COALESCE("added", "removed")) OVER (PARTITION BY "productid", "field") '
+        'AS "c" FROM spc_changes) ch GROUP BY "productid", "field", "c"), '
+        'spc_updated AS (UPDATE "coa_statistics" s SET '
+        + _merge('s."count"', 's."mean"', 's."m2"', 'd."dn"', 'd."c"', 'd."s1"', 'd."s2"')
+        + ' FROM spc_deltas d WHERE s."productid" = d."productid" AND s."field" = d."field"), '
+        'spc_started AS (INSERT INTO "coa_statistics" ("productid", "field", "count", "mean", "m2", '
+        '"updatedat") SELECT "productid", "field", "dn", "c" + "s1" / "dn", '
+        'GREATEST("s2" - "s1" * "s1" / "dn", 0), now() FROM spc_deltas d WHERE "dn" > 0 '
+        'AND NOT EXISTS (SELECT 1 FROM "coa_statistics" s '
+        'WHERE s."productid" = d."productid" AND s."field" = d."field") '
+        'ON CONFLICT ("productid", "field") DO UPDATE SET '
+        + _merge(
+            '"coa_statistics"."count"', '"coa_statistics"."mean"', '"coa_statistics"."m2"',
+            'EXCLUDED."count"', 'EXCLUDED."mean"', "0", 'EXCLUDED."m2"',
+        )
+        + ")"
+    )
+
+
+# Writers keep the table in step, so they wait while it is rebuilt; the
+# rebuild then sees every write committed before it.
+LOCK_STATISTICS_SQL = (
+    'LOCK TABLE "coa_statistics" IN EXCLUSIVE MODE; DELETE FROM "coa_statistics"'
+)
+RECOMPUTE_SQL = (
+    'WITH history AS (SELECT "productid", ' + ", ".join(f'"{f}"' for f in FIELDS)
+    + ' FROM "product_inventory" UNION ALL SELECT "productid", ' + ", ".join(f'"{f}"' for f in FIELDS)
+    + ' FROM "product_inventory_archive"), '
+    'saved AS (INSERT INTO "coa_statistics" ("productid", "field", "count", "mean", "m2", "updatedat") '
+    'SELECT h."productid", v."field", count(*), avg(v."value"), var_pop(v."value") * count(*), now() '
+    "FROM history h CROSS JOIN LATERAL (VALUES "
+    + ", ".join(f"('{f}', h.\"{f}\")" for f in FIELDS)
+    + ') AS v("field", "value") WHERE v."value" IS NOT NULL '
+    'GROUP BY h."productid", v."field" RETURNING 1) '
+    'SELECT count(*)::int AS "count" FROM saved'
+)
+
+
+def sigma(count: int, m2: float) -> Optional[float]:
+    """The sample standard deviation, or None below two values."""
+    return (m2 / (count - 1)) ** 0.5 if count > 1 else None
+
+
+def _runs(mask: np.ndarray, length: int) -> np.ndarray:
+    """How many of the ``length`` points ending at each point are in ``mask``;
+    0 before the first full window."""
+    total = np.concatenate([[0], np.cumsum(mask)])
+    counts = np.zeros(len(mask), dtype=np.int64)
+    counts[length - 1:] = total[length:] - total[:-length]
+    return counts
+
+
+def western_electric(
+    values: np.ndarray, mean: float, std: float
+) -> Dict[WesternElectricRule, np.ndarray]:
+    """Points breaking each Western Electric rule, in chronological order.
+
+    A point is flagged when it completes the pattern, so for the run rules
+    it is the last point of the run.
+
+    Returns:
+        Dict[WesternElectricRule, np.ndarray]: A boolean mask over ``values`` per rule.
+    """
+    z = (np.asarray(values, dtype=np.float64) - mean) / std
+    rules = {WesternElectricRule.BEYOND_3_SIGMA: np.abs(z) > 3}
+    for rule, limit, count, length in (
+        (WesternElectricRule.TWO_OF_THREE_BEYOND_2_SIGMA, 2, 2, 3),
+        (WesternElectricRule.FOUR_OF_FIVE_BEYOND_1_SIGMA, 1, 4, 5),
+        (WesternElectricRule.EIGHT_ON_ONE_SIDE, 0, 8, 8),
+    ):
+        rules[rule] = (_runs(z > limit, length) >= count) | (_runs(z < -limit, length) >= count)
+    return rules
+
+
+async def recompute_statistics() -> int:
+    """Rebuild coa_statistics from every live and archived batch.
+
+    Returns:
+        int: The number of product and field rows written.
+    """
+    async with in_transaction() as connection:
+        await connection.execute_script(LOCK_STATISTICS_SQL)
+        rows = await connection.execute_query_dict(RECOMPUTE_SQL)
+    return rows[0]["count"]
+
+
+async def _main(args) -> None:
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_URL"),
+        modules={"models": ["models.productlog.tortoise"]},
+    )
+    try:
+        print(f"Recomputed {await recompute_statistics()} COA statistics")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("recompute", help="rebuild the statistics from every batch")
+    run_async(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,115 @@
+from typing import Optional
+
 from fastapi import HTTPException
+from tortoise import connections
 from tortoise.exceptions import DoesNotExist
 
+from api.productlog.reservations import RELEASE_HOLDS_SQL
+from api.summaries.leadtimes import (FORGET_LEADTIME_SQL, NOT_FULFILLED,
+                                     RECORD_LEADTIME_SQL)
+from api.summaries.rollups import MARK_DAY_SQL
+from db import update_assignments
 from models.productlog.tortoise import ProductDetails
 from models.productrequests.pydantic import (ProductDetailsInfo,
                                              RequestDetailsCreate,
-                                             RequestDetailsResponse,
-                                             RequestDetailsSchema)
+                                             RequestDetailsResponse)
 from models.productrequests.tortoise import RequestDetails
+from models.requests.versioning import VersionConflictError
+
+# Every statement returns the request joined with its product names, which
+# is all RequestDetailsResponse needs. Writes also mark the request's day
+# for the request rollups and keep the lead time of fulfilled requests.
+REQUEST_SELECT_SQL = (
+    'SELECT r.*, p."productnamezh", p."productnameen" FROM "requestdetails" r '
+    'JOIN "productdetails" p ON p."productid" = r."requestproductid" '
+    'WHERE r."requestid" = $1'
+)
+# Inserts nothing when the product does not exist
+REQUEST_INSERT_SQL = (
+    'WITH product AS (SELECT "productid", "productnamezh", "productnameen" '
+    'FROM "productdetails" WHERE "productid" = $4), '
+    'inserted AS (INSERT INTO "requestdetails" ("requestid", "requestorname", '
+    '"requestdate", "requestproductid", "requestunit", "is_urgent", "remarks", "status") '
+    "SELECT $1::varchar, $2::varchar, $3::timestamptz, product.\"productid\", $5::int, "
+    "$6::bool, $7::varchar, 'PENDING' FROM product RETURNING *), "
+    "marked AS (" + MARK_DAY_SQL.format(source="inserted") + ") "
+    'SELECT i.*, product."productnamezh", product."productnameen" FROM inserted i, product'
+)
+# $2 is the expected version, NULL for an unconditional update. Nothing is
+# written unless the product, the new $3 or the current one, exists. A
+# request that is fulfilled or rejected gives back its held stock.
+REQUEST_UPDATE_SQL = (
+    'WITH updated AS (UPDATE "requestdetails" r SET {assignments}"version" = r."version" + 1 '
+    'WHERE r."requestid" = $1 AND ($2::int IS NULL OR r."version" = $2) '
+    'AND EXISTS (SELECT 1 FROM "productdetails" '
+    'WHERE "productid" = COALESCE($3::varchar, r."requestproductid")) RETURNING r.*), '
+    "marked AS (" + MARK_DAY_SQL.format(source="updated") + "), "
+    "fulfilled AS (" + RECORD_LEADTIME_SQL.format(source="updated") + "), "
+    "unfulfilled AS (" + FORGET_LEADTIME_SQL.format(source="updated", condition=NOT_FULFILLED) + "), "
+    + RELEASE_HOLDS_SQL.format(source="updated") + " "
+    'SELECT u.*, p."productnamezh", p."productnameen" FROM updated u '
+    'JOIN "productdetails" p ON p."productid" = u."requestproductid"'
+)
+# Returns the requestor, whose live view is told about the deletion
+REQUEST_DELETE_SQL = (
+    'WITH deleted AS (DELETE FROM "requestdetails" WHERE "requestid" = $1 '
+    'RETURNING "requestid", "requestdate", "requestorname"), '
+    "unfulfilled AS (" + FORGET_LEADTIME_SQL.format(source="deleted", condition="TRUE") + "), "
+    "marked AS (" + MARK_DAY_SQL.format(source="deleted") + ") "
+    'SELECT "requestorname" FROM deleted'
+)
+# Explains why an update matched no row
+REQUEST_STATE_SQL = (
+    'SELECT r."version", EXISTS (SELECT 1 FROM "productdetails" '
+    'WHERE "productid" = COALESCE($2::varchar, r."requestproductid")) AS "product_exists" '
+    'FROM "requestdetails" r WHERE r."requestid" = $1'
+)
+
+
+def _response_from_row(row) -> RequestDetailsResponse:
+    if row["productnameen"] is None:
+        raise DoesNotExist(f"Product {row['requestproductid']} not found")
+    product_info = ProductDetailsInfo(
+        productid=row["requestproductid"],
+        productnamezh=row["productnamezh"],
+        productnameen=row["productnameen"],
+    )
+    return RequestDetailsResponse(**dict(row), product=product_info)
+
 
+async def create_request(data: RequestDetailsCreate) -> RequestDetailsResponse:
+    """Insert a request and return it with its product, in one statement.
 
-async def create_request(data: RequestDetailsCreate) -> RequestDetailsSchema:
-    data_dict = data.dict()
-    # Check if the referenced product exists
-    try:
-        await ProductDetails.get(productid=data_dict["requestproductid"])
-    except DoesNotExist:
+    Raises:
+        HTTPException: If the referenced product does not exist.
+    """
+    rows = await connections.get("default").execute_query_dict(
+        REQUEST_INSERT_SQL,
+        [
+            RequestDetails.generate_requestid(),
+            data.requestorname,
+            data.requestdate,
+            data.requestproductid,
+            data.requestunit,
+            data.is_urgent,
+            data.remarks,
+        ],
+    )
+    if not rows:
         raise HTTPException(
             status_code=400,
             detail="ProductDetails with given productid does not exist.",
         )
-    obj = await RequestDetails.create(**data_dict)
-    # Always return the enriched response with all required fields
-    return await get_request(obj.requestid)
+    return _response_from_row(rows[0])
 
 
 async def get_request(requestid: int) -> RequestDetailsResponse:
-    obj = await RequestDetails.get(requestid=requestid)
-    product = await ProductDetails.get(productid=obj.requestproductid)
-    product_info = ProductDetailsInfo(
-        productid=product.productid,
-        productnamezh=product.productnamezh,
-        productnameen=product.productnameen,
-    )
-    return RequestDetailsResponse(
-        requestid=obj.requestid,
-        requestorname=obj.requestorname,
-        requestdate=obj.requestdate,
-        requestproductid=obj.requestproductid,
-        product=product_info,
-        requestunit=obj.requestunit,
-        is_urgent=obj.is_urgent,
-        remarks=obj.remarks,
-        status=obj.status,
-        fullfillername=obj.fullfillername,
-        fullfilldate=obj.fullfilldate,
+    rows = await connections.get("default").execute_query_dict(
+        REQUEST_SELECT_SQL, [requestid]
     )
+    if not rows:
+        raise DoesNotExist(f"Request {requestid} not found")
+    return _response_from_row(rows[0])
 
 
 async def list_requests() -> list[RequestDetailsResponse]:
@@ -70,19 +135,51 @@ async def list_requests() -> list[RequestDetailsResponse]:
                 status=obj.status,
                 fullfillername=obj.fullfillername,
                 fullfilldate=obj.fullfilldate,
+                version=obj.version,
             )
         )
     return result
 
 
 async def update_request(
-    requestid: int, data: RequestDetailsCreate
-) -> RequestDetailsSchema:
-    await RequestDetails.filter(requestid=requestid).update(**data.dict())
-    obj = await RequestDetails.get(requestid=requestid)
-    # Always return the enriched response with all required fields
-    return await get_request(requestid)
+    requestid: int, data: RequestDetailsCreate, expected_version: Optional[int] = None
+) -> RequestDetailsResponse:
+    """Update a request in one statement, bumping its version.
+
+    Only the fields the client sent are written; requestdate stays the date
+    the request was raised. A failed update costs one more statement to
+    tell a missing request, a missing product and a version conflict apart.
+
+    Raises:
+        DoesNotExist: If the request is not found.
+        HTTPException: If the referenced product does not exist.
+        VersionConflictError: If the request was changed since ``expected_version``.
+    """
+    data_dict = data.dict(exclude_unset=True, exclude={"version", "requestdate"})
+    productid = data_dict.get("requestproductid")
+    assignments, params = update_assignments(data_dict, first_param=4)
+    connection = connections.get("default")
+    rows = await connection.execute_query_dict(
+        REQUEST_UPDATE_SQL.format(assignments=assignments + ", " if assignments else ""),
+        [requestid, expected_version, productid, *params],
+    )
+    if rows:
+        return _response_from_row(rows[0])
+
+    state = await connection.execute_query_dict(REQUEST_STATE_SQL, [requestid, productid])
+    if not state:
+        raise DoesNotExist(f"Request {requestid} not found")
+    if not state[0]["product_exists"]:
+        raise HTTPException(
+            status_code=400,
+            detail="ProductDetails with given productid does not exist.",
+        )
+    raise VersionConflictError(
+        f"Request {requestid} was modified, it is no longer at version {expected_version}"
+    )
 
 
-async def delete_request(requestid: int) -> None:
-    await RequestDetails.filter(requestid=requestid).delete()
+async def delete_request(requestid: int) -> Optional[str]:
+    """Delete a request; returns its requestorname, None if there was none."""
+    rows = await connections.get("default").execute_query_dict(REQUEST_DELETE_SQL, [requestid])
+    return rows[0]["requestorname"] if rows else None
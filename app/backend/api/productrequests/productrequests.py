@@ -1,28 +1,71 @@
 from datetime import datetime
-from typing import List
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 
 from api.productrequests import crud
+from api.realtime.hub import REQUESTS_CHANNEL, hub
+from api.summaries.crud import leadtime_cache
 from models.productrequests.pydantic import (RequestDetailsCreate,
                                              RequestDetailsResponse,
                                              RequestDetailsSchema,
                                              RequestStatusUpdate)
+from models.requests.api_keys import api_key_handler
 from models.requests.authentication import AuthHandler
+from models.requests.idempotency import idempotency_store
+from models.requests.rate_limit import rate_limiter
+from models.requests.versioning import (VersionConflictError, expected_version,
+                                        set_etag, version_conflict)
 
 router = APIRouter()
 auth_handler = AuthHandler()
+write_limit = rate_limiter.limit("write")
+# LIMS integrations may raise requests with an API key
+request_creator = api_key_handler.auth_or_api_key("requests:write")
+# Updates touching these may change request_leadtime
+LEADTIME_FIELDS = {"status", "fullfilldate", "fullfillername", "is_urgent", "requestproductid"}
 
 
-@router.post("/requests/", response_model=RequestDetailsResponse)
+async def _update_and_publish(
+    requestid: str,
+    data,
+    owner: str,
+    version: Optional[int] = None,
+    response: Optional[Response] = None,
+):
+    """Apply an update and push the changed request to live subscribers.
+
+    With ``version`` the update only applies if nobody changed the request
+    since it was read, otherwise the client gets 412. The new version is
+    sent back as the ETag.
+    """
+    try:
+        updated = await crud.update_request(requestid, data, version)
+    except VersionConflictError as e:
+        raise version_conflict(e)
+    if LEADTIME_FIELDS.intersection(data.dict(exclude_unset=True)):
+        # Fulfilling, or moving a fulfilled request back, changes lead times
+        leadtime_cache.invalidate()
+    hub.publish(REQUESTS_CHANNEL, "updated", requestid, updated, owner)
+    set_etag(response, updated)
+    return updated
+
+
+@router.post("/requests/", response_model=RequestDetailsResponse, dependencies=[Depends(write_limit)])
 async def create_request(
-    request: RequestDetailsCreate, auth_details=Depends(auth_handler.auth_wrapper)
+    request: RequestDetailsCreate,
+    auth_details=Depends(request_creator),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None,
+    response: Response = None,
 ):
     """Create a new product request.
 
     Args:
         request (RequestDetailsCreate): The details of the request to create.
-        auth_details (dict, optional): Authentication details containing user roles and username. Defaults to Depends(auth_handler.auth_wrapper).
+        auth_details (dict, optional): Authentication details containing user roles and username. Defaults to Depends(request_creator), a JWT or an API key.
+        idempotency_key (Optional[str], optional): Retries with the same key get the
+            first response back instead of creating another request. Defaults to None.
+        response (Response, optional): Carries the ETag of the new request.
 
     Raises:
         HTTPException: If the user does not have permission to create a request.
@@ -36,20 +79,34 @@ async def create_request(
         raise HTTPException(
             status_code=403, detail="You do not have permission to create a request."
         )
-    request.requestorname = auth_details["username"]
 
-    # if remarks in request is "string", convert it to empty string
-    if request.remarks == "string":
-        request.remarks = ""
+    async def execute():
+        request.requestorname = auth_details["username"]
+
+        # if remarks in request is "string", convert it to empty string
+        if request.remarks == "string":
+            request.remarks = ""
+
+        # Create the request and return the enriched response (with product info)
+        created = await crud.create_request(request)
+        hub.publish(
+            REQUESTS_CHANNEL, "created", created.requestid, created, request.requestorname
+        )
+        return created
 
-    # Create the request and return the enriched response (with product info)
-    created = await crud.create_request(request)
-    # Fetch the full response with product info
-    return await crud.get_request(created.requestid)
+    created = await idempotency_store.run(
+        "requests.create", idempotency_key, auth_details["username"], request, execute
+    )
+    set_etag(response, created)
+    return created
 
 
 @router.get("/requests/{requestid}", response_model=RequestDetailsResponse)
-async def get_request(requestid: str, auth_details=Depends(auth_handler.auth_wrapper)):
+async def get_request(
+    requestid: str,
+    auth_details=Depends(auth_handler.auth_wrapper),
+    response: Response = None,
+):
     list_of_roles = auth_details["list_of_roles"]
     username = auth_details["username"]
 
@@ -59,10 +116,10 @@ async def get_request(requestid: str, auth_details=Depends(auth_handler.auth_wra
     except Exception:
         raise HTTPException(status_code=404, detail="Request not found")
 
-    if "ADMIN" in list_of_roles:
-        return request_obj
-
-    if "REQUESTOR" in list_of_roles and request_obj.requestorname == username:
+    if "ADMIN" in list_of_roles or (
+        "REQUESTOR" in list_of_roles and request_obj.requestorname == username
+    ):
+        set_etag(response, request_obj)
         return request_obj
 
     raise HTTPException(
@@ -93,11 +150,13 @@ async def list_requests(auth_details=Depends(auth_handler.auth_wrapper)):
     return await crud.list_requests()
 
 
-@router.put("/requests/{requestid}", response_model=RequestDetailsSchema)
+@router.put("/requests/{requestid}", response_model=RequestDetailsSchema, dependencies=[Depends(write_limit)])
 async def update_request(
     requestid: str,
     request: RequestDetailsCreate,
     auth_details=Depends(auth_handler.auth_wrapper),
+    if_match: Annotated[Optional[str], Header(alias="If-Match")] = None,
+    response: Response = None,
 ):
     """Update a product request.
 
@@ -105,16 +164,21 @@ async def update_request(
         requestid (str): The ID of the request to update.
         request (RequestDetailsCreate): The updated request details.
         auth_details (dict, optional): Authentication details containing user roles and username. Defaults to Depends(auth_handler.auth_wrapper).
+        if_match (Optional[str], optional): The version the client last read. The
+            ``version`` field of the body works too. Defaults to None.
+        response (Response, optional): Carries the ETag of the new version.
 
     Raises:
         HTTPException: If the user does not have permission to update the request.
         HTTPException: If the request is not found.
+        HTTPException: If the request was modified since the given version (412).
 
     Returns:
         RequestDetailsSchema: The updated request details.
     """
 
     username = auth_details["username"]
+    version = expected_version(if_match, request.version)
 
     # if remarks in request is "string", convert it to empty string
     if request.remarks == "string":
@@ -133,17 +197,21 @@ async def update_request(
         # Prevent changing the requestorname field if present in the update payload
         if hasattr(request, "requestorname"):
             request.requestorname = request_obj.requestorname
-        return await crud.update_request(requestid, request)
+        return await _update_and_publish(
+            requestid, request, request_obj.requestorname, version, response
+        )
 
     if request_obj.requestorname == username:
-        return await crud.update_request(requestid, request)
+        return await _update_and_publish(
+            requestid, request, request_obj.requestorname, version, response
+        )
 
     raise HTTPException(
         status_code=403, detail="You do not have permission to modify this request."
     )
 
 
-@router.delete("/requests/{requestid}")
+@router.delete("/requests/{requestid}", dependencies=[Depends(write_limit)])
 async def delete_request(
     requestid: str, auth_details=Depends(auth_handler.auth_wrapper)
 ):
@@ -164,7 +232,9 @@ async def delete_request(
     list_of_roles = auth_details["list_of_roles"]
 
     if "ADMIN" in list_of_roles or "PRODUCTION_MANAGER" in list_of_roles:
-        await crud.delete_request(requestid)
+        owner = await crud.delete_request(requestid)
+        leadtime_cache.invalidate()
+        hub.publish(REQUESTS_CHANNEL, "deleted", requestid, owner=owner)
         return {"detail": "Request deleted"}
 
     raise HTTPException(
@@ -172,9 +242,11 @@ async def delete_request(
     )
 
 
-@router.put("/requests/{requestid}/approve", response_model=RequestDetailsSchema)
+@router.put("/requests/{requestid}/approve", response_model=RequestDetailsSchema, dependencies=[Depends(write_limit)])
 async def update_request_approval(
-    requestid: str, auth_details=Depends(auth_handler.auth_wrapper)
+    requestid: str,
+    auth_details=Depends(auth_handler.auth_wrapper),
+    response: Response = None,
 ):
     """Approve a request.
 
@@ -182,6 +254,7 @@ async def update_request_approval(
         requestid (str): The ID of the request to approve.
         auth_details (dict, optional): Authentication details containing user roles,
             automatically provided by dependency injection.
+        response (Response, optional): Carries the ETag of the new version.
 
     Raises:
         HTTPException: If the user does not have permission to approve the request.
@@ -210,14 +283,20 @@ async def update_request_approval(
     else:
         remarks = f"Approved by {username} at {timestamp}"
 
-    return await crud.update_request(
-        requestid, RequestStatusUpdate(status="APPROVED", remarks=remarks)
+    return await _update_and_publish(
+        requestid,
+        RequestStatusUpdate(status="APPROVED", remarks=remarks),
+        request_obj.requestorname,
+        request_obj.version,
+        response,
     )
 
 
-@router.put("/requests/{requestid}/reject", response_model=RequestDetailsSchema)
+@router.put("/requests/{requestid}/reject", response_model=RequestDetailsSchema, dependencies=[Depends(write_limit)])
 async def update_request_rejection(
-    requestid: str, auth_details=Depends(auth_handler.auth_wrapper)
+    requestid: str,
+    auth_details=Depends(auth_handler.auth_wrapper),
+    response: Response = None,
 ):
     """Reject a request.
 
@@ -225,6 +304,7 @@ async def update_request_rejection(
         requestid (str): The ID of the request to reject.
         auth_details (dict, optional): Authentication details containing user roles,
             automatically provided by dependency injection.
+        response (Response, optional): Carries the ETag of the new version.
 
     Raises:
         HTTPException: If the user does not have permission to reject the request.
@@ -253,14 +333,20 @@ async def update_request_rejection(
     else:
         remarks = f"Rejected by {username} at {timestamp}"
 
-    return await crud.update_request(
-        requestid, RequestStatusUpdate(status="REJECTED", remarks=remarks)
+    return await _update_and_publish(
+        requestid,
+        RequestStatusUpdate(status="REJECTED", remarks=remarks),
+        request_obj.requestorname,
+        request_obj.version,
+        response,
     )
 
 
-@router.put("/requests/{requestid}/fullfill", response_model=RequestDetailsSchema)
+@router.put("/requests/{requestid}/fullfill", response_model=RequestDetailsSchema, dependencies=[Depends(write_limit)])
 async def fullfill_request(
-    requestid: str, auth_details=Depends(auth_handler.auth_wrapper)
+    requestid: str,
+    auth_details=Depends(auth_handler.auth_wrapper),
+    response: Response = None,
 ):
     """Fullfill a request.
 
@@ -268,6 +354,7 @@ async def fullfill_request(
         requestid (str): The ID of the request to fullfill.
         auth_details (dict, optional): Authentication details containing user roles,
             automatically provided by dependency injection.
+        response (Response, optional): Carries the ETag of the new version.
 
     Raises:
         HTTPException: If the user does not have permission to fullfill the request.
@@ -308,7 +395,7 @@ async def fullfill_request(
     else:
         remarks = f"Fullfilled by {username} at {timestamp}"
 
-    return await crud.update_request(
+    return await _update_and_publish(
         requestid,
         RequestStatusUpdate(
             status="FULLFILLED",
@@ -316,4 +403,8 @@ async def fullfill_request(
             fullfillername=username,
             fullfilldate=datetime.utcnow(),
         ),
+        request_obj.requestorname,
+        # A concurrent fullfill or rejection after the status check gets 412
+        request_obj.version,
+        response,
     )
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from typing import Any, Iterable, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+INVENTORY_CHANNEL = "inventory"
+REQUESTS_CHANNEL = "requests"
+CHANNELS = (INVENTORY_CHANNEL, REQUESTS_CHANNEL)
+
+# Roles allowed to see every request, mirrors GET /productrequests/requests/
+REQUEST_BOARD_ROLES = {"ADMIN", "PRODUCTION_MANAGER"}
+
+RESYNC_FRAME = json.dumps({"channel": "*", "action": "resync"})
+
+
+class Subscriber:
+    def __init__(self, username, list_of_roles, channels, queue_size):
+        self.username = username
+        self.list_of_roles = set(list_of_roles or [])
+        self.channels = set(channels)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def can_see(self, channel: str, owner: Optional[str]) -> bool:
+        """Check whether an event is visible to this subscriber.
+
+        Args:
+            channel (str): The channel the event was published on.
+            owner (Optional[str]): The username owning the row, if any.
+
+        Returns:
+            bool: True if the event should be delivered.
+        """
+        if channel not in self.channels:
+            return False
+        if channel == REQUESTS_CHANNEL:
+            if self.list_of_roles & REQUEST_BOARD_ROLES:
+                return True
+            return owner is not None and owner == self.username
+        return True
+
+
+class EventHub:
+    """Fan-out hub pushing row diffs to connected clients of this worker.
+
+    Each published event is serialized once and the same frame is queued for
+    every subscriber allowed to see it. A subscriber that falls behind gets
+    its backlog replaced by a single resync frame, telling the client to
+    reload the full listing instead of slowing down the publisher.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Set[Subscriber] = set()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(
+        self, username: str, list_of_roles: list, channels: Iterable[str] = CHANNELS
+    ) -> Subscriber:
+        """Register a new subscriber.
+
+        Args:
+            username (str): The username of the connected user.
+            list_of_roles (list): The roles of the connected user.
+            channels (Iterable[str], optional): The channels to listen to.
+                Defaults to all channels.
+
+        Raises:
+            ValueError: If an unknown channel is requested.
+
+        Returns:
+            Subscriber: The subscriber whose queue receives the frames.
+        """
+        channels = set(channels)
+        unknown = channels - set(CHANNELS)
+        if unknown:
+            raise ValueError(f"Unknown channel(s): {', '.join(sorted(unknown))}")
+        subscriber = Subscriber(username, list_of_roles, channels, self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+    def publish(
+        self,
+        channel: str,
+        action: str,
+        key: str,
+        data: Any = None,
+        owner: Optional[str] = None,
+    ) -> int:
+        """Publish a created/updated/deleted diff to the subscribers.
+
+        Args:
+            channel (str): The channel, "inventory" or "requests".
+            action (str): One of "created", "updated" or "deleted".
+            key (str): The primary key of the changed row.
+            data (Any, optional): The changed row, omitted for deletions.
+            owner (Optional[str], optional): The requestor owning the row,
+                used for role filtering on the requests channel.
+
+        Returns:
+            int: The number of subscribers the event was queued for.
+        """
+        targets = [s for s in self._subscribers if s.can_see(channel, owner)]
+        if not targets:
+            return 0
+        event = {"channel": channel, "action": action, "key": key}
+        if data is not None:
+            event["data"] = data
+        frame = json.dumps(
+            jsonable_encoder(event), ensure_ascii=False, separators=(",", ":")
+        )
+        for subscriber in targets:
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(RESYNC_FRAME)
+        return len(targets)
+
+
+hub = EventHub()
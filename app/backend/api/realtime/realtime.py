@@ -0,0 +1,129 @@
+import asyncio
+from typing import Optional
+
+from fastapi import (APIRouter, Depends, HTTPException, Query, Request,
+                     WebSocket, WebSocketDisconnect, status)
+from fastapi.responses import StreamingResponse
+
+from api.realtime.hub import CHANNELS, hub
+from models.requests.authentication import AuthHandler
+
+router = APIRouter()
+auth_handler = AuthHandler()
+
+# Idle connections get a keep-alive well within nginx's 60s proxy_read_timeout
+HEARTBEAT_SECONDS = 25
+PING_FRAME = '{"channel":"*","action":"ping"}'
+
+
+def parse_channels(channels: Optional[str]) -> list:
+    """Parse a comma separated channel list, defaulting to all channels."""
+    if not channels:
+        return list(CHANNELS)
+    return [c.strip() for c in channels.split(",") if c.strip()]
+
+
+async def wait_for_disconnect(websocket: WebSocket) -> None:
+    """Consume client frames until the client goes away."""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@router.websocket("/ws")
+async def subscribe_websocket(
+    websocket: WebSocket,
+    token: str = Query(...),
+    channels: Optional[str] = Query(None),
+):
+    """Push inventory and request diffs over a WebSocket.
+
+    Browsers cannot set an Authorization header on a WebSocket handshake, so
+    the JWT is passed as the ``token`` query parameter.
+
+    Args:
+        websocket (WebSocket): The client connection.
+        token (str): The JWT access token.
+        channels (Optional[str], optional): Comma separated channels to
+            subscribe to ("inventory", "requests"). Defaults to all.
+    """
+    try:
+        username, list_of_roles = auth_handler.decode_token(token)
+        subscriber = hub.subscribe(username, list_of_roles, parse_channels(channels))
+    except (HTTPException, ValueError):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    disconnected = asyncio.create_task(wait_for_disconnect(websocket))
+    try:
+        while not disconnected.done():
+            getter = asyncio.create_task(subscriber.queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected},
+                timeout=HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if getter in done:
+                await websocket.send_text(getter.result())
+                continue
+            getter.cancel()
+            if not disconnected.done():
+                await websocket.send_text(PING_FRAME)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        disconnected.cancel()
+        hub.unsubscribe(subscriber)
+
+
+@router.get("/events")
+async def subscribe_events(
+    request: Request,
+    channels: Optional[str] = Query(None),
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """Push inventory and request diffs as Server-Sent Events.
+
+    Args:
+        request (Request): The incoming request, used to detect disconnects.
+        channels (Optional[str], optional): Comma separated channels to
+            subscribe to ("inventory", "requests"). Defaults to all.
+        auth_details (dict, optional): Authentication details containing user roles and username.
+            Defaults to Depends(auth_handler.auth_wrapper).
+
+    Raises:
+        HTTPException: If an unknown channel is requested.
+
+    Returns:
+        StreamingResponse: The ``text/event-stream`` response.
+    """
+    try:
+        subscriber = hub.subscribe(
+            auth_details["username"],
+            auth_details["list_of_roles"],
+            parse_channels(channels),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    frame = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {frame}\n\n"
+        finally:
+            hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,252 @@
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+from decouple import config
+from tortoise import connections
+
+from models.summaries.pydantic import (LeadTimeGroupBy, LeadTimeGroupSchema,
+                                       LeadTimeSummarySchema,
+                                       LeadTimeTrendPointSchema,
+                                       ProductForecastSchema, RequestGroupBy,
+                                       RequestVolumePointSchema,
+                                       RequestVolumeSeriesSchema, TimeBucket)
+
+# Summaries are cached per worker; the TTL bounds how stale they get after
+# changes made by other workers
+SUMMARY_CACHE_SECONDS = config("SUMMARY_CACHE_SECONDS", default=60, cast=float)
+SUMMARY_CACHE_SIZE = config("SUMMARY_CACHE_SIZE", default=256, cast=int)
+# Urgent requests fulfilled later than this breach their SLA
+LEADTIME_URGENT_SLA_HOURS = config("LEADTIME_URGENT_SLA_HOURS", default=48, cast=float)
+
+# The rollup column each grouping keys on, never taken from client input
+GROUP_KEYS = {
+    RequestGroupBy.NONE: "NULL::varchar",
+    RequestGroupBy.PRODUCT: '"requestproductid"',
+    RequestGroupBy.REQUESTOR: '"requestorname"',
+}
+
+# $1 is the bucket width, $2 and $3 the first day and the day after the
+# last. Each key gets every bucket in the range, empty ones as zeros, so
+# lag() and the moving average step over whole buckets.
+REQUEST_VOLUME_SQL = (
+    'WITH rollup AS (SELECT date_trunc($1, "day"::timestamp)::date AS "bucket", {key} AS "key", '
+    'sum("total")::int AS "total", sum("urgent")::int AS "urgent", '
+    'sum("pending")::int AS "pending", sum("approved")::int AS "approved", '
+    'sum("rejected")::int AS "rejected", sum("fulfilled")::int AS "fulfilled", '
+    'sum("units")::int AS "units" FROM "request_daily_rollup" '
+    'WHERE "day" >= $2 AND "day" < $3 '
+    'AND ($4::varchar IS NULL OR "requestproductid" = $4) '
+    'AND ($5::varchar IS NULL OR "requestorname" = $5) GROUP BY 1, 2), '
+    'buckets AS (SELECT generate_series(date_trunc($1, $2::date::timestamp), '
+    "($3::date - 1)::timestamp, ('1 ' || $1)::interval)::date AS \"bucket\"), "
+    'series AS (SELECT b."bucket", k."key", COALESCE(r."total", 0) AS "total", '
+    'COALESCE(r."urgent", 0) AS "urgent", COALESCE(r."pending", 0) AS "pending", '
+    'COALESCE(r."approved", 0) AS "approved", COALESCE(r."rejected", 0) AS "rejected", '
+    'COALESCE(r."fulfilled", 0) AS "fulfilled", COALESCE(r."units", 0) AS "units" '
+    'FROM (SELECT DISTINCT "key" FROM rollup) k CROSS JOIN buckets b '
+    'LEFT JOIN rollup r ON r."bucket" = b."bucket" AND r."key" IS NOT DISTINCT FROM k."key") '
+    'SELECT *, "urgent"::float8 / NULLIF("total", 0) AS "urgent_ratio", '
+    '("approved" + "fulfilled")::float8 / NULLIF("approved" + "fulfilled" + "rejected", 0) '
+    'AS "approval_rate", '
+    '"rejected"::float8 / NULLIF("approved" + "fulfilled" + "rejected", 0) AS "rejection_rate", '
+    'lag("total") OVER w AS "previous_total", '
+    'avg("total") OVER (w ROWS BETWEEN 3 PRECEDING AND CURRENT ROW)::float8 AS "moving_average" '
+    'FROM series WINDOW w AS (PARTITION BY "key" ORDER BY "bucket") '
+    'ORDER BY "key", "bucket"'
+)
+
+LEADTIME_GROUP_KEYS = {
+    LeadTimeGroupBy.NONE: "NULL::varchar",
+    LeadTimeGroupBy.PRODUCT: '"productid"',
+    LeadTimeGroupBy.FULFILLER: '"fullfillername"',
+}
+
+# Per-key statistics and the trend per bucket of fulfilment date in one
+# pass over request_leadtime, one grouping set each. $1 and $2 are the
+# first day and the day after the last; the percentiles share one sort.
+LEADTIME_SQL = (
+    'SELECT "is_group", "key", "bucket", "count", "percentiles"[1] AS "p50_hours", '
+    '"percentiles"[2] AS "p90_hours", "percentiles"[3] AS "p95_hours", "mean_hours", '
+    '"late", "urgent", "urgent_breached" FROM (SELECT GROUPING("bucket") = 1 AS "is_group", '
+    '"key", "bucket", count(*)::int AS "count", '
+    'percentile_cont(ARRAY[0.5, 0.9, 0.95]) WITHIN GROUP (ORDER BY "hours") AS "percentiles", '
+    'avg("hours") AS "mean_hours", '
+    'count(*) FILTER (WHERE "hours" > "targetdays" * 24)::int AS "late", '
+    'count(*) FILTER (WHERE "is_urgent")::int AS "urgent", '
+    'count(*) FILTER (WHERE "is_urgent" AND "hours" > $5::float8)::int AS "urgent_breached" '
+    'FROM (SELECT *, {key} AS "key", '
+    "date_trunc($6::text, \"fullfilldate\" AT TIME ZONE 'UTC')::date AS \"bucket\" "
+    'FROM "request_leadtime" '
+    "WHERE \"fullfilldate\" >= $1::date::timestamp AT TIME ZONE 'UTC' "
+    "AND \"fullfilldate\" < $2::date::timestamp AT TIME ZONE 'UTC' "
+    'AND ($3::varchar IS NULL OR "productid" = $3) '
+    'AND ($4::varchar IS NULL OR "fullfillername" = $4)) f '
+    'GROUP BY GROUPING SETS (("key"), ("bucket"))) g '
+    'ORDER BY "is_group" DESC, "key", "bucket"'
+)
+
+# The stored forecast next to the reorder level typed in by hand
+PRODUCT_FORECAST_SQL = (
+    'SELECT f.*, p."reorderlevel" FROM "product_forecast" f '
+    'LEFT JOIN "productdetails" p ON p."productid" = f."productid" '
+    'WHERE f."productid" = $1'
+)
+
+
+class SummaryCache:
+    """A per-worker LRU cache of summaries that expire after ``ttl`` seconds.
+
+    ``invalidate`` drops every entry and bumps the generation; a result
+    computed while that happened is not stored, so it cannot outlive it.
+    """
+
+    def __init__(self, ttl: float = SUMMARY_CACHE_SECONDS, size: int = SUMMARY_CACHE_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.generation = 0
+        # parameters -> (expiry, summary)
+        self._entries: "OrderedDict[tuple, Tuple[float, object]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: tuple):
+        cached = self._entries.get(key)
+        if cached is None:
+            return None
+        if cached[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return cached[1]
+
+    def put(self, key: tuple, value, generation: int) -> None:
+        if generation != self.generation:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+
+# Dropped by the rollup refresher of this worker when it rebuilds days
+request_volume_cache = SummaryCache()
+# Dropped when this worker fulfils a request
+leadtime_cache = SummaryCache()
+
+
+async def get_request_volume(
+    bucket: TimeBucket,
+    group_by: RequestGroupBy,
+    start: date,
+    end: date,
+    productid: Optional[str] = None,
+    requestorname: Optional[str] = None,
+) -> RequestVolumeSeriesSchema:
+    """Request counts and rates per time bucket, read from the daily rollups.
+
+    Weeks start on Monday and days are UTC days. Results are cached per
+    worker for SUMMARY_CACHE_SECONDS.
+
+    Args:
+        bucket (TimeBucket): The width of each point.
+        group_by (RequestGroupBy): One series in total, per product or per requestor.
+        start (date): The first day, included.
+        end (date): The last day, included.
+        productid (Optional[str], optional): Only count this product. Defaults to None.
+        requestorname (Optional[str], optional): Only count this requestor. Defaults to None.
+
+    Returns:
+        RequestVolumeSeriesSchema: The points, ordered by key and bucket.
+    """
+    key = (bucket, group_by, start, end, productid, requestorname)
+    cached = request_volume_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = request_volume_cache.generation
+    rows = await connections.get("default").execute_query_dict(
+        REQUEST_VOLUME_SQL.format(key=GROUP_KEYS[group_by]),
+        [bucket.value, start, end + timedelta(days=1), productid, requestorname],
+    )
+    series = RequestVolumeSeriesSchema(
+        bucket=bucket,
+        group_by=group_by,
+        start=start,
+        end=end,
+        points=[RequestVolumePointSchema(**row) for row in rows],
+    )
+    request_volume_cache.put(key, series, generation)
+    return series
+
+
+async def get_lead_times(
+    group_by: LeadTimeGroupBy,
+    bucket: TimeBucket,
+    start: date,
+    end: date,
+    productid: Optional[str] = None,
+    fullfillername: Optional[str] = None,
+) -> LeadTimeSummarySchema:
+    """Lead-time percentiles and SLA breaches of requests fulfilled in a range.
+
+    Read from request_leadtime, which the request writes keep up to date,
+    and cached per worker for SUMMARY_CACHE_SECONDS.
+
+    Args:
+        group_by (LeadTimeGroupBy): One group in total, per product or per fulfiller.
+        bucket (TimeBucket): The width of each trend point.
+        start (date): The first fulfilment day, included.
+        end (date): The last fulfilment day, included.
+        productid (Optional[str], optional): Only count this product. Defaults to None.
+        fullfillername (Optional[str], optional): Only count this fulfiller. Defaults to None.
+
+    Returns:
+        LeadTimeSummarySchema: The groups ordered by key and the trend by bucket.
+    """
+    key = (group_by, bucket, start, end, productid, fullfillername)
+    cached = leadtime_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = leadtime_cache.generation
+    rows = await connections.get("default").execute_query_dict(
+        LEADTIME_SQL.format(key=LEADTIME_GROUP_KEYS[group_by]),
+        [
+            start,
+            end + timedelta(days=1),
+            productid,
+            fullfillername,
+            LEADTIME_URGENT_SLA_HOURS,
+            bucket.value,
+        ],
+    )
+    summary = LeadTimeSummarySchema(
+        group_by=group_by,
+        bucket=bucket,
+        start=start,
+        end=end,
+        urgent_sla_hours=LEADTIME_URGENT_SLA_HOURS,
+        groups=[LeadTimeGroupSchema(**row) for row in rows if row["is_group"]],
+        trend=[LeadTimeTrendPointSchema(**row) for row in rows if not row["is_group"]],
+    )
+    leadtime_cache.put(key, summary, generation)
+    return summary
+
+
+async def get_product_forecast(productid: str) -> ProductForecastSchema:
+    """The latest demand forecast of a product.
+
+    Raises:
+        ValueError: If the product has not been forecast yet.
+    """
+    rows = await connections.get("default").execute_query_dict(
+        PRODUCT_FORECAST_SQL, [productid]
+    )
+    if not rows:
+        raise ValueError(f"No forecast for product {productid}")
+    return ProductForecastSchema(**rows[0])
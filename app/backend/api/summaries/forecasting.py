@@ -0,0 +1,273 @@
+"""Demand forecasts and suggested reorder points for every product.
+
+Run from app/backend:
+
+    python -m api.summaries.forecasting [--history-days 1095] [--alpha 0.1]
+"""
+import argparse
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta, timezone
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from decouple import config
+from fastapi.concurrency import run_in_threadpool
+from tortoise import Tortoise, connections, run_async
+
+from models.productrequests.pydantic import RequestStatus
+from models.requests.periodic import DailyTask
+from models.summaries.pydantic import ForecastMethod
+
+log = logging.getLogger("uvicorn")
+
+# UTC time of day of the nightly refit
+FORECAST_AT = config("FORECAST_AT", default="04:00", cast=time.fromisoformat)
+FORECAST_HISTORY_DAYS = config("FORECAST_HISTORY_DAYS", default=1095, cast=int)
+FORECAST_ALPHA = config("FORECAST_ALPHA", default=0.1, cast=float)
+FORECAST_SERVICE_LEVEL = config("FORECAST_SERVICE_LEVEL", default=0.95, cast=float)
+FORECAST_CHUNK_PRODUCTS = config("FORECAST_CHUNK_PRODUCTS", default=4096, cast=int)
+
+# Syntetos-Boylan cut-off: above this average interval between demands,
+# demand is intermittent and Croston's method beats exponential smoothing
+INTERMITTENT_ADI = 1.32
+
+PRODUCTS_SQL = 'SELECT "productid", "leadtime" FROM "productdetails" ORDER BY "productid"'
+# Each product's requests as day offsets from $1 and units, read through
+# the requestdate index; rejected requests are not demand
+DEMAND_SQL = (
+    'SELECT "requestproductid" AS "productid", '
+    "array_agg((\"requestdate\" AT TIME ZONE 'UTC')::date - $1::date) AS \"days\", "
+    'array_agg("requestunit") AS "units" FROM "requestdetails" '
+    "WHERE \"requestdate\" >= $1::date::timestamp AT TIME ZONE 'UTC' "
+    "AND \"requestdate\" < $2::date::timestamp AT TIME ZONE 'UTC' "
+    f"AND \"status\" <> '{RequestStatus.REJECTED.value}' "
+    'GROUP BY "requestproductid"'
+)
+# One statement per chunk of products
+UPSERT_SQL = (
+    'INSERT INTO "product_forecast" ("productid", "method", "dailydemand", "demandstd", '
+    '"leadtimedemand", "safetystock", "reorderpoint", "historydays", "computedat") '
+    "SELECT v.*, $8::int, $9::timestamptz FROM unnest($1::varchar[], $2::varchar[], "
+    "$3::float8[], $4::float8[], $5::float8[], $6::float8[], $7::int[]) AS v "
+    'ON CONFLICT ("productid") DO UPDATE SET "method" = EXCLUDED."method", '
+    '"dailydemand" = EXCLUDED."dailydemand", "demandstd" = EXCLUDED."demandstd", '
+    '"leadtimedemand" = EXCLUDED."leadtimedemand", "safetystock" = EXCLUDED."safetystock", '
+    '"reorderpoint" = EXCLUDED."reorderpoint", "historydays" = EXCLUDED."historydays", '
+    '"computedat" = EXCLUDED."computedat"'
+)
+# Forecasts of products deleted since the last run
+DELETE_STALE_SQL = 'DELETE FROM "product_forecast" WHERE "computedat" < $1'
+
+History = Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+@dataclass
+class Forecast:
+    """Per-product results, one entry per row of the demand matrix."""
+
+    method: np.ndarray
+    daily: np.ndarray
+    std: np.ndarray
+    leadtime_demand: np.ndarray
+    safety_stock: np.ndarray
+    reorder_point: np.ndarray
+
+
+def demand_matrix(productids: Sequence[str], history: History, days: int) -> np.ndarray:
+    """Daily demand as a products x days matrix, summing requests of the same day."""
+    rows, offsets, units = [], [], []
+    for row, productid in enumerate(productids):
+        if productid in history:
+            product_days, product_units = history[productid]
+            rows.append(np.full(len(product_days), row))
+            offsets.append(product_days)
+            units.append(product_units)
+    if not rows:
+        return np.zeros((len(productids), days), dtype=np.float32)
+    flat = np.concatenate(rows) * days + np.concatenate(offsets)
+    totals = np.bincount(flat, weights=np.concatenate(units), minlength=len(productids) * days)
+    return totals.reshape(len(productids), days).astype(np.float32)
+
+
+def exponential_smoothing(demand: np.ndarray, alpha: float) -> np.ndarray:
+    """The level after the last day of simple exponential smoothing, per row.
+
+    Starting at the first day, the level after day T weighs day t by
+    alpha(1-alpha)^(T-t), so one matrix-vector product fits every row.
+    """
+    days = demand.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+    weights[0] = (1 - alpha) ** (days - 1)
+    return demand.astype(np.float64) @ weights
+
+
+def croston(demand: np.ndarray, alpha: float) -> np.ndarray:
+    """Demand per day by Croston's method with the Syntetos-Boylan correction, per row.
+
+    Sizes of nonzero demands and the intervals between them are smoothed
+    separately, each like exponential_smoothing over the nonzero days
+    only: of n demands, the k-th weighs alpha(1-alpha)^(n-1-k) and the
+    first (1-alpha)^(n-1). Ranks and intervals come from running sums
+    along the rows, so no loop runs over products or days.
+    """
+    days = np.arange(demand.shape[1])
+    nonzero = demand > 0
+    rank = np.cumsum(nonzero, axis=1, dtype=np.int32) - 1
+    count = rank[:, -1] + 1
+    weights = np.where(rank == 0, np.float32(1), np.float32(alpha)) * np.power(
+        np.float32(1 - alpha), count[:, None] - 1 - rank, dtype=np.float32
+    )
+    weights[~nonzero] = 0
+    # Days since the previous demand, or since the day before the first day
+    last = np.maximum.accumulate(np.where(nonzero, days, -1), axis=1)
+    previous = np.empty_like(last)
+    previous[:, 0] = -1
+    previous[:, 1:] = last[:, :-1]
+    size = np.einsum("ij,ij->i", weights, demand, dtype=np.float64)
+    interval = np.einsum("ij,ij->i", weights, days - previous, dtype=np.float64)
+    rate = np.zeros(len(demand))
+    np.divide(size, interval, out=rate, where=count > 0)
+    return (1 - alpha / 2) * rate
+
+
+def forecast(
+    demand: np.ndarray,
+    leadtimes: Sequence[int],
+    alpha: float = FORECAST_ALPHA,
+    service_level: float = FORECAST_SERVICE_LEVEL,
+) -> Forecast:
+    """Forecast every row of a products x days demand matrix.
+
+    Intermittent rows use Croston's method, the others exponential
+    smoothing. The reorder point covers the forecast over the lead time
+    plus safety stock for ``service_level`` under normal daily demand.
+    """
+    rows, days = demand.shape
+    demand_days = np.count_nonzero(demand, axis=1)
+    intermittent = demand_days * INTERMITTENT_ADI < days
+    daily = exponential_smoothing(demand, alpha)
+    daily[intermittent] = croston(demand[intermittent], alpha)
+    method = np.where(
+        intermittent,
+        ForecastMethod.CROSTON.value,
+        ForecastMethod.EXPONENTIAL_SMOOTHING.value,
+    ).astype(object)
+    method[demand_days == 0] = ForecastMethod.NO_DEMAND.value
+    std = demand.std(axis=1, dtype=np.float64)
+    leadtime = np.maximum(np.asarray(leadtimes, dtype=np.float64), 0)
+    leadtime_demand = daily * leadtime
+    safety_stock = NormalDist().inv_cdf(service_level) * std * np.sqrt(leadtime)
+    # Rounded first, so float noise in an exact forecast does not add a unit
+    reorder_point = np.ceil(np.round(leadtime_demand + safety_stock, 6)).astype(np.int64)
+    return Forecast(method, daily, std, leadtime_demand, safety_stock, reorder_point)
+
+
+class DemandForecaster(DailyTask):
+    """Forecast the demand of every product every night at ``at``.
+
+    Daily demand over the last ``history_days`` full UTC days is loaded in
+    one query and fitted ``chunk_size`` products at a time in the thread
+    pool, which bounds the matrix to chunk_size x history_days floats.
+    """
+
+    name = "demand_forecast"
+    description = "forecast product demand"
+
+    def __init__(
+        self,
+        at: time = FORECAST_AT,
+        history_days: int = FORECAST_HISTORY_DAYS,
+        alpha: float = FORECAST_ALPHA,
+        service_level: float = FORECAST_SERVICE_LEVEL,
+        chunk_size: int = FORECAST_CHUNK_PRODUCTS,
+    ):
+        super().__init__(at)
+        self.history_days = history_days
+        self.alpha = alpha
+        self.service_level = service_level
+        self.chunk_size = chunk_size
+
+    def fit(self, productids: Sequence[str], leadtimes: Sequence[int], history: History) -> Forecast:
+        demand = demand_matrix(productids, history, self.history_days)
+        return forecast(demand, leadtimes, self.alpha, self.service_level)
+
+    async def run(self, today: Optional[date] = None) -> int:
+        """Forecast every product from the days before ``today``.
+
+        Args:
+            today (date, optional): The first day not in the history. Defaults to today in UTC.
+
+        Returns:
+            int: The number of products forecast.
+        """
+        today = today or datetime.now(timezone.utc).date()
+        start = today - timedelta(days=self.history_days)
+        connection = connections.get("default")
+        products = await connection.execute_query_dict(PRODUCTS_SQL)
+        rows = await connection.execute_query_dict(DEMAND_SQL, [start, today])
+        history = {
+            row["productid"]: (np.asarray(row["days"], dtype=np.int64), np.asarray(row["units"], dtype=np.float64))
+            for row in rows
+        }
+        computedat = datetime.now(timezone.utc)
+        for i in range(0, len(products), self.chunk_size):
+            chunk = products[i:i + self.chunk_size]
+            productids: List[str] = [product["productid"] for product in chunk]
+            result = await run_in_threadpool(
+                self.fit, productids, [product["leadtime"] for product in chunk], history
+            )
+            await connection.execute_query(
+                UPSERT_SQL,
+                [
+                    productids,
+                    result.method.tolist(),
+                    result.daily.tolist(),
+                    result.std.tolist(),
+                    result.leadtime_demand.tolist(),
+                    result.safety_stock.tolist(),
+                    result.reorder_point.tolist(),
+                    self.history_days,
+                    computedat,
+                ],
+            )
+        await connection.execute_query(DELETE_STALE_SQL, [computedat])
+        return len(products)
+
+    async def tick(self) -> None:
+        count = await self.run()
+        log.info(f"Forecast demand of {count} products")
+
+
+demand_forecaster = DemandForecaster()
+
+
+async def _main(args) -> None:
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_URL"),
+        modules={
+            "models": [
+                "models.productlog.tortoise",
+                "models.productrequests.tortoise",
+                "models.summaries.tortoise",
+            ]
+        },
+    )
+    try:
+        forecaster = DemandForecaster(history_days=args.history_days, alpha=args.alpha)
+        print(f"Forecast demand of {await forecaster.run()} products")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--history-days", type=int, default=FORECAST_HISTORY_DAYS)
+    parser.add_argument("--alpha", type=float, default=FORECAST_ALPHA)
+    run_async(_main(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+from models.productrequests.pydantic import RequestStatus
+
+FULFILLED = RequestStatus.FULLFILLED.value
+
+# Request writes keep request_leadtime in the same statement: a request
+# that is fulfilled is recorded with the product's lead time at that
+# moment as its target, one that no longer is, or is deleted, is dropped.
+# Both take the written rows as {source}.
+RECORD_LEADTIME_SQL = (
+    'INSERT INTO "request_leadtime" ("requestid", "productid", "fullfillername", '
+    '"is_urgent", "requestdate", "fullfilldate", "hours", "targetdays") '
+    'SELECT s."requestid", s."requestproductid", s."fullfillername", s."is_urgent", '
+    's."requestdate", s."fullfilldate", '
+    'EXTRACT(EPOCH FROM s."fullfilldate" - s."requestdate") / 3600, p."leadtime" '
+    'FROM {source} s JOIN "productdetails" p ON p."productid" = s."requestproductid" '
+    f"WHERE s.\"status\" = '{FULFILLED}' AND s.\"fullfilldate\" IS NOT NULL "
+    'ON CONFLICT ("requestid") DO UPDATE SET "productid" = EXCLUDED."productid", '
+    '"fullfillername" = EXCLUDED."fullfillername", "is_urgent" = EXCLUDED."is_urgent", '
+    '"requestdate" = EXCLUDED."requestdate", "fullfilldate" = EXCLUDED."fullfilldate", '
+    '"hours" = EXCLUDED."hours", "targetdays" = EXCLUDED."targetdays"'
+)
+FORGET_LEADTIME_SQL = (
+    'DELETE FROM "request_leadtime" l USING {source} s '
+    'WHERE l."requestid" = s."requestid" AND {condition}'
+)
+NOT_FULFILLED = f"(s.\"status\" <> '{FULFILLED}' OR s.\"fullfilldate\" IS NULL)"
@@ -0,0 +1,99 @@
+from datetime import date
+from typing import List
+
+from decouple import config
+from tortoise.transactions import in_transaction
+
+from api.summaries.crud import request_volume_cache
+from models.productrequests.pydantic import RequestStatus
+from models.requests.periodic import PeriodicTask
+
+SUMMARY_REFRESH_SECONDS = config("SUMMARY_REFRESH_SECONDS", default=300, cast=float)
+SUMMARY_REFRESH_BATCH = config("SUMMARY_REFRESH_BATCH", default=31, cast=int)
+
+# The UTC day a request counts towards
+REQUEST_DAY = "(\"requestdate\" AT TIME ZONE 'UTC')::date"
+
+# Every request write marks its day in the same statement. The upsert locks
+# the mark until the write commits, so the refresher skips the day instead
+# of rebuilding it without that write; DO NOTHING would not lock it.
+MARK_DAY_SQL = (
+    'INSERT INTO "request_rollup_dirty" ("day") '
+    f"SELECT {REQUEST_DAY} FROM {{source}} "
+    'ON CONFLICT ("day") DO UPDATE SET "day" = EXCLUDED."day"'
+)
+
+# Takes up to $1 marked days and drops their rollup rows; days a running
+# write still holds are left for the next run
+CLAIM_DAYS_SQL = (
+    'WITH claimed AS (DELETE FROM "request_rollup_dirty" WHERE "day" IN '
+    '(SELECT "day" FROM "request_rollup_dirty" ORDER BY "day" LIMIT $1 '
+    'FOR UPDATE SKIP LOCKED) RETURNING "day"), '
+    'cleared AS (DELETE FROM "request_daily_rollup" '
+    'WHERE "day" IN (SELECT "day" FROM claimed)) '
+    'SELECT "day" FROM claimed ORDER BY "day"'
+)
+
+# Rebuilds the claimed days from requestdetails, read by day through the
+# requestdate index
+REBUILD_DAYS_SQL = (
+    'INSERT INTO "request_daily_rollup" ("day", "requestproductid", "requestorname", '
+    '"total", "urgent", "pending", "approved", "rejected", "fulfilled", "units") '
+    'SELECT d."day", r."requestproductid", r."requestorname", count(*), '
+    'count(*) FILTER (WHERE r."is_urgent"), '
+    f"count(*) FILTER (WHERE r.\"status\" = '{RequestStatus.PENDING.value}'), "
+    f"count(*) FILTER (WHERE r.\"status\" = '{RequestStatus.APPROVED.value}'), "
+    f"count(*) FILTER (WHERE r.\"status\" = '{RequestStatus.REJECTED.value}'), "
+    f"count(*) FILTER (WHERE r.\"status\" = '{RequestStatus.FULLFILLED.value}'), "
+    'COALESCE(sum(r."requestunit"), 0) '
+    'FROM unnest($1::date[]) AS d("day") JOIN "requestdetails" r '
+    "ON r.\"requestdate\" >= d.\"day\"::timestamp AT TIME ZONE 'UTC' "
+    "AND r.\"requestdate\" < (d.\"day\" + 1)::timestamp AT TIME ZONE 'UTC' "
+    'GROUP BY d."day", r."requestproductid", r."requestorname"'
+)
+
+
+class RequestRollupRefresher(PeriodicTask):
+    """Rebuild the daily request rollups of changed days every ``interval`` seconds.
+
+    Only days marked by a request write since the last run are read, a
+    whole day at a time, so a refresh costs what changed rather than the
+    size of requestdetails. Workers share the marks and never rebuild the
+    same day at once.
+    """
+
+    description = "refresh request rollups"
+
+    def __init__(
+        self,
+        interval: float = SUMMARY_REFRESH_SECONDS,
+        batch_size: int = SUMMARY_REFRESH_BATCH,
+    ):
+        super().__init__(interval)
+        self.batch_size = batch_size
+
+    async def refresh(self) -> List[date]:
+        """Rebuild marked days, ``batch_size`` per transaction, until none are left.
+
+        Returns:
+            List[date]: The days that were rebuilt.
+        """
+        refreshed = []
+        while True:
+            async with in_transaction() as connection:
+                rows = await connection.execute_query_dict(CLAIM_DAYS_SQL, [self.batch_size])
+                days = [row["day"] for row in rows]
+                if days:
+                    await connection.execute_query(REBUILD_DAYS_SQL, [days])
+            refreshed.extend(days)
+            if len(days) < self.batch_size:
+                break
+        if refreshed:
+            request_volume_cache.invalidate()
+        return refreshed
+
+    async def tick(self) -> None:
+        await self.refresh()
+
+
+request_rollup_refresher = RequestRollupRefresher()
@@ -0,0 +1,149 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+
+from api.summaries.crud import (get_lead_times, get_product_forecast,
+                                get_request_volume)
+from models.requests.authentication import AuthHandler
+from models.summaries.pydantic import (LeadTimeGroupBy, LeadTimeSummarySchema,
+                                       ProductForecastSchema, RequestGroupBy,
+                                       RequestVolumeSeriesSchema, TimeBucket)
+
+router = APIRouter()
+auth_handler = AuthHandler()
+SUMMARY_ROLES = {"ADMIN", "PRODUCTION_MANAGER", "REQUEST_APPROVER"}
+# Bounds the series one query returns, 10 years of weeks
+MAX_BUCKETS = 520
+BUCKET_DAYS = {TimeBucket.DAY: 1, TimeBucket.WEEK: 7, TimeBucket.MONTH: 28}
+
+
+def check_summary_reader(auth_details: dict) -> None:
+    """Require the ADMIN, PRODUCTION_MANAGER or REQUEST_APPROVER role."""
+    if not SUMMARY_ROLES.intersection(auth_details["list_of_roles"]):
+        raise HTTPException(
+            status_code=403,
+            detail="You do not have permission to view summaries.",
+        )
+
+
+def check_range(start: date, end: date, bucket: TimeBucket) -> None:
+    """Reject empty ranges and ranges of more than MAX_BUCKETS buckets."""
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days // BUCKET_DAYS[bucket] >= MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The range has more than {MAX_BUCKETS} {bucket.value} buckets",
+        )
+
+
+@router.get("/requests", response_model=RequestVolumeSeriesSchema)
+async def get_request_volume_endpoint(
+    bucket: TimeBucket = TimeBucket.WEEK,
+    group_by: RequestGroupBy = RequestGroupBy.NONE,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    productid: Optional[str] = None,
+    requestorname: Optional[str] = None,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    Request counts, urgent ratio and approval and rejection rates per time bucket.
+    
+    Served from the daily rollups, which lag requests by up to
+    SUMMARY_REFRESH_SECONDS.
+    
+    Args:
+        bucket (TimeBucket, optional): day, week or month. Defaults to week.
+        group_by (RequestGroupBy, optional): none, product or requestor. Defaults to none.
+        start (Optional[date], optional): The first UTC day. Defaults to 12 weeks before ``end``.
+        end (Optional[date], optional): The last UTC day, included. Defaults to today.
+        productid (Optional[str], optional): Only count this product. Defaults to None.
+        requestorname (Optional[str], optional): Only count this requestor. Defaults to None.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to view summaries.
+        HTTPException: If the range is empty or has too many buckets (400).
+    
+    Returns:
+        RequestVolumeSeriesSchema: One point per bucket and key.
+    """
+    check_summary_reader(auth_details)
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(weeks=12) + timedelta(days=1)
+    check_range(start, end, bucket)
+    return await get_request_volume(bucket, group_by, start, end, productid, requestorname)
+
+
+@router.get("/leadtimes", response_model=LeadTimeSummarySchema)
+async def get_lead_times_endpoint(
+    bucket: TimeBucket = TimeBucket.WEEK,
+    group_by: LeadTimeGroupBy = LeadTimeGroupBy.NONE,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    productid: Optional[str] = None,
+    fullfillername: Optional[str] = None,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    Fulfilment lead-time percentiles, late requests and urgent SLA breaches.
+    
+    Counts requests by the UTC day they were fulfilled. A request is late
+    when it took longer than its product's lead time, and an urgent one
+    breaches its SLA after LEADTIME_URGENT_SLA_HOURS.
+    
+    Args:
+        bucket (TimeBucket, optional): The width of each trend point. Defaults to week.
+        group_by (LeadTimeGroupBy, optional): none, product or fulfiller. Defaults to none.
+        start (Optional[date], optional): The first UTC day. Defaults to 12 weeks before ``end``.
+        end (Optional[date], optional): The last UTC day, included. Defaults to today.
+        productid (Optional[str], optional): Only count this product. Defaults to None.
+        fullfillername (Optional[str], optional): Only count this fulfiller. Defaults to None.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to view summaries.
+        HTTPException: If the range is empty or has too many buckets (400).
+    
+    Returns:
+        LeadTimeSummarySchema: The statistics per group and the trend per bucket.
+    """
+    check_summary_reader(auth_details)
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(weeks=12) + timedelta(days=1)
+    check_range(start, end, bucket)
+    return await get_lead_times(group_by, bucket, start, end, productid, fullfillername)
+
+
+@router.get("/forecasts/{productid}", response_model=ProductForecastSchema)
+async def get_product_forecast_endpoint(
+    productid: str,
+    auth_details=Depends(auth_handler.auth_wrapper),
+):
+    """
+    The latest demand forecast and suggested reorder point of a product.
+    
+    Forecasts are refit by the forecasting job every night at FORECAST_AT;
+    ``reorderlevel`` is the level currently set on the product, for comparison.
+    
+    Args:
+        productid (str): The product.
+        auth_details (dict, optional): Authentication details containing user roles and username. 
+            Defaults to Depends(auth_handler.auth_wrapper).
+    
+    Raises:
+        HTTPException: If the user does not have permission to view summaries.
+        HTTPException: If the product has no forecast yet (404).
+    
+    Returns:
+        ProductForecastSchema: The forecast.
+    """
+    check_summary_reader(auth_details)
+    try:
+        return await get_product_forecast(productid)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -0,0 +1,51 @@
+"""Measure auth_wrapper overhead of the in-memory revocation list.
+
+Run from app/backend:
+
+    python benchmarks/auth_revocation.py [--revoked 100000] [--calls 20000]
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.security import HTTPAuthorizationCredentials  # noqa: E402
+
+from models.requests.authentication import AuthHandler  # noqa: E402
+from models.requests.revocation import revocation_list  # noqa: E402
+
+
+def time_auth(handler, credentials, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        handler.auth_wrapper(credentials)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--revoked", type=int, default=100_000)
+    parser.add_argument("--calls", type=int, default=20_000)
+    args = parser.parse_args()
+
+    handler = AuthHandler()
+    token = handler.encode_token("bench", ["REQUESTOR"])
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    time_auth(handler, credentials, args.calls)  # warm up
+    empty = time_auth(handler, credentials, args.calls)
+    expires_at = time.time() + 3600
+    for _ in range(args.revoked):
+        revocation_list.add(uuid.uuid4().hex, expires_at)
+    full = time_auth(handler, credentials, args.calls)
+
+    print(f"{'0 revoked':>16}: {empty:8.2f} us/call")
+    print(f"{f'{args.revoked} revoked':>16}: {full:8.2f} us/call")
+    print(f"{'overhead':>16}: {full - empty:8.2f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Measure checking many batches against COA specifications at once.
+
+Builds synthetic specifications and chunks shaped like the rows the COA
+check reads, and times CoaRules evaluation over all of them. No database
+is needed.
+
+Run from app/backend:
+
+    python benchmarks/coa_rules.py [--batches 1000000] [--products 5000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.productlog.coa import (COA_CHECK_BATCH, check_chunk,  # noqa: E402
+                                compile_rules)
+from models.productlog.pydantic import (COA_BOOLEAN_FIELDS,  # noqa: E402
+                                        COA_RANGE_FIELDS, CoaField)
+
+
+def synthetic_specs(products: int):
+    specs = []
+    for i in range(products):
+        productid = f"P{i:06d}"
+        specs.append({"productid": productid, "field": CoaField.PH.value,
+                      "minvalue": 7.0, "maxvalue": 7.6, "expected": None})
+        specs.append({"productid": productid, "field": CoaField.OSMOTIC_PRESSURE.value,
+                      "minvalue": 260.0, "maxvalue": 340.0, "expected": None})
+        specs.append({"productid": productid, "field": CoaField.STERILITY.value,
+                      "minvalue": None, "maxvalue": None, "expected": True})
+        specs.append({"productid": productid, "field": CoaField.MYCOPLASMA.value,
+                      "minvalue": None, "maxvalue": None, "expected": False})
+    return specs
+
+
+def synthetic_chunk(rows: int, products: int, rng):
+    # As asyncpg decodes the arrays: lists, with None for untested results
+    ph = rng.normal(7.3, 0.12, rows)
+    osmotic = rng.normal(300, 15, rows)
+    untested = rng.random(rows) < 0.05
+    chunk = {
+        "productid": [f"P{i:06d}" for i in rng.integers(0, products, rows)],
+        CoaField.PH.value: [None if u else v for u, v in zip(untested, ph.tolist())],
+        CoaField.OSMOTIC_PRESSURE.value: osmotic.tolist(),
+    }
+    for field in COA_BOOLEAN_FIELDS:
+        chunk[field.value] = rng.choice([-1, 0, 1], rows, p=[0.05, 0.01, 0.94]).tolist()
+    chunk[CoaField.MYCOPLASMA.value] = rng.choice([-1, 0, 1], rows, p=[0.05, 0.94, 0.01]).tolist()
+    return chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batches", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--chunk-size", type=int, default=COA_CHECK_BATCH)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    rules = compile_rules(synthetic_specs(args.products))
+    chunks = [
+        synthetic_chunk(min(args.chunk_size, args.batches - i), args.products, rng)
+        for i in range(0, args.batches, args.chunk_size)
+    ]
+    failed = np.zeros(len(COA_RANGE_FIELDS) + len(COA_BOOLEAN_FIELDS), dtype=np.int64)
+    start = time.perf_counter()
+    for chunk in chunks:
+        failed += check_chunk(rules, chunk).sum(axis=0)
+    elapsed = time.perf_counter() - start
+    print(f"{args.batches} batches of {args.products} products in {elapsed:.2f}s")
+    for field, count in zip(COA_RANGE_FIELDS + COA_BOOLEAN_FIELDS, failed):
+        print(f"  {field.value}: {count} failed")
+
+
+if __name__ == "__main__":
+    main()
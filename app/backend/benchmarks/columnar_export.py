@@ -0,0 +1,114 @@
+"""Measure exporting product_inventory to Parquet or an Arrow IPC stream.
+
+By default --rows synthetic rows are fed through TableExport from an
+in-memory cursor, which times the encoding and writing alone. With
+--database the real product_inventory behind DATABASE_URL is exported
+instead. Prints rows per second and the peak resident memory, which
+should stay flat as --rows grows.
+
+Run from app/backend:
+
+    python benchmarks/columnar_export.py [--rows 10000000] [--format parquet] [--database]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tortoise import Tortoise, connections  # noqa: E402
+
+from api.exports.writer import EXPORT_BATCH_ROWS, TableExport  # noqa: E402
+from models.exports.pydantic import ExportFormat, ExportTable  # noqa: E402
+
+STATUSES = ["AVAILABLE(可用)", "RESERVED(预留)", "USED(已使用)", "EXPIRED(过期)"]
+
+
+def synthetic_batch(n: int):
+    day = date(2024, 1, 1)
+    stamp = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        (
+            f"BM{i % 50:03d}-AD{i % 40:03d}-{i:08d}", f"EXT-{i}", f"P{i % 500:04d}",
+            f"BM{i % 50:03d}", f"AD{i % 40:03d}", i % 1000, 0,
+            day + timedelta(days=i % 700), None, STATUSES[i % 4],
+            stamp + timedelta(seconds=i), "bench", "clear", True, 290.0, 7.2,
+            False, True, False, True, stamp, "bench", 1,
+        )
+        for i in range(n)
+    ]
+
+
+class SyntheticCursor:
+    """Hands out the same prebuilt batch until ``rows`` have been read."""
+
+    def __init__(self, rows: int):
+        self.remaining = rows
+        self.batch = []
+
+    async def fetch(self, n: int):
+        if len(self.batch) != n:
+            self.batch = synthetic_batch(n)
+        n = min(n, self.remaining)
+        self.remaining -= n
+        return self.batch[:n]
+
+
+class SyntheticConnection:
+    def __init__(self, rows: int):
+        self.rows = rows
+
+    @asynccontextmanager
+    async def acquire_connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        yield
+
+    async def cursor(self, sql):
+        return SyntheticCursor(self.rows)
+
+
+async def run(args) -> None:
+    if args.database:
+        await Tortoise.init(
+            db_url=os.environ.get("DATABASE_URL"),
+            modules={"models": ["models.productlog.tortoise", "models.productrequests.tortoise"]},
+        )
+    else:
+        synthetic = SyntheticConnection(args.rows)
+        connections.get = lambda alias: synthetic
+    try:
+        export = TableExport(ExportTable.PRODUCT_INVENTORY, ExportFormat(args.format), args.batch_rows)
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            result = await export.to_file(directory)
+            elapsed = time.perf_counter() - start
+    finally:
+        if args.database:
+            await Tortoise.close_connections()
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{result.rows} rows, {result.bytes / 2**20:.1f} MiB {args.format} in {elapsed:.1f}s "
+        f"({result.rows / elapsed:,.0f} rows/s), peak RSS {peak_mb:.0f} MiB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--format", choices=[f.value for f in ExportFormat], default="parquet")
+    parser.add_argument("--batch-rows", type=int, default=EXPORT_BATCH_ROWS)
+    parser.add_argument("--database", action="store_true", help="export the real table")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Measure fitting demand forecasts for many products at once.
+
+Builds a synthetic request history, a mix of steady and intermittent
+products, and times DemandForecaster.fit over all of them in chunks, as
+the forecasting job does. No database is needed.
+
+Run from app/backend:
+
+    python benchmarks/demand_forecast.py [--products 50000] [--days 1095]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.summaries.forecasting import (FORECAST_CHUNK_PRODUCTS,  # noqa: E402
+                                       DemandForecaster)
+
+
+def synthetic_history(products: int, days: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    # Between three requests a day and one a year per product
+    rates = np.exp(rng.uniform(np.log(1 / 365), np.log(3), products))
+    history = {}
+    for i, rate in enumerate(rates):
+        count = rng.poisson(rate * days)
+        history[f"P{i:06d}"] = (
+            rng.integers(0, days, count), rng.integers(1, 10, count).astype(np.float64)
+        )
+    return history
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--products", type=int, default=50_000)
+    parser.add_argument("--days", type=int, default=1095)
+    parser.add_argument("--chunk-size", type=int, default=FORECAST_CHUNK_PRODUCTS)
+    args = parser.parse_args()
+
+    history = synthetic_history(args.products, args.days)
+    productids = sorted(history)
+    leadtimes = np.random.default_rng(1).integers(1, 30, args.products)
+    forecaster = DemandForecaster(history_days=args.days, chunk_size=args.chunk_size)
+    methods = {}
+    start = time.perf_counter()
+    for i in range(0, args.products, args.chunk_size):
+        result = forecaster.fit(
+            productids[i:i + args.chunk_size], leadtimes[i:i + args.chunk_size], history
+        )
+        for method in result.method:
+            methods[method] = methods.get(method, 0) + 1
+    elapsed = time.perf_counter() - start
+    print(f"{args.products} products x {args.days} days in {elapsed:.2f}s")
+    for method, count in sorted(methods.items()):
+        print(f"  {method}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Measure point-in-time stock from checkpoints against replaying the ledger.
+
+Fills a throwaway schema with --entries ledger rows spread over --days,
+writes a checkpoint every --checkpoint-hours like InventoryCheckpointer,
+then compares crud.STOCK_AT_SQL with summing a product's whole history.
+Needs DATABASE_URL and a few GB of disk for the default 10M rows.
+
+Run from app/backend:
+
+    python benchmarks/inventory_ledger.py [--entries 10000000] [--products 500]
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tortoise import Tortoise, connections  # noqa: E402
+
+from api.productlog.crud import STOCK_AT_SQL  # noqa: E402
+from api.productlog.ledger import CHECKPOINT_SQL  # noqa: E402
+
+MIGRATION = (
+    Path(__file__).resolve().parents[1]
+    / "migrations"
+    / "models"
+    / "12_20261019210000_add_inventory_ledger.py"
+)
+CHUNK = 1_000_000
+
+# Rows are appended in time order, as the application writes them
+FILL_SQL = (
+    'INSERT INTO "inventory_transaction" ("productid", "batchid_internal", "delta", '
+    '"quantity_after", "kind", "createdby", "createdat") '
+    "SELECT 'P' || (i % $3), 'B-' || (i % ($3 * 20)), "
+    "CASE WHEN i % 3 = 0 THEN -1 ELSE 2 END, 0, 'ADJUSTED(调整)', 'bench', "
+    "$4::timestamptz + (i * $5::float8) * interval '1 second' "
+    "FROM generate_series($1::bigint, $2::bigint) AS i"
+)
+REPLAY_SQL = (
+    'SELECT COALESCE(sum("delta"), 0)::int AS "quantity", count(*)::int AS "entries" '
+    'FROM "inventory_transaction" WHERE "productid" = $1 AND "createdat" <= $2'
+)
+
+
+def schema_url(db_url: str, schema: str) -> str:
+    return f"{db_url}{'&' if '?' in db_url else '?'}schema={schema}"
+
+
+async def time_queries(conn, sql, probes):
+    results = []
+    start = time.perf_counter()
+    for product_id, at in probes:
+        results.append((await conn.execute_query_dict(sql, [product_id, at]))[0])
+    return results, (time.perf_counter() - start) / len(probes) * 1e3
+
+
+async def run(args):
+    schema = f"ledger_bench_{uuid.uuid4().hex[:12]}"
+    await Tortoise.init(
+        db_url=schema_url(os.environ["DATABASE_URL"], schema),
+        modules={"models": ["models.productlog.tortoise"]},
+    )
+    conn = connections.get("default")
+    await conn.execute_script(f'CREATE SCHEMA "{schema}"')
+    try:
+        await Tortoise.generate_schemas()
+        spec = importlib.util.spec_from_file_location("ledger_migration", MIGRATION)
+        migration = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(migration)
+        await conn.execute_script(await migration.upgrade(conn))
+
+        start_at = datetime.now(timezone.utc) - timedelta(days=args.days)
+        step = args.days * 86400 / args.entries
+        start = time.perf_counter()
+        for first in range(1, args.entries + 1, CHUNK):
+            last = min(first + CHUNK - 1, args.entries)
+            await conn.execute_query(
+                FILL_SQL, [first, last, args.products, start_at, step]
+            )
+            print(f"  {last:>12,} ledger rows", end="\r", flush=True)
+        await conn.execute_script('ANALYZE "inventory_transaction"')
+        print(f"{'fill':>16}: {time.perf_counter() - start:8.1f} s")
+
+        checkpoints = int(args.days * 24 / args.checkpoint_hours)
+        start = time.perf_counter()
+        for n in range(1, checkpoints + 1):
+            asof = start_at + timedelta(hours=n * args.checkpoint_hours)
+            await conn.execute_query_dict(CHECKPOINT_SQL, [asof, asof])
+        await conn.execute_script('ANALYZE "inventory_checkpoint"')
+        elapsed = time.perf_counter() - start
+        print(f"{'checkpoints':>16}: {elapsed / checkpoints * 1e3:8.2f} ms/run ({checkpoints} runs)")
+
+        rng = random.Random(42)
+        probes = [
+            (
+                f"P{rng.randrange(args.products)}",
+                start_at + timedelta(seconds=rng.uniform(0, args.days * 86400)),
+            )
+            for _ in range(args.queries)
+        ]
+        await time_queries(conn, STOCK_AT_SQL, probes[:10])  # warm up
+        fast, fast_ms = await time_queries(conn, STOCK_AT_SQL, probes)
+        slow, slow_ms = await time_queries(conn, REPLAY_SQL, probes)
+        assert [r["quantity"] for r in fast] == [r["quantity"] for r in slow]
+
+        def rows_read(results):
+            return sum(r["entries"] for r in results) / len(results)
+
+        print(f"{'checkpointed':>16}: {fast_ms:8.2f} ms/query, {rows_read(fast):10.0f} rows read")
+        print(f"{'full replay':>16}: {slow_ms:8.2f} ms/query, {rows_read(slow):10.0f} rows read")
+    finally:
+        if not args.keep:
+            await conn.execute_script(f'DROP SCHEMA "{schema}" CASCADE')
+        await Tortoise.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=10_000_000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--checkpoint-hours", type=float, default=24)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="keep the schema")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
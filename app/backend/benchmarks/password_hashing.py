@@ -0,0 +1,55 @@
+"""Report logins per second per core at each password hashing cost.
+
+A login costs one verify, so one core sustains about 1 / verify time
+logins per second. Use this to pick PASSWORD_HASH_SCHEME and
+PASSWORD_HASH_ROUNDS, and to size login capacity.
+
+Run from app/backend:
+
+    python benchmarks/password_hashing.py [--scheme bcrypt] [--rounds 10 11 12 13]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.requests.authentication import build_pwd_context  # noqa: E402
+
+DEFAULT_ROUNDS = {
+    "bcrypt": [10, 11, 12, 13, 14],
+    "pbkdf2_sha256": [29000, 100000, 300000, 600000],
+}
+
+
+def logins_per_second(context, hashed, min_seconds):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        context.verify("correct horse battery", hashed)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--scheme", choices=sorted(DEFAULT_ROUNDS), default="bcrypt"
+    )
+    parser.add_argument("--rounds", type=int, nargs="+")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print(f"{'scheme':>14} {'rounds':>8} {'ms/login':>9} {'logins/s/core':>14}")
+    for rounds in args.rounds or DEFAULT_ROUNDS[args.scheme]:
+        context = build_pwd_context(args.scheme, rounds)
+        hashed = context.hash("correct horse battery")
+        rate = logins_per_second(context, hashed, args.seconds)
+        print(f"{args.scheme:>14} {rounds:>8} {1000 / rate:>9.1f} {rate:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import logging
 from functools import lru_cache
+from typing import Literal, Optional
 
 from pydantic import AnyUrl
 from pydantic_settings import BaseSettings
@@ -10,7 +11,11 @@ log = logging.getLogger("uvicorn")
 class Settings(BaseSettings):
     environment: str = "dev"
     testing: bool = bool(0)
-    database_url: AnyUrl = None
+    database_url: Optional[AnyUrl] = None
+    # Existing hashes of the other scheme still verify and are upgraded on login
+    password_hash_scheme: Literal["bcrypt", "pbkdf2_sha256"] = "bcrypt"
+    # Log2 cost for bcrypt, iterations for pbkdf2_sha256; None keeps passlib's default
+    password_hash_rounds: Optional[int] = None
 
 
 @lru_cache()
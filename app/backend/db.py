@@ -1,5 +1,7 @@
 import logging
 import os
+from enum import Enum
+from typing import Tuple
 
 from fastapi import FastAPI
 from tortoise import Tortoise, run_async
@@ -16,6 +18,7 @@ TORTOISE_ORM = {
                 "models.accounts.tortoise",
                 "models.productlog.tortoise",
                 "models.productrequests.tortoise",
+                "models.summaries.tortoise",
                 "aerich.models",
             ],
             "default_connection": "default",
@@ -33,6 +36,7 @@ def init_db(app: FastAPI) -> None:
                 "models.accounts.tortoise",
                 "models.productlog.tortoise",
                 "models.productrequests.tortoise",
+                "models.summaries.tortoise",
             ]
         },
         generate_schemas=False,
@@ -40,6 +44,35 @@ def init_db(app: FastAPI) -> None:
     )
 
 
+def _db_value(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def update_assignments(values: dict, first_param: int = 1) -> Tuple[str, list]:
+    """Build the SET list of a raw UPDATE with $n placeholders.
+
+    Column names are taken from our schemas, never from client input.
+
+    Returns:
+        Tuple[str, list]: The assignments and their parameters.
+    """
+    assignments = ", ".join(
+        f'"{column}" = ${i}' for i, column in enumerate(values, first_param)
+    )
+    return assignments, [_db_value(value) for value in values.values()]
+
+
+def insert_values(values: dict, first_param: int = 1) -> Tuple[str, str, list]:
+    """Build the column list and VALUES placeholders of a raw INSERT.
+
+    Returns:
+        Tuple[str, str, list]: The columns, the placeholders and the parameters.
+    """
+    columns = ", ".join(f'"{column}"' for column in values)
+    placeholders = ", ".join(f"${i}" for i in range(first_param, first_param + len(values)))
+    return columns, placeholders, [_db_value(value) for value in values.values()]
+
+
 async def generate_schema() -> None:
     log.info("Initializing Tortoise...")
 
@@ -50,6 +83,7 @@ async def generate_schema() -> None:
                 "models.productlog.tortoise",
                 "models.accounts.tortoise",
                 "models.productrequests.tortoise",
+                "models.summaries.tortoise",
             ]
         },
     )
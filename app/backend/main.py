@@ -1,15 +1,36 @@
 import logging
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 
 from api.accounts import accounts
+from api.accounts.crud import shutdown_hash_pool, start_hash_pool
+from api.accounts.last_login import last_login_writer
+from api.accounts.password_rehash import password_rehasher
+from api.accounts.refresh_tokens import refresh_token_sweeper
+from api.exports import exports
 from api.productlog import productlog
+from api.productlog.coa import coa_checker
+from api.productlog.expiry import inventory_expirer
+from api.productlog.ledger import inventory_checkpointer
+from api.productlog.partitions import (ensure_partitions_on_startup,
+                                       inventory_archiver)
+from api.productlog.reservations import reservation_sweeper
 from api.productrequests import productrequests
+from api.realtime import realtime
+from api.summaries import summaries
+from api.summaries.forecasting import demand_forecaster
+from api.summaries.rollups import request_rollup_refresher
 from db import init_db
+from models.requests.authentication import AuthHandler
+from models.requests.idempotency import idempotency_store
+from models.requests.rate_limit import rate_limiter
+from models.requests.revocation import revocation_list
 
 log = logging.getLogger("uvicorn")
 
+auth_handler = AuthHandler()
+
 
 def create_application() -> FastAPI:
     application = FastAPI(
@@ -38,6 +59,13 @@ def create_application() -> FastAPI:
     application.include_router(
         productrequests.router, prefix="/productrequests", tags=["productrequests"]
     )
+    application.include_router(
+        realtime.router, prefix="/realtime", tags=["realtime"]
+    )
+    application.include_router(exports.router, prefix="/exports", tags=["exports"])
+    application.include_router(
+        summaries.router, prefix="/summaries", tags=["summaries"]
+    )
 
     return application
 
@@ -55,6 +83,16 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/metrics/rate-limits")
+async def rate_limit_metrics(auth_details=Depends(auth_handler.auth_wrapper)):
+    if "ADMIN" not in auth_details["list_of_roles"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only ADMIN can view rate limit metrics.",
+        )
+    return rate_limiter.get_metrics()
+
+
 @app.get("/debug/openapi")
 async def debug_openapi():
     return app.openapi()
@@ -63,9 +101,40 @@ async def debug_openapi():
 @app.on_event("startup")
 async def startup_event():
     log.info("Starting up...")
+    # Fork the bcrypt workers before connections and tasks exist
+    start_hash_pool()
     init_db(app)
+    # init_db adds Tortoise's own startup handler, this one runs after it
+    app.add_event_handler("startup", ensure_partitions_on_startup)
+    last_login_writer.start()
+    password_rehasher.start()
+    revocation_list.start()
+    rate_limiter.start()
+    idempotency_store.start()
+    refresh_token_sweeper.start()
+    reservation_sweeper.start()
+    inventory_checkpointer.start()
+    inventory_archiver.start()
+    inventory_expirer.start()
+    coa_checker.start()
+    request_rollup_refresher.start()
+    demand_forecaster.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down...")
+    await last_login_writer.stop()
+    await password_rehasher.stop()
+    await revocation_list.stop()
+    await rate_limiter.stop()
+    await idempotency_store.stop()
+    await refresh_token_sweeper.stop()
+    await reservation_sweeper.stop()
+    await inventory_checkpointer.stop()
+    await inventory_archiver.stop()
+    await inventory_expirer.stop()
+    await coa_checker.stop()
+    await request_rollup_refresher.stop()
+    await demand_forecaster.stop()
+    shutdown_hash_pool()
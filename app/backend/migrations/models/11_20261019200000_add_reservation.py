@@ -0,0 +1,33 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "product_inventory" ADD "quantityreserved" INT NOT NULL  DEFAULT 0;
+        COMMENT ON COLUMN "product_inventory"."quantityreserved" IS '已预留数量';
+        CREATE TABLE IF NOT EXISTS "reservation" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "batchid_internal" VARCHAR(70) NOT NULL,
+    "requestid" VARCHAR(32) NOT NULL,
+    "quantity" INT NOT NULL,
+    "status" VARCHAR(20) NOT NULL,
+    "reservedby" VARCHAR(50) NOT NULL,
+    "reservedat" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "expiresat" TIMESTAMPTZ NOT NULL,
+    "releasedat" TIMESTAMPTZ
+);
+        CREATE INDEX IF NOT EXISTS "idx_reservation_batchid_0084df" ON "reservation" ("batchid_internal", "status");
+        CREATE INDEX IF NOT EXISTS "idx_reservation_request_c8df5d" ON "reservation" ("requestid", "reservedat");
+        CREATE INDEX IF NOT EXISTS "idx_reservation_active_expires" ON "reservation" ("expiresat") WHERE "status" = 'ACTIVE(有效)';
+        COMMENT ON COLUMN "reservation"."batchid_internal" IS '内部批次号';
+        COMMENT ON COLUMN "reservation"."requestid" IS '需求号';
+        COMMENT ON COLUMN "reservation"."quantity" IS '预留数量';
+        COMMENT ON COLUMN "reservation"."status" IS '预留状态';
+        COMMENT ON COLUMN "reservation"."expiresat" IS '预留到期时间';
+        COMMENT ON TABLE "reservation" IS 'A hold on part of a batch''s stock for one approved product request.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "reservation";
+        ALTER TABLE "product_inventory" DROP COLUMN "quantityreserved";"""
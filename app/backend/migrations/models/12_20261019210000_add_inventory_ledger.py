@@ -0,0 +1,49 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "inventory_transaction" (
+    "id" BIGSERIAL NOT NULL PRIMARY KEY,
+    "productid" VARCHAR(20) NOT NULL,
+    "batchid_internal" VARCHAR(70) NOT NULL,
+    "delta" INT NOT NULL,
+    "quantity_after" INT NOT NULL,
+    "kind" VARCHAR(20) NOT NULL,
+    "reason" VARCHAR(40),
+    "createdby" VARCHAR(50),
+    "createdat" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+        CREATE INDEX IF NOT EXISTS "idx_inventory_t_product_fd19b9" ON "inventory_transaction" ("productid", "createdat");
+        CREATE INDEX IF NOT EXISTS "idx_inventory_t_createdat_brin" ON "inventory_transaction" USING brin ("createdat");
+        COMMENT ON COLUMN "inventory_transaction"."productid" IS '产品号';
+        COMMENT ON COLUMN "inventory_transaction"."batchid_internal" IS '内部批次号';
+        COMMENT ON COLUMN "inventory_transaction"."delta" IS '库存变化量';
+        COMMENT ON COLUMN "inventory_transaction"."quantity_after" IS '变化后批次库存数量';
+        COMMENT ON COLUMN "inventory_transaction"."kind" IS '流水类型';
+        COMMENT ON COLUMN "inventory_transaction"."reason" IS '调整原因';
+        COMMENT ON TABLE "inventory_transaction" IS 'One change to the stock of a batch. Rows are only ever appended.';
+        CREATE TABLE IF NOT EXISTS "inventory_checkpoint" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "productid" VARCHAR(20) NOT NULL,
+    "asof" TIMESTAMPTZ NOT NULL,
+    "quantity" INT NOT NULL,
+    "createdat" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "uid_inventory_c_product_5da095" UNIQUE ("productid", "asof")
+);
+        CREATE INDEX IF NOT EXISTS "idx_inventory_c_asof_9b6b0a" ON "inventory_checkpoint" ("asof");
+        COMMENT ON COLUMN "inventory_checkpoint"."productid" IS '产品号';
+        COMMENT ON COLUMN "inventory_checkpoint"."asof" IS '截至时间';
+        COMMENT ON COLUMN "inventory_checkpoint"."quantity" IS '截至时库存数量';
+        COMMENT ON TABLE "inventory_checkpoint" IS 'The stock of a product as of ``asof``, summed from the ledger.';
+        INSERT INTO "inventory_transaction" ("productid", "batchid_internal", "delta",
+            "quantity_after", "kind", "createdby", "createdat")
+        SELECT "productid", "batchid_internal", "quantityinstock", "quantityinstock",
+            'OPENING(期初)', 'migration', now()
+        FROM "product_inventory" WHERE "quantityinstock" <> 0;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "inventory_checkpoint";
+        DROP TABLE IF EXISTS "inventory_transaction";"""
@@ -0,0 +1,133 @@
+from tortoise import BaseDBAsyncClient
+
+COLUMNS = (
+    '"batchid_internal", "batchid_external", "productid", "basicmediumid", "addictiveid", "quantityinstock", "quantityreserved", "productiondate", "imageurl", "status", "productiondatetime", "producedby", "coa_appearance", "coa_clarity", "coa_osmoticpressure", "coa_ph", "coa__mycoplasma", "coa_sterility", "coa_fillingvolumedifference", "to_show", "lastupdated", "lastupdatedby", "version"'
+)
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Rebuilds product_inventory partitioned by month of productiondate. A
+    # primary key of a partitioned table must contain the partition key.
+    # Partitions are made for every month with batches and the months
+    # around today; api/productlog/partitions.py adds the ones after that.
+    return f"""
+        ALTER TABLE "product_inventory" RENAME TO "product_inventory_legacy";
+        CREATE TABLE "product_inventory" (
+    "batchid_internal" VARCHAR(70) NOT NULL,
+    "batchid_external" VARCHAR(70) NOT NULL,
+    "productid" VARCHAR(20) NOT NULL,
+    "basicmediumid" VARCHAR(7) NOT NULL,
+    "addictiveid" VARCHAR(7) NOT NULL,
+    "quantityinstock" INT NOT NULL,
+    "quantityreserved" INT NOT NULL  DEFAULT 0,
+    "productiondate" DATE NOT NULL,
+    "imageurl" TEXT,
+    "status" VARCHAR(20) NOT NULL,
+    "productiondatetime" TIMESTAMPTZ NOT NULL,
+    "producedby" VARCHAR(50) NOT NULL,
+    "coa_appearance" VARCHAR(100),
+    "coa_clarity" BOOL,
+    "coa_osmoticpressure" DOUBLE PRECISION,
+    "coa_ph" DOUBLE PRECISION,
+    "coa__mycoplasma" BOOL,
+    "coa_sterility" BOOL,
+    "coa_fillingvolumedifference" BOOL,
+    "to_show" BOOL NOT NULL  DEFAULT True,
+    "lastupdated" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "lastupdatedby" VARCHAR(50) NOT NULL,
+    "version" INT NOT NULL  DEFAULT 1
+) PARTITION BY RANGE ("productiondate");
+        CREATE TABLE "product_inventory_default" PARTITION OF "product_inventory" DEFAULT;
+        DO $$
+        DECLARE m date;
+        BEGIN
+            FOR m IN
+                SELECT DISTINCT date_trunc('month', "productiondate")::date FROM "product_inventory_legacy"
+                UNION
+                SELECT generate_series(date_trunc('month', current_date) - interval '1 month',
+                                       date_trunc('month', current_date) + interval '3 months',
+                                       interval '1 month')::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF "product_inventory" FOR VALUES FROM (%L) TO (%L)',
+                    'product_inventory_p' || to_char(m, 'YYYYMM'), m, (m + interval '1 month')::date
+                );
+            END LOOP;
+        END $$;
+        INSERT INTO "product_inventory" ({COLUMNS}) SELECT {COLUMNS} FROM "product_inventory_legacy";
+        DROP TABLE "product_inventory_legacy";
+        ALTER TABLE "product_inventory" ADD PRIMARY KEY ("batchid_internal", "productiondate");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_lastupd_2fa4f2" ON "product_inventory" ("lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_product_d9c3c7" ON "product_inventory" ("productid", "lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_status_a3bd4d" ON "product_inventory" ("status", "lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_to_show_lastupd" ON "product_inventory" ("lastupdated" DESC) WHERE "to_show" = true;
+        COMMENT ON COLUMN "product_inventory"."productid" IS '产品号，必须存在于产品详情中';
+        COMMENT ON COLUMN "product_inventory"."quantityreserved" IS '已预留数量';
+        COMMENT ON COLUMN "product_inventory"."productiondatetime" IS '生产时间';
+        COMMENT ON COLUMN "product_inventory"."producedby" IS '生产人员';
+        COMMENT ON COLUMN "product_inventory"."coa_appearance" IS '外观描述';
+        COMMENT ON COLUMN "product_inventory"."coa_clarity" IS '透明度';
+        COMMENT ON COLUMN "product_inventory"."coa_osmoticpressure" IS '渗透压';
+        COMMENT ON COLUMN "product_inventory"."coa_ph" IS 'pH值';
+        COMMENT ON COLUMN "product_inventory"."coa__mycoplasma" IS '支原体检测';
+        COMMENT ON COLUMN "product_inventory"."coa_sterility" IS '无菌检测';
+        COMMENT ON COLUMN "product_inventory"."coa_fillingvolumedifference" IS '装量差异限度';
+        COMMENT ON COLUMN "product_inventory"."to_show" IS '是否展示';
+        CREATE TABLE IF NOT EXISTS "product_inventory_archive" (
+    "batchid_internal" VARCHAR(70) NOT NULL  PRIMARY KEY,
+    "batchid_external" VARCHAR(70) NOT NULL,
+    "productid" VARCHAR(20) NOT NULL,
+    "basicmediumid" VARCHAR(7) NOT NULL,
+    "addictiveid" VARCHAR(7) NOT NULL,
+    "quantityinstock" INT NOT NULL,
+    "quantityreserved" INT NOT NULL  DEFAULT 0,
+    "productiondate" DATE NOT NULL,
+    "imageurl" TEXT,
+    "status" VARCHAR(20) NOT NULL,
+    "productiondatetime" TIMESTAMPTZ NOT NULL,
+    "producedby" VARCHAR(50) NOT NULL,
+    "coa_appearance" VARCHAR(100),
+    "coa_clarity" BOOL,
+    "coa_osmoticpressure" DOUBLE PRECISION,
+    "coa_ph" DOUBLE PRECISION,
+    "coa__mycoplasma" BOOL,
+    "coa_sterility" BOOL,
+    "coa_fillingvolumedifference" BOOL,
+    "to_show" BOOL NOT NULL  DEFAULT True,
+    "lastupdated" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "lastupdatedby" VARCHAR(50) NOT NULL,
+    "version" INT NOT NULL  DEFAULT 1,
+    "archivedat" TIMESTAMPTZ NOT NULL
+);
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_lastupd_81bbc2" ON "product_inventory_archive" ("lastupdated");
+        COMMENT ON COLUMN "product_inventory_archive"."productid" IS '产品号，必须存在于产品详情中';
+        COMMENT ON COLUMN "product_inventory_archive"."quantityreserved" IS '已预留数量';
+        COMMENT ON COLUMN "product_inventory_archive"."productiondatetime" IS '生产时间';
+        COMMENT ON COLUMN "product_inventory_archive"."producedby" IS '生产人员';
+        COMMENT ON COLUMN "product_inventory_archive"."coa_appearance" IS '外观描述';
+        COMMENT ON COLUMN "product_inventory_archive"."coa_clarity" IS '透明度';
+        COMMENT ON COLUMN "product_inventory_archive"."coa_osmoticpressure" IS '渗透压';
+        COMMENT ON COLUMN "product_inventory_archive"."coa_ph" IS 'pH值';
+        COMMENT ON COLUMN "product_inventory_archive"."coa__mycoplasma" IS '支原体检测';
+        COMMENT ON COLUMN "product_inventory_archive"."coa_sterility" IS '无菌检测';
+        COMMENT ON COLUMN "product_inventory_archive"."coa_fillingvolumedifference" IS '装量差异限度';
+        COMMENT ON COLUMN "product_inventory_archive"."to_show" IS '是否展示';
+        COMMENT ON COLUMN "product_inventory_archive"."archivedat" IS '归档时间';
+        COMMENT ON TABLE "product_inventory_archive" IS 'Closed batches moved out of product_inventory; read-only history.';
+        ANALYZE "product_inventory";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    # Archived batches go back into the one plain table
+    return f"""
+        CREATE TABLE "product_inventory_flat" (LIKE "product_inventory" INCLUDING DEFAULTS);
+        INSERT INTO "product_inventory_flat" ({COLUMNS}) SELECT {COLUMNS} FROM "product_inventory";
+        INSERT INTO "product_inventory_flat" ({COLUMNS}) SELECT {COLUMNS} FROM "product_inventory_archive";
+        DROP TABLE "product_inventory_archive";
+        DROP TABLE "product_inventory";
+        ALTER TABLE "product_inventory_flat" RENAME TO "product_inventory";
+        ALTER TABLE "product_inventory" ADD PRIMARY KEY ("batchid_internal");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_lastupd_2fa4f2" ON "product_inventory" ("lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_product_d9c3c7" ON "product_inventory" ("productid", "lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_status_a3bd4d" ON "product_inventory" ("status", "lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_to_show_lastupd" ON "product_inventory" ("lastupdated" DESC) WHERE "to_show" = true;"""
@@ -0,0 +1,46 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "request_daily_rollup" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "day" DATE NOT NULL,
+    "requestproductid" VARCHAR(20) NOT NULL,
+    "requestorname" VARCHAR(100) NOT NULL,
+    "total" INT NOT NULL,
+    "urgent" INT NOT NULL,
+    "pending" INT NOT NULL,
+    "approved" INT NOT NULL,
+    "rejected" INT NOT NULL,
+    "fulfilled" INT NOT NULL,
+    "units" INT NOT NULL,
+    CONSTRAINT "uid_request_dai_day_f2884e" UNIQUE ("day", "requestproductid", "requestorname")
+);
+        CREATE INDEX IF NOT EXISTS "idx_request_dai_request_0db096" ON "request_daily_rollup" ("requestproductid", "day");
+        CREATE INDEX IF NOT EXISTS "idx_request_dai_request_1d1274" ON "request_daily_rollup" ("requestorname", "day");
+        COMMENT ON COLUMN "request_daily_rollup"."day" IS '需求日期 (UTC)';
+        COMMENT ON COLUMN "request_daily_rollup"."requestproductid" IS '需求产品号';
+        COMMENT ON COLUMN "request_daily_rollup"."requestorname" IS '需求人姓名';
+        COMMENT ON COLUMN "request_daily_rollup"."total" IS '需求数';
+        COMMENT ON COLUMN "request_daily_rollup"."urgent" IS '紧急需求数';
+        COMMENT ON COLUMN "request_daily_rollup"."pending" IS '待审批数';
+        COMMENT ON COLUMN "request_daily_rollup"."approved" IS '已批准数';
+        COMMENT ON COLUMN "request_daily_rollup"."rejected" IS '已拒绝数';
+        COMMENT ON COLUMN "request_daily_rollup"."fulfilled" IS '已完成数';
+        COMMENT ON COLUMN "request_daily_rollup"."units" IS '需求单位合计';
+        COMMENT ON TABLE "request_daily_rollup" IS 'Request counts of one product and requestor on one UTC day.';
+        CREATE TABLE IF NOT EXISTS "request_rollup_dirty" (
+    "day" DATE NOT NULL  PRIMARY KEY
+);
+        COMMENT ON COLUMN "request_rollup_dirty"."day" IS '需求日期 (UTC)';
+        COMMENT ON TABLE "request_rollup_dirty" IS 'A day whose requests changed since its rollup was last rebuilt.';
+        INSERT INTO "request_rollup_dirty" ("day")
+        SELECT DISTINCT ("requestdate" AT TIME ZONE 'UTC')::date FROM "requestdetails"
+        ON CONFLICT DO NOTHING;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "request_rollup_dirty";
+        DROP TABLE IF EXISTS "request_daily_rollup";"""
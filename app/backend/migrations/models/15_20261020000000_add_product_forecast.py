@@ -0,0 +1,31 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "product_forecast" (
+    "productid" VARCHAR(20) NOT NULL  PRIMARY KEY,
+    "method" VARCHAR(40) NOT NULL,
+    "dailydemand" DOUBLE PRECISION NOT NULL,
+    "demandstd" DOUBLE PRECISION NOT NULL,
+    "leadtimedemand" DOUBLE PRECISION NOT NULL,
+    "safetystock" DOUBLE PRECISION NOT NULL,
+    "reorderpoint" INT NOT NULL,
+    "historydays" INT NOT NULL,
+    "computedat" TIMESTAMPTZ NOT NULL
+);
+        COMMENT ON COLUMN "product_forecast"."productid" IS '产品号';
+        COMMENT ON COLUMN "product_forecast"."method" IS '预测方法';
+        COMMENT ON COLUMN "product_forecast"."dailydemand" IS '预测日需求';
+        COMMENT ON COLUMN "product_forecast"."demandstd" IS '日需求标准差';
+        COMMENT ON COLUMN "product_forecast"."leadtimedemand" IS '交付周期内预测需求';
+        COMMENT ON COLUMN "product_forecast"."safetystock" IS '安全库存';
+        COMMENT ON COLUMN "product_forecast"."reorderpoint" IS '建议再订货点';
+        COMMENT ON COLUMN "product_forecast"."historydays" IS '历史天数';
+        COMMENT ON COLUMN "product_forecast"."computedat" IS '计算时间';
+        COMMENT ON TABLE "product_forecast" IS 'The latest demand forecast and suggested reorder point of a product.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "product_forecast";"""
@@ -0,0 +1,40 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "request_leadtime" (
+    "requestid" VARCHAR(32) NOT NULL  PRIMARY KEY,
+    "productid" VARCHAR(20) NOT NULL,
+    "fullfillername" VARCHAR(100),
+    "is_urgent" BOOL NOT NULL,
+    "requestdate" TIMESTAMPTZ NOT NULL,
+    "fullfilldate" TIMESTAMPTZ NOT NULL,
+    "hours" DOUBLE PRECISION NOT NULL,
+    "targetdays" INT NOT NULL
+);
+        CREATE INDEX IF NOT EXISTS "idx_request_lea_fullfil_38f512" ON "request_leadtime" ("fullfilldate");
+        CREATE INDEX IF NOT EXISTS "idx_request_lea_product_e7ca49" ON "request_leadtime" ("productid", "fullfilldate");
+        CREATE INDEX IF NOT EXISTS "idx_request_lea_fullfil_114372" ON "request_leadtime" ("fullfillername", "fullfilldate");
+        COMMENT ON COLUMN "request_leadtime"."requestid" IS '需求号';
+        COMMENT ON COLUMN "request_leadtime"."productid" IS '需求产品号';
+        COMMENT ON COLUMN "request_leadtime"."fullfillername" IS '完成者姓名';
+        COMMENT ON COLUMN "request_leadtime"."is_urgent" IS '是否紧急请求';
+        COMMENT ON COLUMN "request_leadtime"."requestdate" IS '需求日期';
+        COMMENT ON COLUMN "request_leadtime"."fullfilldate" IS '完成日期';
+        COMMENT ON COLUMN "request_leadtime"."hours" IS '交付用时 (小时)';
+        COMMENT ON COLUMN "request_leadtime"."targetdays" IS '完成时产品的交付周期 (天)';
+        COMMENT ON TABLE "request_leadtime" IS 'The lead time of one fulfilled request, kept by the request writes.';
+        INSERT INTO "request_leadtime" ("requestid", "productid", "fullfillername", "is_urgent",
+            "requestdate", "fullfilldate", "hours", "targetdays")
+        SELECT r."requestid", r."requestproductid", r."fullfillername", r."is_urgent",
+            r."requestdate", r."fullfilldate",
+            EXTRACT(EPOCH FROM r."fullfilldate" - r."requestdate") / 3600, p."leadtime"
+        FROM "requestdetails" r JOIN "productdetails" p ON p."productid" = r."requestproductid"
+        WHERE r."status" = 'FULLFILLED' AND r."fullfilldate" IS NOT NULL
+        ON CONFLICT DO NOTHING;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "request_leadtime";"""
@@ -0,0 +1,23 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Both columns start empty. The shelf life is parsed from free text in
+    # Python, so `python -m api.productlog.expiry backfill` fills them in
+    # chunks once this has run.
+    return """
+        ALTER TABLE "productdetails" ADD "shelflifedays" INT;
+        ALTER TABLE "product_inventory" ADD "expirydate" DATE;
+        ALTER TABLE "product_inventory_archive" ADD "expirydate" DATE;
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_expiryd_c96661" ON "product_inventory" ("expirydate");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_expiryd_44827a" ON "product_inventory_archive" ("expirydate");
+        COMMENT ON COLUMN "productdetails"."shelflifedays" IS '质保期（天）';
+        COMMENT ON COLUMN "product_inventory"."expirydate" IS '失效日期';
+        COMMENT ON COLUMN "product_inventory_archive"."expirydate" IS '失效日期';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "product_inventory_archive" DROP COLUMN "expirydate";
+        ALTER TABLE "product_inventory" DROP COLUMN "expirydate";
+        ALTER TABLE "productdetails" DROP COLUMN "shelflifedays";"""
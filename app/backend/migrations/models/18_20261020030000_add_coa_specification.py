@@ -0,0 +1,29 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Products start without a specification, so nothing is checked or
+    # quarantined until rules are set through the API.
+    return """
+        CREATE TABLE IF NOT EXISTS "coa_specification" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "productid" VARCHAR(20) NOT NULL,
+    "field" VARCHAR(40) NOT NULL,
+    "minvalue" DOUBLE PRECISION,
+    "maxvalue" DOUBLE PRECISION,
+    "expected" BOOL,
+    "updatedby" VARCHAR(50) NOT NULL,
+    "updatedat" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "uid_coa_specifi_product_59d6fa" UNIQUE ("productid", "field")
+);
+        COMMENT ON COLUMN "coa_specification"."productid" IS '产品号';
+        COMMENT ON COLUMN "coa_specification"."field" IS 'COA 字段';
+        COMMENT ON COLUMN "coa_specification"."minvalue" IS '下限（含）';
+        COMMENT ON COLUMN "coa_specification"."maxvalue" IS '上限（含）';
+        COMMENT ON COLUMN "coa_specification"."expected" IS '要求结果';
+        COMMENT ON TABLE "coa_specification" IS 'The accepted range or outcome of one COA result of a product.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "coa_specification";"""
@@ -0,0 +1,38 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # The statistics start from every batch measured so far; inventory writes
+    # keep them up to date from here on.
+    return """
+        CREATE TABLE IF NOT EXISTS "coa_statistics" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "productid" VARCHAR(20) NOT NULL,
+    "field" VARCHAR(40) NOT NULL,
+    "count" INT NOT NULL,
+    "mean" DOUBLE PRECISION NOT NULL,
+    "m2" DOUBLE PRECISION NOT NULL,
+    "updatedat" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "uid_coa_statist_product_8caaca" UNIQUE ("productid", "field")
+);
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_product_16c4c9" ON "product_inventory" ("productid", "productiondatetime");
+        COMMENT ON COLUMN "coa_statistics"."productid" IS '产品号';
+        COMMENT ON COLUMN "coa_statistics"."field" IS 'COA 字段';
+        COMMENT ON COLUMN "coa_statistics"."count" IS '已测批次数';
+        COMMENT ON COLUMN "coa_statistics"."mean" IS '均值';
+        COMMENT ON COLUMN "coa_statistics"."m2" IS '离差平方和';
+        COMMENT ON TABLE "coa_statistics" IS 'Running count, mean and M2 of one measured COA result of a product.';
+        INSERT INTO "coa_statistics" ("productid", "field", "count", "mean", "m2", "updatedat")
+        SELECT h."productid", v."field", count(*), avg(v."value"), var_pop(v."value") * count(*), now()
+        FROM (SELECT "productid", "coa_ph", "coa_osmoticpressure" FROM "product_inventory"
+            UNION ALL SELECT "productid", "coa_ph", "coa_osmoticpressure" FROM "product_inventory_archive") h
+        CROSS JOIN LATERAL (VALUES ('coa_ph', h."coa_ph"), ('coa_osmoticpressure', h."coa_osmoticpressure"))
+            AS v("field", "value")
+        WHERE v."value" IS NOT NULL
+        GROUP BY h."productid", v."field";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_product_inv_product_16c4c9";
+        DROP TABLE IF EXISTS "coa_statistics";"""
@@ -0,0 +1,30 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE INDEX IF NOT EXISTS "idx_usersaccoun_email_6cd04c" ON "usersaccount" ("email");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_lastupd_2fa4f2" ON "product_inventory" ("lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_product_d9c3c7" ON "product_inventory" ("productid", "lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_status_a3bd4d" ON "product_inventory" ("status", "lastupdated");
+        CREATE INDEX IF NOT EXISTS "idx_product_inv_to_show_lastupd" ON "product_inventory" ("lastupdated" DESC) WHERE "to_show" = true;
+        CREATE INDEX IF NOT EXISTS "idx_requestdeta_request_a4b580" ON "requestdetails" ("requestdate");
+        CREATE INDEX IF NOT EXISTS "idx_requestdeta_request_b966a3" ON "requestdetails" ("requestorname", "requestdate");
+        CREATE INDEX IF NOT EXISTS "idx_requestdeta_status_3b7cc5" ON "requestdetails" ("status", "requestdate");
+        CREATE INDEX IF NOT EXISTS "idx_requestdeta_request_d405b7" ON "requestdetails" ("requestproductid", "requestdate");
+        ANALYZE "usersaccount";
+        ANALYZE "product_inventory";
+        ANALYZE "requestdetails";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_usersaccoun_email_6cd04c";
+        DROP INDEX IF EXISTS "idx_product_inv_lastupd_2fa4f2";
+        DROP INDEX IF EXISTS "idx_product_inv_product_d9c3c7";
+        DROP INDEX IF EXISTS "idx_product_inv_status_a3bd4d";
+        DROP INDEX IF EXISTS "idx_product_inv_to_show_lastupd";
+        DROP INDEX IF EXISTS "idx_requestdeta_request_a4b580";
+        DROP INDEX IF EXISTS "idx_requestdeta_request_b966a3";
+        DROP INDEX IF EXISTS "idx_requestdeta_status_3b7cc5";
+        DROP INDEX IF EXISTS "idx_requestdeta_request_d405b7";"""
@@ -0,0 +1,22 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Prefixes start without a counter row; their first reservation creates
+    # it. Batches from before keep their random suffixes, which the
+    # allocator skips if a block reaches one.
+    return """
+        CREATE TABLE IF NOT EXISTS "batch_id_counter" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "basicmediumid" VARCHAR(7) NOT NULL,
+    "addictiveid" VARCHAR(7) NOT NULL,
+    "nextvalue" BIGINT NOT NULL,
+    CONSTRAINT "uid_batch_id_co_basicme_0f6154" UNIQUE ("basicmediumid", "addictiveid")
+);
+        COMMENT ON COLUMN "batch_id_counter"."nextvalue" IS '下一个批次序号';
+        COMMENT ON TABLE "batch_id_counter" IS 'The next batchid_internal number of a basicmediumid-addictiveid prefix.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "batch_id_counter";"""
@@ -0,0 +1,17 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # No job has a recorded run yet, so each daily job runs once when the
+    # first worker starts after this migration.
+    return """
+        CREATE TABLE IF NOT EXISTS "scheduledrun" (
+    "name" VARCHAR(50) NOT NULL  PRIMARY KEY,
+    "last_run_at" TIMESTAMPTZ NOT NULL
+);
+        COMMENT ON TABLE "scheduledrun" IS 'The last successful run of a daily background job.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "scheduledrun";"""
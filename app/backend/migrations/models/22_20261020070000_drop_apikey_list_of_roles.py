@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Keys act with their account's current roles from UserRole; the copy
+    # taken at creation was never read.
+    return """
+        ALTER TABLE "apikey" DROP COLUMN "list_of_roles";"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "apikey" ADD "list_of_roles" JSONB NOT NULL  DEFAULT '[]';"""
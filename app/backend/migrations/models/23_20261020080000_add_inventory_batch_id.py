@@ -0,0 +1,22 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    # Partitioning made the primary key of product_inventory
+    # (batchid_internal, productiondate); this table keeps batchid_internal
+    # unique again. It starts with the IDs of every live and archived batch.
+    return """
+        CREATE TABLE IF NOT EXISTS "inventory_batch_id" (
+    "batchid_internal" VARCHAR(70) NOT NULL  PRIMARY KEY
+);
+        COMMENT ON COLUMN "inventory_batch_id"."batchid_internal" IS '内部批次号';
+        COMMENT ON TABLE "inventory_batch_id" IS 'The batchid_internal of every batch, live or archived.';
+        INSERT INTO "inventory_batch_id" ("batchid_internal")
+        SELECT "batchid_internal" FROM "product_inventory"
+        UNION SELECT "batchid_internal" FROM "product_inventory_archive"
+        ON CONFLICT DO NOTHING;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "inventory_batch_id";"""
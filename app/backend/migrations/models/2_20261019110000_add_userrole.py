@@ -0,0 +1,23 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "userrole" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "username" VARCHAR(50) NOT NULL,
+    "role" VARCHAR(30) NOT NULL,
+    CONSTRAINT "uid_userrole_role_c5c5ad" UNIQUE ("role", "username")
+);
+        CREATE INDEX IF NOT EXISTS "idx_userrole_usernam_cbaf81" ON "userrole" ("username");
+        COMMENT ON COLUMN "userrole"."username" IS 'UsersAccount.username';
+        INSERT INTO "userrole" ("username", "role")
+            SELECT "username", jsonb_array_elements_text("list_of_roles")
+            FROM "usersaccount"
+            WHERE jsonb_typeof("list_of_roles") = 'array'
+            ON CONFLICT DO NOTHING;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "userrole";"""
@@ -0,0 +1,20 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "refreshtoken" (
+    "token_hash" VARCHAR(64) NOT NULL  PRIMARY KEY,
+    "username" VARCHAR(50) NOT NULL,
+    "issued_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "expires_at" TIMESTAMPTZ NOT NULL,
+    "revoked_at" TIMESTAMPTZ,
+    "replaced_by" VARCHAR(64)
+);
+        CREATE INDEX IF NOT EXISTS "idx_refreshtoke_usernam_675faf" ON "refreshtoken" ("username");
+        COMMENT ON TABLE "refreshtoken" IS 'Opaque refresh token, stored only as its SHA-256 hex digest.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "refreshtoken";"""
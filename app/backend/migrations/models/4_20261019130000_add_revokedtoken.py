@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "revokedtoken" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "jti" VARCHAR(32) NOT NULL UNIQUE,
+    "username" VARCHAR(50) NOT NULL,
+    "expires_at" TIMESTAMPTZ NOT NULL,
+    "revoked_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+        CREATE INDEX IF NOT EXISTS "idx_revokedtoke_expires_8751bc" ON "revokedtoken" ("expires_at");
+        COMMENT ON TABLE "revokedtoken" IS 'Revoked access token ids; the serial id is the workers'' change feed.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "revokedtoken";"""
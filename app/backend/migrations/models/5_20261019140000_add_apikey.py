@@ -0,0 +1,25 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "apikey" (
+    "key_hash" VARCHAR(64) NOT NULL  PRIMARY KEY,
+    "prefix" VARCHAR(12) NOT NULL UNIQUE,
+    "name" VARCHAR(100) NOT NULL,
+    "username" VARCHAR(50) NOT NULL,
+    "list_of_roles" JSONB NOT NULL,
+    "scopes" JSONB NOT NULL,
+    "rate_limit_per_minute" INT NOT NULL,
+    "created_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP,
+    "created_by" VARCHAR(50) NOT NULL,
+    "expires_at" TIMESTAMPTZ,
+    "revoked_at" TIMESTAMPTZ
+);
+        CREATE INDEX IF NOT EXISTS "idx_apikey_usernam_a8f12c" ON "apikey" ("username");
+        COMMENT ON TABLE "apikey" IS 'Machine credential for instruments and integrations.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "apikey";"""
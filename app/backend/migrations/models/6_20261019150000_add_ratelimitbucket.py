@@ -0,0 +1,17 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "ratelimitbucket" (
+    "key" VARCHAR(200) NOT NULL  PRIMARY KEY,
+    "tokens" DOUBLE PRECISION NOT NULL,
+    "updated_at" TIMESTAMPTZ NOT NULL
+);
+        CREATE INDEX IF NOT EXISTS "idx_ratelimitbu_updated_578f8d" ON "ratelimitbucket" ("updated_at");
+        COMMENT ON TABLE "ratelimitbucket" IS 'Token bucket shared by all workers when RATE_LIMIT_BACKEND=postgres.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "ratelimitbucket";"""
@@ -0,0 +1,20 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "idempotencyrecord" (
+    "key" VARCHAR(64) NOT NULL  PRIMARY KEY,
+    "request_hash" VARCHAR(64) NOT NULL,
+    "status_code" INT,
+    "response" TEXT,
+    "created_at" TIMESTAMPTZ NOT NULL,
+    "expires_at" TIMESTAMPTZ NOT NULL
+);
+        CREATE INDEX IF NOT EXISTS "idx_idempotency_expires_920f31" ON "idempotencyrecord" ("expires_at");
+        COMMENT ON TABLE "idempotencyrecord" IS 'Stored response of a create request, keyed by its Idempotency-Key.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "idempotencyrecord";"""
@@ -0,0 +1,16 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "productdetails" ADD "version" INT NOT NULL  DEFAULT 1;
+        ALTER TABLE "product_inventory" ADD "version" INT NOT NULL  DEFAULT 1;
+        ALTER TABLE "requestdetails" ADD "version" INT NOT NULL  DEFAULT 1;
+        COMMENT ON COLUMN "requestdetails"."version" IS '行版本，每次更新加一';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "productdetails" DROP COLUMN "version";
+        ALTER TABLE "product_inventory" DROP COLUMN "version";
+        ALTER TABLE "requestdetails" DROP COLUMN "version";"""
@@ -0,0 +1,26 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "stock_adjustment" (
+    "id" SERIAL NOT NULL PRIMARY KEY,
+    "batchid_internal" VARCHAR(70) NOT NULL,
+    "delta" INT NOT NULL,
+    "quantity_after" INT NOT NULL,
+    "reason" VARCHAR(40) NOT NULL,
+    "note" VARCHAR(255),
+    "adjustedby" VARCHAR(50) NOT NULL,
+    "adjustedat" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+        CREATE INDEX IF NOT EXISTS "idx_stock_adjus_batchid_28ae08" ON "stock_adjustment" ("batchid_internal", "adjustedat");
+        COMMENT ON COLUMN "stock_adjustment"."batchid_internal" IS '内部批次号';
+        COMMENT ON COLUMN "stock_adjustment"."delta" IS '库存变化量';
+        COMMENT ON COLUMN "stock_adjustment"."quantity_after" IS '调整后库存数量';
+        COMMENT ON COLUMN "stock_adjustment"."reason" IS '调整原因';
+        COMMENT ON TABLE "stock_adjustment" IS 'One signed change to the quantityinstock of a batch, and why.';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "stock_adjustment";"""
@@ -17,6 +17,11 @@ class Role(str, Enum):
     PRODUCTION_MANAGER = "PRODUCTION_MANAGER"
 
 
+class ApiKeyScope(str, Enum):
+    INVENTORY_WRITE = "inventory:write"
+    REQUESTS_WRITE = "requests:write"
+
+
 # Request payload schema (includes password)
 class AccountPayloadSchema(BaseModel):
     username: str = Field(
@@ -97,6 +102,63 @@ class AccountResponseSchema(BaseModel):
         }
 
 
+class BulkAccountResultSchema(BaseModel):
+    index: int = Field(..., description="Position of the account in the request.")
+    username: str
+    status: str = Field(..., description='"created" or "error".')
+    detail: Optional[str] = None
+
+
+class RolesUpdateSchema(BaseModel):
+    list_of_roles: List[Role] = Field(..., description="The complete new list of roles.")
+
+    class Config:
+        schema_extra = {"example": {"list_of_roles": ["REQUESTOR", "FULFILLER"]}}
+
+
+class RefreshTokenSchema(BaseModel):
+    refresh_token: str = Field(..., min_length=1, description="The opaque refresh token.")
+
+
+class ApiKeyPayloadSchema(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100, description="What the key is for.")
+    username: str = Field(
+        ..., min_length=3, max_length=50, description="The account the key acts as."
+    )
+    scopes: List[ApiKeyScope] = Field(..., min_items=1)
+    rate_limit_per_minute: Optional[int] = Field(None, gt=0)
+    expires_at: Optional[datetime] = None
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "name": "Bioreactor 3 controller",
+                "username": "bioreactor3",
+                "scopes": ["inventory:write"],
+                "rate_limit_per_minute": 120,
+            }
+        }
+
+
+class ApiKeyResponseSchema(BaseModel):
+    prefix: str
+    name: str
+    username: str
+    scopes: List[ApiKeyScope]
+    rate_limit_per_minute: int
+    created_at: Optional[datetime] = None
+    created_by: str
+    expires_at: Optional[datetime] = None
+    revoked_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+class ApiKeyCreatedSchema(ApiKeyResponseSchema):
+    api_key: str = Field(..., description="The key itself; it cannot be retrieved again.")
+
+
 class LoginSchema(BaseModel):
     username: str = Field(
         ...,
@@ -10,7 +10,7 @@ from tortoise.contrib.pydantic import pydantic_model_creator
 class UsersAccount(models.Model):
     username = fields.CharField(max_length=50, pk=True)
     password = fields.CharField(max_length=100)
-    email = fields.CharField(max_length=100)
+    email = fields.CharField(max_length=100, db_index=True)
     created_at = fields.DatetimeField(auto_now_add=True)
     list_of_roles = fields.JSONField(default=list)
     created_at = fields.DatetimeField(auto_now_add=True)
@@ -21,4 +21,131 @@ class UsersAccount(models.Model):
         return self.username
 
 
+class UserRole(models.Model):
+    """Normalized copy of UsersAccount.list_of_roles for indexed role lookups.
+
+    list_of_roles stays the source of the JWT claim; rows here are rewritten
+    together with it in api.accounts.crud.
+    """
+
+    username = fields.CharField(
+        max_length=50, description="UsersAccount.username", db_index=True
+    )
+    # (role, username) unique index serves the by-role lookups
+    role = fields.CharField(max_length=30)
+
+    class Meta:
+        table = "userrole"
+        unique_together = (("role", "username"),)
+
+    def __str__(self):
+        return f"{self.username}: {self.role}"
+
+
+class RefreshToken(models.Model):
+    """Opaque refresh token, stored only as its SHA-256 hex digest."""
+
+    token_hash = fields.CharField(max_length=64, pk=True)
+    username = fields.CharField(max_length=50, db_index=True)
+    issued_at = fields.DatetimeField(auto_now_add=True)
+    # Rows past expiry are swept by api.accounts.refresh_tokens
+    expires_at = fields.DatetimeField(db_index=True)
+    revoked_at = fields.DatetimeField(null=True)
+    replaced_by = fields.CharField(max_length=64, null=True)
+
+    class Meta:
+        table = "refreshtoken"
+
+    def __str__(self):
+        return f"RefreshToken({self.username})"
+
+
+class RevokedToken(models.Model):
+    """Revoked access token ids; the serial id is the workers' change feed."""
+
+    jti = fields.CharField(max_length=32, unique=True)
+    username = fields.CharField(max_length=50)
+    expires_at = fields.DatetimeField(db_index=True)
+    revoked_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "revokedtoken"
+
+    def __str__(self):
+        return self.jti
+
+
+class ApiKey(models.Model):
+    """Machine credential for instruments and integrations.
+
+    Only the HMAC-SHA256 of the key is stored; the key itself is shown once
+    when it is created.
+    """
+
+    key_hash = fields.CharField(max_length=64, pk=True)
+    prefix = fields.CharField(max_length=12, unique=True)
+    name = fields.CharField(max_length=100)
+    # The account the key acts as; its roles are read from UserRole when the
+    # key is verified
+    username = fields.CharField(max_length=50, db_index=True)
+    scopes = fields.JSONField(default=list)
+    rate_limit_per_minute = fields.IntField()
+    created_at = fields.DatetimeField(auto_now_add=True)
+    created_by = fields.CharField(max_length=50)
+    expires_at = fields.DatetimeField(null=True)
+    revoked_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "apikey"
+
+    def __str__(self):
+        return f"{self.name} ({self.prefix})"
+
+
+class RateLimitBucket(models.Model):
+    """Token bucket shared by all workers when RATE_LIMIT_BACKEND=postgres."""
+
+    key = fields.CharField(max_length=200, pk=True)
+    tokens = fields.FloatField()
+    updated_at = fields.DatetimeField(db_index=True)
+
+    class Meta:
+        table = "ratelimitbucket"
+
+    def __str__(self):
+        return self.key
+
+
+class IdempotencyRecord(models.Model):
+    """Stored response of a create request, keyed by its Idempotency-Key."""
+
+    # sha256 of route, user and the client's key
+    key = fields.CharField(max_length=64, pk=True)
+    request_hash = fields.CharField(max_length=64)
+    # NULL while the first request is still running
+    status_code = fields.IntField(null=True)
+    response = fields.TextField(null=True)
+    created_at = fields.DatetimeField()
+    expires_at = fields.DatetimeField(db_index=True)
+
+    class Meta:
+        table = "idempotencyrecord"
+
+    def __str__(self):
+        return self.key
+
+
+class ScheduledRun(models.Model):
+    """The last successful run of a daily background job."""
+
+    name = fields.CharField(max_length=50, pk=True)
+    last_run_at = fields.DatetimeField()
+
+    class Meta:
+        table = "scheduledrun"
+
+    def __str__(self):
+        return self.name
+
+
 UsersAccountSchema = pydantic_model_creator(UsersAccount)
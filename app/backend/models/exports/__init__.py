@@ -0,0 +1 @@
+# This file makes the exports directory a Python package.
@@ -0,0 +1,23 @@
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+
+class ExportTable(str, Enum):
+    PRODUCT_INVENTORY = "product_inventory"
+    PRODUCT_DETAILS = "product_details"
+    REQUEST_DETAILS = "request_details"
+
+
+class ExportFormat(str, Enum):
+    PARQUET = "parquet"
+    # Arrow IPC stream format, which can be read while it is written
+    ARROW = "arrow"
+
+
+class ExportResultSchema(BaseModel):
+    table: ExportTable = Field(..., description="导出的表")
+    format: ExportFormat = Field(..., description="文件格式")
+    path: str = Field(..., description="导出文件路径")
+    rows: int = Field(..., description="导出行数")
+    bytes: int = Field(..., description="文件大小")
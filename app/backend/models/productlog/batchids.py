@@ -0,0 +1,106 @@
+import asyncio
+import string
+from collections import defaultdict, deque
+from typing import Deque, Dict, Iterable, List, Tuple
+
+from decouple import config
+from tortoise import connections
+
+# Numbers reserved per trip to the database. A worker that exits skips the
+# rest of its block, so larger blocks trade fewer trips for bigger gaps.
+BATCH_ID_BLOCK = config("BATCH_ID_BLOCK", default=100, cast=int)
+
+# The suffix is the number in base 36, the alphabet of the random suffixes
+# batches got before, so IDs keep the basicmediumid-addictiveid-XXXXXX form
+SUFFIX_ALPHABET = string.digits + string.ascii_uppercase
+SUFFIX_LENGTH = 6
+SUFFIX_COUNT = len(SUFFIX_ALPHABET) ** SUFFIX_LENGTH
+
+# Moves the prefix's counter past $3 numbers and returns the first of them.
+# The row lock orders concurrent workers, so no two get the same block.
+RESERVE_SQL = (
+    'INSERT INTO "batch_id_counter" AS c ("basicmediumid", "addictiveid", "nextvalue") '
+    "VALUES ($1, $2, $3) ON CONFLICT (\"basicmediumid\", \"addictiveid\") "
+    'DO UPDATE SET "nextvalue" = c."nextvalue" + EXCLUDED."nextvalue" '
+    'RETURNING "nextvalue" - $3 AS "start"'
+)
+# IDs of a new block that a batch, live or archived, already has, from the
+# random suffixes
+TAKEN_SQL = (
+    'SELECT "batchid_internal" FROM "inventory_batch_id" '
+    'WHERE "batchid_internal" = ANY($1::varchar[])'
+)
+
+
+def encode_suffix(number: int) -> str:
+    """``number`` as SUFFIX_LENGTH base-36 digits, e.g. 35 is 00000Z."""
+    digits = []
+    for _ in range(SUFFIX_LENGTH):
+        number, digit = divmod(number, len(SUFFIX_ALPHABET))
+        digits.append(SUFFIX_ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+class BatchIdAllocator:
+    """Hand out batchid_internal values that no other batch has.
+
+    Each (basicmediumid, addictiveid) prefix has a counter row in
+    batch_id_counter. A worker reserves a block of numbers from it with one
+    statement and hands them out from memory, so workers never share a
+    number and a bulk import costs one reservation per prefix.
+    """
+
+    def __init__(self, block_size: int = BATCH_ID_BLOCK):
+        self.block_size = block_size
+        self._free: Dict[Tuple[str, str], Deque[str]] = defaultdict(deque)
+        self._lock = asyncio.Lock()
+
+    async def _reserve(self, basicmediumid: str, addictiveid: str, count: int) -> List[str]:
+        connection = connections.get("default")
+        rows = await connection.execute_query_dict(RESERVE_SQL, [basicmediumid, addictiveid, count])
+        start = rows[0]["start"]
+        if start + count > SUFFIX_COUNT:
+            raise ValueError(f"Batch IDs of {basicmediumid}-{addictiveid} are used up")
+        ids = [
+            f"{basicmediumid}-{addictiveid}-{encode_suffix(number)}"
+            for number in range(start, start + count)
+        ]
+        taken = await connection.execute_query_dict(TAKEN_SQL, [ids])
+        taken = {row["batchid_internal"] for row in taken}
+        return [batch_id for batch_id in ids if batch_id not in taken]
+
+    async def allocate(self, basicmediumid: str, addictiveid: str, count: int = 1) -> List[str]:
+        """``count`` new batch IDs of the prefix.
+
+        Raises:
+            ValueError: If the prefix has run out of suffixes.
+        """
+        async with self._lock:
+            free = self._free[(basicmediumid, addictiveid)]
+            while len(free) < count:
+                free.extend(
+                    await self._reserve(
+                        basicmediumid, addictiveid, max(self.block_size, count - len(free))
+                    )
+                )
+            return [free.popleft() for _ in range(count)]
+
+    async def assign(self, batches: Iterable) -> None:
+        """Give each batch without them its batchid_internal and batchid_external.
+
+        Batches are ProductInventory objects or anything else with their
+        attributes, e.g. before a bulk_create.
+        """
+        pending = defaultdict(list)
+        for batch in batches:
+            if not batch.batchid_external:
+                batch.batchid_external = f"{batch.basicmediumid}-{batch.addictiveid}"
+            if not batch.batchid_internal:
+                pending[(batch.basicmediumid, batch.addictiveid)].append(batch)
+        for (basicmediumid, addictiveid), group in pending.items():
+            batch_ids = await self.allocate(basicmediumid, addictiveid, len(group))
+            for batch, batch_id in zip(group, batch_ids):
+                batch.batchid_internal = batch_id
+
+
+batch_ids = BatchIdAllocator()
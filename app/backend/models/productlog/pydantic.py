@@ -2,7 +2,7 @@ from datetime import datetime, date
 from enum import Enum
 from typing import List, Optional
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, root_validator, validator
 
 
 class Category(str, Enum):
@@ -64,6 +64,53 @@ class InventoryStatus(str, Enum):
     OUT_OF_STOCK = "OUT_OF_STOCK(缺货)"
 
 
+class ReservationStatus(str, Enum):
+    ACTIVE = "ACTIVE(有效)"
+    RELEASED = "RELEASED(已释放)"
+    EXPIRED = "EXPIRED(已过期)"
+
+
+class LedgerEntryKind(str, Enum):
+    OPENING = "OPENING(期初)"
+    CREATED = "CREATED(新建)"
+    EDITED = "EDITED(编辑)"
+    ADJUSTED = "ADJUSTED(调整)"
+    DELETED = "DELETED(删除)"
+
+
+class AdjustmentReason(str, Enum):
+    PRODUCTION = "PRODUCTION(生产入库)"
+    SHIPMENT = "SHIPMENT(出库)"
+    RETURN = "RETURN(退货)"
+    QC_SAMPLE = "QC_SAMPLE(质检取样)"
+    DAMAGE = "DAMAGE(损坏)"
+    EXPIRY = "EXPIRY(过期)"
+    STOCKTAKE = "STOCKTAKE(盘点)"
+    OTHER = "OTHER(其他)"
+
+
+class CoaField(str, Enum):
+    """COA results a specification can cover, by inventory column"""
+    PH = "coa_ph"
+    OSMOTIC_PRESSURE = "coa_osmoticpressure"
+    CLARITY = "coa_clarity"
+    MYCOPLASMA = "coa__mycoplasma"
+    STERILITY = "coa_sterility"
+    FILLING_VOLUME_DIFFERENCE = "coa_fillingvolumedifference"
+
+
+# Measured values, checked against a range; the others are pass/fail
+COA_RANGE_FIELDS = (CoaField.PH, CoaField.OSMOTIC_PRESSURE)
+COA_BOOLEAN_FIELDS = tuple(field for field in CoaField if field not in COA_RANGE_FIELDS)
+
+
+class WesternElectricRule(str, Enum):
+    BEYOND_3_SIGMA = "BEYOND_3_SIGMA(超出3σ)"
+    TWO_OF_THREE_BEYOND_2_SIGMA = "TWO_OF_THREE_BEYOND_2_SIGMA(3点中2点超出2σ)"
+    FOUR_OF_FIVE_BEYOND_1_SIGMA = "FOUR_OF_FIVE_BEYOND_1_SIGMA(5点中4点超出1σ)"
+    EIGHT_ON_ONE_SIDE = "EIGHT_ON_ONE_SIDE(连续8点同侧)"
+
+
 class ProductDetailsSchema(BaseModel):
     productid: str = Field(
         ..., min_length=1, max_length=20, description="产品号，唯一标识", example="P12345"
@@ -87,9 +134,13 @@ class ProductDetailsSchema(BaseModel):
     storage_temperature_duration: Optional[str] = Field(
         None, description="储存温度&质保期", example="Store at -20°C for 6 months"
     )
+    shelflifedays: Optional[int] = Field(
+        None, ge=0, description="质保期（天），为空时由储存温度&质保期解析", example=180
+    )
     reorderlevel: int = Field(..., example=10, description="补货水平")
     targetstocklevel: int = Field(..., example=100, description="目标库存水平")
     leadtime: int = Field(..., example=5, description="交货时间（天）")
+    version: Optional[int] = Field(None, description="行版本，更新时可代替 If-Match")
 
 
 class ProductInventoryCreateSchema(BaseModel):
@@ -112,6 +163,7 @@ class ProductInventoryCreateSchema(BaseModel):
     coa_fillingvolumedifference: Optional[bool] = Field(None, description="装量差异限度")
     to_show: bool = Field(default=True, description="是否展示")
     lastupdatedby: str = Field(..., max_length=50)
+    version: Optional[int] = Field(None, description="行版本，更新时可代替 If-Match")
 
     class Config:
         orm_mode = True
@@ -140,6 +192,11 @@ class ProductInventoryCreateSchema(BaseModel):
         }
 
 
+class ProductInventoryBulkCreateSchema(BaseModel):
+    """Batches created with one INSERT, all or none"""
+    items: List[ProductInventoryCreateSchema] = Field(..., min_items=1, max_items=5000)
+
+
 class ProductInventorySchema(BaseModel):
     """Schema for ProductInventory - includes all fields for read operations"""
     batchid_internal: Optional[str] = Field(None, max_length=70, description="内部批次号（自动生成）")
@@ -148,7 +205,9 @@ class ProductInventorySchema(BaseModel):
     basicmediumid: str = Field(..., max_length=7)
     addictiveid: str = Field(..., max_length=7)
     quantityinstock: int = Field(...)
+    quantityreserved: int = Field(0, description="已预留数量")
     productiondate: date = Field(...)
+    expirydate: Optional[date] = Field(None, description="失效日期（生产日期加质保期）")
     imageurl: Optional[str] = Field(None, description="图片URL")
     status: InventoryStatus = Field(..., description="库存状态")
     productiondatetime: datetime = Field(..., description="生产时间")
@@ -163,6 +222,7 @@ class ProductInventorySchema(BaseModel):
     to_show: bool = Field(default=True, description="是否展示")
     lastupdated: datetime = Field(...)
     lastupdatedby: str = Field(..., max_length=50)
+    version: Optional[int] = Field(None, description="行版本")
 
     class Config:
         orm_mode = True
@@ -173,6 +233,7 @@ class ProductInventorySchema(BaseModel):
                 "addictiveid": "AD001",
                 "quantityinstock": 50,
                 "productiondate": "2025-01-01",
+                "expirydate": "2025-06-30",
                 "imageurl": "http://example.com/image.jpg",
                 "status": "AVAILABLE(可用)",
                 "productiondatetime": "2025-01-01T12:00:00",
@@ -206,6 +267,7 @@ class ProductInventoryWithDetailsSchema(BaseModel):
     is_sold_independently: bool = Field(default=True, description="是否独立销售")
     remarks_temperature: Optional[str] = Field(None, max_length=100, description="标签温度标注")
     storage_temperature_duration: Optional[str] = Field(None, max_length=100, description="储存温度&质保期")
+    shelflifedays: Optional[int] = Field(None, description="质保期（天）")
     reorderlevel: int = Field(..., description="补货水平")
     targetstocklevel: int = Field(..., description="目标库存水平")
     leadtime: int = Field(..., description="交货时间（天）")
@@ -216,7 +278,9 @@ class ProductInventoryWithDetailsSchema(BaseModel):
     basicmediumid: str = Field(..., max_length=7, description="基础培养基ID")
     addictiveid: str = Field(..., max_length=7, description="添加剂ID")
     quantityinstock: int = Field(..., description="库存数量")
+    quantityreserved: int = Field(0, description="已预留数量")
     productiondate: date = Field(..., description="生产日期")
+    expirydate: Optional[date] = Field(None, description="失效日期")
     imageurl: Optional[str] = Field(None, description="图片URL")
     status: InventoryStatus = Field(..., description="库存状态")
     productiondatetime: datetime = Field(..., description="生产时间")
@@ -234,3 +298,150 @@ class ProductInventoryWithDetailsSchema(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class StockAdjustmentSchema(BaseModel):
+    """A signed change to the quantity in stock of one batch"""
+    delta: int = Field(..., description="库存变化量，正数入库，负数出库", example=-2)
+    reason: AdjustmentReason = Field(..., description="调整原因", example=AdjustmentReason.SHIPMENT)
+    note: Optional[str] = Field(None, max_length=255, description="备注")
+
+    @validator("delta")
+    def delta_not_zero(cls, value):
+        if value == 0:
+            raise ValueError("delta must not be zero")
+        return value
+
+
+class StockAdjustmentItemSchema(StockAdjustmentSchema):
+    batchid_internal: str = Field(..., max_length=70, description="内部批次号")
+
+
+class StockAdjustmentBatchSchema(BaseModel):
+    """Adjustments applied together, all or none"""
+    adjustments: List[StockAdjustmentItemSchema] = Field(..., min_items=1, max_items=500)
+
+
+class StockAdjustmentResultSchema(BaseModel):
+    batchid_internal: str = Field(..., max_length=70, description="内部批次号")
+    quantityinstock: int = Field(..., description="调整后库存数量")
+    version: int = Field(..., description="行版本")
+
+    class Config:
+        orm_mode = True
+
+
+class ReservationCreateSchema(BaseModel):
+    """Hold part of a batch's stock for an approved request"""
+    requestid: str = Field(..., max_length=32, description="需求号")
+    quantity: int = Field(..., gt=0, description="预留数量", example=2)
+    ttl_minutes: Optional[int] = Field(
+        None, gt=0, le=43200, description="预留有效分钟数，默认 RESERVATION_TTL_MINUTES"
+    )
+
+
+class ReservationSchema(BaseModel):
+    id: int
+    batchid_internal: str = Field(..., max_length=70, description="内部批次号")
+    requestid: str = Field(..., max_length=32, description="需求号")
+    quantity: int = Field(..., description="预留数量")
+    status: ReservationStatus = Field(..., description="预留状态")
+    reservedby: str = Field(..., max_length=50)
+    reservedat: datetime
+    expiresat: datetime = Field(..., description="预留到期时间")
+    releasedat: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
+class AvailableToPromiseSchema(BaseModel):
+    """Unreserved AVAILABLE stock of one product across its batches"""
+    productid: str = Field(..., max_length=20, description="产品号")
+    quantityinstock: int = Field(..., description="库存数量")
+    quantityreserved: int = Field(..., description="已预留数量")
+    available: int = Field(..., description="可承诺数量")
+    batches: int = Field(..., description="可用批次数")
+
+
+class StockAtSchema(BaseModel):
+    """Stock of a product at a point in time, from the ledger"""
+    productid: str = Field(..., max_length=20, description="产品号")
+    at: datetime = Field(..., description="查询时间")
+    quantity: int = Field(..., description="库存数量")
+    checkpoint_at: Optional[datetime] = Field(None, description="所用检查点时间")
+    entries: int = Field(..., description="检查点之后的流水条数")
+
+
+class CoaRuleSchema(BaseModel):
+    """The accepted range of a measured COA result, or the required outcome of a test"""
+    field: CoaField = Field(..., description="COA 字段", example=CoaField.PH)
+    minvalue: Optional[float] = Field(None, description="下限（含）", example=7.0)
+    maxvalue: Optional[float] = Field(None, description="上限（含）", example=7.6)
+    expected: Optional[bool] = Field(None, description="要求结果", example=None)
+
+    @root_validator(skip_on_failure=True)
+    def matches_field(cls, values):
+        field, low, high = values["field"], values["minvalue"], values["maxvalue"]
+        if field in COA_RANGE_FIELDS:
+            if values["expected"] is not None:
+                raise ValueError(f"{field.value} takes minvalue and maxvalue, not expected")
+            if low is None and high is None:
+                raise ValueError(f"{field.value} needs minvalue or maxvalue")
+            if low is not None and high is not None and low > high:
+                raise ValueError("minvalue must not be greater than maxvalue")
+        elif low is not None or high is not None or values["expected"] is None:
+            raise ValueError(f"{field.value} takes expected, not minvalue or maxvalue")
+        return values
+
+
+class CoaSpecificationUpdateSchema(BaseModel):
+    """Replaces all rules of a product; a field left out is no longer checked"""
+    rules: List[CoaRuleSchema] = Field(..., max_items=len(CoaField))
+
+    @validator("rules")
+    def one_rule_per_field(cls, rules):
+        fields = [rule.field for rule in rules]
+        if len(set(fields)) != len(fields):
+            raise ValueError("each field may have one rule only")
+        return rules
+
+
+class CoaSpecificationSchema(CoaSpecificationUpdateSchema):
+    productid: str = Field(..., max_length=20, description="产品号")
+
+
+class CoaFailureSchema(BaseModel):
+    batchid_internal: str = Field(..., max_length=70, description="内部批次号")
+    productid: str = Field(..., max_length=20, description="产品号")
+    fields: List[CoaField] = Field(..., description="不合格的 COA 字段")
+
+
+class CoaCheckResultSchema(BaseModel):
+    """Batches checked against their product's COA specification"""
+    checked: int = Field(..., description="检查批次数")
+    failed: int = Field(..., description="不合格批次数")
+    quarantined: int = Field(..., description="转为隔离的批次数")
+    failures: List[CoaFailureSchema] = Field(
+        ..., description="不合格批次，最多 COA_CHECK_MAX_FAILURES 条"
+    )
+
+
+class ControlChartPointSchema(BaseModel):
+    batchid_internal: str = Field(..., max_length=70, description="内部批次号")
+    productiondatetime: datetime = Field(..., description="生产时间")
+    value: float = Field(..., description="测量值")
+    violations: List[WesternElectricRule] = Field(..., description="违反的判异规则")
+
+
+class ControlChartSchema(BaseModel):
+    """A measured COA result of a product's newest batches against limits from
+    all its batches"""
+    productid: str = Field(..., max_length=20, description="产品号")
+    field: CoaField = Field(..., description="COA 字段")
+    count: int = Field(..., description="历史已测批次数")
+    mean: Optional[float] = Field(None, description="中心线")
+    sigma: Optional[float] = Field(None, description="标准差，少于两批时为空")
+    ucl: Optional[float] = Field(None, description="控制上限 (均值+3σ)")
+    lcl: Optional[float] = Field(None, description="控制下限 (均值-3σ)")
+    points: List[ControlChartPointSchema] = Field(..., description="按生产时间排序的最新批次")
@@ -0,0 +1,50 @@
+import re
+from typing import Optional
+
+# Days per unit. Months and years are nominal, so an expiry date is
+# productiondate plus a whole number of days.
+UNIT_DAYS = {
+    "day": 1,
+    "week": 7,
+    "month": 30,
+    "year": 365,
+}
+UNIT_ALIASES = {
+    "d": "day", "day": "day", "days": "day", "天": "day", "日": "day",
+    "w": "week", "wk": "week", "wks": "week", "week": "week", "weeks": "week",
+    "周": "week", "星期": "week",
+    "m": "month", "mo": "month", "mos": "month", "month": "month", "months": "month",
+    "个月": "month", "月": "month",
+    "y": "year", "yr": "year", "yrs": "year", "year": "year", "years": "year", "年": "year",
+}
+# A number and a unit, e.g. "6 months", "12M", "2年" or "6个月". Longer
+# aliases come first so "months" is not read as "m". A temperature such as
+# "-20°C" or "2-8℃" has no unit here and never matches.
+DURATION = re.compile(
+    r"(\d+(?:\.\d+)?)\s*("
+    + "|".join(sorted(map(re.escape, UNIT_ALIASES), key=len, reverse=True))
+    + r")(?![a-z])",
+    re.IGNORECASE,
+)
+
+
+def parse_shelf_life_days(text: Optional[str]) -> Optional[int]:
+    """The shelf life in ``storage_temperature_duration``, in days.
+
+    Reads the first duration in the text, which is the shelf life under
+    the labelled storage condition: "Store at -20°C for 6 months" is 180,
+    "-80℃保存2年" is 730.
+
+    Args:
+        text (Optional[str]): The free text, in English or Chinese.
+
+    Returns:
+        Optional[int]: The shelf life, or None if the text has no duration.
+    """
+    if not text:
+        return None
+    match = DURATION.search(text)
+    if match is None:
+        return None
+    unit = UNIT_ALIASES[match.group(2).lower()]
+    return round(float(match.group(1)) * UNIT_DAYS[unit])
@@ -1,9 +1,8 @@
-import random
-import string
-
 from tortoise import fields, models
 from tortoise.contrib.pydantic import pydantic_model_creator
 
+from models.productlog.batchids import batch_ids
+
 
 class ProductDetails(models.Model):
     productid = fields.CharField(max_length=20, pk=True)
@@ -20,22 +19,32 @@ class ProductDetails(models.Model):
     storage_temperature_duration = fields.CharField(
         max_length=100, description="储存温度&质保期"
     )
+    # Parsed from storage_temperature_duration unless given explicitly
+    shelflifedays = fields.IntField(null=True, description="质保期（天）")
     reorderlevel = fields.IntField()
     targetstocklevel = fields.IntField()
     leadtime = fields.IntField()
+    # Bumped by every update, compared against If-Match
+    version = fields.IntField(default=1)
 
     def __str__(self):
         return self.productnameen
 
 
-class ProductInventory(models.Model):
+class InventoryBatch(models.Model):
+    """The columns of a batch, shared by the live and the archive table."""
+
     batchid_internal = fields.CharField(max_length=70, unique=True, pk=True)
     batchid_external = fields.CharField(max_length=70)
     productid = fields.CharField(max_length=20, description="产品号，必须存在于产品详情中")
     basicmediumid = fields.CharField(max_length=7)
     addictiveid = fields.CharField(max_length=7)
     quantityinstock = fields.IntField()
+    # Sum of the ACTIVE reservations on this batch
+    quantityreserved = fields.IntField(default=0, description="已预留数量")
     productiondate = fields.DateField()
+    # productiondate plus the product's shelflifedays, kept by the writes
+    expirydate = fields.DateField(null=True, db_index=True, description="失效日期")
     imageurl = fields.TextField(null=True)
     status = fields.CharField(max_length=20)
     productiondatetime = fields.DatetimeField(description="生产时间")
@@ -48,28 +57,194 @@ class ProductInventory(models.Model):
     coa_sterility = fields.BooleanField(description="无菌检测", null=True)
     coa_fillingvolumedifference = fields.BooleanField(description="装量差异限度", null=True)
     to_show = fields.BooleanField(default=True, description="是否展示")
-    lastupdated = fields.DatetimeField(auto_now=True)
+    lastupdated = fields.DatetimeField(auto_now=True, db_index=True)
     lastupdatedby = fields.CharField(max_length=50)
+    version = fields.IntField(default=1)
+
+    class Meta:
+        abstract = True
+
+
+class ProductInventory(InventoryBatch):
+    async def assign_batch_ids(self):
+        # batchid_external is basicmediumid-addictiveid, batchid_internal
+        # that plus a suffix from the prefix's counter
+        await batch_ids.assign([self])
 
     async def save(self, *args, **kwargs):
-        # Set batchid_external as basicmediumid-addictiveid
-        if not self.batchid_external:
-            self.batchid_external = f"{self.basicmediumid}-{self.addictiveid}"
-        if not self.batchid_internal:
-            rand_str = "".join(
-                random.choices(string.ascii_uppercase + string.digits, k=6)
-            )
-            self.batchid_internal = (
-                f"{self.basicmediumid}-{self.addictiveid}-{rand_str}"
-            )
+        await self.assign_batch_ids()
         await super().save(*args, **kwargs)
 
+    @classmethod
+    async def bulk_create(cls, objects, *args, **kwargs):
+        """Model.bulk_create, with the batch IDs of all objects allocated first."""
+        objects = list(objects)
+        await batch_ids.assign(objects)
+        return await super().bulk_create(objects, *args, **kwargs)
+
     def __str__(self):
         return f"BatchID: {self.batchid_external}, BasicMedium: {self.basicmediumid}, Additive: {self.addictiveid}"
 
     class Meta:
         table = "product_inventory"
         ordering = ["-lastupdated"]
+        # Listings filter on product/status and sort by -lastupdated, control
+        # charts read the newest batches of a product. The partial index on
+        # to_show = true lives in the aerich migration only, as does the
+        # monthly partitioning by productiondate, which makes the primary key
+        # (batchid_internal, productiondate). InventoryBatchId keeps
+        # batchid_internal unique across the partitions.
+        indexes = (
+            ("productid", "lastupdated"),
+            ("status", "lastupdated"),
+            ("productid", "productiondatetime"),
+        )
+
+
+class ProductInventoryArchive(InventoryBatch):
+    """Closed batches moved out of product_inventory; read-only history."""
+
+    archivedat = fields.DatetimeField(description="归档时间")
+
+    class Meta:
+        table = "product_inventory_archive"
+
+
+class StockAdjustment(models.Model):
+    """One signed change to the quantityinstock of a batch, and why."""
+
+    batchid_internal = fields.CharField(max_length=70, description="内部批次号")
+    delta = fields.IntField(description="库存变化量")
+    quantity_after = fields.IntField(description="调整后库存数量")
+    reason = fields.CharField(max_length=40, description="调整原因")
+    note = fields.CharField(max_length=255, null=True)
+    adjustedby = fields.CharField(max_length=50)
+    adjustedat = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "stock_adjustment"
+        # The history of one batch, newest first
+        indexes = (("batchid_internal", "adjustedat"),)
+
+
+class Reservation(models.Model):
+    """A hold on part of a batch's stock for one approved product request.
+
+    ProductInventory.quantityreserved is kept equal to the sum of the
+    ACTIVE reservations of the batch, so available stock needs no join.
+    """
+
+    batchid_internal = fields.CharField(max_length=70, description="内部批次号")
+    requestid = fields.CharField(max_length=32, description="需求号")
+    quantity = fields.IntField(description="预留数量")
+    status = fields.CharField(max_length=20, description="预留状态")
+    reservedby = fields.CharField(max_length=50)
+    reservedat = fields.DatetimeField(auto_now_add=True)
+    expiresat = fields.DatetimeField(description="预留到期时间")
+    releasedat = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "reservation"
+        # The partial index on expiresat of ACTIVE holds, which the sweeper
+        # reads, lives in the aerich migration only.
+        indexes = (("batchid_internal", "status"), ("requestid", "reservedat"))
+
+
+class InventoryTransaction(models.Model):
+    """One change to the stock of a batch. Rows are only ever appended.
+
+    Every statement that changes quantityinstock, or creates or deletes a
+    batch, writes its rows here in the same statement.
+    """
+
+    id = fields.BigIntField(pk=True, generated=True)
+    productid = fields.CharField(max_length=20, description="产品号")
+    batchid_internal = fields.CharField(max_length=70, description="内部批次号")
+    delta = fields.IntField(description="库存变化量")
+    quantity_after = fields.IntField(description="变化后批次库存数量")
+    kind = fields.CharField(max_length=20, description="流水类型")
+    reason = fields.CharField(max_length=40, null=True, description="调整原因")
+    createdby = fields.CharField(max_length=50, null=True)
+    createdat = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "inventory_transaction"
+        # Stock of a product between a checkpoint and a point in time. The
+        # BRIN index on createdat, which the checkpointer reads, lives in
+        # the aerich migration only.
+        indexes = (("productid", "createdat"),)
+
+
+class InventoryCheckpoint(models.Model):
+    """The stock of a product as of ``asof``, summed from the ledger."""
+
+    productid = fields.CharField(max_length=20, description="产品号")
+    # The checkpointer starts from the newest asof of all products
+    asof = fields.DatetimeField(db_index=True, description="截至时间")
+    quantity = fields.IntField(description="截至时库存数量")
+    createdat = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "inventory_checkpoint"
+        unique_together = (("productid", "asof"),)
+
+
+class CoaSpecification(models.Model):
+    """The accepted range or outcome of one COA result of a product."""
+
+    productid = fields.CharField(max_length=20, description="产品号")
+    field = fields.CharField(max_length=40, description="COA 字段")
+    minvalue = fields.FloatField(null=True, description="下限（含）")
+    maxvalue = fields.FloatField(null=True, description="上限（含）")
+    expected = fields.BooleanField(null=True, description="要求结果")
+    updatedby = fields.CharField(max_length=50)
+    updatedat = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "coa_specification"
+        unique_together = (("productid", "field"),)
+
+
+class CoaStatistics(models.Model):
+    """Running count, mean and M2 of one measured COA result of a product."""
+
+    productid = fields.CharField(max_length=20, description="产品号")
+    field = fields.CharField(max_length=40, description="COA 字段")
+    count = fields.IntField(description="已测批次数")
+    mean = fields.FloatField(description="均值")
+    # Sum of squared deviations from the mean, as kept by Welford's algorithm
+    m2 = fields.FloatField(description="离差平方和")
+    updatedat = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "coa_statistics"
+        unique_together = (("productid", "field"),)
+
+
+class BatchIdCounter(models.Model):
+    """The next batchid_internal number of a basicmediumid-addictiveid prefix."""
+
+    basicmediumid = fields.CharField(max_length=7)
+    addictiveid = fields.CharField(max_length=7)
+    nextvalue = fields.BigIntField(description="下一个批次序号")
+
+    class Meta:
+        table = "batch_id_counter"
+        unique_together = (("basicmediumid", "addictiveid"),)
+
+
+class InventoryBatchId(models.Model):
+    """The batchid_internal of every batch, live or archived.
+
+    The primary key of the partitioned product_inventory includes
+    productiondate, so batch writes claim their ID here in the same
+    statement; a second batch with the ID fails on this primary key.
+    """
+
+    batchid_internal = fields.CharField(max_length=70, pk=True, description="内部批次号")
+
+    class Meta:
+        table = "inventory_batch_id"
 
 
 ProductDetailsSchema = pydantic_model_creator(ProductDetails)
@@ -34,6 +34,7 @@ class RequestDetailsSchema(BaseModel):
     )
     fullfillername: Optional[str] = Field(None, max_length=100, description="完成者姓名")
     fullfilldate: Optional[datetime] = Field(None, description="完成日期")
+    version: Optional[int] = Field(None, description="行版本")
 
 
 # Schema for creating a new request (POST)
@@ -49,6 +50,8 @@ class RequestDetailsCreate(BaseModel):
     requestunit: int = Field(..., description="需求单位", example=1)
     is_urgent: bool = Field(default=False, description="是否紧急请求")
     remarks: str = Field(..., max_length=4096, description="备注信息")
+    # Only read on PUT, where it can stand in for If-Match
+    version: Optional[int] = Field(None, description="行版本")
 
 
 # Schema for updating the status of a request (PUT)
@@ -73,4 +76,5 @@ class RequestDetailsResponse(BaseModel):
     remarks: str
     status: RequestStatus
     fullfillername: Optional[str]
-    fullfilldate: Optional[datetime]
\ No newline at end of file
+    fullfilldate: Optional[datetime]
+    version: Optional[int] = None
\ No newline at end of file
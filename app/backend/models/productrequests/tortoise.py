@@ -13,7 +13,9 @@ class RequestDetails(models.Model):
         default=lambda: RequestDetails.generate_requestid(),
     )
     requestorname = fields.CharField(max_length=100, description="需求人姓名")
-    requestdate = fields.DatetimeField(auto_now_add=True, description="需求日期")
+    requestdate = fields.DatetimeField(
+        auto_now_add=True, description="需求日期", db_index=True
+    )
     requestproductid = fields.CharField(
         max_length=20,
         description="需求产品号 (ProductDetails.productid, application-level FK)",
@@ -28,6 +30,7 @@ class RequestDetails(models.Model):
     )
     fullfillername = fields.CharField(max_length=100, null=True, description="完成者姓名")
     fullfilldate = fields.DatetimeField(null=True, description="完成日期")
+    version = fields.IntField(default=1, description="行版本，每次更新加一")
 
     @staticmethod
     def generate_requestid():
@@ -39,6 +42,14 @@ class RequestDetails(models.Model):
     def __str__(self):
         return self.id
 
+    class Meta:
+        # Per-user, per-status and per-product listings, newest first
+        indexes = (
+            ("requestorname", "requestdate"),
+            ("status", "requestdate"),
+            ("requestproductid", "requestdate"),
+        )
+
 
 RequestDetailsSchema = pydantic_model_creator(
     RequestDetails, name="RequestDetailsSchema"
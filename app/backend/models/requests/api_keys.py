@@ -0,0 +1,198 @@
+import hashlib
+import hmac
+import math
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+from decouple import config
+from fastapi import HTTPException, Security, status
+from fastapi.security import (APIKeyHeader, HTTPAuthorizationCredentials,
+                              HTTPBearer)
+
+from models.accounts.tortoise import ApiKey, UserRole
+from models.requests.authentication import SECRET_KEY, AuthHandler
+from models.requests.rate_limit import TokenBucket
+
+# Keys are random, so a keyed SHA-256 is enough; bcrypt would cost ~100ms a call
+API_KEY_SECRET = config("API_KEY_SECRET", default=SECRET_KEY)
+API_KEY_CACHE_SECONDS = config("API_KEY_CACHE_SECONDS", default=60, cast=float)
+API_KEY_RATE_LIMIT = config("API_KEY_RATE_LIMIT_PER_MINUTE", default=600, cast=int)
+API_KEY_PREFIX = "sct_"
+
+
+class ApiKeyHandler:
+    """Authenticate machine clients with the ``X-API-Key`` header.
+
+    Verified keys are cached per worker for ``ttl`` seconds, so a busy
+    instrument costs one HMAC and two dict lookups per call. A revoked key
+    stops working on this worker at once and on the others once their cache
+    entry expires. Keys act with the current roles of their account, read
+    from UserRole together with the key, so role changes follow the same
+    rule.
+    """
+
+    header = APIKeyHeader(name="X-API-Key", auto_error=False)
+    bearer = HTTPBearer(auto_error=False)
+
+    def __init__(self, ttl: float = API_KEY_CACHE_SECONDS):
+        self.ttl = ttl
+        # key_hash -> (cache deadline, key details)
+        self._cache: Dict[str, Tuple[float, dict]] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.auth_handler = AuthHandler()
+
+    def hash_api_key(self, api_key: str) -> str:
+        """Hash an API key for storage and lookup.
+
+        Args:
+            api_key (str): The API key.
+
+        Returns:
+            str: The HMAC-SHA256 hex digest of the key.
+        """
+        return hmac.new(
+            API_KEY_SECRET.encode(), api_key.encode(), hashlib.sha256
+        ).hexdigest()
+
+    def generate_api_key(self) -> Tuple[str, str, str]:
+        """Generate a new API key.
+
+        Returns:
+            Tuple[str, str, str]: The key, its display prefix and its hash.
+        """
+        api_key = API_KEY_PREFIX + secrets.token_urlsafe(32)
+        return api_key, api_key[: len(API_KEY_PREFIX) + 8], self.hash_api_key(api_key)
+
+    def invalidate(self, key_hash: Optional[str] = None) -> None:
+        """Drop one cached key, or all of them."""
+        if key_hash is None:
+            self._cache.clear()
+            self._buckets.clear()
+        else:
+            self._cache.pop(key_hash, None)
+            self._buckets.pop(key_hash, None)
+
+    def invalidate_user(self, username: str) -> None:
+        """Drop the cached keys of an account, e.g. after its roles changed.
+
+        Rate limit buckets are kept, the keys themselves did not change.
+        """
+        for key_hash, (_, details) in list(self._cache.items()):
+            if details["username"] == username:
+                del self._cache[key_hash]
+
+    async def lookup(self, key_hash: str) -> Optional[dict]:
+        """Find an active key by its hash, using the cache when possible.
+
+        Args:
+            key_hash (str): The hash of the presented key.
+
+        Returns:
+            Optional[dict]: The key details, or None if it is unknown,
+                revoked or expired.
+        """
+        now = time.monotonic()
+        cached = self._cache.get(key_hash)
+        if cached and cached[0] > now:
+            return cached[1]
+        key = await ApiKey.filter(key_hash=key_hash, revoked_at__isnull=True).first()
+        if not key:
+            self.invalidate(key_hash)
+            return None
+        deadline = now + self.ttl
+        if key.expires_at is not None:
+            remaining = (key.expires_at - datetime.now(timezone.utc)).total_seconds()
+            if remaining <= 0:
+                self.invalidate(key_hash)
+                return None
+            deadline = min(deadline, now + remaining)
+        roles = await UserRole.filter(username=key.username).values_list(
+            "role", flat=True
+        )
+        details = {
+            "username": key.username,
+            "list_of_roles": sorted(roles),
+            "scopes": key.scopes,
+            "api_key": key.prefix,
+            "rate_limit_per_minute": key.rate_limit_per_minute,
+        }
+        self._cache[key_hash] = (deadline, details)
+        return details
+
+    def check_rate_limit(self, key_hash: str, details: dict) -> None:
+        """Charge one call against the key's rate limit.
+
+        Raises:
+            HTTPException: If the key is over its limit.
+        """
+        bucket = self._buckets.get(key_hash)
+        if bucket is None:
+            bucket = self._buckets[key_hash] = TokenBucket(
+                details["rate_limit_per_minute"]
+            )
+        retry_after = bucket.take()
+        if retry_after:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="API key rate limit exceeded",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    async def verify(self, api_key: str, scope: str) -> dict:
+        """Verify an API key for a scope.
+
+        Args:
+            api_key (str): The presented key.
+            scope (str): The scope the endpoint requires.
+
+        Raises:
+            HTTPException: If the key is invalid, lacks the scope or is over
+                its rate limit.
+
+        Returns:
+            dict: The username and list_of_roles the key acts as, like
+                ``AuthHandler.auth_wrapper``, plus the key prefix and scopes.
+        """
+        key_hash = self.hash_api_key(api_key)
+        details = await self.lookup(key_hash)
+        if details is None:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+        if scope not in details["scopes"]:
+            raise HTTPException(
+                status_code=403, detail=f"API key does not have the {scope} scope"
+            )
+        self.check_rate_limit(key_hash, details)
+        return details
+
+    def api_key_wrapper(self, scope: str):
+        """Build a dependency that requires an API key with ``scope``."""
+
+        async def dependency(api_key: Optional[str] = Security(self.header)) -> dict:
+            if not api_key:
+                raise HTTPException(status_code=401, detail="Missing API key")
+            return await self.verify(api_key, scope)
+
+        return dependency
+
+    def auth_or_api_key(self, scope: str):
+        """Build a dependency that accepts a user JWT or an API key with ``scope``.
+
+        A bearer token is checked exactly like ``AuthHandler.auth_wrapper``.
+        """
+
+        async def dependency(
+            auth: Optional[HTTPAuthorizationCredentials] = Security(self.bearer),
+            api_key: Optional[str] = Security(self.header),
+        ) -> dict:
+            if auth is not None:
+                return self.auth_handler.auth_wrapper(auth)
+            if api_key:
+                return await self.verify(api_key, scope)
+            raise HTTPException(status_code=403, detail="Not authenticated")
+
+        return dependency
+
+
+api_key_handler = ApiKeyHandler()
@@ -1,3 +1,6 @@
+import hashlib
+import secrets
+import uuid
 from datetime import datetime, timedelta
 
 import jwt
@@ -6,14 +9,47 @@ from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from passlib.context import CryptContext
 
+from config import get_settings
+from models.requests.revocation import revocation_list
+
 # Read from environment variables or set defaults
 SECRET_KEY = config("SECRET_KEY", default="default_secret_key")
 EXPIRE_TIME_MINUTE = config("EXPIRE_TIME_MINUTE", default=30)
+REFRESH_EXPIRE_DAYS = config("REFRESH_EXPIRE_DAYS", default=14, cast=int)
+
+PASSWORD_HASH_SCHEMES = ("bcrypt", "pbkdf2_sha256")
+
+
+def build_pwd_context(scheme: str = "bcrypt", rounds=None) -> CryptContext:
+    """Build the password context for a scheme and cost.
+
+    Hashes of the other schemes, or of the same scheme at any other cost,
+    still verify but are reported by ``needs_update``.
+
+    Args:
+        scheme (str, optional): The scheme new hashes use. Defaults to "bcrypt".
+        rounds (int, optional): The cost of new hashes. Defaults to None,
+            which keeps passlib's default and accepts any stored cost.
+
+    Returns:
+        CryptContext: The password context.
+    """
+    schemes = [scheme] + [s for s in PASSWORD_HASH_SCHEMES if s != scheme]
+    options = {}
+    if rounds is not None:
+        options = {
+            f"{scheme}__default_rounds": rounds,
+            f"{scheme}__min_rounds": rounds,
+            f"{scheme}__max_rounds": rounds,
+        }
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
 
 
 class AuthHandler:
     security = HTTPBearer()
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    pwd_context = build_pwd_context(
+        get_settings().password_hash_scheme, get_settings().password_hash_rounds
+    )
     secret = SECRET_KEY
 
     def get_password_hash(self, password):
@@ -39,6 +75,17 @@ class AuthHandler:
         """
         return self.pwd_context.verify(plain_password, hashed_password)
 
+    def needs_rehash(self, hashed_password):
+        """Check whether a hash uses an outdated scheme or cost.
+
+        Args:
+            hashed_password (str): The stored hash.
+
+        Returns:
+            bool: True if the hash should be replaced on the next login.
+        """
+        return self.pwd_context.needs_update(hashed_password)
+
     def encode_token(self, username, list_of_roles):
         """Generate a JWT token.
 
@@ -54,28 +101,70 @@ class AuthHandler:
             "iat": datetime.utcnow(),
             "sub": username,
             "list_of_roles": list_of_roles,
+            "jti": uuid.uuid4().hex,
         }
         return jwt.encode(payload, self.secret, algorithm="HS256")
 
-    def decode_token(self, token):
-        """Decode a JWT token.
+    def generate_refresh_token(self):
+        """Generate an opaque refresh token.
+
+        Returns:
+            tuple: The token for the client and its SHA-256 hex digest to store.
+        """
+        token = secrets.token_urlsafe(32)
+        return token, self.hash_refresh_token(token)
+
+    def hash_refresh_token(self, token):
+        """Hash a refresh token for storage and lookup.
+
+        Refresh tokens carry 256 random bits, so a fast digest is enough and
+        renewing a session never costs a bcrypt round.
+
+        Args:
+            token (str): The refresh token presented by the client.
+
+        Returns:
+            str: The SHA-256 hex digest of the token.
+        """
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def decode_token_payload(self, token):
+        """Decode a JWT token and reject revoked ones.
 
         Args:
             token (str): The JWT token to decode.
 
         Raises:
-            HTTPException: If the token is invalid or expired.
+            HTTPException: If the token is invalid, expired or revoked.
 
         Returns:
-            tuple: The user ID and list_of_roles extracted from the token.
+            dict: The token claims.
         """
         try:
             payload = jwt.decode(token, self.secret, algorithms=["HS256"])
-            return payload["sub"], payload["list_of_roles"]
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail="Signature has expired")
         except jwt.InvalidTokenError as e:
             raise HTTPException(status_code=401, detail="Invalid token")
+        # In-memory lookup, no I/O for the common not-revoked case
+        if revocation_list.is_revoked(payload.get("jti")):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        return payload
+
+    def decode_token(self, token):
+        """Decode a JWT token.
+
+        Args:
+            token (str): The JWT token to decode.
+
+        Raises:
+            HTTPException: If the token is invalid, expired or revoked.
+
+        Returns:
+            tuple: The user ID and list_of_roles extracted from the token.
+        """
+        payload = self.decode_token_payload(token)
+        return payload["sub"], payload["list_of_roles"]
 
     def auth_wrapper(self, auth: HTTPAuthorizationCredentials = Security(security)):
         """Extract user ID and list_of_roles from the JWT token.
@@ -84,10 +173,16 @@ class AuthHandler:
             auth (HTTPAuthorizationCredentials, optional): The HTTP authorization credentials. Defaults to Security(security).
 
         Returns:
-            dict: A dictionary containing the user ID and list_of_roles.
+            dict: A dictionary containing the user ID, list_of_roles, and the
+                token id and expiry used for revocation.
         """
-        username, list_of_roles = self.decode_token(auth.credentials)
-        return {"username": username, "list_of_roles": list_of_roles}
+        payload = self.decode_token_payload(auth.credentials)
+        return {
+            "username": payload["sub"],
+            "list_of_roles": payload["list_of_roles"],
+            "jti": payload.get("jti"),
+            "exp": payload.get("exp"),
+        }
 
     def encode_verification_token(self, username):
         """Generate a verification token.
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from decouple import config
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from tortoise import connections
+
+from models.requests.periodic import PeriodicTask
+
+
+IDEMPOTENCY_TTL_HOURS = config("IDEMPOTENCY_TTL_HOURS", default=24, cast=float)
+IDEMPOTENCY_CACHE_SIZE = config("IDEMPOTENCY_CACHE_SIZE", default=10000, cast=int)
+# A claim older than this without a response is from a crashed worker
+IDEMPOTENCY_PENDING_SECONDS = config("IDEMPOTENCY_PENDING_SECONDS", default=60, cast=float)
+IDEMPOTENCY_WAIT_SECONDS = config("IDEMPOTENCY_WAIT_SECONDS", default=30, cast=float)
+IDEMPOTENCY_POLL_SECONDS = 0.1
+IDEMPOTENCY_SWEEP_SECONDS = config("IDEMPOTENCY_SWEEP_SECONDS", default=3600, cast=float)
+
+# Claims the key unless a live record exists; RETURNING is empty otherwise
+CLAIM_SQL = (
+    'INSERT INTO "idempotencyrecord" AS r '
+    '("key", "request_hash", "created_at", "expires_at") VALUES ($1, $2, $3, $4) '
+    'ON CONFLICT ("key") DO UPDATE SET "request_hash" = EXCLUDED."request_hash", '
+    '"status_code" = NULL, "response" = NULL, '
+    '"created_at" = EXCLUDED."created_at", "expires_at" = EXCLUDED."expires_at" '
+    'WHERE r."expires_at" < $3 OR (r."status_code" IS NULL AND r."created_at" < $5) '
+    'RETURNING "key"'
+)
+SELECT_SQL = (
+    'SELECT "request_hash", "status_code", "response", "expires_at" '
+    'FROM "idempotencyrecord" WHERE "key" = $1'
+)
+COMPLETE_SQL = (
+    'UPDATE "idempotencyrecord" SET "status_code" = $2, "response" = $3 '
+    'WHERE "key" = $1'
+)
+RELEASE_SQL = (
+    'DELETE FROM "idempotencyrecord" WHERE "key" = $1 AND "status_code" IS NULL'
+)
+SWEEP_SQL = 'DELETE FROM "idempotencyrecord" WHERE "expires_at" < $1'
+
+
+def hash_request(payload) -> str:
+    """Hash a request body independently of key order."""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class IdempotencyStore(PeriodicTask):
+    """Run create requests at most once per ``Idempotency-Key``.
+
+    The first request with a key claims a row in ``idempotencyrecord`` and
+    stores its response there; retries within the TTL get that response
+    back without running again. Completed responses are also kept in a
+    per-worker LRU cache. A duplicate that arrives while the first is still
+    running waits for it, on the same worker through a shared future and
+    on other workers by polling the row.
+    """
+
+    description = "sweep idempotency records"
+
+    def __init__(
+        self,
+        ttl_hours: float = IDEMPOTENCY_TTL_HOURS,
+        cache_size: int = IDEMPOTENCY_CACHE_SIZE,
+        interval: float = IDEMPOTENCY_SWEEP_SECONDS,
+    ):
+        super().__init__(interval)
+        self.ttl = timedelta(hours=ttl_hours)
+        self.cache_size = cache_size
+        # record key -> (expiry as a unix timestamp, request hash, response)
+        self._cache: "OrderedDict[str, Tuple[float, str, object]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def record_key(self, scope: str, principal: str, idempotency_key: str) -> str:
+        # Keys are per user and per route, so clients cannot collide
+        return hashlib.sha256(
+            f"{scope}\x00{principal}\x00{idempotency_key}".encode()
+        ).hexdigest()
+
+    def _remember(self, key: str, expires_at: float, request_hash: str, response) -> None:
+        self._cache[key] = (expires_at, request_hash, response)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _cached(self, key: str, request_hash: str):
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        expires_at, stored_hash, response = cached
+        if expires_at <= time.time():
+            del self._cache[key]
+            return None
+        self._check_hash(stored_hash, request_hash)
+        self._cache.move_to_end(key)
+        return response
+
+    @staticmethod
+    def _check_hash(stored_hash: str, request_hash: str) -> None:
+        if stored_hash != request_hash:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different request body",
+            )
+
+    async def run(
+        self,
+        scope: str,
+        idempotency_key: Optional[str],
+        principal: str,
+        payload,
+        execute: Callable[[], Awaitable],
+    ):
+        """Execute a create request once per idempotency key.
+
+        Args:
+            scope (str): The route, e.g. "requests.create".
+            idempotency_key (Optional[str]): The Idempotency-Key header. When
+                missing, ``execute`` just runs.
+            principal (str): The user the key belongs to.
+            payload: The request body, used to detect a reused key.
+            execute (Callable[[], Awaitable]): Runs the request.
+
+        Raises:
+            HTTPException: If the key was used for a different body, or the
+                first request is still running after IDEMPOTENCY_WAIT_SECONDS.
+
+        Returns:
+            The response of the first execution, as JSON compatible data
+            on replays.
+        """
+        if not idempotency_key:
+            return await execute()
+        key = self.record_key(scope, principal, idempotency_key)
+        request_hash = hash_request(payload)
+
+        cached = self._cached(key, request_hash)
+        if cached is not None:
+            return cached
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            stored_hash, response = await asyncio.shield(inflight)
+            self._check_hash(stored_hash, request_hash)
+            return response
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await self._run_once(key, request_hash, execute)
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark retrieved, waiters may not exist
+            future.exception()
+            raise
+        else:
+            future.set_result((request_hash, response))
+            return response
+        finally:
+            del self._inflight[key]
+
+    async def _run_once(self, key: str, request_hash: str, execute):
+        connection = connections.get("default")
+        now = datetime.now(timezone.utc)
+        expires_at = now + self.ttl
+        stale = now - timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS)
+        _, claimed = await connection.execute_query(
+            CLAIM_SQL, [key, request_hash, now, expires_at, stale]
+        )
+        if not claimed:
+            return await self._wait_for_other_worker(connection, key, request_hash)
+
+        try:
+            result = await execute()
+        except BaseException:
+            # Failed requests are not replayed, the client may retry
+            await connection.execute_query(RELEASE_SQL, [key])
+            raise
+        response = jsonable_encoder(result)
+        await connection.execute_query(
+            COMPLETE_SQL, [key, status.HTTP_200_OK, json.dumps(response)]
+        )
+        self._remember(key, expires_at.timestamp(), request_hash, response)
+        return result
+
+    async def _wait_for_other_worker(self, connection, key: str, request_hash: str):
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            _, rows = await connection.execute_query(SELECT_SQL, [key])
+            if rows:
+                row = rows[0]
+                self._check_hash(row["request_hash"], request_hash)
+                if row["status_code"] is not None:
+                    response = json.loads(row["response"])
+                    self._remember(
+                        key, row["expires_at"].timestamp(), request_hash, response
+                    )
+                    return response
+            if time.monotonic() >= deadline:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="A request with this Idempotency-Key is still in progress",
+                )
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    async def sweep(self) -> int:
+        """Delete expired records.
+
+        Returns:
+            int: The number of deleted rows.
+        """
+        count, _ = await connections.get("default").execute_query(
+            SWEEP_SQL, [datetime.now(timezone.utc)]
+        )
+        now = time.time()
+        for key in [k for k, (exp, _, _) in self._cache.items() if exp <= now]:
+            del self._cache[key]
+        return count
+
+    async def tick(self) -> None:
+        await self.sweep()
+
+
+idempotency_store = IdempotencyStore()
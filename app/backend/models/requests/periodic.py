@@ -0,0 +1,171 @@
+import asyncio
+import logging
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, Generic, Hashable, Optional, TypeVar
+
+from tortoise import connections
+
+log = logging.getLogger("uvicorn")
+
+# A daily run holds a session advisory lock on its name while it ticks
+TRY_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext($1))"
+UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext($1))"
+LAST_RUN_SQL = 'SELECT "last_run_at" FROM "scheduledrun" WHERE "name" = $1'
+RECORD_RUN_SQL = (
+    'INSERT INTO "scheduledrun" ("name", "last_run_at") VALUES ($1, $2) '
+    'ON CONFLICT ("name") DO UPDATE SET "last_run_at" = EXCLUDED."last_run_at"'
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class PeriodicTask:
+    """Run ``tick`` every ``interval`` seconds in a background task.
+
+    A failed tick is logged and tried again next interval. Subclasses set
+    ``description`` for the log message and ``run_first`` to tick once
+    before the first sleep. ``stop`` cancels the task and then awaits
+    ``on_stop``.
+    """
+
+    description = "run periodic task"
+    run_first = False
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def tick(self) -> None:
+        raise NotImplementedError
+
+    async def _tick(self) -> None:
+        try:
+            await self.tick()
+        except Exception as e:
+            log.warning(f"Failed to {self.description}: {e}")
+
+    async def _run(self) -> None:
+        if self.run_first:
+            await self._tick()
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._tick()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def on_stop(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.on_stop()
+
+
+class DailyTask(PeriodicTask):
+    """Run ``tick`` once a day at ``at`` UTC, in one worker of all.
+
+    Every worker wakes at ``at``, and once on start in case a run was
+    missed, e.g. by a restart across ``at``. A run holds a Postgres
+    advisory lock on ``name``; a worker that does not get it skips, and
+    the one that does checks scheduledrun first, so each day's run happens
+    once. Only a successful run is recorded, so a failed one is tried
+    again by the next worker start or the next day.
+    """
+
+    name = "daily"
+
+    def __init__(self, at: time):
+        super().__init__(timedelta(days=1).total_seconds())
+        self.at = at
+
+    def due(self, now: datetime) -> datetime:
+        """The latest scheduled run at or before ``now``."""
+        due = datetime.combine(now.date(), self.at, tzinfo=timezone.utc)
+        return due if due <= now else due - timedelta(days=1)
+
+    async def run_due(self, now: Optional[datetime] = None) -> bool:
+        """Tick if the run due at ``now`` has not happened yet.
+
+        Returns:
+            bool: Whether this worker ticked.
+        """
+        now = now or datetime.now(timezone.utc)
+        async with connections.get("default").acquire_connection() as connection:
+            if not await connection.fetchval(TRY_LOCK_SQL, self.name):
+                return False
+            try:
+                last_run = await connection.fetchval(LAST_RUN_SQL, self.name)
+                if last_run is not None and last_run >= self.due(now):
+                    return False
+                await self.tick()
+                await connection.execute(RECORD_RUN_SQL, self.name, now)
+                return True
+            finally:
+                await connection.fetchval(UNLOCK_SQL, self.name)
+
+    async def _tick(self) -> None:
+        try:
+            await self.run_due()
+        except Exception as e:
+            log.warning(f"Failed to {self.description}: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await self._tick()
+            now = datetime.now(timezone.utc)
+            await asyncio.sleep((self.due(now) + timedelta(days=1) - now).total_seconds())
+
+
+class WriteBehindBuffer(PeriodicTask, Generic[K, V]):
+    """Collect pending writes in memory and ``write`` them as one batch.
+
+    Every interval, and once more on stop, the pending entries are swapped
+    out and handed to ``write``. If that fails they are put back with
+    ``restore``, so entries recorded in the meantime win by default.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(interval)
+        self._pending: Dict[K, V] = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def write(self, pending: Dict[K, V]) -> None:
+        raise NotImplementedError
+
+    def restore(self, key: K, value: V) -> None:
+        self._pending.setdefault(key, value)
+
+    async def flush(self) -> int:
+        """Write all pending entries.
+
+        Returns:
+            int: The number of entries written.
+        """
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            await self.write(pending)
+        except Exception:
+            for key, value in pending.items():
+                self.restore(key, value)
+            raise
+        return len(pending)
+
+    async def tick(self) -> None:
+        await self.flush()
+
+    async def on_stop(self) -> None:
+        """Write what is still pending."""
+        await self.flush()
@@ -0,0 +1,290 @@
+import hashlib
+import logging
+import math
+import time
+from typing import Dict, Optional
+
+import jwt
+from decouple import config
+from fastapi import HTTPException, Request, status
+from tortoise import connections
+
+from models.requests.authentication import SECRET_KEY
+from models.requests.periodic import PeriodicTask
+
+log = logging.getLogger("uvicorn")
+
+# "memory" keeps buckets per worker, "postgres" shares them between workers
+RATE_LIMIT_BACKEND = config("RATE_LIMIT_BACKEND", default="memory")
+# Behind nginx the client address is in X-Real-IP
+RATE_LIMIT_TRUST_PROXY = config("RATE_LIMIT_TRUST_PROXY", default=True, cast=bool)
+RATE_LIMIT_PRUNE_SECONDS = config("RATE_LIMIT_PRUNE_SECONDS", default=60, cast=float)
+# The wait of a rejected call that found a token refilled meanwhile
+MIN_RETRY_SECONDS = 1.0
+
+# One statement per check. Only an allowed call writes the bucket; a
+# rejected one reads the refilled tokens from the unchanged row, so the
+# client is let in again as soon as one token has refilled, as with
+# TokenBucket. The fallback SELECT sees the row as of the statement's start.
+REFILLED = 'LEAST($2, b."tokens" + EXTRACT(EPOCH FROM now() - b."updated_at") * $3)'
+TAKE_SQL = (
+    'WITH taken AS (INSERT INTO "ratelimitbucket" AS b ("key", "tokens", "updated_at") '
+    "VALUES ($1, $2 - 1, now()) "
+    f'ON CONFLICT ("key") DO UPDATE SET "tokens" = {REFILLED} - 1, "updated_at" = now() '
+    f'WHERE {REFILLED} >= 1 RETURNING "tokens") '
+    'SELECT true AS "allowed", "tokens" FROM taken UNION ALL '
+    f'SELECT false, {REFILLED} - 1 FROM "ratelimitbucket" b '
+    'WHERE b."key" = $1 AND NOT EXISTS (SELECT 1 FROM taken)'
+)
+PRUNE_SQL = (
+    'DELETE FROM "ratelimitbucket" '
+    'WHERE "updated_at" < now() - make_interval(secs => $1)'
+)
+
+
+class TokenBucket:
+    """Allow ``rate_per_minute`` calls a minute, with bursts up to ``burst``."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, rate_per_minute: int, burst: Optional[int] = None):
+        self.capacity = float(burst or rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> float:
+        return min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+
+    def take(self, now: Optional[float] = None) -> float:
+        """Take one token.
+
+        Returns:
+            float: 0 if the call is allowed, otherwise the seconds to wait.
+        """
+        now = now if now is not None else time.monotonic()
+        self.tokens = self.refill(now)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RouteLimit:
+    """A named limit on one request attribute.
+
+    Args:
+        name (str): The limit name, used in bucket keys and metrics.
+        per_minute (int): The sustained rate.
+        burst (int, optional): The bucket size. Defaults to ``per_minute``.
+        key (str, optional): What to count by, "ip", "username" (from the
+            JSON body) or "principal" (the caller's user, the IP for
+            anonymous calls). Defaults to "ip". Calls with an API key are
+            not counted by principal; each key has its own
+            rate_limit_per_minute, charged when the key is verified.
+    """
+
+    def __init__(self, name: str, per_minute: int, burst: Optional[int] = None, key: str = "ip"):
+        self.name = name
+        self.per_minute = per_minute
+        self.burst = burst or per_minute
+        self.key = key
+
+    @property
+    def refill_seconds(self) -> float:
+        """Seconds for an empty bucket to fill up again."""
+        return self.burst * 60.0 / self.per_minute
+
+
+ROUTE_LIMITS = {
+    limit.name: limit
+    for limit in (
+        RouteLimit(
+            "login_ip",
+            config("RATE_LIMIT_LOGIN_IP_PER_MINUTE", default=30, cast=int),
+            config("RATE_LIMIT_LOGIN_IP_BURST", default=10, cast=int),
+        ),
+        RouteLimit(
+            "login_username",
+            config("RATE_LIMIT_LOGIN_USERNAME_PER_MINUTE", default=10, cast=int),
+            config("RATE_LIMIT_LOGIN_USERNAME_BURST", default=5, cast=int),
+            key="username",
+        ),
+        RouteLimit(
+            "write",
+            config("RATE_LIMIT_WRITE_PER_MINUTE", default=300, cast=int),
+            config("RATE_LIMIT_WRITE_BURST", default=100, cast=int),
+            key="principal",
+        ),
+    )
+}
+
+
+class MemoryBuckets:
+    """Buckets held by this worker."""
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    async def take(self, key: str, limit: RouteLimit) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit.per_minute, limit.burst)
+        return bucket.take()
+
+    async def prune(self, now: Optional[float] = None) -> int:
+        """Forget buckets that have filled up again, they carry no state."""
+        now = now if now is not None else time.monotonic()
+        full = [
+            key
+            for key, bucket in self._buckets.items()
+            if bucket.refill(now) >= bucket.capacity
+        ]
+        for key in full:
+            del self._buckets[key]
+        return len(full)
+
+
+class PostgresBuckets:
+    """Buckets in the ratelimitbucket table, shared by all workers."""
+
+    async def take(self, key: str, limit: RouteLimit) -> float:
+        _, rows = await connections.get("default").execute_query(
+            TAKE_SQL, [key, float(limit.burst), limit.per_minute / 60.0]
+        )
+        if rows and rows[0]["allowed"]:
+            return 0.0
+        # A concurrent call may have refilled the row since the statement
+        # started, or created it; the client may then retry at once
+        missing = max(-rows[0]["tokens"], 0.0) if rows else 0.0
+        return missing * 60.0 / limit.per_minute or MIN_RETRY_SECONDS
+
+    async def prune(self) -> int:
+        max_refill = max(limit.refill_seconds for limit in ROUTE_LIMITS.values())
+        count, _ = await connections.get("default").execute_query(
+            PRUNE_SQL, [max_refill]
+        )
+        return count
+
+
+def client_ip(request: Request) -> Optional[str]:
+    if RATE_LIMIT_TRUST_PROXY and request.headers.get("x-real-ip"):
+        return request.headers["x-real-ip"]
+    return request.client.host if request.client else None
+
+
+def client_principal(request: Request) -> Optional[str]:
+    """The user or API key a request acts as, before the endpoint checks it.
+
+    A bearer token counts only if its signature is valid, so a forged one
+    cannot charge someone else's bucket. API keys are counted by their
+    digest and verified by the endpoint.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            return None
+        return f"user:{payload.get('sub')}"
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        return f"key:{hashlib.sha256(api_key.encode()).hexdigest()[:32]}"
+    return None
+
+
+class RateLimiter(PeriodicTask):
+    """Token-bucket rate limiting for routes, keyed by client IP, username
+    or authenticated principal.
+
+    ``limit(*names)`` builds a dependency that runs before the endpoint, so a
+    limited call is rejected with 429 before any hashing or database work.
+    If the shared backend is unavailable calls are let through.
+    """
+
+    description = "prune rate limit buckets"
+
+    def __init__(self, backend: str = RATE_LIMIT_BACKEND, interval: float = RATE_LIMIT_PRUNE_SECONDS):
+        super().__init__(interval)
+        self.backend = backend
+        self.store = PostgresBuckets() if backend == "postgres" else MemoryBuckets()
+        self.metrics: Dict[str, Dict[str, int]] = {
+            name: {"allowed": 0, "rejected": 0} for name in ROUTE_LIMITS
+        }
+
+    async def key_value(self, request: Request, limit: RouteLimit) -> Optional[str]:
+        if limit.key == "ip":
+            return client_ip(request)
+        if limit.key == "principal":
+            principal = client_principal(request)
+            if principal and principal.startswith("key:"):
+                return None
+            return principal or client_ip(request)
+        try:
+            # FastAPI has already read the body, this is the cached copy
+            body = await request.json()
+        except ValueError:
+            return None
+        value = body.get(limit.key) if isinstance(body, dict) else None
+        return str(value).lower() if value else None
+
+    async def check(self, request: Request, names) -> None:
+        """Charge one call against each named limit.
+
+        Raises:
+            HTTPException: If any limit is exhausted.
+        """
+        for name in names:
+            limit = ROUTE_LIMITS[name]
+            value = await self.key_value(request, limit)
+            if value is None:
+                continue
+            try:
+                retry_after = await self.store.take(f"{name}:{value}", limit)
+            except Exception as e:
+                log.warning(f"Rate limiter unavailable, allowing request: {e}")
+                continue
+            if retry_after:
+                self.metrics[name]["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+            self.metrics[name]["allowed"] += 1
+
+    def limit(self, *names: str):
+        """Build a dependency that applies the named ROUTE_LIMITS."""
+        unknown = set(names) - set(ROUTE_LIMITS)
+        if unknown:
+            raise ValueError(f"Unknown rate limits: {sorted(unknown)}")
+
+        async def dependency(request: Request) -> None:
+            await self.check(request, names)
+
+        return dependency
+
+    def get_metrics(self) -> dict:
+        return {
+            "backend": self.backend,
+            "buckets": len(self.store) if isinstance(self.store, MemoryBuckets) else None,
+            "limits": {
+                name: {
+                    "per_minute": limit.per_minute,
+                    "burst": limit.burst,
+                    "key": limit.key,
+                    **self.metrics[name],
+                }
+                for name, limit in ROUTE_LIMITS.items()
+            },
+        }
+
+    async def tick(self) -> None:
+        await self.store.prune()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,121 @@
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Optional, Tuple
+
+from decouple import config
+from tortoise import connections
+
+from models.requests.periodic import PeriodicTask
+
+REVOCATION_REFRESH_SECONDS = config("REVOCATION_REFRESH_SECONDS", default=5, cast=float)
+REVOCATION_BATCH_SIZE = 10000
+# Serial ids are handed out before commit, so a row with a lower id can
+# become visible after a higher one was read. Each refresh re-reads the ids
+# seen in this many seconds; longer transactions than that would be missed.
+REVOCATION_RESCAN_SECONDS = config("REVOCATION_RESCAN_SECONDS", default=60, cast=float)
+
+# revokedtoken.id only grows, so it doubles as the change feed cursor
+CHANGES_SQL = (
+    'SELECT "id", "jti", "expires_at" FROM "revokedtoken" '
+    'WHERE "id" > $1 AND "expires_at" > $2 ORDER BY "id" LIMIT $3'
+)
+
+
+class RevocationList(PeriodicTask):
+    """Per-worker copy of the revoked JWT ids.
+
+    ``is_revoked`` is a dict lookup with no I/O. A background task pulls
+    rows added since the last seen id every ``interval`` seconds, so a
+    revocation made on any worker applies everywhere within that interval;
+    the worker that revokes a token adds it locally right away. Rows read in
+    the last ``rescan`` seconds are read again, so one that committed out of
+    id order is still picked up. Entries are dropped once the token would
+    have expired anyway.
+    """
+
+    description = "refresh token revocations"
+    run_first = True
+
+    def __init__(
+        self,
+        interval: float = REVOCATION_REFRESH_SECONDS,
+        rescan: float = REVOCATION_RESCAN_SECONDS,
+    ):
+        super().__init__(interval)
+        self.rescan = rescan
+        self.last_id = 0
+        # (monotonic time, last_id) after each refresh within the rescan window
+        self._checkpoints: Deque[Tuple[float, int]] = deque()
+        # jti -> expiry as a unix timestamp
+        self._revoked: Dict[str, float] = {}
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def __contains__(self, jti):
+        return self.is_revoked(jti)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and jti in self._revoked
+
+    def add(self, jti: str, expires_at: float) -> None:
+        self._revoked[jti] = expires_at
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Forget entries whose token has expired.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        now = now or time.time()
+        expired = [jti for jti, exp in self._revoked.items() if exp <= now]
+        for jti in expired:
+            del self._revoked[jti]
+        return len(expired)
+
+    def _rescan_from(self, now: float) -> int:
+        """The last_id of the newest refresh at least ``rescan`` seconds old."""
+        cutoff = now - self.rescan
+        while len(self._checkpoints) > 1 and self._checkpoints[1][0] <= cutoff:
+            self._checkpoints.popleft()
+        if self._checkpoints and self._checkpoints[0][0] <= cutoff:
+            return self._checkpoints[0][1]
+        # Until the first refresh is that old, anything may still commit
+        return 0
+
+    async def refresh(self) -> int:
+        """Load revocations added since the last refresh.
+
+        Ids seen within the last ``rescan`` seconds are read again and
+        deduplicated, to catch rows that committed out of id order.
+
+        Returns:
+            int: The number of new entries.
+        """
+        connection = connections.get("default")
+        now = datetime.now(timezone.utc)
+        started = time.monotonic()
+        cursor = self._rescan_from(started)
+        loaded = 0
+        while True:
+            _, rows = await connection.execute_query(
+                CHANGES_SQL, [cursor, now, REVOCATION_BATCH_SIZE]
+            )
+            for row in rows:
+                if row["jti"] not in self._revoked:
+                    loaded += 1
+                self.add(row["jti"], row["expires_at"].timestamp())
+                cursor = max(cursor, row["id"])
+                self.last_id = max(self.last_id, row["id"])
+            if len(rows) < REVOCATION_BATCH_SIZE:
+                break
+        self._checkpoints.append((started, self.last_id))
+        return loaded
+
+    async def tick(self) -> None:
+        await self.refresh()
+        self.prune()
+
+
+revocation_list = RevocationList()
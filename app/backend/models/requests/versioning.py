@@ -0,0 +1,70 @@
+from typing import Optional
+
+from fastapi import HTTPException, Response, status
+
+
+class VersionConflictError(Exception):
+    """The row exists but no longer has the version the client edited."""
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """Read the expected row version from an ``If-Match`` header.
+
+    Accepts ``"3"``, ``W/"3"`` and a bare ``3``. ``*`` matches any version.
+
+    Raises:
+        HTTPException: If the header is not a single version.
+
+    Returns:
+        Optional[int]: The version, or None if any version may be replaced.
+    """
+    if if_match is None:
+        return None
+    value = if_match.strip()
+    if value in ("", "*"):
+        return None
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value.isdigit():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="If-Match must be a single row version",
+        )
+    return int(value)
+
+
+def expected_version(if_match: Optional[str], body_version: Optional[int]) -> Optional[int]:
+    """Combine the ``If-Match`` header with a ``version`` in the request body.
+
+    Raises:
+        HTTPException: If both are given and disagree.
+
+    Returns:
+        Optional[int]: The version the update must match, or None for an
+            unconditional update.
+    """
+    header_version = parse_if_match(if_match)
+    if header_version is not None and body_version is not None and header_version != body_version:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="If-Match and the version in the body do not match",
+        )
+    return header_version if header_version is not None else body_version
+
+
+def version_conflict(e: VersionConflictError) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=str(e))
+
+
+def set_etag(response: Optional[Response], row) -> None:
+    """Send the version of a row as its ETag, for the next ``If-Match``.
+
+    ``row`` may be a model, a schema or a dict, e.g. a replayed idempotent
+    response. Nothing is sent if it has no version.
+    """
+    if response is None:
+        return
+    version = row.get("version") if isinstance(row, dict) else getattr(row, "version", None)
+    if isinstance(version, int):
+        response.headers["ETag"] = f'"{version}"'
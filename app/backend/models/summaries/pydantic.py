@@ -0,0 +1,98 @@
+from datetime import date, datetime
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class TimeBucket(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+class RequestGroupBy(str, Enum):
+    NONE = "none"
+    PRODUCT = "product"
+    REQUESTOR = "requestor"
+
+
+class LeadTimeGroupBy(str, Enum):
+    NONE = "none"
+    PRODUCT = "product"
+    FULFILLER = "fulfiller"
+
+
+class ForecastMethod(str, Enum):
+    EXPONENTIAL_SMOOTHING = "EXPONENTIAL_SMOOTHING(指数平滑)"
+    CROSTON = "CROSTON(间歇需求)"
+    NO_DEMAND = "NO_DEMAND(无需求)"
+
+
+class RequestVolumePointSchema(BaseModel):
+    bucket: date = Field(..., description="时间段起始日 (周从周一开始)")
+    key: Optional[str] = Field(None, description="产品号或需求人, 不分组时为空")
+    total: int = Field(..., description="需求数")
+    urgent: int = Field(..., description="紧急需求数")
+    pending: int = Field(..., description="待审批数")
+    approved: int = Field(..., description="已批准数")
+    rejected: int = Field(..., description="已拒绝数")
+    fulfilled: int = Field(..., description="已完成数")
+    units: int = Field(..., description="需求单位合计")
+    urgent_ratio: Optional[float] = Field(None, description="紧急需求占比")
+    approval_rate: Optional[float] = Field(
+        None, description="批准率, 已批准和已完成占已审批的比例"
+    )
+    rejection_rate: Optional[float] = Field(None, description="拒绝率")
+    previous_total: Optional[int] = Field(None, description="上一时间段需求数")
+    moving_average: float = Field(..., description="含本时间段在内最近四段的平均需求数")
+
+
+class RequestVolumeSeriesSchema(BaseModel):
+    bucket: TimeBucket
+    group_by: RequestGroupBy
+    start: date = Field(..., description="起始日期 (含)")
+    end: date = Field(..., description="结束日期 (含)")
+    points: List[RequestVolumePointSchema]
+
+
+class ProductForecastSchema(BaseModel):
+    productid: str = Field(..., max_length=20, description="产品号")
+    method: ForecastMethod = Field(..., description="预测方法")
+    dailydemand: float = Field(..., description="预测日需求")
+    demandstd: float = Field(..., description="日需求标准差")
+    leadtimedemand: float = Field(..., description="交付周期内预测需求")
+    safetystock: float = Field(..., description="安全库存")
+    reorderpoint: int = Field(..., description="建议再订货点")
+    reorderlevel: Optional[int] = Field(None, description="当前手填再订货点")
+    historydays: int = Field(..., description="历史天数")
+    computedat: datetime = Field(..., description="计算时间")
+
+
+class LeadTimeStatsSchema(BaseModel):
+    count: int = Field(..., description="完成需求数")
+    p50_hours: float = Field(..., description="交付用时中位数 (小时)")
+    p90_hours: float = Field(..., description="交付用时90分位 (小时)")
+    p95_hours: float = Field(..., description="交付用时95分位 (小时)")
+    mean_hours: float = Field(..., description="平均交付用时 (小时)")
+    late: int = Field(..., description="超过产品交付周期的需求数")
+    urgent: int = Field(..., description="紧急需求数")
+    urgent_breached: int = Field(..., description="超过紧急时限的紧急需求数")
+
+
+class LeadTimeGroupSchema(LeadTimeStatsSchema):
+    key: Optional[str] = Field(None, description="产品号或完成者, 不分组时为空")
+
+
+class LeadTimeTrendPointSchema(LeadTimeStatsSchema):
+    bucket: date = Field(..., description="完成时间段起始日 (周从周一开始)")
+
+
+class LeadTimeSummarySchema(BaseModel):
+    group_by: LeadTimeGroupBy
+    bucket: TimeBucket
+    start: date = Field(..., description="起始完成日期 (含)")
+    end: date = Field(..., description="结束完成日期 (含)")
+    urgent_sla_hours: float = Field(..., description="紧急需求时限 (小时)")
+    groups: List[LeadTimeGroupSchema]
+    trend: List[LeadTimeTrendPointSchema]
@@ -0,0 +1,68 @@
+from tortoise import fields, models
+
+
+class RequestDailyRollup(models.Model):
+    """Request counts of one product and requestor on one UTC day.
+
+    Rebuilt a day at a time from requestdetails by the rollup refresher.
+    """
+
+    day = fields.DateField(description="需求日期 (UTC)")
+    requestproductid = fields.CharField(max_length=20, description="需求产品号")
+    requestorname = fields.CharField(max_length=100, description="需求人姓名")
+    total = fields.IntField(description="需求数")
+    urgent = fields.IntField(description="紧急需求数")
+    pending = fields.IntField(description="待审批数")
+    approved = fields.IntField(description="已批准数")
+    rejected = fields.IntField(description="已拒绝数")
+    fulfilled = fields.IntField(description="已完成数")
+    units = fields.IntField(description="需求单位合计")
+
+    class Meta:
+        table = "request_daily_rollup"
+        unique_together = (("day", "requestproductid", "requestorname"),)
+        # Per-product and per-requestor series over a date range
+        indexes = (("requestproductid", "day"), ("requestorname", "day"))
+
+
+class RequestRollupDirtyDay(models.Model):
+    """A day whose requests changed since its rollup was last rebuilt."""
+
+    day = fields.DateField(pk=True, description="需求日期 (UTC)")
+
+    class Meta:
+        table = "request_rollup_dirty"
+
+
+class ProductForecast(models.Model):
+    """The latest demand forecast and suggested reorder point of a product."""
+
+    productid = fields.CharField(max_length=20, pk=True, description="产品号")
+    method = fields.CharField(max_length=40, description="预测方法")
+    dailydemand = fields.FloatField(description="预测日需求")
+    demandstd = fields.FloatField(description="日需求标准差")
+    leadtimedemand = fields.FloatField(description="交付周期内预测需求")
+    safetystock = fields.FloatField(description="安全库存")
+    reorderpoint = fields.IntField(description="建议再订货点")
+    historydays = fields.IntField(description="历史天数")
+    computedat = fields.DatetimeField(description="计算时间")
+
+    class Meta:
+        table = "product_forecast"
+
+
+class RequestLeadTime(models.Model):
+    """The lead time of one fulfilled request, kept by the request writes."""
+
+    requestid = fields.CharField(max_length=32, pk=True, description="需求号")
+    productid = fields.CharField(max_length=20, description="需求产品号")
+    fullfillername = fields.CharField(max_length=100, null=True, description="完成者姓名")
+    is_urgent = fields.BooleanField(description="是否紧急请求")
+    requestdate = fields.DatetimeField(description="需求日期")
+    fullfilldate = fields.DatetimeField(db_index=True, description="完成日期")
+    hours = fields.FloatField(description="交付用时 (小时)")
+    targetdays = fields.IntField(description="完成时产品的交付周期 (天)")
+
+    class Meta:
+        table = "request_leadtime"
+        indexes = (("productid", "fullfilldate"), ("fullfillername", "fullfilldate"))
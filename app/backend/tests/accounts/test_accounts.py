@@ -5,11 +5,17 @@ from unittest.mock import AsyncMock, MagicMock, patch
 import pytest
 from fastapi import status
 
-from api.accounts.accounts import (HTTPException, create_account,
-                                   get_current_user, login_account,
-                                   reset_password)
+from api.accounts.accounts import (BULK_REGISTER_MAX_ACCOUNTS, HTTPException,
+                                   create_account, create_accounts_bulk,
+                                   create_api_key, list_api_keys,
+                                   revoke_api_key,
+                                   get_current_user, login_account, logout,
+                                   refresh_session, reset_password,
+                                   revoke_current_token, update_user_roles)
 from models.accounts.pydantic import (AccountPayloadSchema,
-                                      AccountResponseSchema, LoginSchema)
+                                      AccountResponseSchema,
+                                      ApiKeyPayloadSchema, LoginSchema,
+                                      RefreshTokenSchema, RolesUpdateSchema)
 
 sys.modules["models.accounts.pydantic"] = types.SimpleNamespace(
     AccountPayloadSchema=AccountPayloadSchema,
@@ -38,9 +44,13 @@ async def test_create_account_success(mock_create_account):
 
 
 @pytest.mark.asyncio
+@patch("api.accounts.accounts.password_rehasher")
+@patch("api.accounts.accounts.crud.create_refresh_token", new_callable=AsyncMock)
 @patch("api.accounts.accounts.crud.get", new_callable=AsyncMock)
 @patch("api.accounts.accounts.auth_handler")
-async def test_login_account_success(mock_auth_handler, mock_crud_get):
+async def test_login_account_success(
+    mock_auth_handler, mock_crud_get, mock_create_refresh_token, mock_rehasher
+):
     payload = MagicMock()
     payload.username = "testuser"
     payload.password = "password"
@@ -51,15 +61,43 @@ async def test_login_account_success(mock_auth_handler, mock_crud_get):
     }
     mock_crud_get.return_value = account
     mock_auth_handler.verify_password.return_value = True
+    mock_auth_handler.needs_rehash.return_value = False
     mock_auth_handler.encode_token.return_value = "token"
+    mock_create_refresh_token.return_value = "refresh"
     with patch("api.accounts.accounts.UsersAccount") as mock_UsersAccount:
         mock_UsersAccount.filter.return_value.update = AsyncMock(return_value=1)
         response = await login_account(payload)
     assert response.status_code == status.HTTP_200_OK
     assert response.body
+    assert b'"refresh_token":"refresh"' in response.body
     mock_crud_get.assert_awaited_once_with(payload.username)
     mock_auth_handler.verify_password.assert_called_once()
     mock_auth_handler.encode_token.assert_called_once()
+    mock_create_refresh_token.assert_awaited_once_with("testuser")
+    mock_rehasher.schedule.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.password_rehasher")
+@patch("api.accounts.accounts.crud.create_refresh_token", new_callable=AsyncMock)
+@patch("api.accounts.accounts.crud.get", new_callable=AsyncMock)
+@patch("api.accounts.accounts.auth_handler")
+async def test_login_schedules_rehash_of_outdated_hash(
+    mock_auth_handler, mock_crud_get, mock_create_refresh_token, mock_rehasher
+):
+    payload = MagicMock(username="testuser", password="password")
+    mock_crud_get.return_value = {
+        "username": "testuser",
+        "password": "old-hash",
+        "list_of_roles": ["user"],
+    }
+    mock_auth_handler.verify_password.return_value = True
+    mock_auth_handler.needs_rehash.return_value = True
+    mock_auth_handler.encode_token.return_value = "token"
+    mock_create_refresh_token.return_value = "refresh"
+    response = await login_account(payload)
+    assert response.status_code == status.HTTP_200_OK
+    mock_rehasher.schedule.assert_called_once_with("testuser", "password", "old-hash")
 
 
 @pytest.mark.asyncio
@@ -165,3 +203,192 @@ def test_get_current_user_not_found(mock_auth_handler, mock_crud_get):
     with pytest.raises(HTTPException) as exc:
         asyncio.run(get_current_user(auth_details=auth_details))
     assert exc.value.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.update_roles", new_callable=AsyncMock)
+async def test_update_user_roles_success(mock_update_roles):
+    mock_update_roles.return_value = {
+        "username": "alice",
+        "email": "alice@example.com",
+        "list_of_roles": ["FULFILLER"],
+        "is_verified": False,
+    }
+    payload = RolesUpdateSchema(list_of_roles=["FULFILLER"])
+    response = await update_user_roles(
+        "alice", payload, auth_details={"username": "boss", "list_of_roles": ["ADMIN"]}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert b"FULFILLER" in response.body
+    mock_update_roles.assert_awaited_once_with("alice", payload.list_of_roles)
+
+
+@pytest.mark.asyncio
+async def test_update_user_roles_forbidden():
+    payload = RolesUpdateSchema(list_of_roles=["ADMIN"])
+    with pytest.raises(HTTPException) as exc:
+        await update_user_roles(
+            "alice",
+            payload,
+            auth_details={"username": "alice", "list_of_roles": ["REQUESTOR"]},
+        )
+    assert exc.value.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.update_roles", new_callable=AsyncMock)
+async def test_update_user_roles_not_found(mock_update_roles):
+    mock_update_roles.return_value = None
+    payload = RolesUpdateSchema(list_of_roles=["ADMIN"])
+    with pytest.raises(HTTPException) as exc:
+        await update_user_roles(
+            "nouser", payload, auth_details={"username": "boss", "list_of_roles": ["ADMIN"]}
+        )
+    assert exc.value.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.create_accounts_bulk", new_callable=AsyncMock)
+async def test_create_accounts_bulk_success(mock_bulk):
+    mock_bulk.return_value = [
+        {"index": 0, "username": "alice", "status": "created", "detail": None}
+    ]
+    payload = [MagicMock()]
+    response = await create_accounts_bulk(
+        payload, auth_details={"username": "boss", "list_of_roles": ["ADMIN"]}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert b"created" in response.body
+    mock_bulk.assert_awaited_once_with(payload)
+
+
+@pytest.mark.asyncio
+async def test_create_accounts_bulk_forbidden():
+    with pytest.raises(HTTPException) as exc:
+        await create_accounts_bulk(
+            [MagicMock()],
+            auth_details={"username": "alice", "list_of_roles": ["REQUESTOR"]},
+        )
+    assert exc.value.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.asyncio
+async def test_create_accounts_bulk_too_large():
+    with pytest.raises(HTTPException) as exc:
+        await create_accounts_bulk(
+            [MagicMock()] * (BULK_REGISTER_MAX_ACCOUNTS + 1),
+            auth_details={"username": "boss", "list_of_roles": ["ADMIN"]},
+        )
+    assert exc.value.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.rotate_refresh_token", new_callable=AsyncMock)
+@patch("api.accounts.accounts.auth_handler")
+async def test_refresh_session_success(mock_auth_handler, mock_rotate):
+    mock_rotate.return_value = (
+        {"username": "alice", "list_of_roles": ["REQUESTOR"]},
+        "new-refresh",
+    )
+    mock_auth_handler.encode_token.return_value = "new-token"
+    response = await refresh_session(RefreshTokenSchema(refresh_token="old"))
+    assert response.status_code == status.HTTP_200_OK
+    assert b"new-refresh" in response.body
+    mock_rotate.assert_awaited_once_with("old")
+    mock_auth_handler.encode_token.assert_called_once_with("alice", ["REQUESTOR"])
+    mock_auth_handler.verify_password.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.rotate_refresh_token", new_callable=AsyncMock)
+async def test_refresh_session_invalid(mock_rotate):
+    mock_rotate.return_value = None
+    with pytest.raises(HTTPException) as exc:
+        await refresh_session(RefreshTokenSchema(refresh_token="bad"))
+    assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.revoke_refresh_token", new_callable=AsyncMock)
+async def test_logout(mock_revoke):
+    response = await logout(RefreshTokenSchema(refresh_token="tok"))
+    assert response.status_code == status.HTTP_200_OK
+    mock_revoke.assert_awaited_once_with("tok")
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.revoke_access_token", new_callable=AsyncMock)
+async def test_revoke_current_token(mock_revoke):
+    auth_details = {
+        "username": "alice",
+        "list_of_roles": ["REQUESTOR"],
+        "jti": "abc",
+        "exp": 1700000000,
+    }
+    response = await revoke_current_token(auth_details=auth_details)
+    assert response.status_code == status.HTTP_200_OK
+    mock_revoke.assert_awaited_once_with("abc", "alice", 1700000000)
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.revoke_access_token", new_callable=AsyncMock)
+async def test_revoke_current_token_without_jti(mock_revoke):
+    auth_details = {"username": "alice", "list_of_roles": [], "jti": None, "exp": 1}
+    with pytest.raises(HTTPException) as excinfo:
+        await revoke_current_token(auth_details=auth_details)
+    assert excinfo.value.status_code == status.HTTP_400_BAD_REQUEST
+    mock_revoke.assert_not_awaited()
+
+
+ADMIN = {"username": "admin", "list_of_roles": ["ADMIN"]}
+API_KEY_PAYLOAD = ApiKeyPayloadSchema(
+    name="Bioreactor 3", username="bioreactor3", scopes=["inventory:write"]
+)
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.create_api_key", new_callable=AsyncMock)
+async def test_create_api_key_success(mock_create):
+    mock_create.return_value = ({"prefix": "sct_abcdefgh"}, "sct_secret")
+    result = await create_api_key(API_KEY_PAYLOAD, auth_details=ADMIN)
+    assert result == {"prefix": "sct_abcdefgh", "api_key": "sct_secret"}
+    mock_create.assert_awaited_once_with(API_KEY_PAYLOAD, "admin")
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.create_api_key", new_callable=AsyncMock)
+async def test_create_api_key_forbidden(mock_create):
+    auth_details = {"username": "bob", "list_of_roles": ["PRODUCER"]}
+    with pytest.raises(HTTPException) as excinfo:
+        await create_api_key(API_KEY_PAYLOAD, auth_details=auth_details)
+    assert excinfo.value.status_code == status.HTTP_403_FORBIDDEN
+    mock_create.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.create_api_key", new_callable=AsyncMock)
+async def test_create_api_key_unknown_account(mock_create):
+    mock_create.return_value = None
+    with pytest.raises(HTTPException) as excinfo:
+        await create_api_key(API_KEY_PAYLOAD, auth_details=ADMIN)
+    assert excinfo.value.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.get_api_keys", new_callable=AsyncMock)
+async def test_list_api_keys(mock_get_api_keys):
+    mock_get_api_keys.return_value = [{"prefix": "sct_abcdefgh"}]
+    assert await list_api_keys(auth_details=ADMIN) == [{"prefix": "sct_abcdefgh"}]
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.crud.revoke_api_key", new_callable=AsyncMock)
+async def test_revoke_api_key(mock_revoke):
+    mock_revoke.return_value = True
+    response = await revoke_api_key("sct_abcdefgh", auth_details=ADMIN)
+    assert response.status_code == status.HTTP_200_OK
+
+    mock_revoke.return_value = False
+    with pytest.raises(HTTPException) as excinfo:
+        await revoke_api_key("sct_abcdefgh", auth_details=ADMIN)
+    assert excinfo.value.status_code == status.HTTP_404_NOT_FOUND
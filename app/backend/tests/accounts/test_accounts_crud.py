@@ -19,9 +19,13 @@ crud = importlib.import_module("api.accounts.crud")
 
 
 @pytest.mark.asyncio
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.sync_roles", new_callable=AsyncMock)
 @patch("api.accounts.crud.UsersAccount")
 @patch("api.accounts.crud.auth_handler")
-async def test_create_account_success(mock_auth_handler, mock_UsersAccount):
+async def test_create_account_success(
+    mock_auth_handler, mock_UsersAccount, mock_sync_roles, mock_in_transaction
+):
     # Arrange
     payload = MagicMock()
     payload.username = "TestUser"
@@ -47,6 +51,8 @@ async def test_create_account_success(mock_auth_handler, mock_UsersAccount):
     # Assert
     assert result == payload.username.lower()
     mock_account_instance.save.assert_awaited_once()
+    mock_sync_roles.assert_awaited_once()
+    assert mock_sync_roles.await_args.args[0] == "testuser"
 
 
 @pytest.mark.asyncio
@@ -138,3 +144,441 @@ async def test_get_all(mock_UsersAccount):
 
     result = await crud.get_all()
     assert result == expected_accounts
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UserRole")
+async def test_sync_roles_rewrites_memberships(mock_UserRole):
+    mock_UserRole.filter.return_value.using_db.return_value.delete = AsyncMock()
+    mock_UserRole.bulk_create = AsyncMock()
+    crud._users_by_role_cache["ADMIN"] = (float("inf"), [])
+
+    await crud.sync_roles("alice", ["REQUESTOR", "ADMIN", "ADMIN"])
+
+    mock_UserRole.filter.assert_called_once_with(username="alice")
+    mock_UserRole.bulk_create.assert_awaited_once()
+    assert mock_UserRole.call_count == 2
+    # Still inside the caller's transaction, so the cache is left alone
+    assert "ADMIN" in crud._users_by_role_cache
+    crud.invalidate_role_cache()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UserRole")
+async def test_sync_roles_without_roles(mock_UserRole):
+    mock_UserRole.filter.return_value.using_db.return_value.delete = AsyncMock()
+    mock_UserRole.bulk_create = AsyncMock()
+
+    await crud.sync_roles("alice", [])
+
+    mock_UserRole.bulk_create.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UsersAccount")
+@patch("api.accounts.crud.UserRole")
+async def test_get_users_by_role_is_cached(mock_UserRole, mock_UsersAccount):
+    crud.invalidate_role_cache()
+    mock_UserRole.filter.return_value.values_list = AsyncMock(
+        return_value=["alice", "bob"]
+    )
+    expected = [{"username": "alice"}, {"username": "bob"}]
+    mock_UsersAccount.filter.return_value.values = AsyncMock(return_value=expected)
+
+    assert await crud.get_users_by_role("FULFILLER") == expected
+    assert await crud.get_users_by_role("FULFILLER") == expected
+
+    mock_UserRole.filter.assert_called_once_with(role="FULFILLER")
+    mock_UsersAccount.filter.assert_called_once_with(username__in=["alice", "bob"])
+
+    crud.invalidate_role_cache()
+    await crud.get_users_by_role("FULFILLER")
+    assert mock_UserRole.filter.call_count == 2
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UsersAccount")
+@patch("api.accounts.crud.UserRole")
+async def test_get_users_by_role_returns_a_copy(mock_UserRole, mock_UsersAccount):
+    crud.invalidate_role_cache()
+    mock_UserRole.filter.return_value.values_list = AsyncMock(return_value=["alice"])
+    mock_UsersAccount.filter.return_value.values = AsyncMock(
+        return_value=[{"username": "alice"}]
+    )
+
+    first = await crud.get_users_by_role("FULFILLER")
+    first[0]["username"] = "mallory"
+    first.append({"username": "eve"})
+
+    assert await crud.get_users_by_role("FULFILLER") == [{"username": "alice"}]
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UsersAccount")
+@patch("api.accounts.crud.UserRole")
+async def test_get_users_by_role_racing_a_write_is_not_cached(
+    mock_UserRole, mock_UsersAccount
+):
+    crud.invalidate_role_cache()
+
+    async def read_then_write(*args, **kwargs):
+        # A role change commits while the lookup is in flight
+        crud.invalidate_role_cache()
+        return ["alice"]
+
+    mock_UserRole.filter.return_value.values_list = AsyncMock(side_effect=read_then_write)
+    mock_UsersAccount.filter.return_value.values = AsyncMock(
+        return_value=[{"username": "alice"}]
+    )
+
+    await crud.get_users_by_role("FULFILLER")
+    assert crud._users_by_role_cache == {}
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UsersAccount")
+@patch("api.accounts.crud.UserRole")
+async def test_get_users_by_role_empty(mock_UserRole, mock_UsersAccount):
+    crud.invalidate_role_cache()
+    mock_UserRole.filter.return_value.values_list = AsyncMock(return_value=[])
+
+    assert await crud.get_users_by_role("PRODUCER") == []
+    mock_UsersAccount.filter.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.api_key_handler")
+@patch("api.accounts.crud.get", new_callable=AsyncMock)
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.sync_roles", new_callable=AsyncMock)
+@patch("api.accounts.crud.UsersAccount")
+async def test_update_roles(
+    mock_UsersAccount, mock_sync_roles, mock_in_transaction, mock_get, mock_handler
+):
+    mock_UsersAccount.filter.return_value.using_db.return_value.update = AsyncMock(
+        return_value=1
+    )
+    mock_get.return_value = {"username": "alice", "list_of_roles": ["FULFILLER"]}
+
+    crud._users_by_role_cache["FULFILLER"] = (float("inf"), [])
+    committed = []
+    mock_in_transaction.return_value.__aexit__.side_effect = (
+        lambda *args: committed.append(dict(crud._users_by_role_cache)) or False
+    )
+
+    result = await crud.update_roles("alice", ["FULFILLER"])
+
+    assert result == mock_get.return_value
+    # The cache is dropped only after the transaction exits
+    assert "FULFILLER" in committed[0]
+    assert crud._users_by_role_cache == {}
+    mock_UsersAccount.filter.return_value.using_db.return_value.update.assert_awaited_once_with(
+        list_of_roles=["FULFILLER"]
+    )
+    assert mock_sync_roles.await_args.args[:2] == ("alice", ["FULFILLER"])
+    # API keys of the account pick up the new roles on their next call
+    mock_handler.invalidate_user.assert_called_once_with("alice")
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.sync_roles", new_callable=AsyncMock)
+@patch("api.accounts.crud.UsersAccount")
+async def test_update_roles_not_found(
+    mock_UsersAccount, mock_sync_roles, mock_in_transaction
+):
+    mock_UsersAccount.filter.return_value.using_db.return_value.update = AsyncMock(
+        return_value=0
+    )
+
+    assert await crud.update_roles("nouser", ["ADMIN"]) is None
+    mock_sync_roles.assert_not_awaited()
+
+
+def make_bulk_payload(username, email, roles=None):
+    payload = MagicMock()
+    payload.username = username
+    payload.email = email
+    payload.password = f"{username}-password"
+    payload.list_of_roles = roles or []
+    payload.created_at = None
+    payload.is_verified = False
+    payload.last_login = None
+    return payload
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.get_hash_pool", return_value=None)
+@patch("api.accounts.crud.hash_password", side_effect=lambda p: f"hashed:{p}")
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.UserRole")
+@patch("api.accounts.crud.UsersAccount")
+async def test_create_accounts_bulk(
+    mock_UsersAccount, mock_UserRole, mock_in_transaction, mock_hash, mock_pool
+):
+    payloads = [
+        make_bulk_payload("Alice", "alice@example.com", ["REQUESTOR"]),
+        make_bulk_payload("taken", "taken@example.com"),
+        make_bulk_payload("carol", "used@example.com"),
+        make_bulk_payload("ALICE", "alice2@example.com"),
+        make_bulk_payload("dave", "dave@example.com", ["FULFILLER", "REQUESTOR"]),
+    ]
+    mock_UsersAccount.filter.return_value.values_list = AsyncMock(
+        side_effect=[["taken"], ["used@example.com"]]
+    )
+    connection = MagicMock()
+    connection.execute_query_dict = AsyncMock(
+        return_value=[{"username": "alice"}, {"username": "dave"}]
+    )
+    mock_in_transaction.return_value.__aenter__.return_value = connection
+    mock_in_transaction.return_value.__aexit__.return_value = False
+    mock_UserRole.bulk_create = AsyncMock()
+
+    results = await crud.create_accounts_bulk(payloads)
+
+    assert [r["status"] for r in results] == [
+        "created",
+        "error",
+        "error",
+        "error",
+        "created",
+    ]
+    assert results[1]["detail"] == "Username already exists"
+    assert results[2]["detail"] == "Email already exists"
+    assert results[3]["detail"] == "Duplicate username in batch"
+    # Two set queries for the whole batch
+    assert mock_UsersAccount.filter.call_count == 2
+    assert mock_hash.call_count == 2
+    sql, params = connection.execute_query_dict.await_args.args
+    assert "ON CONFLICT" in sql and "RETURNING" in sql
+    assert params[0] == ["alice", "dave"]
+    assert params[2] == ["hashed:Alice-password", "hashed:dave-password"]
+    assert params[3] == ['["REQUESTOR"]', '["FULFILLER", "REQUESTOR"]']
+    assert all(when.tzinfo for when in params[4])
+    assert len(mock_UserRole.bulk_create.await_args.args[0]) == 3
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.get_hash_pool", return_value=None)
+@patch("api.accounts.crud.hash_password", side_effect=lambda p: f"hashed:{p}")
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.UserRole")
+@patch("api.accounts.crud.UsersAccount")
+async def test_create_accounts_bulk_reports_rows_lost_to_a_race(
+    mock_UsersAccount, mock_UserRole, mock_in_transaction, mock_hash, mock_pool
+):
+    mock_UsersAccount.filter.return_value.values_list = AsyncMock(
+        side_effect=[[], []]
+    )
+    connection = MagicMock()
+    # bob was registered by someone else between the checks and the insert
+    connection.execute_query_dict = AsyncMock(return_value=[{"username": "alice"}])
+    mock_in_transaction.return_value.__aenter__.return_value = connection
+    mock_in_transaction.return_value.__aexit__.return_value = False
+    mock_UserRole.bulk_create = AsyncMock()
+
+    results = await crud.create_accounts_bulk(
+        [
+            make_bulk_payload("alice", "alice@example.com", ["REQUESTOR"]),
+            make_bulk_payload("bob", "bob@example.com", ["ADMIN"]),
+        ]
+    )
+
+    assert [(r["status"], r["detail"]) for r in results] == [
+        ("created", None),
+        ("error", "Username or email already exists"),
+    ]
+    roles = mock_UserRole.bulk_create.await_args.args[0]
+    assert len(roles) == 1
+    mock_UserRole.assert_called_once_with(username="alice", role="REQUESTOR")
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.get_hash_pool")
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.UsersAccount")
+async def test_create_accounts_bulk_nothing_valid(
+    mock_UsersAccount, mock_in_transaction, mock_pool
+):
+    mock_UsersAccount.filter.return_value.values_list = AsyncMock(
+        side_effect=[["taken"], []]
+    )
+
+    results = await crud.create_accounts_bulk(
+        [make_bulk_payload("taken", "taken@example.com")]
+    )
+
+    assert results[0]["status"] == "error"
+    mock_pool.assert_not_called()
+    mock_in_transaction.assert_not_called()
+
+
+def test_hash_password_in_worker_process():
+    assert crud.get_hash_pool() is None
+    crud.start_hash_pool()
+    hashed = crud.get_hash_pool().submit(crud.hash_password, "password123").result()
+    crud.shutdown_hash_pool()
+    assert crud.get_hash_pool() is None
+    assert crud.AuthHandler.pwd_context.verify("password123", hashed)
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.auth_handler")
+@patch("api.accounts.crud.RefreshToken")
+async def test_create_refresh_token_stores_hash_only(mock_RefreshToken, mock_auth):
+    mock_auth.generate_refresh_token.return_value = ("plain", "digest")
+    mock_RefreshToken.create = AsyncMock()
+
+    assert await crud.create_refresh_token("alice") == "plain"
+    kwargs = mock_RefreshToken.create.await_args.kwargs
+    assert kwargs["token_hash"] == "digest"
+    assert kwargs["username"] == "alice"
+    assert "plain" not in kwargs.values()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.UsersAccount")
+@patch("api.accounts.crud.RefreshToken")
+async def test_rotate_refresh_token(
+    mock_RefreshToken, mock_UsersAccount, mock_in_transaction
+):
+    stored = MagicMock(username="alice", revoked_at=None)
+    queryset = mock_RefreshToken.filter.return_value.using_db.return_value
+    queryset.first = AsyncMock(return_value=stored)
+    queryset.update = AsyncMock(return_value=1)
+    mock_RefreshToken.create = AsyncMock()
+    account = {"username": "alice", "list_of_roles": ["REQUESTOR"]}
+    mock_UsersAccount.filter.return_value.using_db.return_value.first.return_value.values = AsyncMock(
+        return_value=account
+    )
+
+    result = await crud.rotate_refresh_token("old-token")
+
+    assert result[0] == account
+    assert isinstance(result[1], str) and result[1] != "old-token"
+    queryset.update.assert_awaited_once()
+    new_hash = mock_RefreshToken.create.await_args.kwargs["token_hash"]
+    assert new_hash == crud.auth_handler.hash_refresh_token(result[1])
+    assert queryset.update.await_args.kwargs["replaced_by"] == new_hash
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.RefreshToken")
+async def test_rotate_unknown_refresh_token(mock_RefreshToken, mock_in_transaction):
+    queryset = mock_RefreshToken.filter.return_value.using_db.return_value
+    queryset.first = AsyncMock(return_value=None)
+    queryset.update = AsyncMock()
+
+    assert await crud.rotate_refresh_token("unknown") is None
+    queryset.update.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.revoke_user_refresh_tokens", new_callable=AsyncMock)
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.RefreshToken")
+async def test_rotate_reused_refresh_token_revokes_all(
+    mock_RefreshToken, mock_in_transaction, mock_revoke_all
+):
+    stored = MagicMock(username="alice", revoked_at="2025-01-01T00:00:00")
+    queryset = mock_RefreshToken.filter.return_value.using_db.return_value
+    queryset.first = AsyncMock(return_value=stored)
+    queryset.update = AsyncMock()
+
+    assert await crud.rotate_refresh_token("stolen") is None
+    mock_revoke_all.assert_awaited_once()
+    assert mock_revoke_all.await_args.args[0] == "alice"
+    queryset.update.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.in_transaction")
+@patch("api.accounts.crud.RefreshToken")
+async def test_rotate_expired_refresh_token(mock_RefreshToken, mock_in_transaction):
+    queryset = mock_RefreshToken.filter.return_value.using_db.return_value
+    queryset.first = AsyncMock(return_value=MagicMock(username="a", revoked_at=None))
+    queryset.update = AsyncMock(return_value=0)
+    mock_RefreshToken.create = AsyncMock()
+
+    assert await crud.rotate_refresh_token("expired") is None
+    mock_RefreshToken.create.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.RefreshToken")
+async def test_revoke_refresh_token(mock_RefreshToken):
+    mock_RefreshToken.filter.return_value.update = AsyncMock(return_value=1)
+    assert await crud.revoke_refresh_token("tok") is True
+    assert (
+        mock_RefreshToken.filter.call_args.kwargs["token_hash"]
+        == crud.auth_handler.hash_refresh_token("tok")
+    )
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.revocation_list")
+@patch("api.accounts.crud.RevokedToken")
+async def test_revoke_access_token(mock_RevokedToken, mock_revocation_list):
+    mock_RevokedToken.get_or_create = AsyncMock(return_value=(MagicMock(), True))
+    assert await crud.revoke_access_token("abc", "alice", 1700000000) is True
+    kwargs = mock_RevokedToken.get_or_create.call_args.kwargs
+    assert kwargs["jti"] == "abc"
+    assert kwargs["defaults"]["expires_at"].timestamp() == 1700000000
+    mock_revocation_list.add.assert_called_once_with("abc", 1700000000)
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.ApiKey")
+@patch("api.accounts.crud.UsersAccount")
+async def test_create_api_key(mock_UsersAccount, mock_ApiKey):
+    mock_UsersAccount.filter.return_value.first.return_value.values = AsyncMock(
+        return_value={"username": "bioreactor3"}
+    )
+    mock_ApiKey.create = AsyncMock(side_effect=lambda **kwargs: MagicMock(**kwargs))
+    payload = MagicMock(
+        username="bioreactor3",
+        scopes=[MagicMock(value="inventory:write")],
+        rate_limit_per_minute=None,
+        expires_at=None,
+    )
+    payload.name = "Bioreactor 3"
+
+    key, api_key = await crud.create_api_key(payload, "admin")
+
+    stored = mock_ApiKey.create.call_args.kwargs
+    assert stored["key_hash"] == crud.api_key_handler.hash_api_key(api_key)
+    assert api_key not in stored.values()
+    assert "list_of_roles" not in stored
+    assert stored["rate_limit_per_minute"] == crud.API_KEY_RATE_LIMIT
+    assert "key_hash" not in key
+    assert key["scopes"] == ["inventory:write"]
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.UsersAccount")
+async def test_create_api_key_unknown_account(mock_UsersAccount):
+    mock_UsersAccount.filter.return_value.first.return_value.values = AsyncMock(
+        return_value=None
+    )
+    assert await crud.create_api_key(MagicMock(username="ghost"), "admin") is None
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.api_key_handler")
+@patch("api.accounts.crud.ApiKey")
+async def test_revoke_api_key(mock_ApiKey, mock_api_key_handler):
+    mock_ApiKey.filter.return_value.first = AsyncMock(
+        return_value=MagicMock(key_hash="h")
+    )
+    mock_ApiKey.filter.return_value.update = AsyncMock(return_value=1)
+    assert await crud.revoke_api_key("sct_abcdefgh") is True
+    mock_api_key_handler.invalidate.assert_called_once_with("h")
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.crud.ApiKey")
+async def test_revoke_unknown_api_key(mock_ApiKey):
+    mock_ApiKey.filter.return_value.first = AsyncMock(return_value=None)
+    assert await crud.revoke_api_key("sct_missing") is False
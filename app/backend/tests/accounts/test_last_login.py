@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from api.accounts.last_login import FLUSH_SQL, LastLoginWriter
+
+
+def test_touch_coalesces_per_user():
+    writer = LastLoginWriter()
+    writer.touch("alice", datetime(2025, 1, 1, 8, 0))
+    writer.touch("alice", datetime(2025, 1, 1, 9, 0))
+    writer.touch("alice", datetime(2025, 1, 1, 7, 0))
+    writer.touch("bob", datetime(2025, 1, 1, 8, 30))
+    assert len(writer) == 2
+    assert writer._pending["alice"] == datetime(2025, 1, 1, 9, 0)
+
+
+def test_restore_keeps_the_latest_login():
+    writer = LastLoginWriter()
+    writer.touch("alice", datetime(2025, 1, 1, 9, 0))
+    writer.restore("alice", datetime(2025, 1, 1, 8, 0))
+    writer.restore("bob", datetime(2025, 1, 1, 8, 0))
+    assert writer._pending == {
+        "alice": datetime(2025, 1, 1, 9, 0),
+        "bob": datetime(2025, 1, 1, 8, 0),
+    }
+
+
+@pytest.mark.asyncio
+async def test_last_logins_are_one_utc_statement(query_log):
+    writer = LastLoginWriter()
+    for hour in range(8, 12):
+        writer.touch("alice", datetime(2025, 1, 1, hour, 0))
+    writer.touch("bob", datetime(2025, 1, 1, 8, 30))
+
+    assert await writer.flush() == 2
+
+    assert query_log.statements == [
+        (
+            FLUSH_SQL,
+            [
+                ["alice", "bob"],
+                [
+                    datetime(2025, 1, 1, 11, 0, tzinfo=timezone.utc),
+                    datetime(2025, 1, 1, 8, 30, tzinfo=timezone.utc),
+                ],
+            ],
+        )
+    ]
+
+
+@pytest.mark.asyncio
+@patch("api.accounts.accounts.password_rehasher", MagicMock())
+@patch("api.accounts.accounts.crud.create_refresh_token", new_callable=AsyncMock)
+@patch("api.accounts.accounts.last_login_writer")
+@patch("api.accounts.accounts.crud.get", new_callable=AsyncMock)
+@patch("api.accounts.accounts.auth_handler")
+async def test_login_defers_last_login(
+    mock_auth_handler, mock_crud_get, mock_writer, mock_create_refresh_token
+):
+    from api.accounts.accounts import login_account
+
+    payload = MagicMock(username="alice", password="password")
+    mock_crud_get.return_value = {
+        "username": "alice",
+        "password": "hashed",
+        "list_of_roles": ["REQUESTOR"],
+    }
+    mock_auth_handler.verify_password.return_value = True
+    mock_auth_handler.encode_token.return_value = "token"
+    mock_create_refresh_token.return_value = "refresh"
+
+    with patch("api.accounts.accounts.UsersAccount") as mock_UsersAccount:
+        response = await login_account(payload)
+
+    assert response.status_code == 200
+    mock_writer.touch.assert_called_once()
+    assert mock_writer.touch.call_args.args[0] == "alice"
+    mock_UsersAccount.filter.assert_not_called()
@@ -0,0 +1,58 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+
+from api.accounts.password_rehash import FLUSH_SQL, PasswordRehasher
+
+
+def make_rehasher(**kwargs):
+    rehasher = PasswordRehasher(**kwargs)
+    rehasher.auth_handler = MagicMock()
+    rehasher.auth_handler.get_password_hash.side_effect = lambda p: f"new:{p}"
+    return rehasher
+
+
+@pytest.mark.asyncio
+async def test_schedule_hashes_in_background():
+    rehasher = make_rehasher()
+    rehasher.schedule("alice", "password", "old")
+    # a second login before the first rehash finished is ignored
+    rehasher.schedule("alice", "password", "old")
+    await asyncio.gather(*rehasher._hash_tasks)
+
+    assert rehasher._pending == {"alice": ("old", "new:password")}
+    rehasher.auth_handler.get_password_hash.assert_called_once_with("password")
+
+
+@pytest.mark.asyncio
+async def test_new_hashes_replace_only_the_verified_hash(query_log):
+    rehasher = make_rehasher()
+    rehasher._pending = {"alice": ("old-a", "new-a"), "bob": ("old-b", "new-b")}
+
+    assert await rehasher.flush() == 2
+
+    assert query_log.statements == [
+        (FLUSH_SQL, [["alice", "bob"], ["old-a", "old-b"], ["new-a", "new-b"]])
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_hash_is_dropped():
+    rehasher = make_rehasher()
+    rehasher.auth_handler.get_password_hash.side_effect = ValueError("bad")
+    rehasher.schedule("alice", "password", "old")
+    await asyncio.gather(*rehasher._hash_tasks)
+    assert len(rehasher) == 0
+    assert not rehasher._hashing
+
+
+@pytest.mark.asyncio
+async def test_stop_waits_for_running_hashes(query_log):
+    rehasher = make_rehasher(interval=3600)
+    rehasher.start()
+    rehasher.schedule("alice", "password", "old")
+    await rehasher.stop()
+
+    assert len(query_log) == 1
+    assert query_log.statements[0][1][2] == ["new:password"]
@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from api.accounts.refresh_tokens import SWEEP_SQL, RefreshTokenSweeper
+
+
+@pytest.mark.asyncio
+async def test_sweep_deletes_expired_tokens(query_log):
+    query_log.returns([{}, {}, {}])
+
+    assert await RefreshTokenSweeper().sweep() == 3
+
+    [(sql, [cutoff])] = query_log.statements
+    assert sql == SWEEP_SQL
+    # Only expiry counts, revoked rows are kept for replay detection
+    assert "revoked_at" not in sql
+    assert abs(datetime.now(timezone.utc) - cutoff) < timedelta(seconds=5)
+
@@ -1,8 +1,10 @@
 import os
 import sys
+from unittest.mock import AsyncMock
 
 import pytest
 from starlette.testclient import TestClient
+from tortoise import connections
 from tortoise.contrib.fastapi import register_tortoise
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
@@ -43,3 +45,46 @@ def test_app_with_db():
         yield test_client
 
     # tear down
+
+
+class QueryLog:
+    """Stands in for the default connection and records raw statements.
+
+    Each statement pops the next entry of ``results`` and returns it, or
+    raises it if the entry is an exception instance. Once ``results`` is
+    exhausted, statements return no rows. ``execute_query`` returns the
+    rows with their count, like the asyncpg client. ``execute_script`` is
+    recorded with params None.
+    """
+
+    def __init__(self):
+        self.results = []
+        self.statements = []
+        self.execute_query_dict = AsyncMock(side_effect=self._execute)
+        self.execute_query = AsyncMock(side_effect=self._execute_query)
+        self.execute_script = AsyncMock(side_effect=self._execute)
+
+    def returns(self, *results):
+        self.results.extend(results)
+        return self
+
+    async def _execute(self, sql, params=None):
+        self.statements.append((sql, params))
+        result = self.results.pop(0) if self.results else []
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def _execute_query(self, sql, params=None):
+        rows = await self._execute(sql, params)
+        return len(rows), rows
+
+    def __len__(self):
+        return len(self.statements)
+
+
+@pytest.fixture
+def query_log(monkeypatch):
+    log = QueryLog()
+    monkeypatch.setattr(connections, "get", lambda alias: log)
+    return log
@@ -0,0 +1,177 @@
+import io
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from tortoise import connections
+
+from api.exports import writer
+from api.exports.writer import DictionaryEncoder, TableExport, select_sql
+from models.exports.pydantic import ExportFormat, ExportTable
+from models.productlog.tortoise import ProductInventory
+
+pa = pytest.importorskip("pyarrow")
+pytest.importorskip("pyarrow.ipc")
+pytest.importorskip("pyarrow.parquet")
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = []
+
+    async def fetch(self, n):
+        self.fetches.append(n)
+        taken, self.rows = self.rows[:n], self.rows[n:]
+        return taken
+
+
+class FakeConnection:
+    """Hands out one server-side cursor over ``rows``."""
+
+    def __init__(self, rows):
+        self.cursor_ = FakeCursor(rows)
+        self.sql = None
+        self.transaction_args = None
+
+    @asynccontextmanager
+    async def acquire_connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def _transaction(self):
+        yield
+
+    def transaction(self, **kwargs):
+        self.transaction_args = kwargs
+        return self._transaction()
+
+    async def cursor(self, sql):
+        self.sql = sql
+        return self.cursor_
+
+
+def inventory_row(i, status="AVAILABLE(可用)"):
+    return (
+        f"B{i:06d}", "BM-AD", "P001", "BM", "AD", 10 + i, 0,
+        date(2026, 1, 1), None, status, datetime(2026, 1, 1, 8, tzinfo=timezone.utc),
+        "producer", None, None, 290.0, 7.2, None, None, None, True,
+        datetime(2026, 1, 2, tzinfo=timezone.utc), "producer", 1,
+    )
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    def install(rows):
+        con = FakeConnection(rows)
+        monkeypatch.setattr(connections, "get", lambda alias: con)
+        return con
+
+    return install
+
+
+def test_select_sql_lists_every_column_in_schema_order():
+    sql = select_sql(ProductInventory)
+    assert sql.startswith('SELECT "batchid_internal", ')
+    assert sql.endswith(' FROM "product_inventory"')
+    export = TableExport(ExportTable.PRODUCT_INVENTORY)
+    assert sql.count('"') // 2 == len(export.schema()) + 1
+
+
+def test_row_fixture_matches_schema():
+    assert len(inventory_row(0)) == len(TableExport(ExportTable.PRODUCT_INVENTORY).schema())
+
+
+def test_dictionary_encoder_only_appends():
+    encoder = DictionaryEncoder()
+    first = encoder.encode(["b", "a", "b", None])
+    second = encoder.encode(["c", "a"])
+
+    assert first.dictionary.to_pylist() == ["b", "a"]
+    assert first.to_pylist() == ["b", "a", "b", None]
+    # The first batch's dictionary is a prefix of the second's, i.e. a delta
+    assert second.dictionary.to_pylist() == ["b", "a", "c"]
+    assert second.indices.to_pylist() == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_parquet_export_reads_in_batches(fake_db):
+    rows = [inventory_row(i, "AVAILABLE(可用)" if i % 3 else "RESERVED(预留)") for i in range(10)]
+    con = fake_db(rows)
+    export = TableExport(ExportTable.PRODUCT_INVENTORY, ExportFormat.PARQUET, batch_rows=4)
+
+    chunks = [chunk async for chunk in export.chunks()]
+
+    assert con.transaction_args == {"isolation": "repeatable_read", "readonly": True}
+    assert con.sql == select_sql(ProductInventory)
+    assert con.cursor_.fetches == [4, 4, 4, 4]
+    assert export.rows == 10
+    parquet = pa.parquet.ParquetFile(io.BytesIO(b"".join(chunks)))
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert pa.types.is_dictionary(table.schema.field("status").type)
+    assert table.column("batchid_internal").to_pylist() == [r[0] for r in rows]
+    assert table.column("status").to_pylist() == [r[9] for r in rows]
+    assert table.column("productiondate").to_pylist()[0] == date(2026, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_arrow_stream_carries_dictionary_deltas(fake_db):
+    rows = [inventory_row(0), inventory_row(1, "RESERVED(预留)"), inventory_row(2, "EXPIRED(过期)")]
+    fake_db(rows)
+    export = TableExport(ExportTable.PRODUCT_INVENTORY, ExportFormat.ARROW, batch_rows=1)
+
+    data = b"".join([chunk async for chunk in export.chunks()])
+
+    batches = list(pa.ipc.open_stream(data))
+    assert [b.num_rows for b in batches] == [1, 1, 1]
+    assert batches[-1].column("status").dictionary.to_pylist() == [
+        "AVAILABLE(可用)", "RESERVED(预留)", "EXPIRED(过期)"
+    ]
+    table = pa.Table.from_batches(batches)
+    assert table.column("status").to_pylist() == [r[9] for r in rows]
+
+
+@pytest.mark.asyncio
+async def test_empty_table_exports_schema_only(fake_db):
+    fake_db([])
+    export = TableExport(ExportTable.PRODUCT_INVENTORY, ExportFormat.PARQUET)
+
+    data = b"".join([chunk async for chunk in export.chunks()])
+
+    table = pa.parquet.read_table(io.BytesIO(data))
+    assert table.num_rows == 0
+    assert table.schema.names == export.schema().names
+
+
+@pytest.mark.asyncio
+async def test_to_file_replaces_the_partial_file(fake_db, tmp_path):
+    fake_db([inventory_row(i) for i in range(5)])
+    export = TableExport(ExportTable.PRODUCT_INVENTORY, ExportFormat.PARQUET, batch_rows=2)
+
+    result = await export.to_file(str(tmp_path))
+
+    assert result.rows == 5
+    assert [p.name for p in tmp_path.iterdir()] == [export.filename]
+    assert result.bytes == (tmp_path / export.filename).stat().st_size
+    assert pa.parquet.read_table(result.path).num_rows == 5
+
+
+@pytest.mark.asyncio
+async def test_to_file_removes_the_partial_file_on_failure(fake_db, tmp_path):
+    con = fake_db([inventory_row(0)])
+    con.cursor_.fetch = MagicMock(side_effect=RuntimeError("connection lost"))
+    export = TableExport(ExportTable.PRODUCT_INVENTORY)
+
+    with pytest.raises(RuntimeError):
+        await export.to_file(str(tmp_path))
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_every_table_has_a_schema():
+    for table in ExportTable:
+        schema = TableExport(table).schema()
+        for column in writer.SPECS[table].dictionary:
+            assert pa.types.is_dictionary(schema.field(column).type)
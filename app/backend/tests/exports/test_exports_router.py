@@ -0,0 +1,90 @@
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.exports.exports import auth_handler, router
+from models.exports.pydantic import ExportResultSchema
+
+app = FastAPI()
+app.include_router(router, prefix="/exports")
+client = TestClient(app)
+
+ADMIN = {"username": "admin", "list_of_roles": ["ADMIN"]}
+REQUESTOR = {"username": "alice", "list_of_roles": ["REQUESTOR"]}
+
+
+@pytest.fixture
+def as_user():
+    def login(auth_details):
+        app.dependency_overrides[auth_handler.auth_wrapper] = lambda: auth_details
+
+    yield login
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("method", ["get", "post"])
+def test_export_requires_admin_or_production_manager(as_user, method):
+    as_user(REQUESTOR)
+
+    response = getattr(client, method)("/exports/product_inventory")
+
+    assert response.status_code == 403
+    assert "permission" in response.json()["detail"]
+
+
+def test_unknown_table_is_rejected(as_user):
+    as_user(ADMIN)
+
+    response = client.get("/exports/usersaccount")
+
+    assert response.status_code == 422
+
+
+def test_stream_export_sends_an_attachment(as_user):
+    as_user(ADMIN)
+
+    async def chunks(self):
+        yield b"PAR1"
+        yield b"PAR1"
+
+    with patch("api.exports.exports.TableExport.chunks", chunks):
+        response = client.get("/exports/product_details?format=arrow")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    disposition = response.headers["content-disposition"]
+    assert disposition.startswith('attachment; filename="product_details-')
+    assert disposition.endswith('.arrows"')
+    assert response.content == b"PAR1PAR1"
+
+
+def test_write_export_returns_where_it_was_written(as_user):
+    as_user(ADMIN)
+    result = ExportResultSchema(
+        table="request_details", format="parquet", path="/mnt/data/x.parquet", rows=3, bytes=10
+    )
+
+    with patch(
+        "api.exports.exports.TableExport.to_file", new_callable=AsyncMock, return_value=result
+    ) as to_file:
+        response = client.post("/exports/request_details")
+
+    assert response.status_code == 200
+    assert response.json()["rows"] == 3
+    to_file.assert_awaited_once_with("/mnt/data")
+
+
+def test_write_export_reports_unwritable_directory(as_user):
+    as_user(ADMIN)
+
+    with patch(
+        "api.exports.exports.TableExport.to_file",
+        new_callable=AsyncMock,
+        side_effect=PermissionError("read-only file system"),
+    ):
+        response = client.post("/exports/product_inventory")
+
+    assert response.status_code == 500
+    assert "read-only" in response.json()["detail"]
@@ -0,0 +1,189 @@
+import importlib.util
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+from tortoise import Tortoise, connections
+
+from models.accounts.tortoise import UsersAccount
+from models.productlog.tortoise import ProductInventory
+from models.productrequests.tortoise import RequestDetails
+
+# These tests need a real Postgres planner, e.g. inside docker compose.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("DATABASE_TEST_URL"),
+    reason="DATABASE_TEST_URL is not set",
+)
+
+MIGRATION = (
+    Path(__file__).resolve().parents[2]
+    / "migrations"
+    / "models"
+    / "1_20261019100000_add_hot_lookup_indexes.py"
+)
+
+# The tests run in a throwaway schema, tables other tests use are untouched
+SCHEMA = f"query_plans_{uuid.uuid4().hex[:12]}"
+
+SEED_SQL = """
+INSERT INTO "usersaccount" (username, password, email, created_at, list_of_roles, is_verified)
+SELECT 'user' || i, 'x', 'user' || i || '@example.com', now(), '["REQUESTOR"]', false
+FROM generate_series(1, 50000) AS i;
+INSERT INTO "product_inventory" (
+    batchid_internal, batchid_external, productid, basicmediumid, addictiveid,
+    quantityinstock, productiondate, status, productiondatetime, producedby,
+    to_show, lastupdated, lastupdatedby)
+SELECT 'BM-AD-' || i, 'BM-AD', 'P' || (i % 2000), 'BM', 'AD', 10,
+       current_date, CASE WHEN i % 100 = 0 THEN 'QUARANTINE(隔离)' ELSE 'AVAILABLE(可用)' END,
+       now(), 'tester', i % 10 = 0, now() - (i || ' minutes')::interval, 'tester'
+FROM generate_series(1, 100000) AS i;
+INSERT INTO "requestdetails" (
+    requestid, requestorname, requestdate, requestproductid, requestunit,
+    is_urgent, remarks, status)
+SELECT 'R' || i, 'user' || (i % 5000), now() - (i || ' minutes')::interval,
+       'P' || (i % 2000), 1, false, '',
+       CASE WHEN i % 100 = 0 THEN 'PENDING' ELSE 'FULLFILLED' END
+FROM generate_series(1, 100000) AS i;
+ANALYZE "usersaccount";
+ANALYZE "product_inventory";
+ANALYZE "requestdetails";
+"""
+
+
+@pytest.fixture(scope="module")
+def event_loop():
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def schema_url(db_url: str, schema: str) -> str:
+    return f"{db_url}{'&' if '?' in db_url else '?'}schema={schema}"
+
+
+@pytest.fixture(scope="module")
+async def seeded_db():
+    # Every pooled connection gets search_path set to SCHEMA
+    await Tortoise.init(
+        db_url=schema_url(os.environ.get("DATABASE_TEST_URL"), SCHEMA),
+        modules={
+            "models": [
+                "models.accounts.tortoise",
+                "models.productlog.tortoise",
+                "models.productrequests.tortoise",
+            ]
+        },
+    )
+    conn = connections.get("default")
+    await conn.execute_script(f'CREATE SCHEMA "{SCHEMA}"')
+    await Tortoise.generate_schemas()
+    spec = importlib.util.spec_from_file_location("index_migration", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    await conn.execute_script(await migration.upgrade(conn))
+    await conn.execute_script(SEED_SQL)
+    yield conn
+    await conn.execute_script(f'DROP SCHEMA "{SCHEMA}" CASCADE')
+    await Tortoise.close_connections()
+
+
+async def explain(conn, queryset) -> list:
+    _, rows = await conn.execute_query(f"EXPLAIN (FORMAT JSON) {queryset.sql()}")
+    plan = rows[0]["QUERY PLAN"]
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def plan_nodes(node):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan."""
+    if isinstance(node, list):
+        for item in node:
+            yield from plan_nodes(item)
+    elif isinstance(node, dict):
+        if "Node Type" in node:
+            yield node
+        for key in ("Plan", "Plans"):
+            if key in node:
+                yield from plan_nodes(node[key])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "name, queryset, index",
+    [
+        # api.productlog.crud.get_product_inventory_by_product_id
+        (
+            "inventory_by_product",
+            lambda: ProductInventory.filter(productid="P42"),
+            "idx_product_inv_product_d9c3c7",
+        ),
+        # api.productlog.crud.get_product_inventory_by_id
+        (
+            "inventory_by_batch",
+            lambda: ProductInventory.filter(batchid_internal="BM-AD-42"),
+            "product_inventory_pkey",
+        ),
+        (
+            "inventory_by_status",
+            lambda: ProductInventory.filter(status="QUARANTINE(隔离)"),
+            "idx_product_inv_status_a3bd4d",
+        ),
+        (
+            "inventory_visible_latest",
+            lambda: ProductInventory.filter(to_show=True).limit(50),
+            "idx_product_inv_to_show_lastupd",
+        ),
+        # api.accounts.crud.create_account existence checks and crud.get
+        (
+            "account_by_username",
+            lambda: UsersAccount.filter(username="user42"),
+            "usersaccount_pkey",
+        ),
+        (
+            "account_by_email",
+            lambda: UsersAccount.filter(email="user42@example.com"),
+            "idx_usersaccoun_email_6cd04c",
+        ),
+        # api.productrequests.crud.get_request and per-user/status listings
+        (
+            "request_by_id",
+            lambda: RequestDetails.filter(requestid="R42"),
+            "requestdetails_pkey",
+        ),
+        (
+            "requests_by_requestor",
+            lambda: RequestDetails.filter(requestorname="user42").order_by(
+                "-requestdate"
+            ),
+            "idx_requestdeta_request_b966a3",
+        ),
+        (
+            "requests_by_status",
+            lambda: RequestDetails.filter(status="PENDING").order_by("-requestdate"),
+            "idx_requestdeta_status_3b7cc5",
+        ),
+        (
+            "requests_by_product",
+            lambda: RequestDetails.filter(requestproductid="P42").order_by(
+                "-requestdate"
+            ),
+            "idx_requestdeta_request_d405b7",
+        ),
+        (
+            "requests_latest",
+            lambda: RequestDetails.all().order_by("-requestdate").limit(50),
+            "idx_requestdeta_request_a4b580",
+        ),
+    ],
+)
+async def test_crud_queries_use_an_index(seeded_db, name, queryset, index):
+    plan = await explain(seeded_db, queryset())
+    nodes = list(plan_nodes(plan))
+    used = {node.get("Index Name") for node in nodes}
+    assert index in used, f"{name} does not use {index}: {json.dumps(plan)}"
+    assert all(node["Node Type"] != "Seq Scan" for node in nodes), (
+        f"{name} scans sequentially"
+    )
@@ -0,0 +1,232 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.productlog import coa, crud
+from api.productlog.productlog import inventory_writer, router
+from models.productlog import batchids
+from models.productlog.batchids import BatchIdAllocator, encode_suffix
+from models.productlog.pydantic import ProductInventoryCreateSchema
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+WRITER = {"username": "producer", "list_of_roles": ["PRODUCER"]}
+READER = {"username": "viewer", "list_of_roles": ["VIEWER"]}
+
+ITEM = {
+    "productid": "P1",
+    "basicmediumid": "BM1",
+    "addictiveid": "AD1",
+    "quantityinstock": 10,
+    "productiondate": "2026-10-01",
+    "status": "AVAILABLE(可用)",
+    "productiondatetime": "2026-10-01T08:00:00",
+    "producedby": "producer",
+    "lastupdatedby": "producer",
+    "coa_ph": 7.4,
+}
+
+
+def test_encode_suffix():
+    assert encode_suffix(0) == "000000"
+    assert encode_suffix(35) == "00000Z"
+    assert encode_suffix(36) == "000010"
+    assert encode_suffix(batchids.SUFFIX_COUNT - 1) == "ZZZZZZ"
+
+
+@pytest.mark.asyncio
+async def test_allocate_reserves_a_block_and_hands_it_out(query_log):
+    allocator = BatchIdAllocator(block_size=3)
+    query_log.returns([{"start": 36}])
+
+    first = await allocator.allocate("BM1", "AD1")
+    rest = await allocator.allocate("BM1", "AD1", 2)
+
+    assert first == ["BM1-AD1-000010"]
+    assert rest == ["BM1-AD1-000011", "BM1-AD1-000012"]
+    assert query_log.statements[0] == (batchids.RESERVE_SQL, ["BM1", "AD1", 3])
+    assert query_log.statements[1] == (batchids.TAKEN_SQL, [first + rest])
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_allocate_more_than_a_block_at_once(query_log):
+    allocator = BatchIdAllocator(block_size=2)
+    query_log.returns([{"start": 0}])
+
+    ids = await allocator.allocate("BM1", "AD1", 5)
+
+    assert ids == [f"BM1-AD1-00000{i}" for i in range(5)]
+    assert query_log.statements[0][1] == ["BM1", "AD1", 5]
+
+
+@pytest.mark.asyncio
+async def test_allocate_keeps_prefixes_apart(query_log):
+    allocator = BatchIdAllocator(block_size=2)
+    query_log.returns([{"start": 0}], [], [{"start": 0}])
+
+    await allocator.allocate("BM1", "AD1")
+    await allocator.allocate("BM2", "AD2")
+    await allocator.allocate("BM1", "AD1")
+
+    reserved = [params for sql, params in query_log.statements if sql == batchids.RESERVE_SQL]
+    assert reserved == [["BM1", "AD1", 2], ["BM2", "AD2", 2]]
+
+
+@pytest.mark.asyncio
+async def test_allocate_skips_ids_batches_already_have(query_log):
+    allocator = BatchIdAllocator(block_size=2)
+    query_log.returns(
+        [{"start": 0}],
+        # A random suffix from before the counter
+        [{"batchid_internal": "BM1-AD1-000000"}],
+        [{"start": 2}],
+    )
+
+    ids = await allocator.allocate("BM1", "AD1", 2)
+
+    assert ids == ["BM1-AD1-000001", "BM1-AD1-000002"]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_allocations_never_share_an_id(query_log):
+    allocator = BatchIdAllocator(block_size=4)
+    query_log.returns([{"start": 0}], [], [{"start": 4}])
+
+    results = await asyncio.gather(*(allocator.allocate("BM1", "AD1", 2) for _ in range(4)))
+
+    ids = [batch_id for result in results for batch_id in result]
+    assert len(set(ids)) == 8
+    assert len(query_log) == 4
+
+
+@pytest.mark.asyncio
+async def test_allocate_used_up_prefix(query_log):
+    query_log.returns([{"start": batchids.SUFFIX_COUNT - 1}])
+
+    with pytest.raises(ValueError):
+        await BatchIdAllocator(block_size=2).allocate("BM1", "AD1")
+
+
+def inserted(item, batch_id, status):
+    return {
+        **item.dict(),
+        "batchid_internal": batch_id,
+        "batchid_external": f"{item.basicmediumid}-{item.addictiveid}",
+        "status": status,
+        "lastupdated": "2026-10-01T08:00:00",
+        "version": 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_create_product_inventory_bulk(query_log):
+    # Arrange: the second batch fails the product's pH range
+    items = [
+        ProductInventoryCreateSchema(**ITEM),
+        ProductInventoryCreateSchema(**{**ITEM, "coa_ph": 8.2}),
+        ProductInventoryCreateSchema(**{**ITEM, "basicmediumid": "BM2"}),
+    ]
+    query_log.returns(
+        [{"productid": "P1", "shelflifedays": 30}],
+        [{"start": 0}],
+        [],
+        [{"start": 0}],
+        [],
+        [{"productid": "P1", "field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6, "expected": None}],
+        # RETURNING gives no order; the result follows the items
+        [
+            inserted(items[2], "BM2-AD1-000000", "AVAILABLE(可用)"),
+            inserted(items[0], "BM1-AD1-000000", "AVAILABLE(可用)"),
+            inserted(items[1], "BM1-AD1-000001", "QUARANTINE(隔离)"),
+        ],
+    )
+
+    # Act
+    with patch("api.productlog.crud.batch_ids", BatchIdAllocator(block_size=10)):
+        result = await crud.create_product_inventory_bulk(items)
+
+    # Assert
+    assert [row.batchid_internal for row in result] == [
+        "BM1-AD1-000000",
+        "BM1-AD1-000001",
+        "BM2-AD1-000000",
+    ]
+    sql, params = query_log.statements[6]
+    columns = list(crud.BULK_COLUMNS)
+    assert params[columns.index("batchid_internal")] == [row.batchid_internal for row in result]
+    assert params[columns.index("status")] == ["AVAILABLE(可用)", "QUARANTINE(隔离)", "AVAILABLE(可用)"]
+    assert params[columns.index("batchid_external")] == ["BM1-AD1", "BM1-AD1", "BM2-AD1"]
+    assert str(params[columns.index("expirydate")][0]) == "2026-10-31"
+    assert query_log.statements[0] == (crud.PRODUCTS_SHELF_LIFE_SQL, [["P1"]])
+    assert query_log.statements[5] == (coa.PRODUCT_SPECS_SQL, [["P1"]])
+    assert crud.INVENTORY_BULK_ROWS in sql and "VALUES" not in sql
+    assert len(params) == len(crud.BULK_COLUMNS)
+    assert len(query_log) == 7
+
+
+@pytest.mark.asyncio
+async def test_create_product_inventory_bulk_keeps_closed_statuses(query_log):
+    items = [ProductInventoryCreateSchema(**{**ITEM, "coa_ph": 8.2, "status": "EXPIRED(过期)"})]
+    query_log.returns(
+        [{"productid": "P1", "shelflifedays": None}],
+        [{"start": 0}],
+        [],
+        [{"productid": "P1", "field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6, "expected": None}],
+    )
+
+    with patch("api.productlog.crud.batch_ids", BatchIdAllocator()):
+        await crud.create_product_inventory_bulk(items)
+
+    params = query_log.statements[-1][1]
+    columns = list(crud.BULK_COLUMNS)
+    assert params[columns.index("status")] == ["EXPIRED(过期)"]
+    assert params[columns.index("expirydate")] == [None]
+
+
+@pytest.mark.asyncio
+async def test_create_product_inventory_bulk_unknown_product(query_log):
+    items = [ProductInventoryCreateSchema(**ITEM), ProductInventoryCreateSchema(**{**ITEM, "productid": "P404"})]
+    query_log.returns([{"productid": "P1", "shelflifedays": 30}])
+
+    with pytest.raises(ValueError, match="P404"):
+        await crud.create_product_inventory_bulk(items)
+
+    # No IDs are reserved for an import that fails
+    assert len(query_log) == 1
+
+
+@pytest.mark.asyncio
+async def test_failing_batches_without_specifications(query_log):
+    result = await coa.failing_batches([{"productid": "P1", "coa_ph": 1.0}])
+
+    assert result.tolist() == [False]
+
+
+@patch("api.productlog.productlog.create_product_inventory_bulk", new_callable=AsyncMock)
+def test_bulk_endpoint(mock_create):
+    app.dependency_overrides[inventory_writer] = lambda: READER
+    assert client.post("/product-inventory/bulk", json={"items": [ITEM]}).status_code == 403
+    mock_create.assert_not_awaited()
+
+    app.dependency_overrides[inventory_writer] = lambda: WRITER
+    assert client.post("/product-inventory/bulk", json={"items": []}).status_code == 422
+
+    mock_create.return_value = [
+        {**ITEM, "batchid_internal": "BM1-AD1-000000", "batchid_external": "BM1-AD1",
+         "lastupdated": "2026-10-01T08:00:00", "version": 1}
+    ]
+    response = client.post("/product-inventory/bulk", json={"items": [ITEM]})
+
+    assert response.status_code == 200
+    assert response.json()[0]["batchid_internal"] == "BM1-AD1-000000"
+    assert mock_create.await_args.args[0][0].productid == "P1"
+
+    mock_create.side_effect = ValueError("Products with IDs P404 not found in ProductDetails.")
+    assert client.post("/product-inventory/bulk", json={"items": [ITEM]}).status_code == 400
+    app.dependency_overrides.clear()
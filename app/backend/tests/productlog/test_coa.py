@@ -0,0 +1,286 @@
+from datetime import date
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+from api.productlog import coa, crud
+from api.productlog.productlog import auth_handler, router
+from models.productlog.pydantic import (CoaCheckResultSchema, CoaField,
+                                        CoaRuleSchema,
+                                        CoaSpecificationUpdateSchema)
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+MANAGER = {"username": "manager", "list_of_roles": ["PRODUCTION_MANAGER"]}
+PRODUCER = {"username": "producer", "list_of_roles": ["PRODUCER"]}
+
+SPECS = [
+    {"productid": "P2", "field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6, "expected": None},
+    {"productid": "P2", "field": "coa_sterility", "minvalue": None, "maxvalue": None, "expected": True},
+    {"productid": "P1", "field": "coa_osmoticpressure", "minvalue": None, "maxvalue": 320.0, "expected": None},
+    {"productid": "P1", "field": "coa__mycoplasma", "minvalue": None, "maxvalue": None, "expected": False},
+]
+
+
+def chunk(*batches):
+    """A BATCHES_SQL row from (batchid, productid, ph, osmotic, {boolean field: outcome})."""
+    row = {
+        "count": len(batches),
+        "last": max(batch[0] for batch in batches),
+        "batchid_internal": [batch[0] for batch in batches],
+        "productiondate": [date(2026, 10, 1)] * len(batches),
+        "productid": [batch[1] for batch in batches],
+        "coa_ph": [batch[2] for batch in batches],
+        "coa_osmoticpressure": [batch[3] for batch in batches],
+    }
+    for field in coa.COA_BOOLEAN_FIELDS:
+        row[field.value] = [batch[4].get(field, -1) for batch in batches]
+    return row
+
+
+def failing(rules, *batches):
+    result = coa.check_chunk(rules, chunk(*batches))
+    return [[field for field, fails in zip(coa.FIELDS, row) if fails] for row in result]
+
+
+def test_compile_rules_fills_missing_bounds():
+    rules = coa.compile_rules(SPECS)
+
+    assert rules.productids.tolist() == ["P1", "P2"]
+    assert rules.lower.tolist() == [[-np.inf, -np.inf], [7.0, -np.inf], [-np.inf, -np.inf]]
+    assert rules.upper.tolist() == [[np.inf, 320.0], [7.6, np.inf], [np.inf, np.inf]]
+    # Columns follow COA_BOOLEAN_FIELDS: clarity, mycoplasma, sterility, filling volume
+    assert rules.expected.tolist() == [[-1, 0, -1, -1], [-1, -1, 1, -1], [-1, -1, -1, -1]]
+
+
+def test_evaluate_ranges_and_outcomes():
+    rules = coa.compile_rules(SPECS)
+
+    result = failing(
+        rules,
+        ("B1", "P2", 7.4, 999.0, {CoaField.STERILITY: 1}),
+        ("B2", "P2", 7.7, None, {CoaField.STERILITY: 0}),
+        # Bounds are inclusive
+        ("B3", "P2", 7.0, None, {}),
+        ("B4", "P1", 1.0, 320.5, {CoaField.MYCOPLASMA: 1}),
+        ("B5", "P1", None, 320.0, {CoaField.MYCOPLASMA: 0}),
+    )
+
+    assert result == [
+        [],
+        [CoaField.PH, CoaField.STERILITY],
+        [],
+        [CoaField.OSMOTIC_PRESSURE, CoaField.MYCOPLASMA],
+        [],
+    ]
+
+
+def test_evaluate_passes_untested_results_and_unknown_products():
+    rules = coa.compile_rules(SPECS)
+
+    result = failing(
+        rules,
+        ("B1", "P2", None, None, {}),
+        ("B2", "P0", 1.0, 999.0, {CoaField.STERILITY: 0}),
+        ("B3", "P9", 14.0, 999.0, {CoaField.MYCOPLASMA: 1}),
+    )
+
+    assert result == [[], [], []]
+
+
+@pytest.mark.asyncio
+async def test_check_inventory_quarantines_failures_per_chunk(query_log):
+    # Arrange
+    query_log.returns(
+        SPECS,
+        [chunk(("B1", "P2", 7.7, None, {}), ("B2", "P2", 7.2, None, {}))],
+        [{"batchid_internal": "B1"}],
+        [chunk(("B3", "P1", None, 330.0, {}))],
+        # Closed since it was read, so not quarantined
+        [],
+    )
+
+    # Act
+    result = await coa.check_inventory(batch_size=2)
+
+    # Assert
+    assert (result.checked, result.failed, result.quarantined) == (3, 2, 1)
+    assert [(f.batchid_internal, f.fields) for f in result.failures] == [
+        ("B1", [CoaField.PH]),
+        ("B3", [CoaField.OSMOTIC_PRESSURE]),
+    ]
+    assert query_log.statements[0] == (coa.SPECS_SQL, [None])
+    sql, [last, products, statuses, limit] = query_log.statements[1]
+    assert (sql, last, products, limit) == (coa.BATCHES_SQL, "", ["P1", "P2"], 2)
+    assert "QUARANTINE(隔离)" in statuses and "EXPIRED(过期)" in statuses
+    sql, [ids, dates, status, _, by, skipped] = query_log.statements[2]
+    assert sql == coa.QUARANTINE_SQL
+    assert (ids, dates, status, by) == (["B1"], [date(2026, 10, 1)], "QUARANTINE(隔离)", "system")
+    assert query_log.statements[3][1][0] == "B2"
+    assert len(query_log) == 5
+
+
+@pytest.mark.asyncio
+async def test_check_inventory_dry_run_and_failure_limit(query_log):
+    query_log.returns(
+        SPECS,
+        [chunk(("B1", "P2", 8.0, None, {}), ("B2", "P2", 6.0, None, {}))],
+    )
+
+    result = await coa.check_inventory("P2", quarantine=False, max_failures=1)
+
+    assert (result.checked, result.failed, result.quarantined) == (2, 2, 0)
+    assert [f.batchid_internal for f in result.failures] == ["B1"]
+    assert query_log.statements[0] == (coa.SPECS_SQL, ["P2"])
+    assert coa.QUARANTINE_SQL not in [sql for sql, _ in query_log.statements]
+
+
+@pytest.mark.asyncio
+async def test_check_inventory_without_specifications_reads_no_batches(query_log):
+    result = await coa.check_inventory()
+
+    assert result == CoaCheckResultSchema(checked=0, failed=0, quarantined=0, failures=[])
+    assert len(query_log) == 1
+
+
+@pytest.mark.parametrize(
+    "rule",
+    [
+        {"field": "coa_ph"},
+        {"field": "coa_ph", "minvalue": 8, "maxvalue": 7},
+        {"field": "coa_ph", "minvalue": 7, "expected": True},
+        {"field": "coa_sterility"},
+        {"field": "coa_sterility", "expected": True, "maxvalue": 1},
+        {"field": "coa_appearance", "expected": True},
+    ],
+)
+def test_coa_rule_rejects_mismatched_rules(rule):
+    with pytest.raises(ValidationError):
+        CoaRuleSchema(**rule)
+
+
+def test_coa_specification_rejects_duplicate_fields():
+    with pytest.raises(ValidationError):
+        CoaSpecificationUpdateSchema(
+            rules=[{"field": "coa_ph", "minvalue": 7}, {"field": "coa_ph", "maxvalue": 8}]
+        )
+
+
+@pytest.mark.asyncio
+async def test_set_coa_specification_replaces_rules_in_one_statement(query_log):
+    query_log.returns([{"found": 1}])
+    data = CoaSpecificationUpdateSchema(
+        rules=[
+            {"field": "coa_sterility", "expected": True},
+            {"field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6},
+        ]
+    )
+
+    result = await crud.set_coa_specification("P1", data, "manager")
+
+    assert [rule.field for rule in result.rules] == [CoaField.PH, CoaField.STERILITY]
+    sql, params = query_log.statements[0]
+    assert sql == crud.COA_SPEC_REPLACE_SQL
+    assert params[:6] == [
+        "P1",
+        ["coa_ph", "coa_sterility"],
+        [7.0, None],
+        [7.6, None],
+        [None, True],
+        "manager",
+    ]
+    assert len(query_log) == 1
+
+
+@pytest.mark.asyncio
+async def test_set_coa_specification_unknown_product(query_log):
+    query_log.returns([{"found": 0}])
+
+    with pytest.raises(ValueError):
+        await crud.set_coa_specification("P404", CoaSpecificationUpdateSchema(rules=[]), "manager")
+
+
+@pytest.mark.asyncio
+async def test_get_coa_specification_of_product_without_rules(query_log):
+    query_log.returns([], [{"?column?": 1}])
+
+    result = await crud.get_coa_specification("P1")
+
+    assert result.rules == []
+    assert query_log.statements[1] == (crud.PRODUCT_EXISTS_SQL, ["P1"])
+
+
+@pytest.mark.asyncio
+async def test_get_coa_specification_unknown_product(query_log):
+    with pytest.raises(ValueError):
+        await crud.get_coa_specification("P404")
+
+
+@pytest.mark.asyncio
+async def test_delete_product_details_removes_its_specification(query_log):
+    query_log.returns([{"productid": "P1"}])
+
+    await crud.delete_product_details("P1")
+
+    assert 'DELETE FROM "coa_specification"' in query_log.statements[0][0]
+
+
+@patch("api.productlog.productlog.set_coa_specification", new_callable=AsyncMock)
+def test_put_coa_specification(mock_set):
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: MANAGER
+    mock_set.return_value = {
+        "productid": "P1",
+        "rules": [{"field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6}],
+    }
+
+    response = client.put(
+        "/product-details/P1/coa-specification",
+        json={"rules": [{"field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6}]},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["rules"][0]["field"] == "coa_ph"
+    assert mock_set.await_args.args[0] == "P1"
+    assert mock_set.await_args.args[2] == "manager"
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.set_coa_specification", new_callable=AsyncMock)
+def test_put_coa_specification_forbidden_and_not_found(mock_set):
+    body = {"rules": [{"field": "coa_sterility", "expected": True}]}
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: PRODUCER
+    assert client.put("/product-details/P1/coa-specification", json=body).status_code == 403
+    mock_set.assert_not_awaited()
+
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: MANAGER
+    mock_set.side_effect = ValueError("Product with ID P404 not found")
+    assert client.put("/product-details/P404/coa-specification", json=body).status_code == 404
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.get_coa_specification", new_callable=AsyncMock)
+def test_get_coa_specification_not_found(mock_get):
+    mock_get.side_effect = ValueError("Product with ID P404 not found")
+
+    assert client.get("/product-details/P404/coa-specification").status_code == 404
+
+
+@patch("api.productlog.productlog.check_inventory", new_callable=AsyncMock)
+def test_coa_check_endpoint(mock_check):
+    mock_check.return_value = CoaCheckResultSchema(checked=3, failed=1, quarantined=0, failures=[])
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: PRODUCER
+    assert client.post("/product-inventory/coa-check").status_code == 403
+
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: MANAGER
+    response = client.post("/product-inventory/coa-check?productid=P1&dry_run=true")
+
+    assert response.status_code == 200
+    assert response.json()["failed"] == 1
+    mock_check.assert_awaited_once_with("P1", quarantine=False)
+    app.dependency_overrides.clear()
@@ -0,0 +1,121 @@
+from datetime import date, datetime
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.productlog import crud, expiry
+from api.productlog.productlog import router
+from models.productlog.shelflife import parse_shelf_life_days
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+@pytest.mark.parametrize(
+    "text, days",
+    [
+        ("Store at -20°C for 6 months", 180),
+        ("-80℃保存2年", 730),
+        ("2-8°C, 12M", 360),
+        ("4℃ 避光保存 6个月", 180),
+        ("Store at -20 C for 1.5 years", 548),
+        ("Room temperature, 30 days", 30),
+        ("2 weeks at 4°C", 14),
+        # The labelled condition comes first, after thawing is not the shelf life
+        ("-20°C 12 months; 4°C 1 week after thawing", 360),
+        ("Store at -20°C", None),
+        ("2-8 ml aliquots", None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_parse_shelf_life_days(text, days):
+    assert parse_shelf_life_days(text) == days
+
+
+@pytest.mark.asyncio
+async def test_backfill_parses_products_then_fills_batches_in_chunks(query_log):
+    # Arrange
+    query_log.returns(
+        [
+            {"productid": "P1", "storage_temperature_duration": "-20°C 6 months"},
+            {"productid": "P2", "storage_temperature_duration": "Store at -20°C"},
+        ],
+        [],
+        [{"last": "B2", "count": 2, "filled": 2}],
+        [{"last": "B3", "count": 1, "filled": 0}],
+    )
+
+    # Act
+    filled = await expiry.backfill_shelf_life(batch_size=2)
+
+    # Assert
+    assert filled == 2
+    # Products without a duration stay NULL, their batches without an expirydate
+    assert query_log.statements[1] == (expiry.FILL_SHELF_LIFE_SQL, [["P1"], [180]])
+    assert query_log.statements[2:] == [
+        (expiry.BACKFILL_EXPIRY_SQL, ["", 2]),
+        (expiry.BACKFILL_EXPIRY_SQL, ["B2", 2]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_expire_inventory_in_chunks(query_log):
+    # Arrange
+    query_log.returns([{"count": 2}], [{"count": 0}])
+
+    # Act
+    expired = await expiry.expire_inventory(batch_size=2, today=date(2026, 10, 19))
+
+    # Assert
+    assert expired == 2
+    assert len(query_log) == 2
+    sql, [today, statuses, limit, status, _, by] = query_log.statements[0]
+    assert sql == expiry.EXPIRE_SQL
+    assert (today, limit, status, by) == (date(2026, 10, 19), 2, "EXPIRED(过期)", "system")
+    assert "EXPIRED(过期)" in statuses
+    assert "SKIP LOCKED" in sql
+
+
+@pytest.mark.asyncio
+async def test_get_expiring_product_inventory(query_log):
+    await crud.get_expiring_product_inventory(30, "P001", today=date(2026, 10, 19))
+
+    sql, params = query_log.statements[0]
+    assert sql == crud.EXPIRING_SQL
+    assert params[:2] == [date(2026, 10, 19), date(2026, 11, 18)]
+    assert params[3] == "P001"
+
+
+@patch("api.productlog.productlog.get_expiring_product_inventory", new_callable=AsyncMock)
+def test_expiring_endpoint(mock_get):
+    mock_get.return_value = [
+        {
+            "batchid_internal": "BM001-AD001-ABC123",
+            "batchid_external": "BM001-AD001",
+            "productid": "P001",
+            "basicmediumid": "BM001",
+            "addictiveid": "AD001",
+            "quantityinstock": 5,
+            "productiondate": "2026-05-01",
+            "expirydate": "2026-10-28",
+            "status": "AVAILABLE(可用)",
+            "productiondatetime": datetime(2026, 5, 1, 9),
+            "producedby": "bob",
+            "lastupdated": datetime(2026, 5, 1, 9),
+            "lastupdatedby": "bob",
+        }
+    ]
+
+    response = client.get("/product-inventory/expiring?days=14")
+
+    assert response.status_code == 200
+    assert response.json()[0]["expirydate"] == "2026-10-28"
+    mock_get.assert_awaited_once_with(14, None)
+
+
+def test_expiring_endpoint_rejects_negative_days():
+    assert client.get("/product-inventory/expiring?days=-1").status_code == 422
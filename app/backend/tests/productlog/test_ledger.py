@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from api.productlog.ledger import CHECKPOINT_SQL, InventoryCheckpointer
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_lags_behind_now(query_log):
+    query_log.returns([{"productid": "P001"}, {"productid": "P002"}])
+
+    assert await InventoryCheckpointer(lag=300).checkpoint() == 2
+
+    [(sql, [asof, createdat])] = query_log.statements
+    assert sql == CHECKPOINT_SQL
+    # Ledger rows stamped just before now may not have committed yet
+    assert timedelta(seconds=295) < createdat - asof < timedelta(seconds=305)
+    assert abs(datetime.now(timezone.utc) - createdat) < timedelta(seconds=5)
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_at_a_given_time(query_log):
+    query_log.returns([])
+    asof = datetime(2025, 1, 31, 23, 59, tzinfo=timezone.utc)
+
+    assert await InventoryCheckpointer().checkpoint(asof) == 0
+
+    assert query_log.statements[0][1][0] == asof
+
+
+def test_checkpoint_reads_only_rows_since_the_newest_checkpoint():
+    assert '"createdat" > (SELECT "asof" FROM since)' in CHECKPOINT_SQL
+    # Running twice for the same instant is harmless
+    assert 'ON CONFLICT ("productid", "asof") DO NOTHING' in CHECKPOINT_SQL
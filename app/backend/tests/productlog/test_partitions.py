@@ -0,0 +1,80 @@
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from api.productlog import partitions
+
+
+def transaction_on(connection):
+    transaction = MagicMock()
+    transaction.return_value.__aenter__.return_value = connection
+    transaction.return_value.__aexit__.return_value = False
+    return transaction
+
+
+@pytest.mark.parametrize(
+    "day, months, expected",
+    [
+        (date(2026, 10, 19), 0, date(2026, 10, 1)),
+        (date(2026, 10, 19), 3, date(2027, 1, 1)),
+        (date(2026, 1, 31), -1, date(2025, 12, 1)),
+        (date(2026, 10, 19), -24, date(2024, 10, 1)),
+    ],
+)
+def test_month_start(day, months, expected):
+    assert partitions.month_start(day, months) == expected
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_creates_missing_months(query_log):
+    # Arrange
+    query_log.returns(
+        [{"partitioned": True}],
+        [{"name": "product_inventory_p202609"}, {"name": "product_inventory_p202610"},
+         {"name": "product_inventory_default"}],
+        [{"month": date(2019, 5, 1)}],
+    )
+
+    # Act
+    with patch("api.productlog.partitions.in_transaction", transaction_on(query_log)):
+        created = await partitions.ensure_partitions(today=date(2026, 10, 19), ahead=2)
+
+    # Assert
+    # A batch backdated into the default partition gets its month too
+    assert created == [
+        "product_inventory_p201905",
+        "product_inventory_p202611",
+        "product_inventory_p202612",
+    ]
+    scripts = [sql for sql, _ in query_log.statements[3:]]
+    assert len(scripts) == 3
+    assert "FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')" in scripts[-1]
+    assert "DELETE FROM \"product_inventory_default\"" in scripts[0]
+
+
+@pytest.mark.asyncio
+async def test_ensure_partitions_leaves_a_plain_table_alone(query_log):
+    query_log.returns([{"partitioned": False}])
+
+    assert await partitions.ensure_partitions(today=date(2026, 10, 19)) == []
+    assert len(query_log) == 1
+
+
+@pytest.mark.asyncio
+async def test_archive_inventory_in_chunks(query_log):
+    # Arrange
+    query_log.returns([{"count": 2}], [{"count": 1}])
+
+    # Act
+    archived = await partitions.archive_inventory(months=24, batch_size=2, today=date(2026, 10, 19))
+
+    # Assert
+    assert archived == 3
+    sql, [cutoff, statuses, limit, _] = query_log.statements[0]
+    assert sql == partitions.ARCHIVE_SQL
+    assert (cutoff, limit) == (date(2024, 10, 1), 2)
+    assert "OUT_OF_STOCK(缺货)" in statuses
+    # Held stock is never archived, and new columns are archived too
+    assert '"quantityreserved" = 0' in sql
+    assert '"quantityreserved"' in partitions.COLUMNS
@@ -0,0 +1,117 @@
+import asyncio
+import importlib.util
+import os
+import uuid
+from datetime import date, datetime, time, timezone
+from pathlib import Path
+
+import pytest
+from tortoise import Tortoise, connections
+from tortoise.exceptions import IntegrityError
+
+from api.productlog import crud, partitions
+from db import insert_values
+
+# These tests need a real Postgres, e.g. inside docker compose.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("DATABASE_TEST_URL"),
+    reason="DATABASE_TEST_URL is not set",
+)
+
+MIGRATION = (
+    Path(__file__).resolve().parents[2]
+    / "migrations"
+    / "models"
+    / "13_20261019220000_partition_product_inventory.py"
+)
+# The migration rebuilds product_inventory, so it runs in its own schema
+SCHEMA = f"partitions_{uuid.uuid4().hex[:12]}"
+
+INSERT_BATCH_SQL = (
+    'INSERT INTO "product_inventory" (batchid_internal, batchid_external, productid, '
+    "basicmediumid, addictiveid, quantityinstock, productiondate, status, "
+    "productiondatetime, producedby, to_show, lastupdated, lastupdatedby) "
+    "VALUES ($1, 'BM-AD', 'P-PART', 'BM', 'AD', $2, $3, $4, now(), 'tester', true, now(), 'tester')"
+)
+PARTITION_OF_SQL = (
+    'SELECT tableoid::regclass::text AS "partition" FROM "product_inventory" '
+    'WHERE "batchid_internal" = $1'
+)
+
+
+@pytest.fixture(scope="module")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+async def db():
+    db_url = os.environ.get("DATABASE_TEST_URL")
+    await Tortoise.init(
+        db_url=f"{db_url}{'&' if '?' in db_url else '?'}schema={SCHEMA}",
+        modules={"models": ["models.productlog.tortoise"]},
+    )
+    conn = connections.get("default")
+    await conn.execute_script(f'CREATE SCHEMA "{SCHEMA}"')
+    await Tortoise.generate_schemas()
+    spec = importlib.util.spec_from_file_location("partition_migration", MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    await conn.execute_script(await migration.upgrade(conn))
+    yield conn
+    await conn.execute_script(f'DROP SCHEMA "{SCHEMA}" CASCADE')
+    await Tortoise.close_connections()
+
+
+@pytest.mark.asyncio
+async def test_backdated_batch_moves_out_of_the_default_partition(db):
+    await db.execute_query(INSERT_BATCH_SQL, ["OLD-1", 5, date(2001, 3, 9), "AVAILABLE(可用)"])
+    rows = await db.execute_query_dict(PARTITION_OF_SQL, ["OLD-1"])
+    assert rows[0]["partition"].endswith("product_inventory_default")
+
+    created = await partitions.ensure_partitions()
+
+    assert "product_inventory_p200103" in created
+    rows = await db.execute_query_dict(PARTITION_OF_SQL, ["OLD-1"])
+    assert rows[0]["partition"].endswith("product_inventory_p200103")
+    # Running again finds nothing to do
+    assert await partitions.ensure_partitions() == []
+
+
+@pytest.mark.asyncio
+async def test_archived_batch_is_still_read_by_batch_id(db):
+    await db.execute_query(INSERT_BATCH_SQL, ["OLD-2", 0, date(2002, 1, 5), "AVAILABLE(可用)"])
+    await db.execute_query(INSERT_BATCH_SQL, ["OLD-3", 4, date(2002, 1, 5), "AVAILABLE(可用)"])
+
+    archived = await partitions.archive_inventory(months=12, batch_size=1)
+
+    # Only the batch with nothing left was closed
+    assert archived >= 1
+    assert not await db.execute_query_dict(PARTITION_OF_SQL, ["OLD-2"])
+    assert await db.execute_query_dict(PARTITION_OF_SQL, ["OLD-3"])
+    found = await crud.get_product_inventory_by_id("OLD-2")
+    assert (found.batchid_internal, found.quantityinstock) == ("OLD-2", 0)
+
+
+
+def insert_batch_sql(productiondate):
+    columns, placeholders, params = insert_values({
+        "batchid_internal": "DUP-1", "batchid_external": "BM-AD", "productid": "P-PART",
+        "basicmediumid": "BM", "addictiveid": "AD", "quantityinstock": 0,
+        "productiondate": productiondate, "status": "AVAILABLE(可用)",
+        "productiondatetime": datetime.combine(productiondate, time(8), timezone.utc),
+        "producedby": "tester", "lastupdatedby": "tester",
+    })
+    return crud.INVENTORY_INSERT_SQL.format(columns=columns, rows=f"VALUES ({placeholders})"), params
+
+
+@pytest.mark.asyncio
+async def test_batch_id_is_unique_across_partitions(db):
+    await db.execute_query(*insert_batch_sql(date(2004, 2, 1)))
+
+    # The primary key of product_inventory alone would let another month have it
+    with pytest.raises(IntegrityError):
+        await db.execute_query(*insert_batch_sql(date(2004, 5, 1)))
+    assert len(await db.execute_query_dict(PARTITION_OF_SQL, ["DUP-1"])) == 1
@@ -3,147 +3,107 @@ Tests for product inventory validation functionality.
 Tests the validation that ensures inventory items have matching productid in ProductDetails.
 """
 import pytest
-from unittest.mock import AsyncMock, patch
 from datetime import date, datetime
+from unittest.mock import AsyncMock, patch
 
-from api.productlog.crud import create_product_inventory, update_product_inventory
+from api.productlog.crud import (INVENTORY_STATE_SQL, PRODUCT_SHELF_LIFE_SQL,
+                                 create_product_inventory,
+                                 update_product_inventory)
 from models.productlog.pydantic import ProductInventoryCreateSchema, InventoryStatus
 
 
+def make_data(productid):
+    return ProductInventoryCreateSchema(
+        productid=productid,
+        basicmediumid="BM001",
+        addictiveid="AD001",
+        quantityinstock=50,
+        productiondate=date.today(),
+        imageurl="http://example.com/image.jpg",
+        status=InventoryStatus.AVAILABLE,
+        productiondatetime=datetime.now(),
+        producedby="John Doe",
+        lastupdatedby="Jane Doe",
+    )
+
+
+def make_row(data, **changes):
+    return {
+        **data.dict(),
+        "batchid_internal": "BM001-AD001-ABC123",
+        "batchid_external": "BM001-AD001",
+        "lastupdated": datetime.now(),
+        "version": 1,
+        **changes,
+    }
+
+
 class TestProductInventoryValidation:
     """Test validation logic for product inventory."""
 
     @pytest.mark.asyncio
-    @patch("api.productlog.crud.ProductDetails")
-    @patch("api.productlog.crud.ProductInventory")
-    @patch("api.productlog.crud.ProductInventorySchema")
-    async def test_create_inventory_with_valid_productid(self, mock_schema, mock_inventory, mock_details):
+    @patch(
+        "models.productlog.batchids.batch_ids.allocate",
+        new_callable=AsyncMock,
+        return_value=["BM001-AD001-00000A"],
+    )
+    async def test_create_inventory_with_valid_productid(self, mock_allocate, query_log):
         """Test creating inventory with valid productid succeeds."""
         # Arrange
-        mock_product = AsyncMock()
-        mock_details.get_or_none = AsyncMock(return_value=mock_product)
-        
-        mock_created_inventory = AsyncMock()
-        mock_inventory.create = AsyncMock(return_value=mock_created_inventory)
-        
-        mock_schema_result = {"productid": "P001", "basicmediumid": "BM001"}
-        mock_schema.from_tortoise_orm = AsyncMock(return_value=mock_schema_result)
-        
-        data = ProductInventoryCreateSchema(
-            productid="P001",
-            basicmediumid="BM001",
-            addictiveid="AD001",
-            quantityinstock=50,
-            productiondate=date.today(),
-            imageurl="http://example.com/image.jpg",
-            status=InventoryStatus.AVAILABLE,
-            productiondatetime=datetime.now(),
-            producedby="John Doe",
-            lastupdatedby="Jane Doe",
-        )
+        data = make_data("P001")
+        query_log.returns([{"shelflifedays": None}], [], [make_row(data)])
         
         # Act
         result = await create_product_inventory(data)
         
         # Assert
-        assert result == mock_schema_result
-        mock_details.get_or_none.assert_awaited_once_with(productid="P001")
-        mock_inventory.create.assert_awaited_once()
+        assert result.productid == "P001"
+        assert result.basicmediumid == "BM001"
+        assert query_log.statements[0] == (PRODUCT_SHELF_LIFE_SQL, ["P001"])
+        assert 'INSERT INTO "product_inventory"' in query_log.statements[2][0]
 
     @pytest.mark.asyncio
-    @patch("api.productlog.crud.ProductDetails")
-    async def test_create_inventory_with_invalid_productid(self, mock_details):
+    async def test_create_inventory_with_invalid_productid(self, query_log):
         """Test creating inventory with invalid productid fails."""
         # Arrange
-        mock_details.get_or_none = AsyncMock(return_value=None)
-        
-        data = ProductInventoryCreateSchema(
-            productid="INVALID",
-            basicmediumid="BM001",
-            addictiveid="AD001",
-            quantityinstock=50,
-            productiondate=date.today(),
-            imageurl="http://example.com/image.jpg",
-            status=InventoryStatus.AVAILABLE,
-            productiondatetime=datetime.now(),
-            producedby="John Doe",
-            lastupdatedby="Jane Doe",
-        )
+        query_log.returns([])
         
         # Act & Assert
         with pytest.raises(ValueError) as exc_info:
-            await create_product_inventory(data)
+            await create_product_inventory(make_data("INVALID"))
         
         assert "Product with ID INVALID not found in ProductDetails" in str(exc_info.value)
-        mock_details.get_or_none.assert_awaited_once_with(productid="INVALID")
+        # Nothing is inserted for an unknown product
+        assert query_log.statements == [(PRODUCT_SHELF_LIFE_SQL, ["INVALID"])]
 
     @pytest.mark.asyncio
-    @patch("api.productlog.crud.ProductDetails")
-    @patch("api.productlog.crud.ProductInventory")
-    @patch("api.productlog.crud.ProductInventorySchema")
-    async def test_update_inventory_with_valid_productid(self, mock_schema, mock_inventory, mock_details):
+    async def test_update_inventory_with_valid_productid(self, query_log):
         """Test updating inventory with valid productid succeeds."""
         # Arrange
-        mock_existing_inventory = AsyncMock()
-        mock_inventory.get_or_none = AsyncMock(return_value=mock_existing_inventory)
-        
-        mock_product = AsyncMock()
-        mock_details.get_or_none = AsyncMock(return_value=mock_product)
-        
-        mock_schema_result = {"productid": "P002", "basicmediumid": "BM002"}
-        mock_schema.from_tortoise_orm = AsyncMock(return_value=mock_schema_result)
-        
-        data = ProductInventoryCreateSchema(
-            productid="P002",
-            basicmediumid="BM002",
-            addictiveid="AD002",
-            quantityinstock=75,
-            productiondate=date.today(),
-            imageurl="http://example.com/image.jpg",
-            status=InventoryStatus.AVAILABLE,
-            productiondatetime=datetime.now(),
-            producedby="John Doe",
-            lastupdatedby="Jane Doe",
-        )
+        data = make_data("P002")
+        query_log.returns([make_row(data, version=2)])
         
         # Act
         result = await update_product_inventory("BATCH123", data)
         
         # Assert
-        assert result == mock_schema_result
-        mock_inventory.get_or_none.assert_awaited_once_with(batchid_internal="BATCH123")
-        mock_details.get_or_none.assert_awaited_once_with(productid="P002")
-        mock_existing_inventory.update_from_dict.assert_awaited_once()
-        mock_existing_inventory.save.assert_awaited_once()
+        assert result.productid == "P002"
+        sql, params = query_log.statements[0]
+        assert 'EXISTS (SELECT 1 FROM "productdetails" WHERE "productid" = $3)' in sql
+        assert params[:3] == ["BATCH123", None, "P002"]
+        # The product's COA specification is read for the new product
+        assert len(query_log) == 2
 
     @pytest.mark.asyncio
-    @patch("api.productlog.crud.ProductDetails")
-    @patch("api.productlog.crud.ProductInventory")
-    async def test_update_inventory_with_invalid_productid(self, mock_inventory, mock_details):
+    async def test_update_inventory_with_invalid_productid(self, query_log):
         """Test updating inventory with invalid productid fails."""
         # Arrange
-        mock_existing_inventory = AsyncMock()
-        mock_inventory.get_or_none = AsyncMock(return_value=mock_existing_inventory)
-        
-        mock_details.get_or_none = AsyncMock(return_value=None)
-        
-        data = ProductInventoryCreateSchema(
-            productid="INVALID",
-            basicmediumid="BM001",
-            addictiveid="AD001",
-            quantityinstock=50,
-            productiondate=date.today(),
-            imageurl="http://example.com/image.jpg",
-            status=InventoryStatus.AVAILABLE,
-            productiondatetime=datetime.now(),
-            producedby="John Doe",
-            lastupdatedby="Jane Doe",
-        )
+        # The guarded update matches nothing, the state query says why
+        query_log.returns([], [{"version": 1, "quantityreserved": 0, "product_exists": False}])
         
         # Act & Assert
         with pytest.raises(ValueError) as exc_info:
-            await update_product_inventory("BATCH123", data)
+            await update_product_inventory("BATCH123", make_data("INVALID"))
         
         assert "Product with ID INVALID not found in ProductDetails" in str(exc_info.value)
-        mock_inventory.get_or_none.assert_awaited_once_with(batchid_internal="BATCH123")
-        mock_details.get_or_none.assert_awaited_once_with(productid="INVALID")
\ No newline at end of file
+        assert query_log.statements[1] == (INVENTORY_STATE_SQL, ["BATCH123", "INVALID"])
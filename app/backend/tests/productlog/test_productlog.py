@@ -4,7 +4,14 @@ import pytest
 from fastapi import FastAPI, HTTPException
 from fastapi.testclient import TestClient
 
-from api.productlog.productlog import router, auth_handler
+from api.productlog.crud import InsufficientStockError, NotReservableError
+from api.productlog.productlog import router, auth_handler, inventory_writer
+from api.realtime.hub import INVENTORY_CHANNEL
+from models.productlog.pydantic import (AvailableToPromiseSchema,
+                                        ProductInventorySchema,
+                                        ReservationSchema,
+                                        StockAtSchema)
+from models.requests.versioning import VersionConflictError
 
 app = FastAPI()
 app.include_router(router)
@@ -531,7 +538,7 @@ def test_delete_product_details_general_error(mock_delete):
 def test_create_product_inventory_success_admin(mock_create):
     """Test successful creation of product inventory by admin."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
     mock_create.return_value = SAMPLE_PRODUCT_INVENTORY_RESPONSE
     
     # Act
@@ -552,7 +559,7 @@ def test_create_product_inventory_success_admin(mock_create):
 def test_create_product_inventory_success_producer(mock_create):
     """Test successful creation of product inventory by producer."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS_PRODUCER
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS_PRODUCER
     mock_create.return_value = SAMPLE_PRODUCT_INVENTORY_RESPONSE
     
     # Act
@@ -570,7 +577,7 @@ def test_create_product_inventory_success_producer(mock_create):
 def test_create_product_inventory_unauthorized():
     """Test product inventory creation fails for unauthorized user."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
     
     # Act
     response = client.post("/product-inventory", json=SAMPLE_PRODUCT_INVENTORY)
@@ -616,12 +623,26 @@ def test_get_product_inventory_by_id_not_found(mock_get):
     assert "Product inventory with batch ID NONEXISTENT not found" in data["detail"]
 
 
+@patch("api.productlog.productlog.get_product_inventory_by_id", new_callable=AsyncMock)
+def test_get_product_inventory_by_id_sends_etag(mock_get):
+    """Test the row version comes back as the ETag for a later If-Match."""
+    # Arrange
+    mock_get.return_value = {**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "version": 7}
+    
+    # Act
+    response = client.get("/product-inventory/BATCH123")
+    
+    # Assert
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"7"'
+
+
 # Tests for PUT /product-inventory/{batch_id}
 @patch("api.productlog.productlog.update_product_inventory", new_callable=AsyncMock)
 def test_update_product_inventory_success(mock_update):
     """Test successful update of product inventory."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
     updated_inventory = {**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "quantityinstock": 75}
     mock_update.return_value = updated_inventory
     
@@ -641,7 +662,7 @@ def test_update_product_inventory_success(mock_update):
 def test_update_product_inventory_unauthorized(mock_update):
     """Test product inventory update fails for unauthorized user."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
     
     # Act
     response = client.put("/product-inventory/BATCH123", json=SAMPLE_PRODUCT_INVENTORY)
@@ -659,7 +680,7 @@ def test_update_product_inventory_unauthorized(mock_update):
 def test_update_product_inventory_not_found(mock_update):
     """Test product inventory update when not found."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
     mock_update.side_effect = ValueError("Product inventory with batch ID NONEXISTENT not found")
     
     # Act
@@ -674,12 +695,284 @@ def test_update_product_inventory_not_found(mock_update):
     app.dependency_overrides.clear()
 
 
+@patch("api.productlog.productlog.update_product_inventory", new_callable=AsyncMock)
+def test_update_product_inventory_if_match(mock_update):
+    """Test If-Match is passed on as the expected version."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_update.return_value = {**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "version": 4}
+    
+    # Act
+    response = client.put(
+        "/product-inventory/BATCH123", json=SAMPLE_PRODUCT_INVENTORY, headers={"If-Match": 'W/"3"'}
+    )
+    
+    # Assert
+    assert response.status_code == 200
+    assert response.json()["version"] == 4
+    assert response.headers["ETag"] == '"4"'
+    assert mock_update.await_args.args[2] == 3
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.update_product_inventory", new_callable=AsyncMock)
+def test_update_product_inventory_version_conflict(mock_update):
+    """Test a stale version is rejected with 412."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_update.side_effect = VersionConflictError("Product inventory BATCH123 was modified")
+    
+    # Act
+    response = client.put("/product-inventory/BATCH123", json={**SAMPLE_PRODUCT_INVENTORY, "version": 3})
+    
+    # Assert
+    assert response.status_code == 412
+    assert mock_update.await_args.args[2] == 3
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.update_product_inventory", new_callable=AsyncMock)
+def test_update_product_inventory_below_reserved(mock_update):
+    """Test a quantity below the reserved stock is rejected with 409."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_update.side_effect = InsufficientStockError("Batch BATCH123 has 80 reserved")
+    
+    # Act
+    response = client.put("/product-inventory/BATCH123", json=SAMPLE_PRODUCT_INVENTORY)
+    
+    # Assert
+    assert response.status_code == 409
+    assert "80 reserved" in response.json()["detail"]
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.update_product_inventory", new_callable=AsyncMock)
+def test_update_product_inventory_if_match_disagrees_with_body(mock_update):
+    """Test a body version that contradicts If-Match is rejected."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    
+    # Act
+    response = client.put(
+        "/product-inventory/BATCH123",
+        json={**SAMPLE_PRODUCT_INVENTORY, "version": 2},
+        headers={"If-Match": '"3"'},
+    )
+    
+    # Assert
+    assert response.status_code == 400
+    mock_update.assert_not_awaited()
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+# Tests for POST /product-inventory/{batch_id}/adjust
+@patch("api.productlog.productlog.adjust_product_inventory", new_callable=AsyncMock)
+def test_adjust_product_inventory_success(mock_adjust):
+    """Test a delta is applied and the new stock returned."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_adjust.return_value = ProductInventorySchema(
+        **{**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "batchid_internal": "BATCH123", "quantityinstock": 48, "version": 5}
+    )
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/adjust", json={"delta": -2, "reason": "SHIPMENT(出库)"}
+    )
+    
+    # Assert
+    assert response.status_code == 200
+    assert response.json() == {"batchid_internal": "BATCH123", "quantityinstock": 48, "version": 5}
+    assert response.headers["ETag"] == '"5"'
+    batch_id, adjustment, adjustedby = mock_adjust.await_args.args
+    assert (batch_id, adjustment.delta, adjustedby) == ("BATCH123", -2, "testuser")
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.hub")
+@patch("api.productlog.productlog.adjust_product_inventory", new_callable=AsyncMock)
+def test_adjust_product_inventory_publishes_full_row(mock_adjust, mock_hub):
+    """Test subscribers get the whole adjusted row, like any other update."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    adjusted = ProductInventorySchema(**{**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "quantityinstock": 48, "version": 2})
+    mock_adjust.return_value = adjusted
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/adjust", json={"delta": -2, "reason": "SHIPMENT(出库)"}
+    )
+    
+    # Assert
+    assert response.status_code == 200
+    mock_hub.publish.assert_called_once_with(INVENTORY_CHANNEL, "updated", "BATCH123", adjusted)
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.adjust_product_inventory", new_callable=AsyncMock)
+def test_adjust_product_inventory_rejects_zero_and_unknown_reason(mock_adjust):
+    """Test a zero delta and an unknown reason code are rejected."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    
+    # Act
+    zero = client.post("/product-inventory/BATCH123/adjust", json={"delta": 0, "reason": "SHIPMENT(出库)"})
+    unknown = client.post("/product-inventory/BATCH123/adjust", json={"delta": 1, "reason": "GIFT"})
+    
+    # Assert
+    assert zero.status_code == 422
+    assert unknown.status_code == 422
+    mock_adjust.assert_not_awaited()
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.adjust_product_inventory", new_callable=AsyncMock)
+def test_adjust_product_inventory_insufficient_stock(mock_adjust):
+    """Test an adjustment below zero is rejected with 409."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_adjust.side_effect = InsufficientStockError("Insufficient stock in batch BATCH123")
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/adjust", json={"delta": -100, "reason": "SHIPMENT(出库)"}
+    )
+    
+    # Assert
+    assert response.status_code == 409
+    assert "Insufficient stock" in response.json()["detail"]
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.adjust_product_inventory", new_callable=AsyncMock)
+def test_adjust_product_inventory_not_found(mock_adjust):
+    """Test adjusting a missing batch returns 404."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_adjust.side_effect = ValueError("Product inventory with batch ID NONEXISTENT not found")
+    
+    # Act
+    response = client.post(
+        "/product-inventory/NONEXISTENT/adjust", json={"delta": 1, "reason": "RETURN(退货)"}
+    )
+    
+    # Assert
+    assert response.status_code == 404
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.adjust_product_inventory", new_callable=AsyncMock)
+def test_adjust_product_inventory_unauthorized(mock_adjust):
+    """Test adjusting fails for unauthorized user."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/adjust", json={"delta": 1, "reason": "RETURN(退货)"}
+    )
+    
+    # Assert
+    assert response.status_code == 403
+    mock_adjust.assert_not_awaited()
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+# Tests for POST /product-inventory/adjust
+@patch("api.productlog.productlog.adjust_product_inventory_batch", new_callable=AsyncMock)
+def test_adjust_product_inventory_batch_success(mock_adjust):
+    """Test several adjustments are applied together."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_adjust.return_value = [
+        ProductInventorySchema(**{**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "batchid_internal": "A", "version": 2}),
+        ProductInventorySchema(**{**SAMPLE_PRODUCT_INVENTORY_RESPONSE, "batchid_internal": "B", "version": 9}),
+    ]
+    
+    # Act
+    response = client.post(
+        "/product-inventory/adjust",
+        json={"adjustments": [
+            {"batchid_internal": "A", "delta": -3, "reason": "QC_SAMPLE(质检取样)"},
+            {"batchid_internal": "B", "delta": -1, "reason": "DAMAGE(损坏)", "note": "dropped"},
+        ]},
+    )
+    
+    # Assert
+    assert response.status_code == 200
+    assert [row["batchid_internal"] for row in response.json()] == ["A", "B"]
+    adjustments, adjustedby = mock_adjust.await_args.args
+    assert [a.batchid_internal for a in adjustments] == ["A", "B"]
+    assert adjustedby == "testuser"
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.adjust_product_inventory_batch", new_callable=AsyncMock)
+def test_adjust_product_inventory_batch_empty(mock_adjust):
+    """Test an empty batch is rejected."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    
+    # Act
+    response = client.post("/product-inventory/adjust", json={"adjustments": []})
+    
+    # Assert
+    assert response.status_code == 422
+    mock_adjust.assert_not_awaited()
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.adjust_product_inventory_batch", new_callable=AsyncMock)
+def test_adjust_product_inventory_batch_insufficient_stock(mock_adjust):
+    """Test a batch with one overdrawn row is rejected as a whole."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_adjust.side_effect = InsufficientStockError("Insufficient stock in batch B")
+    
+    # Act
+    response = client.post(
+        "/product-inventory/adjust",
+        json={"adjustments": [{"batchid_internal": "B", "delta": -5, "reason": "SHIPMENT(出库)"}]},
+    )
+    
+    # Assert
+    assert response.status_code == 409
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
 # Tests for DELETE /product-inventory/{batch_id}
 @patch("api.productlog.productlog.delete_product_inventory", new_callable=AsyncMock)
 def test_delete_product_inventory_success(mock_delete):
     """Test successful deletion of product inventory."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
     mock_delete.return_value = {"message": "Product inventory BATCH123 deleted successfully", "batch_id": "BATCH123"}
     
     # Act
@@ -699,7 +992,7 @@ def test_delete_product_inventory_success(mock_delete):
 def test_delete_product_inventory_unauthorized(mock_delete):
     """Test product inventory deletion fails for unauthorized user."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
     
     # Act
     response = client.delete("/product-inventory/BATCH123")
@@ -717,7 +1010,7 @@ def test_delete_product_inventory_unauthorized(mock_delete):
 def test_delete_product_inventory_not_found(mock_delete):
     """Test product inventory deletion when not found."""
     # Arrange
-    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: SAMPLE_AUTH_DETAILS
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
     mock_delete.side_effect = ValueError("Product inventory with batch ID NONEXISTENT not found")
     
     # Act
@@ -783,3 +1076,205 @@ def test_get_product_inventory_by_product_id_empty(mock_get):
     assert isinstance(data, list)
     assert len(data) == 0
     mock_get.assert_awaited_once_with("P002")
+
+
+@patch("api.productlog.productlog.idempotency_store")
+@patch("api.productlog.productlog.create_product_inventory", new_callable=AsyncMock)
+def test_create_product_inventory_passes_idempotency_key(mock_create, mock_store):
+    """The Idempotency-Key header routes creation through the idempotency store."""
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_create.return_value = SAMPLE_PRODUCT_INVENTORY_RESPONSE
+
+    async def run(scope, key, principal, payload, execute):
+        return await execute()
+
+    mock_store.run = AsyncMock(side_effect=run)
+
+    response = client.post(
+        "/product-inventory",
+        json=SAMPLE_PRODUCT_INVENTORY,
+        headers={"Idempotency-Key": "retry-1"},
+    )
+
+    assert response.status_code == 200
+    args = mock_store.run.await_args.args
+    assert args[:3] == ("inventory.create", "retry-1", "testuser")
+    mock_create.assert_awaited_once()
+
+    app.dependency_overrides.clear()
+
+
+# Tests for reservations
+SAMPLE_RESERVATION = {
+    "id": 7,
+    "batchid_internal": "BATCH123",
+    "requestid": "R1",
+    "quantity": 3,
+    "status": "ACTIVE(有效)",
+    "reservedby": "testuser",
+    "reservedat": "2025-01-01T12:00:00",
+    "expiresat": "2025-01-02T12:00:00",
+    "releasedat": None,
+}
+
+
+@patch("api.productlog.productlog.reserve_product_inventory", new_callable=AsyncMock)
+def test_reserve_product_inventory_success(mock_reserve):
+    """Test reserving part of a batch for an approved request."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_reserve.return_value = ReservationSchema(**SAMPLE_RESERVATION)
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/reservations", json={"requestid": "R1", "quantity": 3}
+    )
+    
+    # Assert
+    assert response.status_code == 200
+    assert response.json()["id"] == 7
+    batch_id, data, reservedby, _ = mock_reserve.await_args.args
+    assert (batch_id, data.requestid, data.quantity, reservedby) == ("BATCH123", "R1", 3, "testuser")
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize(
+    "error, status_code",
+    [
+        (InsufficientStockError("Insufficient stock in batch BATCH123"), 409),
+        (NotReservableError("Request R1 is PENDING, not APPROVED"), 409),
+        (ValueError("Request with ID R1 not found"), 404),
+    ],
+)
+@patch("api.productlog.productlog.reserve_product_inventory", new_callable=AsyncMock)
+def test_reserve_product_inventory_refused(mock_reserve, error, status_code):
+    """Test a refused reservation maps to 409, a missing batch or request to 404."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_reserve.side_effect = error
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/reservations", json={"requestid": "R1", "quantity": 3}
+    )
+    
+    # Assert
+    assert response.status_code == status_code
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.reserve_product_inventory", new_callable=AsyncMock)
+def test_reserve_product_inventory_unauthorized(mock_reserve):
+    """Test reserving fails for unauthorized user."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS_UNAUTHORIZED
+    
+    # Act
+    response = client.post(
+        "/product-inventory/BATCH123/reservations", json={"requestid": "R1", "quantity": 3}
+    )
+    
+    # Assert
+    assert response.status_code == 403
+    mock_reserve.assert_not_awaited()
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.release_reservation", new_callable=AsyncMock)
+def test_release_reservation_success(mock_release):
+    """Test releasing a reservation."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_release.return_value = ReservationSchema(**{**SAMPLE_RESERVATION, "status": "RELEASED(已释放)"})
+    
+    # Act
+    response = client.delete("/reservations/7")
+    
+    # Assert
+    assert response.status_code == 200
+    assert response.json()["status"] == "RELEASED(已释放)"
+    mock_release.assert_awaited_once_with(7)
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.release_reservation", new_callable=AsyncMock)
+def test_release_reservation_already_expired(mock_release):
+    """Test releasing an expired reservation returns 409."""
+    # Arrange
+    app.dependency_overrides[inventory_writer] = lambda: SAMPLE_AUTH_DETAILS
+    mock_release.side_effect = NotReservableError("Reservation 7 is EXPIRED(已过期)")
+    
+    # Act
+    response = client.delete("/reservations/7")
+    
+    # Assert
+    assert response.status_code == 409
+    
+    # Cleanup
+    app.dependency_overrides.clear()
+
+
+@patch("api.productlog.productlog.get_reservations_by_request_id", new_callable=AsyncMock)
+def test_get_reservations_by_request(mock_get):
+    """Test listing the reservations of a request."""
+    mock_get.return_value = [ReservationSchema(**SAMPLE_RESERVATION)]
+
+    response = client.get("/reservations", params={"requestid": "R1"})
+
+    assert response.status_code == 200
+    assert [r["id"] for r in response.json()] == [7]
+    mock_get.assert_awaited_once_with("R1")
+
+
+@patch("api.productlog.productlog.get_available_to_promise", new_callable=AsyncMock)
+def test_get_available_to_promise(mock_atp):
+    """Test available-to-promise of a product."""
+    mock_atp.return_value = AvailableToPromiseSchema(
+        productid="P001", quantityinstock=50, quantityreserved=12, available=40, batches=3
+    )
+
+    response = client.get("/product-details/P001/available-to-promise")
+
+    assert response.status_code == 200
+    assert response.json()["available"] == 40
+
+
+@patch("api.productlog.productlog.get_available_to_promise", new_callable=AsyncMock)
+def test_get_available_to_promise_not_found(mock_atp):
+    """Test available-to-promise of a missing product returns 404."""
+    mock_atp.side_effect = ValueError("Product details with ID NOPE not found")
+
+    response = client.get("/product-details/NOPE/available-to-promise")
+
+    assert response.status_code == 404
+
+
+
+@patch("api.productlog.productlog.get_product_stock_at", new_callable=AsyncMock)
+def test_get_product_stock_at(mock_stock_at):
+    """Test the stock of a product at a point in time."""
+    mock_stock_at.return_value = StockAtSchema(
+        productid="P001", at="2025-01-31T23:59:59+00:00", quantity=42, checkpoint_at=None, entries=7
+    )
+
+    response = client.get("/product-details/P001/stock-at", params={"at": "2025-01-31T23:59:59Z"})
+
+    assert response.status_code == 200
+    assert response.json()["quantity"] == 42
+    product_id, at = mock_stock_at.await_args.args
+    assert (product_id, at.day, at.utcoffset().total_seconds()) == ("P001", 31, 0)
+
+
+def test_get_product_stock_at_requires_a_time():
+    """Test the point in time is required."""
+    response = client.get("/product-details/P001/stock-at")
+
+    assert response.status_code == 422
@@ -1,15 +1,21 @@
 from unittest.mock import AsyncMock, MagicMock, patch
-from datetime import date, datetime
+from datetime import date, datetime, timedelta, timezone
 
 import pytest
 
-from api.productlog import crud
+from api.productlog import coa, crud
 from models.productlog.pydantic import (
     ProductDetailsSchema as ProductDetailsCreateSchema,
     ProductInventoryCreateSchema,
     ProductInventoryWithDetailsSchema,
-    InventoryStatus
+    InventoryStatus,
+    AdjustmentReason,
+    ReservationCreateSchema,
+    ReservationStatus,
+    StockAdjustmentItemSchema,
+    StockAdjustmentSchema,
 )
+from models.requests.versioning import VersionConflictError
 
 
 # Sample test data
@@ -119,6 +125,10 @@ SAMPLE_INVENTORY_RESPONSE_DATA = {
     **SAMPLE_INVENTORY_DATA
 }
 
+# Rows as the RETURNING clauses give them back
+PRODUCT_ROW = {**SAMPLE_PRODUCT_DICT, "components": "[]", "version": 2}
+INVENTORY_ROW = {**SAMPLE_INVENTORY_RESPONSE_DATA, "version": 1}
+
 
 # Tests for get_all_product_details
 @pytest.mark.asyncio
@@ -273,7 +283,10 @@ async def test_create_product_details_success(mock_schema, mock_model):
     result = await crud.create_product_details(SAMPLE_PRODUCT_CREATE_DATA)
 
     # Assert
-    mock_model.create.assert_awaited_once_with(**SAMPLE_PRODUCT_CREATE_DATA.dict())
+    # The shelf life is parsed from storage_temperature_duration, "6 months"
+    mock_model.create.assert_awaited_once_with(
+        **{**SAMPLE_PRODUCT_CREATE_DATA.dict(exclude={"version"}), "shelflifedays": 180}
+    )
     mock_schema.from_tortoise_orm.assert_awaited_once_with(mock_product_instance)
     assert result == expected_result
     assert result["productid"] == "P001"
@@ -333,38 +346,36 @@ async def test_get_product_details_by_id_not_found(mock_model):
 
 # Tests for update_product_details
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-@patch("api.productlog.crud.ProductDetailsSchema")
-async def test_update_product_details_success(mock_schema, mock_model):
+async def test_update_product_details_success(query_log):
     """Test successful update of product details."""
     # Arrange
-    mock_product_instance = MagicMock()
-    mock_product_instance.update_from_dict = AsyncMock()
-    mock_product_instance.save = AsyncMock()
-    mock_model.get_or_none = AsyncMock(return_value=mock_product_instance)
-    
+    query_log.returns([{**PRODUCT_ROW, "productnameen": "Updated Product"}])
     updated_data = ProductDetailsCreateSchema(**{**SAMPLE_PRODUCT_DICT, "productnameen": "Updated Product"})
-    expected_result = {**SAMPLE_PRODUCT_DICT, "productnameen": "Updated Product"}
-    mock_schema.from_tortoise_orm = AsyncMock(return_value=expected_result)
 
     # Act
     result = await crud.update_product_details("P001", updated_data)
 
     # Assert
-    mock_model.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_product_instance.update_from_dict.assert_awaited_once_with(updated_data.dict(exclude_unset=True))
-    mock_product_instance.save.assert_awaited_once()
-    mock_schema.from_tortoise_orm.assert_awaited_once_with(mock_product_instance)
-    assert result == expected_result
-    assert result["productnameen"] == "Updated Product"
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql.startswith('WITH updated AS (UPDATE "productdetails"')
+    assert "RETURNING *" in sql
+    # The batches' expiry dates follow the parsed shelf life in the same statement
+    assert 'UPDATE "product_inventory" p SET "expirydate"' in sql
+    assert 180 in params
+    assert '"productid" =' not in sql.split("WHERE")[0]
+    assert params[:2] == ["P001", None]
+    assert "Updated Product" in params
+    assert result.productnameen == "Updated Product"
+    assert result.components == []
+    assert result.version == 2
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-async def test_update_product_details_not_found(mock_model):
+async def test_update_product_details_not_found(query_log):
     """Test update_product_details when product doesn't exist."""
     # Arrange
-    mock_model.get_or_none = AsyncMock(return_value=None)
+    query_log.returns([])
     updated_data = ProductDetailsCreateSchema(**SAMPLE_PRODUCT_DICT)
 
     # Act & Assert
@@ -372,18 +383,15 @@ async def test_update_product_details_not_found(mock_model):
         await crud.update_product_details("NOTFOUND", updated_data)
     
     assert "Product with ID NOTFOUND not found" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(productid="NOTFOUND")
+    assert query_log.statements[0][1][0] == "NOTFOUND"
+    assert len(query_log) == 1
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-async def test_update_product_details_save_error(mock_model):
+async def test_update_product_details_save_error(query_log):
     """Test update_product_details handles save errors."""
     # Arrange
-    mock_product_instance = MagicMock()
-    mock_product_instance.update_from_dict = AsyncMock()
-    mock_product_instance.save = AsyncMock(side_effect=Exception("Save failed"))
-    mock_model.get_or_none = AsyncMock(return_value=mock_product_instance)
+    query_log.returns(Exception("Save failed"))
     
     updated_data = ProductDetailsCreateSchema(**SAMPLE_PRODUCT_DICT)
 
@@ -392,79 +400,91 @@ async def test_update_product_details_save_error(mock_model):
         await crud.update_product_details("P001", updated_data)
     
     assert "Save failed" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_product_instance.update_from_dict.assert_awaited_once()
-    mock_product_instance.save.assert_awaited_once()
+    assert len(query_log) == 1
+
+
+@pytest.mark.asyncio
+async def test_update_product_details_with_version(query_log):
+    """Test the update is conditional on the expected version."""
+    # Arrange
+    query_log.returns([{**PRODUCT_ROW, "version": 4}])
+
+    # Act
+    result = await crud.update_product_details("P001", ProductDetailsCreateSchema(**SAMPLE_PRODUCT_DICT), 3)
+
+    # Assert
+    sql, params = query_log.statements[0]
+    assert '"version" = "version" + 1' in sql
+    assert params[:2] == ["P001", 3]
+    assert result.version == 4
+
+
+@pytest.mark.asyncio
+async def test_update_product_details_version_conflict(query_log):
+    """Test a stale version raises VersionConflictError instead of not found."""
+    # Arrange
+    query_log.returns([], [{"version": 5}])
+
+    # Act & Assert
+    with pytest.raises(VersionConflictError) as exc_info:
+        await crud.update_product_details("P001", ProductDetailsCreateSchema(**SAMPLE_PRODUCT_DICT), 3)
+
+    assert "version 3" in str(exc_info.value)
+    assert query_log.statements[1] == (crud.PRODUCT_DETAILS_VERSION_SQL, ["P001"])
+    assert len(query_log) == 2
 
 
 # Tests for delete_product_details
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-async def test_delete_product_details_success(mock_model):
+async def test_delete_product_details_success(query_log):
     """Test successful deletion of product details."""
     # Arrange
-    mock_product_instance = MagicMock()
-    mock_product_instance.delete = AsyncMock()
-    mock_model.get_or_none = AsyncMock(return_value=mock_product_instance)
+    query_log.returns([{"productid": "P001"}])
 
     # Act
     result = await crud.delete_product_details("P001")
 
     # Assert
-    mock_model.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_product_instance.delete.assert_awaited_once()
+    assert query_log.statements == [(crud.PRODUCT_DETAILS_DELETE_SQL, ["P001"])]
     assert result == {"message": "Product P001 deleted successfully", "product_id": "P001"}
     assert result["product_id"] == "P001"
     assert "deleted successfully" in result["message"]
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-async def test_delete_product_details_not_found(mock_model):
+async def test_delete_product_details_not_found(query_log):
     """Test delete_product_details when product doesn't exist."""
     # Arrange
-    mock_model.get_or_none = AsyncMock(return_value=None)
+    query_log.returns([])
 
     # Act & Assert
     with pytest.raises(ValueError) as exc_info:
         await crud.delete_product_details("NOTFOUND")
     
     assert "Product with ID NOTFOUND not found" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(productid="NOTFOUND")
+    assert query_log.statements == [(crud.PRODUCT_DETAILS_DELETE_SQL, ["NOTFOUND"])]
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-async def test_delete_product_details_delete_error(mock_model):
+async def test_delete_product_details_delete_error(query_log):
     """Test delete_product_details handles deletion errors."""
     # Arrange
-    mock_product_instance = MagicMock()
-    mock_product_instance.delete = AsyncMock(side_effect=Exception("Foreign key constraint"))
-    mock_model.get_or_none = AsyncMock(return_value=mock_product_instance)
+    query_log.returns(Exception("Foreign key constraint"))
 
     # Act & Assert
     with pytest.raises(Exception) as exc_info:
         await crud.delete_product_details("P001")
     
     assert "Foreign key constraint" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_product_instance.delete.assert_awaited_once()
+    assert len(query_log) == 1
 
 
 # Edge case tests
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-@patch("api.productlog.crud.ProductDetailsSchema")
-async def test_update_product_details_partial_update(mock_schema, mock_model):
+async def test_update_product_details_partial_update(query_log):
     """Test partial update of product details."""
     # Arrange
-    mock_product_instance = MagicMock()
-    mock_product_instance.update_from_dict = AsyncMock()
-    mock_product_instance.save = AsyncMock()
-    mock_model.get_or_none = AsyncMock(return_value=mock_product_instance)
-    
-    expected_result = {**SAMPLE_PRODUCT_DICT, "productnameen": "Partially Updated Product"}
-    mock_schema.from_tortoise_orm = AsyncMock(return_value=expected_result)
+    query_log.returns([{**PRODUCT_ROW, "productnameen": "Partially Updated Product"}])
     
     # Create partial update data
     partial_data = ProductDetailsCreateSchema(
@@ -476,10 +496,6 @@ async def test_update_product_details_partial_update(mock_schema, mock_model):
         productnamezh="测试产品",
         specification="Test Specification",
         unit="Box(盒)",
-        components=[],
-        is_sold_independently=True,
-        remarks_temperature="Store at -20°C",
-        storage_temperature_duration="6 months",
         reorderlevel=10,
         targetstocklevel=100,
         leadtime=5,
@@ -489,14 +505,12 @@ async def test_update_product_details_partial_update(mock_schema, mock_model):
     result = await crud.update_product_details("P001", partial_data)
 
     # Assert
-    mock_model.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_product_instance.update_from_dict.assert_awaited_once()
-    mock_product_instance.save.assert_awaited_once()
-    mock_schema.from_tortoise_orm.assert_awaited_once_with(mock_product_instance)
-    assert result == expected_result
+    assert result.productnameen == "Partially Updated Product"
     # Verify that exclude_unset=True is used
-    call_args = mock_product_instance.update_from_dict.call_args
-    assert call_args is not None
+    sql, _ = query_log.statements[0]
+    assert '"components"' not in sql
+    assert '"remarks_temperature"' not in sql
+    assert '"productnameen" = $' in sql
 
 
 @pytest.mark.asyncio
@@ -517,44 +531,49 @@ async def test_get_product_details_by_id_empty_string(mock_model):
 # Tests for ProductInventory CRUD operations
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-@patch("api.productlog.crud.ProductInventory")
-@patch("api.productlog.crud.ProductInventorySchema")
-async def test_create_product_inventory_success(mock_schema, mock_model, mock_product_details):
+@patch("models.productlog.batchids.batch_ids.allocate", new_callable=AsyncMock)
+async def test_create_product_inventory_success(mock_allocate, query_log):
     """Test successful creation of product inventory."""
     # Arrange
-    # Mock ProductDetails exists
-    mock_product = MagicMock()
-    mock_product.productid = "P001"
-    mock_product_details.get_or_none = AsyncMock(return_value=mock_product)
-    
-    mock_created_obj = MagicMock()
-    mock_model.create = AsyncMock(return_value=mock_created_obj)
-    expected_result = SAMPLE_INVENTORY_RESPONSE_DATA
-    mock_schema.from_tortoise_orm = AsyncMock(return_value=expected_result)
+    mock_allocate.return_value = ["BM001-AD001-00000A"]
+    query_log.returns([{"shelflifedays": 180}], [], [INVENTORY_ROW])
 
     # Act
     result = await crud.create_product_inventory(SAMPLE_INVENTORY_CREATE_DATA)
 
     # Assert
-    mock_product_details.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_model.create.assert_awaited_once()
-    mock_schema.from_tortoise_orm.assert_awaited_once_with(mock_created_obj)
-    assert result == expected_result
+    assert query_log.statements[0] == (crud.PRODUCT_SHELF_LIFE_SQL, ["P001"])
+    assert query_log.statements[1] == (coa.PRODUCT_SPECS_SQL, [["P001"]])
+    sql, params = query_log.statements[2]
+    assert sql.startswith('WITH created AS (INSERT INTO "product_inventory"')
+    # The opening stock is on the ledger, written by the same statement
+    assert 'INSERT INTO "inventory_transaction"' in sql
+    assert "'CREATED(新建)'" in sql
+    # batchid_internal is not unique across partitions, its claim is
+    assert 'INSERT INTO "inventory_batch_id"' in sql
+    # Batch ids are allocated before the insert, enums are sent as values
+    mock_allocate.assert_awaited_once_with("BM001", "AD001", 1)
+    assert "BM001-AD001-00000A" in params
+    assert "BM001-AD001" in params
+    assert "AVAILABLE(可用)" in params
+    assert '"expirydate"' in sql
+    assert SAMPLE_INVENTORY_CREATE_DATA.productiondate + timedelta(days=180) in params
+    assert len(query_log) == 3
+    assert result.batchid_internal == "BM001-AD001-ABC123"
+    assert result.version == 1
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
-async def test_create_product_inventory_invalid_productid(mock_product_details):
+async def test_create_product_inventory_invalid_productid(query_log):
     """Test creation fails when productid doesn't exist in ProductDetails."""
     # Arrange
-    mock_product_details.get_or_none = AsyncMock(return_value=None)  # ProductDetails doesn't exist
+    query_log.returns([])  # ProductDetails doesn't exist
 
     # Act & Assert
     with pytest.raises(ValueError, match="Product with ID P001 not found in ProductDetails"):
         await crud.create_product_inventory(SAMPLE_INVENTORY_CREATE_DATA)
     
-    mock_product_details.get_or_none.assert_awaited_once_with(productid="P001")
+    assert query_log.statements == [(crud.PRODUCT_SHELF_LIFE_SQL, ["P001"])]
 
 
 @pytest.mark.asyncio
@@ -578,11 +597,13 @@ async def test_get_product_inventory_by_id_success(mock_schema, mock_model):
 
 
 @pytest.mark.asyncio
+@patch("api.productlog.crud.ProductInventoryArchive")
 @patch("api.productlog.crud.ProductInventory")
-async def test_get_product_inventory_by_id_not_found(mock_model):
+async def test_get_product_inventory_by_id_not_found(mock_model, mock_archive):
     """Test get_product_inventory_by_id when inventory is not found."""
     # Arrange
     mock_model.get_or_none = AsyncMock(return_value=None)
+    mock_archive.filter.return_value.values = AsyncMock(return_value=[])
 
     # Act & Assert
     with pytest.raises(ValueError) as exc_info:
@@ -593,44 +614,102 @@ async def test_get_product_inventory_by_id_not_found(mock_model):
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductDetails")
+@patch("api.productlog.crud.ProductInventoryArchive")
 @patch("api.productlog.crud.ProductInventory")
-@patch("api.productlog.crud.ProductInventorySchema")
-async def test_update_product_inventory_success(mock_schema, mock_model, mock_product_details):
+async def test_get_product_inventory_by_id_archived(mock_model, mock_archive):
+    """Test an archived batch is still found by its batch ID."""
+    # Arrange
+    mock_model.get_or_none = AsyncMock(return_value=None)
+    archived = {**INVENTORY_ROW, "status": "OUT_OF_STOCK(缺货)", "archivedat": datetime(2027, 1, 1)}
+    mock_archive.filter.return_value.values = AsyncMock(return_value=[archived])
+
+    # Act
+    result = await crud.get_product_inventory_by_id("BM001-AD001-ABC123")
+
+    # Assert
+    assert (result.batchid_internal, result.status) == ("BM001-AD001-ABC123", InventoryStatus.OUT_OF_STOCK)
+    mock_archive.filter.assert_called_once_with(batchid_internal="BM001-AD001-ABC123")
+
+
+@pytest.mark.asyncio
+async def test_update_product_inventory_success(query_log):
     """Test successful update of product inventory."""
     # Arrange
-    # Mock ProductDetails exists
-    mock_product = MagicMock()
-    mock_product.productid = "P001"
-    mock_product_details.get_or_none = AsyncMock(return_value=mock_product)
-    
-    mock_inventory = MagicMock()
-    mock_inventory.update_from_dict = AsyncMock()
-    mock_inventory.save = AsyncMock()
-    mock_model.get_or_none = AsyncMock(return_value=mock_inventory)
-    
+    query_log.returns([{**INVENTORY_ROW, "quantityinstock": 75, "version": 2}], [])
     updated_data = ProductInventoryCreateSchema(**{**SAMPLE_INVENTORY_DATA, "quantityinstock": 75})
-    expected_result = {**SAMPLE_INVENTORY_RESPONSE_DATA, "quantityinstock": 75}
-    mock_schema.from_tortoise_orm = AsyncMock(return_value=expected_result)
 
     # Act
     result = await crud.update_product_inventory("BATCH123", updated_data)
 
     # Assert
-    mock_model.get_or_none.assert_awaited_once_with(batchid_internal="BATCH123")
-    mock_product_details.get_or_none.assert_awaited_once_with(productid="P001")
-    mock_inventory.update_from_dict.assert_awaited_once()
-    mock_inventory.save.assert_awaited_once()
-    mock_schema.from_tortoise_orm.assert_awaited_once_with(mock_inventory)
-    assert result == expected_result
+    # The batch passes its COA specification, so it is left as it is
+    assert query_log.statements[1] == (coa.PRODUCT_SPECS_SQL, [["P001"]])
+    assert len(query_log) == 2
+    sql, params = query_log.statements[0]
+    # The productid check is part of the update
+    assert 'EXISTS (SELECT 1 FROM "productdetails"' in sql
+    assert params[:5] == ["BATCH123", None, "P001", date(2025, 1, 1), 75]
+    # The new quantity may not drop below the reserved stock
+    assert '$5::int >= p."quantityreserved"' in sql
+    # A new product or production date computes the expirydate again
+    assert '"expirydate" = CASE' in sql
+    assert 75 in params
+    # auto_now does not apply to raw updates
+    assert '"lastupdated" = $' in sql
+    assert result.quantityinstock == 75
+    assert result.version == 2
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductInventory")
-async def test_update_product_inventory_not_found(mock_model):
+@patch("models.productlog.batchids.batch_ids.allocate", new_callable=AsyncMock)
+async def test_create_product_inventory_quarantines_failed_coa(mock_allocate, query_log):
+    """Test a batch failing its product's COA specification is created in QUARANTINE."""
+    # Arrange
+    mock_allocate.return_value = ["BM001-AD001-00000A"]
+    query_log.returns(
+        [{"shelflifedays": None}],
+        [{"productid": "P001", "field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.2, "expected": None}],
+        [{**INVENTORY_ROW, "status": "QUARANTINE(隔离)"}],
+    )
+
+    # Act
+    result = await crud.create_product_inventory(SAMPLE_INVENTORY_CREATE_DATA)
+
+    # Assert
+    sql, params = query_log.statements[2]
+    assert "QUARANTINE(隔离)" in params and "AVAILABLE(可用)" not in params
+    assert result.status == InventoryStatus.QUARANTINE
+
+
+@pytest.mark.asyncio
+async def test_update_product_inventory_quarantines_failed_coa(query_log):
+    """Test an update to a failing COA result quarantines the batch."""
+    # Arrange
+    query_log.returns(
+        [{**INVENTORY_ROW, "coa_ph": 8.1, "version": 2}],
+        [{"productid": "P001", "field": "coa_ph", "minvalue": 7.0, "maxvalue": 7.6, "expected": None}],
+        [{"batchid_internal": "BM001-AD001-ABC123"}],
+    )
+    updated_data = ProductInventoryCreateSchema(**{**SAMPLE_INVENTORY_DATA, "coa_ph": 8.1})
+
+    # Act
+    result = await crud.update_product_inventory("BM001-AD001-ABC123", updated_data)
+
+    # Assert
+    sql, params = query_log.statements[2]
+    assert sql == coa.QUARANTINE_SQL
+    assert params[:3] == [["BM001-AD001-ABC123"], [INVENTORY_ROW["productiondate"]], "QUARANTINE(隔离)"]
+    assert params[5] == coa.SKIPPED_STATUSES
+    assert (result.status, result.version, result.lastupdatedby) == (
+        InventoryStatus.QUARANTINE, 3, coa.QUARANTINED_BY
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_product_inventory_not_found(query_log):
     """Test update_product_inventory when inventory is not found."""
     # Arrange
-    mock_model.get_or_none = AsyncMock(return_value=None)
+    query_log.returns([], [])
     updated_data = ProductInventoryCreateSchema(**SAMPLE_INVENTORY_DATA)
 
     # Act & Assert
@@ -638,40 +717,438 @@ async def test_update_product_inventory_not_found(mock_model):
         await crud.update_product_inventory("NONEXISTENT", updated_data)
     
     assert "Product inventory with batch ID NONEXISTENT not found" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(batchid_internal="NONEXISTENT")
+    assert query_log.statements[1] == (crud.INVENTORY_STATE_SQL, ["NONEXISTENT", "P001"])
+    assert len(query_log) == 2
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductInventory")
-async def test_delete_product_inventory_success(mock_model):
+async def test_update_product_inventory_version_conflict(query_log):
+    """Test a stale version on inventory raises VersionConflictError."""
+    # Arrange
+    query_log.returns([], [{"version": 3, "quantityreserved": 0, "product_exists": True}])
+    updated_data = ProductInventoryCreateSchema(**{**SAMPLE_INVENTORY_DATA, "version": 2})
+
+    # Act & Assert
+    with pytest.raises(VersionConflictError):
+        await crud.update_product_inventory("BATCH123", updated_data, 2)
+
+    sql, params = query_log.statements[0]
+    assert params[1] == 2
+    # The body version is a precondition, never written as is
+    assert '"version" = $' not in sql.split("WHERE")[0]
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_update_product_inventory_below_reserved(query_log):
+    """Test a new quantity below the reserved stock raises InsufficientStockError."""
+    # Arrange
+    query_log.returns([], [{"version": 1, "quantityreserved": 80, "product_exists": True}])
+    updated_data = ProductInventoryCreateSchema(**{**SAMPLE_INVENTORY_DATA, "quantityinstock": 75})
+
+    # Act & Assert
+    with pytest.raises(crud.InsufficientStockError) as exc_info:
+        await crud.update_product_inventory("BATCH123", updated_data)
+
+    assert "80 reserved" in str(exc_info.value)
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_delete_product_inventory_success(query_log):
     """Test successful deletion of product inventory."""
     # Arrange
-    mock_inventory = MagicMock()
-    mock_inventory.delete = AsyncMock()
-    mock_model.get_or_none = AsyncMock(return_value=mock_inventory)
+    query_log.returns([{"batchid_internal": "BATCH123"}])
 
     # Act
     result = await crud.delete_product_inventory("BATCH123")
 
     # Assert
-    mock_model.get_or_none.assert_awaited_once_with(batchid_internal="BATCH123")
-    mock_inventory.delete.assert_awaited_once()
+    [(sql, params)] = query_log.statements
+    assert sql == crud.INVENTORY_DELETE_SQL
+    assert params[:2] == ["BATCH123", None]
+    # The remaining stock leaves through the ledger
+    assert '-"quantityinstock"' in sql
+    # and the batch ID is free again
+    assert 'DELETE FROM "inventory_batch_id"' in sql
     assert result == {"message": "Product inventory BATCH123 deleted successfully", "batch_id": "BATCH123"}
 
 
 @pytest.mark.asyncio
-@patch("api.productlog.crud.ProductInventory")
-async def test_delete_product_inventory_not_found(mock_model):
+async def test_delete_product_inventory_not_found(query_log):
     """Test delete_product_inventory when inventory is not found."""
     # Arrange
-    mock_model.get_or_none = AsyncMock(return_value=None)
+    query_log.returns([])
 
     # Act & Assert
     with pytest.raises(ValueError) as exc_info:
         await crud.delete_product_inventory("NONEXISTENT")
     
     assert "Product inventory with batch ID NONEXISTENT not found" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(batchid_internal="NONEXISTENT")
+    assert [sql for sql, _ in query_log.statements] == [crud.INVENTORY_DELETE_SQL]
+
+
+# Tests for stock adjustments
+def transaction_on(connection):
+    transaction = MagicMock()
+    transaction.return_value.__aenter__.return_value = connection
+    # Let exceptions propagate, as a rolled back transaction does
+    transaction.return_value.__aexit__.return_value = False
+    return transaction
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_one_statement(query_log):
+    """Test a successful adjustment updates and logs in a single statement."""
+    # Arrange
+    query_log.returns([{**INVENTORY_ROW, "batchid_internal": "BATCH123", "quantityinstock": 48, "version": 3}])
+    adjustment = StockAdjustmentSchema(delta=-2, reason=AdjustmentReason.SHIPMENT, note="order 17")
+
+    # Act
+    result = await crud.adjust_product_inventory("BATCH123", adjustment, "alice")
+
+    # Assert
+    assert (result.batchid_internal, result.quantityinstock, result.version) == ("BATCH123", 48, 3)
+    # The full row, for realtime subscribers
+    assert result.productid == INVENTORY_ROW["productid"]
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql == crud.STOCK_ADJUST_SQL
+    assert params[:4] == ["BATCH123", -2, "SHIPMENT(出库)", "order 17"]
+    assert params[5] == "alice"
+    # Reserved stock cannot be adjusted away
+    assert '"quantityinstock" + $2 >= "quantityreserved"' in sql
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_insufficient_stock(query_log):
+    """Test an adjustment that would go negative is explained by a second query."""
+    # Arrange
+    query_log.returns([], [{"batchid_internal": "BATCH123", "quantityinstock": 1, "quantityreserved": 0}])
+    adjustment = StockAdjustmentSchema(delta=-2, reason=AdjustmentReason.SHIPMENT)
+
+    # Act & Assert
+    with pytest.raises(crud.InsufficientStockError) as exc_info:
+        await crud.adjust_product_inventory("BATCH123", adjustment, "alice")
+
+    assert "BATCH123 (1 in stock, 0 reserved, needs 2)" in str(exc_info.value)
+    assert query_log.statements[1] == (crud.STOCK_LEVEL_SQL, [["BATCH123"]])
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_not_found(query_log):
+    """Test adjusting a missing batch raises ValueError."""
+    # Arrange
+    query_log.returns([], [])
+    adjustment = StockAdjustmentSchema(delta=5, reason=AdjustmentReason.RETURN)
+
+    # Act & Assert
+    with pytest.raises(ValueError) as exc_info:
+        await crud.adjust_product_inventory("NONEXISTENT", adjustment, "alice")
+
+    assert "Product inventory with batch ID NONEXISTENT not found" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_batch(query_log):
+    """Test a batch is one statement in a transaction, with results by batch ID."""
+    # Arrange
+    query_log.returns([
+        {**INVENTORY_ROW, "batchid_internal": "B", "quantityinstock": 4, "version": 2},
+        {**INVENTORY_ROW, "batchid_internal": "A", "quantityinstock": 7, "version": 5},
+    ])
+    adjustments = [
+        StockAdjustmentItemSchema(batchid_internal="B", delta=-1, reason=AdjustmentReason.DAMAGE),
+        StockAdjustmentItemSchema(batchid_internal="A", delta=2, reason=AdjustmentReason.STOCKTAKE),
+        StockAdjustmentItemSchema(batchid_internal="B", delta=-1, reason=AdjustmentReason.QC_SAMPLE),
+    ]
+
+    # Act
+    with patch("api.productlog.crud.in_transaction", transaction_on(query_log)):
+        result = await crud.adjust_product_inventory_batch(adjustments, "alice")
+
+    # Assert
+    assert [row.batchid_internal for row in result] == ["A", "B"]
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql == crud.STOCK_ADJUST_BATCH_SQL
+    assert params[0] == ["B", "A", "B"]
+    assert params[1] == [-1, 2, -1]
+    assert params[2] == ["DAMAGE(损坏)", "STOCKTAKE(盘点)", "QC_SAMPLE(质检取样)"]
+    assert "FOR UPDATE" in sql
+    # Every running total of a batch is guarded, not just the sum
+    assert 'p."quantityinstock" + t.lowest >= p."quantityreserved"' in sql
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_batch_rolls_back_on_shortfall(query_log):
+    """Test a batch where one row would go negative is rejected as a whole."""
+    # Arrange
+    query_log.returns(
+        [{**INVENTORY_ROW, "batchid_internal": "A", "quantityinstock": 7, "version": 5}],
+        [
+            {"batchid_internal": "A", "quantityinstock": 7, "quantityreserved": 0},
+            {"batchid_internal": "B", "quantityinstock": 1, "quantityreserved": 0},
+        ],
+    )
+    adjustments = [
+        StockAdjustmentItemSchema(batchid_internal="A", delta=2, reason=AdjustmentReason.STOCKTAKE),
+        StockAdjustmentItemSchema(batchid_internal="B", delta=-1, reason=AdjustmentReason.SHIPMENT),
+        StockAdjustmentItemSchema(batchid_internal="B", delta=-1, reason=AdjustmentReason.SHIPMENT),
+    ]
+    transaction = transaction_on(query_log)
+
+    # Act & Assert
+    with patch("api.productlog.crud.in_transaction", transaction):
+        with pytest.raises(crud.InsufficientStockError) as exc_info:
+            await crud.adjust_product_inventory_batch(adjustments, "alice")
+
+    # The deltas of B are checked as a running total
+    assert "B (1 in stock, 0 reserved, needs 2)" in str(exc_info.value)
+    assert "A (" not in str(exc_info.value)
+    exc_type = transaction.return_value.__aexit__.await_args.args[0]
+    assert exc_type is crud.InsufficientStockError
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_batch_guards_intermediate_totals(query_log):
+    """Test a batch whose sum is fine but which dips below zero on the way is rejected."""
+    # Arrange
+    query_log.returns([], [{"batchid_internal": "A", "quantityinstock": 2, "quantityreserved": 0}])
+    adjustments = [
+        StockAdjustmentItemSchema(batchid_internal="A", delta=-5, reason=AdjustmentReason.SHIPMENT),
+        StockAdjustmentItemSchema(batchid_internal="A", delta=10, reason=AdjustmentReason.PRODUCTION),
+    ]
+
+    # Act & Assert
+    with patch("api.productlog.crud.in_transaction", transaction_on(query_log)):
+        with pytest.raises(crud.InsufficientStockError) as exc_info:
+            await crud.adjust_product_inventory_batch(adjustments, "alice")
+
+    assert "A (2 in stock, 0 reserved, needs 5)" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_adjust_product_inventory_keeps_reserved_stock(query_log):
+    """Test an adjustment may not take stock that is held for a request."""
+    # Arrange
+    query_log.returns([], [{"batchid_internal": "BATCH123", "quantityinstock": 10, "quantityreserved": 4}])
+    adjustment = StockAdjustmentSchema(delta=-8, reason=AdjustmentReason.SHIPMENT)
+
+    # Act & Assert
+    with pytest.raises(crud.InsufficientStockError) as exc_info:
+        await crud.adjust_product_inventory("BATCH123", adjustment, "alice")
+
+    assert "BATCH123 (10 in stock, 4 reserved, needs 8)" in str(exc_info.value)
+
+
+# Tests for the inventory ledger
+@pytest.mark.parametrize(
+    "sql",
+    [
+        crud.INVENTORY_INSERT_SQL,
+        crud.INVENTORY_UPDATE_SQL,
+        crud.INVENTORY_DELETE_SQL,
+        crud.STOCK_ADJUST_SQL,
+        crud.STOCK_ADJUST_BATCH_SQL,
+    ],
+)
+def test_stock_changes_append_to_the_ledger(sql):
+    """Test every statement changing stock writes the ledger in the same statement."""
+    assert sql.startswith("WITH ")
+    assert sql.count('INSERT INTO "inventory_transaction"') == 1
+
+
+def test_update_product_inventory_ledgers_the_difference():
+    """Test an edit records the stock difference, and a product move as out and in."""
+    sql = crud.INVENTORY_UPDATE_SQL
+    # The old stock is read under the lock the update takes anyway
+    assert '"batchid_internal" = $1 FOR UPDATE' in sql
+    assert 'u."quantityinstock" - u."old_quantity"' in sql
+    assert '(u."old_productid", -u."old_quantity", 0)' in sql
+
+
+@pytest.mark.asyncio
+async def test_update_product_inventory_returns_the_row_without_ledger_columns(query_log):
+    """Test the columns the ledger needs do not leak into the response."""
+    query_log.returns([{**INVENTORY_ROW, "old_productid": "P001", "old_quantity": 50, "version": 2}])
+
+    result = await crud.update_product_inventory("BATCH123", SAMPLE_INVENTORY_CREATE_DATA)
+
+    assert "old_quantity" not in result.dict()
+
+
+@pytest.mark.asyncio
+async def test_get_product_stock_at(query_log):
+    """Test stock at a point in time is one checkpoint plus the ledger rows after it."""
+    # Arrange
+    checkpoint = datetime(2025, 1, 31, 23, 0, tzinfo=timezone.utc)
+    query_log.returns([{"checkpoint_at": checkpoint, "quantity": 42, "entries": 3}])
+
+    # Act
+    result = await crud.get_product_stock_at("P001", datetime(2025, 2, 1))
+
+    # Assert
+    assert (result.quantity, result.checkpoint_at, result.entries) == (42, checkpoint, 3)
+    [(sql, [product_id, at])] = query_log.statements
+    assert sql == crud.STOCK_AT_SQL
+    # Naive times are UTC, asyncpg would read them as local time
+    assert (product_id, at) == ("P001", datetime(2025, 2, 1, tzinfo=timezone.utc))
+    assert 'ORDER BY "asof" DESC LIMIT 1' in sql
+
+
+# Tests for reservations
+RESERVATION_ROW = {
+    "id": 7,
+    "batchid_internal": "BATCH123",
+    "requestid": "R1",
+    "quantity": 3,
+    "status": ReservationStatus.ACTIVE.value,
+    "reservedby": "alice",
+    "reservedat": datetime(2025, 1, 1, 12, 0),
+    "expiresat": datetime(2025, 1, 2, 12, 0),
+    "releasedat": None,
+}
+
+
+@pytest.mark.asyncio
+async def test_reserve_product_inventory_one_statement(query_log):
+    """Test a reservation holds stock and records itself in a single statement."""
+    # Arrange
+    query_log.returns([RESERVATION_ROW])
+    data = ReservationCreateSchema(requestid="R1", quantity=3)
+
+    # Act
+    result = await crud.reserve_product_inventory("BATCH123", data, "alice", 1440)
+
+    # Assert
+    assert (result.id, result.quantity, result.status) == (7, 3, ReservationStatus.ACTIVE)
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql == crud.RESERVE_SQL
+    assert params[:4] == ["BATCH123", "R1", 3, 1440]
+    assert params[5:] == ["alice", "AVAILABLE(可用)", "APPROVED", "ACTIVE(有效)"]
+    assert '"quantityinstock" - "quantityreserved" >= $3' in sql
+
+
+@pytest.mark.asyncio
+async def test_reserve_product_inventory_uses_requested_ttl(query_log):
+    """Test the TTL of the request overrides the default."""
+    query_log.returns([RESERVATION_ROW])
+    data = ReservationCreateSchema(requestid="R1", quantity=3, ttl_minutes=30)
+
+    await crud.reserve_product_inventory("BATCH123", data, "alice", 1440)
+
+    assert query_log.statements[0][1][3] == 30
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "state, error, message",
+    [
+        ([], ValueError, "batch ID BATCH123 not found"),
+        (
+            [{"status": "AVAILABLE(可用)", "unreserved": 5, "request_status": None}],
+            ValueError,
+            "Request with ID R1 not found",
+        ),
+        (
+            [{"status": "AVAILABLE(可用)", "unreserved": 5, "request_status": "PENDING"}],
+            crud.NotReservableError,
+            "R1 is PENDING",
+        ),
+        (
+            [{"status": "DAMAGED(损坏)", "unreserved": 5, "request_status": "APPROVED"}],
+            crud.NotReservableError,
+            "BATCH123 is DAMAGED(损坏)",
+        ),
+        (
+            [{"status": "AVAILABLE(可用)", "unreserved": 2, "request_status": "APPROVED"}],
+            crud.InsufficientStockError,
+            "(2 unreserved, needs 3)",
+        ),
+    ],
+)
+async def test_reserve_product_inventory_refused(query_log, state, error, message):
+    """Test a refused reservation is explained by a second query."""
+    # Arrange
+    query_log.returns([], state)
+    data = ReservationCreateSchema(requestid="R1", quantity=3)
+
+    # Act & Assert
+    with pytest.raises(error) as exc_info:
+        await crud.reserve_product_inventory("BATCH123", data, "alice", 1440)
+
+    assert message in str(exc_info.value)
+    assert query_log.statements[1] == (crud.RESERVE_STATE_SQL, ["BATCH123", "R1"])
+
+
+@pytest.mark.asyncio
+async def test_release_reservation_success(query_log):
+    """Test releasing gives the stock back in the same statement."""
+    # Arrange
+    released = {**RESERVATION_ROW, "status": "RELEASED(已释放)", "releasedat": datetime(2025, 1, 1, 13, 0)}
+    query_log.returns([released])
+
+    # Act
+    result = await crud.release_reservation(7)
+
+    # Assert
+    assert result.status == ReservationStatus.RELEASED
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql == crud.RELEASE_SQL
+    assert (params[0], params[1], params[3]) == (7, "RELEASED(已释放)", "ACTIVE(有效)")
+
+
+@pytest.mark.asyncio
+async def test_release_reservation_not_active(query_log):
+    """Test releasing an expired reservation does not give the stock back twice."""
+    query_log.returns([], [{"status": "EXPIRED(已过期)"}])
+
+    with pytest.raises(crud.NotReservableError) as exc_info:
+        await crud.release_reservation(7)
+
+    assert "7 is EXPIRED(已过期)" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_release_reservation_not_found(query_log):
+    """Test releasing a missing reservation raises ValueError."""
+    query_log.returns([], [])
+
+    with pytest.raises(ValueError):
+        await crud.release_reservation(99)
+
+
+@pytest.mark.asyncio
+async def test_get_available_to_promise(query_log):
+    """Test available-to-promise is one aggregate over the product's AVAILABLE batches."""
+    # Arrange
+    query_log.returns(
+        [{"1": 1}],
+        [{"quantityinstock": 50, "quantityreserved": 12, "available": 40, "batches": 3}],
+    )
+
+    # Act
+    result = await crud.get_available_to_promise("P001")
+
+    # Assert
+    assert (result.productid, result.available, result.batches) == ("P001", 40, 3)
+    assert query_log.statements[1] == (crud.AVAILABLE_TO_PROMISE_SQL, ["P001", "AVAILABLE(可用)"])
+    # Overbooked batches count as zero, not against the others
+    assert 'GREATEST("quantityinstock" - "quantityreserved", 0)' in crud.AVAILABLE_TO_PROMISE_SQL
+
+
+@pytest.mark.asyncio
+async def test_get_available_to_promise_product_not_found(query_log):
+    """Test available-to-promise of a missing product raises ValueError."""
+    query_log.returns([])
+
+    with pytest.raises(ValueError):
+        await crud.get_available_to_promise("NOPE")
+
+    assert len(query_log) == 1
 
 
 # Tests for get_product_inventory_by_product_id function
@@ -711,37 +1188,3 @@ async def test_get_product_inventory_by_product_id_invalid_product(mock_product_
     
     assert "Product with ID INVALID not found in ProductDetails" in str(exc_info.value)
     mock_product_details.get_or_none.assert_awaited_once_with(productid="INVALID")
-
-
-# Tests for delete_product_inventory function
-@pytest.mark.asyncio
-@patch("api.productlog.crud.ProductInventory")
-async def test_delete_product_inventory_success(mock_model):
-    """Test successful deletion of product inventory."""
-    # Arrange
-    mock_inventory = MagicMock()
-    mock_inventory.delete = AsyncMock()
-    mock_model.get_or_none = AsyncMock(return_value=mock_inventory)
-    
-    # Act
-    result = await crud.delete_product_inventory("BATCH123")
-    
-    # Assert
-    assert result == {"message": "Product inventory BATCH123 deleted successfully", "batch_id": "BATCH123"}
-    mock_model.get_or_none.assert_awaited_once_with(batchid_internal="BATCH123")
-    mock_inventory.delete.assert_awaited_once()
-
-
-@pytest.mark.asyncio
-@patch("api.productlog.crud.ProductInventory")
-async def test_delete_product_inventory_not_found(mock_model):
-    """Test delete_product_inventory when inventory not found."""
-    # Arrange
-    mock_model.get_or_none = AsyncMock(return_value=None)
-    
-    # Act & Assert
-    with pytest.raises(ValueError) as exc_info:
-        await crud.delete_product_inventory("NONEXISTENT")
-    
-    assert "Product inventory with batch ID NONEXISTENT not found" in str(exc_info.value)
-    mock_model.get_or_none.assert_awaited_once_with(batchid_internal="NONEXISTENT")
@@ -0,0 +1,40 @@
+import pytest
+
+from api.productlog.reservations import (RELEASE_HOLDS_SQL, SWEEP_SQL,
+                                         ReservationSweeper)
+
+
+@pytest.mark.asyncio
+async def test_sweep_expires_in_batches_until_done(query_log):
+    query_log.returns([{"count": 2}], [{"count": 2}], [{"count": 1}])
+
+    assert await ReservationSweeper(batch_size=2).sweep() == 5
+
+    assert len(query_log) == 3
+    sql, [now, status, limit] = query_log.statements[0]
+    assert sql == SWEEP_SQL
+    assert (status, limit) == ("EXPIRED(已过期)", 2)
+    # One cutoff for the whole sweep, so it ends
+    assert {params[0] for _, params in query_log.statements} == {now}
+
+
+@pytest.mark.asyncio
+async def test_sweep_matches_the_partial_index(query_log):
+    query_log.returns([{"count": 0}])
+
+    assert await ReservationSweeper().sweep() == 0
+
+    # A bound parameter would keep the planner off the partial index
+    assert "\"status\" = 'ACTIVE(有效)' AND \"expiresat\" < $1" in SWEEP_SQL
+    assert "FOR UPDATE SKIP LOCKED" in SWEEP_SQL
+
+
+def test_release_holds_of_closed_requests():
+    sql = RELEASE_HOLDS_SQL.format(source="updated")
+
+    assert "s.\"status\" IN ('FULLFILLED', 'REJECTED')" in sql
+    # Only ACTIVE holds give back stock, so the sweeper cannot do it twice
+    assert "h.\"status\" = 'ACTIVE(有效)'" in sql
+    assert "'RELEASED(已释放)'" in sql
+    # Batches are locked in the same order as the sweeper locks them
+    assert 'ORDER BY p."batchid_internal" FOR UPDATE OF p' in sql
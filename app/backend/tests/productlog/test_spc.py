@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.productlog import crud, spc
+from api.productlog.productlog import router
+from models.productlog.pydantic import CoaField, WesternElectricRule
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+def transaction_on(connection):
+    transaction = MagicMock()
+    transaction.return_value.__aenter__.return_value = connection
+    transaction.return_value.__aexit__.return_value = False
+    return transaction
+
+
+def broken(values, rule):
+    return spc.western_electric(np.array(values, dtype=float), 0.0, 1.0)[rule].nonzero()[0].tolist()
+
+
+def test_sigma_needs_two_values():
+    assert spc.sigma(0, 0.0) is None
+    assert spc.sigma(1, 0.0) is None
+    assert spc.sigma(5, 16.0) == 2.0
+
+
+def test_beyond_3_sigma():
+    assert broken([0, 3.1, -2.9, -3.5], WesternElectricRule.BEYOND_3_SIGMA) == [1, 3]
+
+
+def test_two_of_three_beyond_2_sigma_on_one_side():
+    rule = WesternElectricRule.TWO_OF_THREE_BEYOND_2_SIGMA
+    assert broken([2.5, 0, 2.1, 2.2, 0], rule) == [2, 3, 4]
+    # Opposite sides do not count together
+    assert broken([2.5, -2.5, 0], rule) == []
+
+
+def test_four_of_five_beyond_1_sigma_on_one_side():
+    rule = WesternElectricRule.FOUR_OF_FIVE_BEYOND_1_SIGMA
+    assert broken([-1.5, -1.2, 0, -1.1, -2.0], rule) == [4]
+    assert broken([1.5, 1.2, 0, 1.1], rule) == []
+
+
+def test_eight_on_one_side():
+    rule = WesternElectricRule.EIGHT_ON_ONE_SIDE
+    assert broken([0.1] * 9, rule) == [7, 8]
+    assert broken([0.1] * 7 + [-0.1] + [0.1] * 7, rule) == []
+
+
+def test_rules_need_no_full_window():
+    assert all(not mask.any() for mask in spc.western_electric(np.array([0.5]), 0.0, 1.0).values())
+
+
+def test_inventory_writes_merge_measured_results_into_statistics():
+    assert 'INSERT INTO "coa_statistics"' in crud.INVENTORY_INSERT_SQL
+    assert spc.added("created") in crud.INVENTORY_INSERT_SQL
+    assert spc.replaced("updated") in crud.INVENTORY_UPDATE_SQL
+    assert 'o."coa_ph" AS "old_coa_ph"' in crud.INVENTORY_UPDATE_SQL
+    assert spc.removed("deleted") in crud.INVENTORY_DELETE_SQL
+    # Pass/fail results have no statistics
+    assert "coa_sterility" not in spc.added("created")
+
+
+def test_replaced_skips_results_that_stayed():
+    sql = spc.replaced("updated")
+
+    assert '"old_coa_ph" AS "removed"' in sql
+    assert '("productid" <> "old_productid" OR "coa_ph" IS DISTINCT FROM "old_coa_ph")' in sql
+
+
+def chart_rows(values):
+    start = datetime(2026, 10, 1)
+    rows = [
+        {
+            "batchid_internal": f"B{i}",
+            "productiondatetime": start + timedelta(days=i),
+            "value": value,
+        }
+        for i, value in enumerate(values)
+    ]
+    # Newest first, as read
+    return rows[::-1]
+
+
+@pytest.mark.asyncio
+async def test_get_control_chart_limits_from_statistics(query_log):
+    # Arrange: mean 7.4, sigma 0.1 over 101 batches
+    query_log.returns(
+        [{"count": 101, "mean": 7.4, "m2": 1.0}],
+        chart_rows([7.4, 7.75, 7.41]),
+    )
+
+    # Act
+    chart = await crud.get_control_chart("P1", CoaField.PH, 3)
+
+    # Assert
+    assert chart.count == 101
+    assert chart.sigma == pytest.approx(0.1)
+    assert (chart.lcl, chart.ucl) == (pytest.approx(7.1), pytest.approx(7.7))
+    assert [point.batchid_internal for point in chart.points] == ["B0", "B1", "B2"]
+    assert chart.points[1].violations == [WesternElectricRule.BEYOND_3_SIGMA]
+    assert query_log.statements[0] == (crud.COA_STATISTICS_SQL, ["P1", "coa_ph"])
+    assert query_log.statements[1] == (crud.CONTROL_CHART_POINTS_SQL[CoaField.PH], ["P1", 3])
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_get_control_chart_without_measurements(query_log):
+    query_log.returns([], [], [{"?column?": 1}])
+
+    chart = await crud.get_control_chart("P1", CoaField.OSMOTIC_PRESSURE, 100)
+
+    assert (chart.count, chart.mean, chart.sigma, chart.ucl, chart.points) == (0, None, None, None, [])
+
+
+@pytest.mark.asyncio
+async def test_get_control_chart_single_batch_has_no_limits(query_log):
+    query_log.returns([{"count": 1, "mean": 300.0, "m2": 0.0}], chart_rows([300.0]))
+
+    chart = await crud.get_control_chart("P1", CoaField.OSMOTIC_PRESSURE, 100)
+
+    assert (chart.mean, chart.sigma, chart.lcl) == (300.0, None, None)
+    assert chart.points[0].violations == []
+
+
+@pytest.mark.asyncio
+async def test_get_control_chart_unknown_product(query_log):
+    with pytest.raises(ValueError):
+        await crud.get_control_chart("P404", CoaField.PH, 100)
+
+
+@pytest.mark.asyncio
+async def test_recompute_statistics_locks_and_rebuilds(query_log):
+    query_log.returns([], [{"count": 4}])
+
+    with patch("api.productlog.spc.in_transaction", transaction_on(query_log)):
+        count = await spc.recompute_statistics()
+
+    assert count == 4
+    assert query_log.statements == [
+        (spc.LOCK_STATISTICS_SQL, None),
+        (spc.RECOMPUTE_SQL, None),
+    ]
+    assert '"product_inventory_archive"' in spc.RECOMPUTE_SQL
+
+
+@patch("api.productlog.productlog.get_control_chart", new_callable=AsyncMock)
+def test_control_chart_endpoint(mock_chart):
+    mock_chart.return_value = {
+        "productid": "P1",
+        "field": "coa_ph",
+        "count": 0,
+        "points": [],
+    }
+
+    response = client.get("/product-details/P1/control-chart?field=coa_ph&points=50")
+
+    assert response.status_code == 200
+    mock_chart.assert_awaited_once_with("P1", CoaField.PH, 50)
+
+
+@patch("api.productlog.productlog.get_control_chart", new_callable=AsyncMock)
+def test_control_chart_endpoint_errors(mock_chart):
+    assert client.get("/product-details/P1/control-chart?field=coa_sterility").status_code == 400
+    assert client.get("/product-details/P1/control-chart?points=0").status_code == 422
+    mock_chart.assert_not_awaited()
+
+    mock_chart.side_effect = ValueError("Product with ID P404 not found")
+    assert client.get("/product-details/P404/control-chart").status_code == 404
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from tortoise import Tortoise, connections
+
+from api.productlog import crud
+from api.productlog.reservations import ReservationSweeper
+from models.productlog.pydantic import (AdjustmentReason,
+                                        ReservationCreateSchema,
+                                        StockAdjustmentItemSchema,
+                                        StockAdjustmentSchema)
+
+# These tests need real row locks, e.g. inside docker compose.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("DATABASE_TEST_URL"),
+    reason="DATABASE_TEST_URL is not set",
+)
+
+INSERT_BATCH_SQL = (
+    'INSERT INTO "product_inventory" (batchid_internal, batchid_external, productid, '
+    "basicmediumid, addictiveid, quantityinstock, productiondate, status, "
+    "productiondatetime, producedby, to_show, lastupdated, lastupdatedby) "
+    "VALUES ($1, 'BM-AD', 'P-CONC', 'BM', 'AD', $2, current_date, 'AVAILABLE(可用)', "
+    "now(), 'tester', true, now(), 'tester')"
+)
+INSERT_REQUEST_SQL = (
+    'INSERT INTO "requestdetails" (requestid, requestorname, requestdate, requestproductid, '
+    "requestunit, is_urgent, remarks, status, version) "
+    "VALUES ($1, 'tester', now(), 'P-CONC', 1, false, '', 'APPROVED', 1)"
+)
+LEDGER_SQL = (
+    'SELECT COALESCE(sum("delta"), 0) AS "total", count(*) AS "count" '
+    'FROM "inventory_transaction" WHERE "batchid_internal" = $1'
+)
+RESERVED_SQL = 'SELECT "quantityreserved" FROM "product_inventory" WHERE "batchid_internal" = $1'
+STOCK_SQL = 'SELECT "quantityinstock" FROM "product_inventory" WHERE "batchid_internal" = $1'
+LOG_SQL = (
+    'SELECT count(*) AS "count", COALESCE(sum("delta"), 0) AS "total", '
+    'min("quantity_after") AS "lowest" FROM "stock_adjustment" WHERE "batchid_internal" = $1'
+)
+
+
+@pytest.fixture(scope="module")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+async def db():
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_TEST_URL"),
+        modules={
+            "models": [
+                "models.accounts.tortoise",
+                "models.productlog.tortoise",
+                "models.productrequests.tortoise",
+            ]
+        },
+    )
+    await Tortoise.generate_schemas()
+    yield connections.get("default")
+    await Tortoise.close_connections()
+
+
+@pytest.fixture
+async def make_batch(db):
+    # Own batch IDs only, so other tests sharing the database are untouched
+    created = []
+
+    async def make(quantity: int) -> str:
+        batch_id = f"CONC-{uuid.uuid4().hex[:12]}"
+        await db.execute_query(INSERT_BATCH_SQL, [batch_id, quantity])
+        created.append(batch_id)
+        return batch_id
+
+    yield make
+    await db.execute_query(
+        'DELETE FROM "inventory_transaction" WHERE "batchid_internal" = ANY($1::varchar[])', [created]
+    )
+    await db.execute_query(
+        'DELETE FROM "reservation" WHERE "batchid_internal" = ANY($1::varchar[])', [created]
+    )
+    await db.execute_query(
+        'DELETE FROM "stock_adjustment" WHERE "batchid_internal" = ANY($1::varchar[])', [created]
+    )
+    await db.execute_query(
+        'DELETE FROM "product_inventory" WHERE "batchid_internal" = ANY($1::varchar[])', [created]
+    )
+
+
+@pytest.fixture
+async def approved_request(db):
+    request_id = f"CONC{uuid.uuid4().hex[:20]}"
+    await db.execute_query(INSERT_REQUEST_SQL, [request_id])
+    yield request_id
+    await db.execute_query('DELETE FROM "requestdetails" WHERE "requestid" = $1', [request_id])
+
+
+async def stock_and_log(db, batch_id):
+    stock = (await db.execute_query_dict(STOCK_SQL, [batch_id]))[0]["quantityinstock"]
+    log = (await db.execute_query_dict(LOG_SQL, [batch_id]))[0]
+    return stock, log
+
+
+@pytest.mark.asyncio
+async def test_concurrent_adjustments_never_oversell(db, make_batch):
+    batch_id = await make_batch(100)
+    adjustment = StockAdjustmentSchema(delta=-1, reason=AdjustmentReason.SHIPMENT)
+
+    results = await asyncio.gather(
+        *(crud.adjust_product_inventory(batch_id, adjustment, "tester") for _ in range(300)),
+        return_exceptions=True,
+    )
+
+    applied = [r for r in results if not isinstance(r, Exception)]
+    rejected = [r for r in results if isinstance(r, Exception)]
+    assert len(applied) == 100
+    assert all(isinstance(e, crud.InsufficientStockError) for e in rejected)
+    stock, log = await stock_and_log(db, batch_id)
+    assert stock == 0
+    assert (log["count"], log["total"], log["lowest"]) == (100, -100, 0)
+    # The batch was inserted behind the ledger's back, so it holds only the adjustments
+    ledger = (await db.execute_query_dict(LEDGER_SQL, [batch_id]))[0]
+    assert (ledger["count"], ledger["total"]) == (100, -100)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_mixed_adjustments_add_up(db, make_batch):
+    batch_id = await make_batch(50)
+    take = StockAdjustmentSchema(delta=-3, reason=AdjustmentReason.SHIPMENT)
+    give = StockAdjustmentSchema(delta=2, reason=AdjustmentReason.RETURN)
+
+    results = await asyncio.gather(
+        *(
+            crud.adjust_product_inventory(batch_id, take if i % 2 else give, "tester")
+            for i in range(400)
+        ),
+        return_exceptions=True,
+    )
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    assert all(isinstance(e, crud.InsufficientStockError) for e in errors)
+    stock, log = await stock_and_log(db, batch_id)
+    # Whatever was rejected, the ledger explains the stock exactly
+    assert stock == 50 + log["total"]
+    assert stock >= 0 and log["lowest"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_batches_in_opposite_order_do_not_deadlock(db, make_batch):
+    first, second = await make_batch(500), await make_batch(500)
+
+    def items(a, b):
+        return [
+            StockAdjustmentItemSchema(batchid_internal=a, delta=-1, reason=AdjustmentReason.SHIPMENT),
+            StockAdjustmentItemSchema(batchid_internal=b, delta=-1, reason=AdjustmentReason.SHIPMENT),
+        ]
+
+    await asyncio.gather(
+        *(
+            crud.adjust_product_inventory_batch(
+                items(first, second) if i % 2 else items(second, first), "tester"
+            )
+            for i in range(200)
+        )
+    )
+
+    for batch_id in (first, second):
+        stock, log = await stock_and_log(db, batch_id)
+        assert stock == 300
+        assert (log["count"], log["total"]) == (200, -200)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reservations_never_overbook(db, make_batch, approved_request):
+    batch_id = await make_batch(100)
+    data = ReservationCreateSchema(requestid=approved_request, quantity=3)
+
+    results = await asyncio.gather(
+        *(crud.reserve_product_inventory(batch_id, data, "tester", 60) for _ in range(100)),
+        return_exceptions=True,
+    )
+
+    held = [r for r in results if not isinstance(r, Exception)]
+    rejected = [r for r in results if isinstance(r, Exception)]
+    assert len(held) == 33
+    assert all(isinstance(e, crud.InsufficientStockError) for e in rejected)
+    reserved = (await db.execute_query_dict(RESERVED_SQL, [batch_id]))[0]["quantityreserved"]
+    assert reserved == 99
+
+    # Releases racing the sweeper give each hold back exactly once
+    await db.execute_query(
+        'UPDATE "reservation" SET "expiresat" = now() - interval \'1 minute\' '
+        'WHERE "batchid_internal" = $1', [batch_id]
+    )
+    await asyncio.gather(
+        ReservationSweeper(batch_size=7).sweep(),
+        *(crud.release_reservation(r.id) for r in held[:10]),
+        return_exceptions=True,
+    )
+    reserved = (await db.execute_query_dict(RESERVED_SQL, [batch_id]))[0]["quantityreserved"]
+    assert reserved == 0
@@ -1,6 +1,8 @@
+from unittest.mock import AsyncMock
+
 import pytest
-import random
 import tortoise.models
+from models.productlog.batchids import batch_ids
 from models.productlog.tortoise import ProductDetails, ProductInventory
 
 
@@ -35,8 +37,32 @@ async def test_productinventory_save_sets_batchids(monkeypatch):
         return None
 
     monkeypatch.setattr(tortoise.models.Model, "save", dummy_save)
-    # Patch random.choices to return a fixed string
-    monkeypatch.setattr(random, "choices", lambda *a, **k: list("ABC123"))
+    allocate = AsyncMock(return_value=["BMID-AID-00000A"])
+    monkeypatch.setattr(batch_ids, "allocate", allocate)
     await obj.save()
     assert obj.batchid_external == "BMID-AID"
-    assert obj.batchid_internal == "BMID-AID-ABC123"
+    assert obj.batchid_internal == "BMID-AID-00000A"
+    allocate.assert_awaited_once_with("BMID", "AID", 1)
+
+
+@pytest.mark.asyncio
+async def test_productinventory_bulk_create_allocates_per_prefix(monkeypatch):
+    objs = [
+        ProductInventory(basicmediumid="BM1", addictiveid="AD1"),
+        ProductInventory(basicmediumid="BM2", addictiveid="AD2"),
+        ProductInventory(basicmediumid="BM1", addictiveid="AD1"),
+        ProductInventory(basicmediumid="BM1", addictiveid="AD1", batchid_internal="KEPT"),
+    ]
+    created = []
+
+    async def dummy_bulk_create(cls, objects, *args, **kwargs):
+        created.extend(objects)
+
+    monkeypatch.setattr(tortoise.models.Model, "bulk_create", classmethod(dummy_bulk_create))
+    allocate = AsyncMock(side_effect=lambda bm, ad, count: [f"{bm}-{ad}-{i}" for i in range(count)])
+    monkeypatch.setattr(batch_ids, "allocate", allocate)
+
+    await ProductInventory.bulk_create(iter(objs))
+
+    assert [obj.batchid_internal for obj in created] == ["BM1-AD1-0", "BM2-AD2-0", "BM1-AD1-1", "KEPT"]
+    assert allocate.await_count == 2
@@ -1,11 +1,13 @@
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
-from fastapi import HTTPException
+from fastapi import HTTPException, Response
 from fastapi.testclient import TestClient
 from datetime import datetime
 
 # Import the router to test
 from api.productrequests import productrequests as pr
+from models.productrequests.pydantic import RequestDetailsCreate
+from models.requests.versioning import VersionConflictError
 
 # Helper: mock auth_details
 def make_auth_details(roles, username="user1"):
@@ -20,10 +22,11 @@ async def test_create_request_success(mock_get_request, mock_create_request):
     req.requestorname = ""
     req.requestid = "REQ1"
     mock_create_request.return_value = req
-    mock_get_request.return_value = "response_obj"
     auth_details = make_auth_details(["REQUESTOR"], "alice")
     result = await pr.create_request(req, auth_details)
-    assert result == "response_obj"
+    # create_request already returns the enriched response
+    assert result is req
+    mock_get_request.assert_not_awaited()
     assert req.requestorname == "alice"
     assert req.remarks == ""
 
@@ -43,6 +46,14 @@ async def test_get_request_admin(mock_get_request):
     result = await pr.get_request("REQ1", auth_details)
     assert result == mock_get_request.return_value
 
+@pytest.mark.asyncio
+@patch("api.productrequests.productrequests.crud.get_request", new_callable=AsyncMock)
+async def test_get_request_sends_etag(mock_get_request):
+    mock_get_request.return_value = MagicMock(requestorname="alice", version=3)
+    response = Response()
+    await pr.get_request("REQ1", make_auth_details(["ADMIN"]), response)
+    assert response.headers["ETag"] == '"3"'
+
 @pytest.mark.asyncio
 @patch("api.productrequests.productrequests.crud.get_request", new_callable=AsyncMock)
 async def test_get_request_requestor(mock_get_request):
@@ -156,6 +167,14 @@ async def test_delete_request_production_manager(mock_delete_request):
     assert result == {"detail": "Request deleted"}
     mock_delete_request.assert_awaited_once_with("REQ1")
 
+@pytest.mark.asyncio
+@patch("api.productrequests.productrequests.hub")
+@patch("api.productrequests.productrequests.crud.delete_request", new_callable=AsyncMock)
+async def test_delete_request_tells_the_requestor(mock_delete_request, mock_hub):
+    mock_delete_request.return_value = "alice"
+    await pr.delete_request("REQ1", make_auth_details(["ADMIN"]))
+    mock_hub.publish.assert_called_once_with(pr.REQUESTS_CHANNEL, "deleted", "REQ1", owner="alice")
+
 @pytest.mark.asyncio
 async def test_delete_request_forbidden():
     auth_details = make_auth_details(["REQUESTOR"])
@@ -176,6 +195,51 @@ async def test_update_request_approval_success(mock_update_request, mock_get_req
     assert result == "updated"
     mock_update_request.assert_awaited_once()
 
+@pytest.mark.asyncio
+@patch("api.productrequests.productrequests.crud.get_request", new_callable=AsyncMock)
+@patch("api.productrequests.productrequests.crud.update_request", new_callable=AsyncMock)
+async def test_update_request_approval_conflict(mock_update_request, mock_get_request):
+    req_obj = MagicMock(remarks="", version=2)
+    mock_get_request.return_value = req_obj
+    mock_update_request.side_effect = VersionConflictError("Request REQ1 was modified")
+    auth_details = make_auth_details(["REQUEST_APPROVER"], "approver")
+    with pytest.raises(HTTPException) as exc:
+        await pr.update_request_approval("REQ1", auth_details)
+    assert exc.value.status_code == 412
+    # The status change only applies to the version that was checked
+    assert mock_update_request.await_args.args[2] == 2
+
+@pytest.mark.asyncio
+@patch("api.productrequests.productrequests.crud.get_request", new_callable=AsyncMock)
+@patch("api.productrequests.productrequests.crud.update_request", new_callable=AsyncMock)
+async def test_update_request_if_match(mock_update_request, mock_get_request):
+    mock_get_request.return_value = MagicMock(requestorname="alice")
+    mock_update_request.return_value = "updated"
+    req = RequestDetailsCreate(
+        requestorname="alice", requestproductid="P1", requestunit=1, remarks="r"
+    )
+    auth_details = make_auth_details(["REQUESTOR"], "alice")
+    response = Response()
+    result = await pr.update_request(
+        "REQ1", req, auth_details, if_match='"4"', response=response
+    )
+    assert result == "updated"
+    assert mock_update_request.await_args.args[2] == 4
+    # No version on the mocked result, so no ETag either
+    assert "ETag" not in response.headers
+
+@pytest.mark.asyncio
+@patch("api.productrequests.productrequests.crud.get_request", new_callable=AsyncMock)
+@patch("api.productrequests.productrequests.crud.update_request", new_callable=AsyncMock)
+async def test_update_request_approval_sends_etag(mock_update_request, mock_get_request):
+    mock_get_request.return_value = MagicMock(remarks="", version=2)
+    mock_update_request.return_value = {"requestid": "REQ1", "version": 3}
+    response = Response()
+    await pr.update_request_approval(
+        "REQ1", make_auth_details(["REQUEST_APPROVER"], "approver"), response
+    )
+    assert response.headers["ETag"] == '"3"'
+
 @pytest.mark.asyncio
 async def test_update_request_approval_forbidden():
     auth_details = make_auth_details(["REQUESTOR"])
@@ -3,18 +3,36 @@ import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 from datetime import datetime
 
+from fastapi import HTTPException
+
 import api.productrequests.crud as crud
 from models.productrequests.pydantic import (
     RequestDetailsCreate,
-    RequestDetailsResponse
+    RequestDetailsResponse,
+    RequestStatusUpdate
 )
+from models.requests.versioning import VersionConflictError
+
+# A request row joined with its product names, as the crud statements return it
+REQUEST_ROW = {
+    "requestid": "REQ1",
+    "requestorname": "alice",
+    "requestdate": datetime(2025, 7, 3, 12, 0, 0),
+    "requestproductid": "P123",
+    "requestunit": 5,
+    "is_urgent": True,
+    "remarks": "urgent",
+    "status": "PENDING",
+    "fullfillername": None,
+    "fullfilldate": None,
+    "version": 1,
+    "productnamezh": "产品",
+    "productnameen": "Product",
+}
 
 
 @pytest.mark.asyncio
-@patch("api.productrequests.crud.ProductDetails")
-@patch("api.productrequests.crud.RequestDetails")
-@patch("api.productrequests.crud.get_request")
-async def test_create_request(mock_get_request, mock_RequestDetails, mock_ProductDetails):
+async def test_create_request(query_log):
     # Setup
     data = RequestDetailsCreate(
         requestorname="alice",
@@ -24,25 +42,25 @@ async def test_create_request(mock_get_request, mock_RequestDetails, mock_Produc
         is_urgent=True,
         remarks="urgent request",
     )
-    # Product exists
-    mock_ProductDetails.get = AsyncMock()
-    mock_RequestDetails.create = AsyncMock(return_value=MagicMock(requestid="REQ1"))
-    mock_get_request.return_value = "response_obj"
+    query_log.returns([REQUEST_ROW])
 
     # Act
     result = await crud.create_request(data)
 
-    # Assert
-    mock_ProductDetails.get.assert_awaited_once_with(productid="P123")
-    mock_RequestDetails.create.assert_awaited_once()
-    mock_get_request.assert_awaited_once_with("REQ1")
-    assert result == "response_obj"
+    # Assert: the product check, insert and read back are one statement
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql == crud.REQUEST_INSERT_SQL
+    assert params[1:] == [
+        "alice", data.requestdate, "P123", 5, True, "urgent request"
+    ]
+    assert isinstance(result, RequestDetailsResponse)
+    assert result.requestid == "REQ1"
+    assert result.product.productnameen == "Product"
 
 
 @pytest.mark.asyncio
-@patch("api.productrequests.crud.ProductDetails")
-@patch("api.productrequests.crud.RequestDetails")
-async def test_create_request_product_not_exist(mock_RequestDetails, mock_ProductDetails):
+async def test_create_request_product_not_exist(query_log):
     data = RequestDetailsCreate(
         requestorname="alice",
         requestdate=datetime.utcnow(),
@@ -51,44 +69,36 @@ async def test_create_request_product_not_exist(mock_RequestDetails, mock_Produc
         is_urgent=True,
         remarks="urgent request",
     )
-    # Product does not exist
-    mock_ProductDetails.get = AsyncMock(side_effect=crud.DoesNotExist)
+    # Product does not exist, so nothing is inserted
+    query_log.returns([])
 
     with pytest.raises(crud.HTTPException) as exc:
         await crud.create_request(data)
     assert exc.value.status_code == 400
     assert "does not exist" in exc.value.detail
+    assert len(query_log) == 1
 
 
 @pytest.mark.asyncio
-@patch("api.productrequests.crud.ProductDetails")
-@patch("api.productrequests.crud.RequestDetails")
-async def test_get_request(mock_RequestDetails, mock_ProductDetails):
+async def test_get_request(query_log):
     # Setup
-    mock_obj = MagicMock()
-    mock_obj.requestid = "REQ1"
-    mock_obj.requestorname = "alice"
-    mock_obj.requestdate = datetime(2025, 7, 3, 12, 0, 0)
-    mock_obj.requestproductid = "P123"
-    mock_obj.requestunit = 5
-    mock_obj.is_urgent = True
-    mock_obj.remarks = "urgent"
-    mock_obj.status = "PENDING"
-    mock_obj.fullfillername = None
-    mock_obj.fullfilldate = None
-    mock_RequestDetails.get = AsyncMock(return_value=mock_obj)
-
-    mock_product = MagicMock()
-    mock_product.productid = "P123"
-    mock_product.productnamezh = "产品"
-    mock_product.productnameen = "Product"
-    mock_ProductDetails.get = AsyncMock(return_value=mock_product)
+    query_log.returns([REQUEST_ROW])
 
     result = await crud.get_request("REQ1")
+    assert query_log.statements == [(crud.REQUEST_SELECT_SQL, ["REQ1"])]
     assert isinstance(result, RequestDetailsResponse)
     assert result.requestid == "REQ1"
     assert result.product.productid == "P123"
     assert result.product.productnamezh == "产品"
+    assert result.version == 1
+
+
+@pytest.mark.asyncio
+async def test_get_request_not_found(query_log):
+    query_log.returns([])
+
+    with pytest.raises(crud.DoesNotExist):
+        await crud.get_request("REQ1")
 
 
 @pytest.mark.asyncio
@@ -107,6 +117,7 @@ async def test_list_requests(mock_RequestDetails, mock_ProductDetails):
     mock_obj1.status = "PENDING"
     mock_obj1.fullfillername = None
     mock_obj1.fullfilldate = None
+    mock_obj1.version = 1
 
     mock_obj2 = MagicMock()
     mock_obj2.requestid = "REQ2"
@@ -119,6 +130,7 @@ async def test_list_requests(mock_RequestDetails, mock_ProductDetails):
     mock_obj2.status = "APPROVED"
     mock_obj2.fullfillername = "admin"
     mock_obj2.fullfilldate = datetime(2025, 7, 3, 14, 0, 0)
+    mock_obj2.version = 3
 
     mock_RequestDetails.all = AsyncMock(return_value=[mock_obj1, mock_obj2])
 
@@ -137,16 +149,13 @@ async def test_list_requests(mock_RequestDetails, mock_ProductDetails):
     assert result[1].requestid == "REQ2"
     assert result[0].product.productid == "P123"
     assert result[1].product.productid == "P124"
+    assert result[1].version == 3
 
 
 @pytest.mark.asyncio
-@patch("api.productrequests.crud.RequestDetails")
-@patch("api.productrequests.crud.get_request")
-async def test_update_request(mock_get_request, mock_RequestDetails):
+async def test_update_request(query_log):
     # Setup
-    mock_RequestDetails.filter.return_value.update = AsyncMock()
-    mock_RequestDetails.get = AsyncMock(return_value=MagicMock(requestid="REQ1"))
-    mock_get_request.return_value = "updated_response"
+    query_log.returns([{**REQUEST_ROW, "remarks": "update", "version": 2}])
 
     data = RequestDetailsCreate(
         requestorname="alice",
@@ -158,17 +167,106 @@ async def test_update_request(mock_get_request, mock_RequestDetails):
     )
 
     result = await crud.update_request("REQ1", data)
-    mock_RequestDetails.filter.assert_called_once_with(requestid="REQ1")
-    mock_RequestDetails.filter.return_value.update.assert_awaited_once()
-    mock_RequestDetails.get.assert_awaited_once_with(requestid="REQ1")
-    mock_get_request.assert_awaited_once_with("REQ1")
-    assert result == "updated_response"
+    assert len(query_log) == 1
+    sql, params = query_log.statements[0]
+    assert sql.startswith('WITH updated AS (UPDATE "requestdetails" r SET')
+    assert '"version" = r."version" + 1' in sql
+    assert params[:3] == ["REQ1", None, "P123"]
+    assert "update" in params
+    assert result.remarks == "update"
+    assert result.version == 2
 
 
 @pytest.mark.asyncio
-@patch("api.productrequests.crud.RequestDetails")
-async def test_delete_request(mock_RequestDetails):
-    mock_RequestDetails.filter.return_value.delete = AsyncMock()
-    await crud.delete_request("REQ1")
-    mock_RequestDetails.filter.assert_called_once_with(requestid="REQ1")
-    mock_RequestDetails.filter.return_value.delete.assert_awaited_once()
+async def test_update_request_version_conflict(query_log):
+    query_log.returns([], [{"version": 3, "product_exists": True}])
+    data = RequestDetailsCreate(
+        requestorname="alice", requestproductid="P123", requestunit=5, remarks="update"
+    )
+
+    with pytest.raises(VersionConflictError):
+        await crud.update_request("REQ1", data, 2)
+    assert query_log.statements[0][1][:2] == ["REQ1", 2]
+    assert query_log.statements[1] == (crud.REQUEST_STATE_SQL, ["REQ1", "P123"])
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_update_request_not_found(query_log):
+    query_log.returns([])
+    data = RequestDetailsCreate(
+        requestorname="alice", requestproductid="P123", requestunit=5, remarks="update"
+    )
+
+    with pytest.raises(crud.DoesNotExist):
+        await crud.update_request("REQ1", data)
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_update_request_missing_product_writes_nothing(query_log):
+    # The guard in the UPDATE matched no row, the request itself exists
+    query_log.returns([], [{"version": 1, "product_exists": False}])
+    data = RequestDetailsCreate(
+        requestorname="alice", requestproductid="NOPE", requestunit=5, remarks="update"
+    )
+
+    with pytest.raises(HTTPException) as exc_info:
+        await crud.update_request("REQ1", data)
+    assert exc_info.value.status_code == 400
+    sql = query_log.statements[0][0]
+    assert 'EXISTS (SELECT 1 FROM "productdetails"' in sql.split("RETURNING")[0]
+
+
+@pytest.mark.asyncio
+async def test_update_request_keeps_request_date(query_log):
+    query_log.returns([REQUEST_ROW])
+    data = RequestDetailsCreate(
+        requestorname="alice", requestproductid="P123", requestunit=5, remarks="update"
+    )
+
+    await crud.update_request("REQ1", data)
+    sql, params = query_log.statements[0]
+    assert '"requestdate" = $' not in sql
+    assert '"version" = $' not in sql.split("WHERE")[0]
+
+
+@pytest.mark.asyncio
+async def test_update_request_status_sends_enum_values(query_log):
+    query_log.returns([{**REQUEST_ROW, "status": "APPROVED"}])
+
+    result = await crud.update_request(
+        "REQ1", RequestStatusUpdate(status="APPROVED", remarks="ok"), 1
+    )
+    sql, params = query_log.statements[0]
+    assert "APPROVED" in params
+    # Only the fields that were given are written
+    assert '"fullfillername" = $' not in sql
+    assert result.status == "APPROVED"
+
+
+@pytest.mark.asyncio
+async def test_delete_request(query_log):
+    query_log.returns([{"requestorname": "alice"}])
+    assert await crud.delete_request("REQ1") == "alice"
+    # The delete marks the request's day for the rollups in the same statement
+    assert query_log.statements == [(crud.REQUEST_DELETE_SQL, ["REQ1"])]
+    assert '"request_rollup_dirty"' in crud.REQUEST_DELETE_SQL
+
+
+@pytest.mark.asyncio
+async def test_delete_missing_request(query_log):
+    assert await crud.delete_request("REQ404") is None
+
+
+def test_update_request_releases_holds_of_closed_requests():
+    # A fulfilled or rejected request gives back its reservations in the update
+    assert 'UPDATE "reservation" h' in crud.REQUEST_UPDATE_SQL
+    assert '"quantityreserved" = GREATEST(' in crud.REQUEST_UPDATE_SQL
+
+
+@pytest.mark.parametrize("sql", [crud.REQUEST_INSERT_SQL, crud.REQUEST_UPDATE_SQL])
+def test_request_writes_mark_their_day(sql):
+    assert 'INSERT INTO "request_rollup_dirty"' in sql
+    # DO NOTHING would not hold the mark until the write commits
+    assert 'DO UPDATE SET "day"' in sql
@@ -0,0 +1,142 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from api.realtime import realtime
+from api.realtime.hub import (INVENTORY_CHANNEL, REQUESTS_CHANNEL, RESYNC_FRAME,
+                              EventHub, hub)
+
+
+def test_publish_without_subscribers_skips_serialization():
+    test_hub = EventHub()
+    # An object json cannot encode would raise if it were serialized
+    assert test_hub.publish(INVENTORY_CHANNEL, "created", "B1", object()) == 0
+
+
+def test_publish_serializes_once_for_all_subscribers():
+    test_hub = EventHub()
+    first = test_hub.subscribe("alice", ["PRODUCER"])
+    second = test_hub.subscribe("bob", ["ADMIN"])
+
+    delivered = test_hub.publish(
+        INVENTORY_CHANNEL, "updated", "B1", {"quantityinstock": 5}
+    )
+
+    assert delivered == 2
+    frame_a = first.queue.get_nowait()
+    frame_b = second.queue.get_nowait()
+    # Same frame object, not just an equal string
+    assert frame_a is frame_b
+    assert json.loads(frame_a) == {
+        "channel": "inventory",
+        "action": "updated",
+        "key": "B1",
+        "data": {"quantityinstock": 5},
+    }
+
+
+def test_requests_channel_filtered_by_role():
+    test_hub = EventHub()
+    admin = test_hub.subscribe("boss", ["ADMIN"])
+    owner = test_hub.subscribe("alice", ["REQUESTOR"])
+    other = test_hub.subscribe("bob", ["REQUESTOR"])
+
+    delivered = test_hub.publish(
+        REQUESTS_CHANNEL, "created", "REQ1", {"requestid": "REQ1"}, owner="alice"
+    )
+
+    assert delivered == 2
+    assert not admin.queue.empty()
+    assert not owner.queue.empty()
+    assert other.queue.empty()
+
+
+def test_deleted_request_without_owner_only_reaches_board_roles():
+    test_hub = EventHub()
+    manager = test_hub.subscribe("boss", ["PRODUCTION_MANAGER"])
+    requestor = test_hub.subscribe("alice", ["REQUESTOR"])
+
+    test_hub.publish(REQUESTS_CHANNEL, "deleted", "REQ1")
+
+    assert json.loads(manager.queue.get_nowait()) == {
+        "channel": "requests",
+        "action": "deleted",
+        "key": "REQ1",
+    }
+    assert requestor.queue.empty()
+
+
+def test_deleted_request_reaches_its_requestor():
+    test_hub = EventHub()
+    owner = test_hub.subscribe("alice", ["REQUESTOR"])
+    other = test_hub.subscribe("bob", ["REQUESTOR"])
+
+    assert test_hub.publish(REQUESTS_CHANNEL, "deleted", "REQ1", owner="alice") == 1
+
+    assert json.loads(owner.queue.get_nowait())["action"] == "deleted"
+    assert other.queue.empty()
+
+
+def test_channel_subscription():
+    test_hub = EventHub()
+    subscriber = test_hub.subscribe("alice", ["ADMIN"], [REQUESTS_CHANNEL])
+    assert test_hub.publish(INVENTORY_CHANNEL, "created", "B1") == 0
+    assert subscriber.queue.empty()
+
+    with pytest.raises(ValueError):
+        test_hub.subscribe("alice", ["ADMIN"], ["unknown"])
+
+
+def test_slow_subscriber_gets_resync():
+    test_hub = EventHub(queue_size=2)
+    subscriber = test_hub.subscribe("alice", ["ADMIN"])
+    for i in range(3):
+        test_hub.publish(INVENTORY_CHANNEL, "updated", f"B{i}")
+
+    assert subscriber.queue.qsize() == 1
+    assert subscriber.queue.get_nowait() == RESYNC_FRAME
+
+
+def test_unsubscribe():
+    test_hub = EventHub()
+    subscriber = test_hub.subscribe("alice", ["ADMIN"])
+    assert len(test_hub) == 1
+    test_hub.unsubscribe(subscriber)
+    assert len(test_hub) == 0
+    assert test_hub.publish(INVENTORY_CHANNEL, "created", "B1") == 0
+
+
+def test_parse_channels():
+    assert realtime.parse_channels(None) == ["inventory", "requests"]
+    assert realtime.parse_channels("requests, ") == ["requests"]
+
+
+def test_websocket_receives_published_events():
+    app = FastAPI()
+    app.include_router(realtime.router)
+    client = TestClient(app)
+    token = realtime.auth_handler.encode_token("alice", ["REQUESTOR"])
+
+    with client.websocket_connect(f"/ws?token={token}&channels=requests") as ws:
+        assert len(hub) == 1
+        # Publish on the server's event loop, where the subscriber queue lives
+        ws.portal.call(
+            hub.publish, REQUESTS_CHANNEL, "created", "REQ2", {"a": 1}, "bob"
+        )
+        ws.portal.call(
+            hub.publish, REQUESTS_CHANNEL, "created", "REQ1", {"a": 1}, "alice"
+        )
+        assert json.loads(ws.receive_text())["key"] == "REQ1"
+
+
+def test_websocket_rejects_invalid_token():
+    app = FastAPI()
+    app.include_router(realtime.router)
+    client = TestClient(app)
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/ws?token=invalid.token.value") as ws:
+            ws.receive_text()
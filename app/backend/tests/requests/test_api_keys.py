@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+
+from models.requests.api_keys import API_KEY_PREFIX, ApiKeyHandler
+
+
+def make_key(**overrides):
+    key = MagicMock(
+        username="bioreactor3",
+        scopes=["inventory:write"],
+        prefix="sct_abcdefgh",
+        rate_limit_per_minute=600,
+        expires_at=None,
+    )
+    for name, value in overrides.items():
+        setattr(key, name, value)
+    return key
+
+
+def mock_lookup(mock_ApiKey, key):
+    mock_ApiKey.filter.return_value.first = AsyncMock(return_value=key)
+
+
+@pytest.fixture(autouse=True)
+def mock_UserRole():
+    with patch("models.requests.api_keys.UserRole") as mock:
+        mock.filter.return_value.values_list = AsyncMock(return_value=["PRODUCER"])
+        yield mock
+
+
+def test_generate_api_key():
+    handler = ApiKeyHandler()
+    api_key, prefix, key_hash = handler.generate_api_key()
+    assert api_key.startswith(API_KEY_PREFIX)
+    assert api_key.startswith(prefix)
+    assert key_hash == handler.hash_api_key(api_key)
+    assert len(key_hash) == 64
+    assert handler.generate_api_key()[0] != api_key
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_verify_caches_key(mock_ApiKey):
+    handler = ApiKeyHandler()
+    mock_lookup(mock_ApiKey, make_key())
+
+    first = await handler.verify("sct_key", "inventory:write")
+    second = await handler.verify("sct_key", "inventory:write")
+
+    assert first == second
+    assert first["username"] == "bioreactor3"
+    assert first["list_of_roles"] == ["PRODUCER"]
+    assert mock_ApiKey.filter.call_count == 1
+    assert (
+        mock_ApiKey.filter.call_args.kwargs["key_hash"]
+        == handler.hash_api_key("sct_key")
+    )
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_verify_uses_current_roles(mock_ApiKey, mock_UserRole):
+    handler = ApiKeyHandler()
+    # The account's roles now, whatever they were when the key was created
+    mock_lookup(mock_ApiKey, make_key())
+    mock_UserRole.filter.return_value.values_list = AsyncMock(
+        return_value=["REQUESTOR", "FULFILLER"]
+    )
+
+    details = await handler.verify("sct_key", "inventory:write")
+
+    assert details["list_of_roles"] == ["FULFILLER", "REQUESTOR"]
+    mock_UserRole.filter.assert_called_once_with(username="bioreactor3")
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_invalidate_user_rereads_roles(mock_ApiKey, mock_UserRole):
+    handler = ApiKeyHandler()
+    mock_lookup(mock_ApiKey, make_key())
+    await handler.verify("sct_key", "inventory:write")
+    await handler.verify("sct_key", "inventory:write")
+    assert mock_UserRole.filter.call_count == 1
+
+    handler.invalidate_user("someone_else")
+    await handler.verify("sct_key", "inventory:write")
+    assert mock_UserRole.filter.call_count == 1
+
+    mock_UserRole.filter.return_value.values_list = AsyncMock(return_value=[])
+    handler.invalidate_user("bioreactor3")
+    details = await handler.verify("sct_key", "inventory:write")
+    assert details["list_of_roles"] == []
+    # The key keeps its rate limit bucket
+    assert handler.hash_api_key("sct_key") in handler._buckets
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_verify_unknown_key(mock_ApiKey):
+    handler = ApiKeyHandler()
+    mock_lookup(mock_ApiKey, None)
+    with pytest.raises(HTTPException) as excinfo:
+        await handler.verify("sct_bad", "inventory:write")
+    assert excinfo.value.status_code == 401
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_verify_expired_key(mock_ApiKey):
+    handler = ApiKeyHandler()
+    expired = datetime.now(timezone.utc) - timedelta(minutes=1)
+    mock_lookup(mock_ApiKey, make_key(expires_at=expired))
+    with pytest.raises(HTTPException) as excinfo:
+        await handler.verify("sct_key", "inventory:write")
+    assert excinfo.value.status_code == 401
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_verify_missing_scope(mock_ApiKey):
+    handler = ApiKeyHandler()
+    mock_lookup(mock_ApiKey, make_key())
+    with pytest.raises(HTTPException) as excinfo:
+        await handler.verify("sct_key", "requests:write")
+    assert excinfo.value.status_code == 403
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_verify_rate_limit_per_key(mock_ApiKey):
+    handler = ApiKeyHandler()
+    mock_lookup(mock_ApiKey, make_key(rate_limit_per_minute=2))
+
+    await handler.verify("sct_key", "inventory:write")
+    await handler.verify("sct_key", "inventory:write")
+    with pytest.raises(HTTPException) as excinfo:
+        await handler.verify("sct_key", "inventory:write")
+    assert excinfo.value.status_code == 429
+    assert int(excinfo.value.headers["Retry-After"]) >= 1
+
+    # another key has its own bucket
+    await handler.verify("sct_other", "inventory:write")
+
+
+@pytest.mark.asyncio
+@patch("models.requests.api_keys.ApiKey")
+async def test_invalidate_forces_lookup(mock_ApiKey):
+    handler = ApiKeyHandler()
+    mock_lookup(mock_ApiKey, make_key())
+    await handler.verify("sct_key", "inventory:write")
+    handler.invalidate(handler.hash_api_key("sct_key"))
+    mock_lookup(mock_ApiKey, None)
+    with pytest.raises(HTTPException):
+        await handler.verify("sct_key", "inventory:write")
+
+
+@pytest.mark.asyncio
+async def test_auth_or_api_key_prefers_bearer_token():
+    handler = ApiKeyHandler()
+    token = handler.auth_handler.encode_token("alice", ["ADMIN"])
+    dependency = handler.auth_or_api_key("inventory:write")
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    with patch.object(handler, "verify", new_callable=AsyncMock) as mock_verify:
+        result = await dependency(auth=credentials, api_key="sct_key")
+    assert result["username"] == "alice"
+    mock_verify.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_auth_or_api_key_uses_api_key():
+    handler = ApiKeyHandler()
+    dependency = handler.auth_or_api_key("inventory:write")
+    with patch.object(handler, "verify", new_callable=AsyncMock) as mock_verify:
+        mock_verify.return_value = {"username": "bioreactor3"}
+        result = await dependency(auth=None, api_key="sct_key")
+    assert result == {"username": "bioreactor3"}
+    mock_verify.assert_awaited_once_with("sct_key", "inventory:write")
+
+
+@pytest.mark.asyncio
+async def test_auth_or_api_key_without_credentials():
+    dependency = ApiKeyHandler().auth_or_api_key("inventory:write")
+    with pytest.raises(HTTPException) as excinfo:
+        await dependency(auth=None, api_key=None)
+    assert excinfo.value.status_code == 403
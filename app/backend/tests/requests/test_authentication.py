@@ -22,6 +22,29 @@ def test_get_password_hash_and_verify_password():
     assert not handler.verify_password("wrongpassword", hashed)
 
 
+def test_needs_rehash_on_cost_change():
+    old = auth_module.build_pwd_context("bcrypt", 4)
+    new = auth_module.build_pwd_context("bcrypt", 5)
+    hashed = old.hash("testpassword123")
+    assert not old.needs_update(hashed)
+    assert new.needs_update(hashed)
+    assert new.verify("testpassword123", hashed)
+
+
+def test_needs_rehash_on_scheme_change():
+    old = auth_module.build_pwd_context("bcrypt", 4)
+    new = auth_module.build_pwd_context("pbkdf2_sha256", 1000)
+    hashed = old.hash("testpassword123")
+    assert new.verify("testpassword123", hashed)
+    assert new.needs_update(hashed)
+    assert new.identify(new.hash("testpassword123")) == "pbkdf2_sha256"
+
+
+def test_default_context_accepts_any_bcrypt_cost():
+    hashed = auth_module.build_pwd_context("bcrypt", 4).hash("testpassword123")
+    assert not auth_module.build_pwd_context("bcrypt").needs_update(hashed)
+
+
 def test_encode_and_decode_token():
     handler = auth_module.AuthHandler()
     username = "user123"
@@ -69,6 +92,28 @@ def test_auth_wrapper():
     result = handler.auth_wrapper(credentials)
     assert result["username"] == username
     assert result["list_of_roles"] == list_of_roles
+    assert len(result["jti"]) == 32
+
+
+def test_encode_token_ids_are_unique():
+    handler = auth_module.AuthHandler()
+    first = handler.decode_token_payload(handler.encode_token("user123", []))
+    second = handler.decode_token_payload(handler.encode_token("user123", []))
+    assert first["jti"] != second["jti"]
+
+
+def test_auth_wrapper_rejects_revoked_token(monkeypatch):
+    handler = auth_module.AuthHandler()
+    revoked = auth_module.revocation_list.__class__()
+    monkeypatch.setattr(auth_module, "revocation_list", revoked)
+    token = handler.encode_token("user123", ["ADMIN"])
+    payload = handler.decode_token_payload(token)
+    revoked.add(payload["jti"], payload["exp"])
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    with pytest.raises(HTTPException) as excinfo:
+        handler.auth_wrapper(credentials)
+    assert excinfo.value.status_code == 401
+    assert "revoked" in str(excinfo.value.detail)
 
 
 def test_encode_and_decode_verification_token():
@@ -103,3 +148,12 @@ def test_decode_verification_token_invalid():
         handler.decode_verification_token(invalid_token)
     assert excinfo.value.status_code == 401
     assert "Invalid verification token" in str(excinfo.value.detail)
+
+
+def test_generate_refresh_token():
+    handler = auth_module.AuthHandler()
+    token, token_hash = handler.generate_refresh_token()
+    other_token, _ = handler.generate_refresh_token()
+    assert token != other_token
+    assert len(token_hash) == 64
+    assert handler.hash_refresh_token(token) == token_hash
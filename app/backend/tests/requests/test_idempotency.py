@@ -0,0 +1,185 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from models.requests.idempotency import (CLAIM_SQL, COMPLETE_SQL, RELEASE_SQL,
+                                         SELECT_SQL, IdempotencyStore,
+                                         hash_request)
+
+
+class FakeConnection:
+    """Just enough of the idempotencyrecord SQL for one worker."""
+
+    def __init__(self):
+        self.rows = {}
+        self.execute_query = AsyncMock(side_effect=self._execute)
+
+    async def _execute(self, sql, params):
+        if sql == CLAIM_SQL:
+            key, request_hash, _, expires_at, _ = params
+            if key in self.rows:
+                return 0, []
+            self.rows[key] = {
+                "request_hash": request_hash,
+                "status_code": None,
+                "response": None,
+                "expires_at": expires_at,
+            }
+            return 1, [{"key": key}]
+        if sql == COMPLETE_SQL:
+            key, status_code, response = params
+            self.rows[key].update(status_code=status_code, response=response)
+            return 1, []
+        if sql == RELEASE_SQL:
+            self.rows.pop(params[0], None)
+            return 1, []
+        if sql == SELECT_SQL:
+            row = self.rows.get(params[0])
+            return (1, [row]) if row else (0, [])
+        raise AssertionError(sql)
+
+
+@pytest.fixture
+def connection():
+    connection = FakeConnection()
+    with patch("models.requests.idempotency.connections") as mock_connections:
+        mock_connections.get.return_value = connection
+        yield connection
+
+
+def test_hash_request_ignores_key_order():
+    assert hash_request({"a": 1, "b": 2}) == hash_request({"b": 2, "a": 1})
+    assert hash_request({"a": 1}) != hash_request({"a": 2})
+
+
+@pytest.mark.asyncio
+async def test_without_key_executes_every_time(connection):
+    store = IdempotencyStore()
+    execute = AsyncMock(return_value={"id": 1})
+    await store.run("requests.create", None, "alice", {}, execute)
+    await store.run("requests.create", None, "alice", {}, execute)
+    assert execute.await_count == 2
+    connection.execute_query.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_retry_returns_stored_response(connection):
+    store = IdempotencyStore()
+    execute = AsyncMock(return_value={"requestid": "R1"})
+
+    first = await store.run("requests.create", "k1", "alice", {"unit": 1}, execute)
+    second = await store.run("requests.create", "k1", "alice", {"unit": 1}, execute)
+
+    assert first == second == {"requestid": "R1"}
+    execute.assert_awaited_once()
+    (row,) = connection.rows.values()
+    assert json.loads(row["response"]) == {"requestid": "R1"}
+    # the replay came from memory, no second claim
+    assert connection.execute_query.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_keys_are_scoped_per_user_and_route(connection):
+    store = IdempotencyStore()
+    execute = AsyncMock(return_value={})
+    await store.run("requests.create", "k1", "alice", {}, execute)
+    await store.run("requests.create", "k1", "bob", {}, execute)
+    await store.run("inventory.create", "k1", "alice", {}, execute)
+    assert execute.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_reused_key_with_other_body(connection):
+    store = IdempotencyStore()
+    await store.run("requests.create", "k1", "alice", {"unit": 1}, AsyncMock(return_value={}))
+    with pytest.raises(HTTPException) as excinfo:
+        await store.run("requests.create", "k1", "alice", {"unit": 2}, AsyncMock())
+    assert excinfo.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_wait_for_first(connection):
+    store = IdempotencyStore()
+    release = asyncio.Event()
+    calls = 0
+
+    async def execute():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return {"requestid": "R1"}
+
+    tasks = [
+        asyncio.create_task(store.run("requests.create", "k1", "alice", {}, execute))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0.01)
+    release.set()
+    results = await asyncio.gather(*tasks)
+
+    assert calls == 1
+    assert results == [{"requestid": "R1"}] * 5
+
+
+@pytest.mark.asyncio
+async def test_failure_is_not_stored(connection):
+    store = IdempotencyStore()
+    failing = AsyncMock(side_effect=HTTPException(status_code=400, detail="bad"))
+    with pytest.raises(HTTPException):
+        await store.run("requests.create", "k1", "alice", {}, failing)
+    assert connection.rows == {}
+
+    execute = AsyncMock(return_value={"requestid": "R1"})
+    assert await store.run("requests.create", "k1", "alice", {}, execute) == {
+        "requestid": "R1"
+    }
+
+
+@pytest.mark.asyncio
+async def test_response_stored_by_other_worker(connection):
+    writer, reader = IdempotencyStore(), IdempotencyStore()
+    await writer.run("requests.create", "k1", "alice", {}, AsyncMock(return_value={"requestid": "R1"}))
+    execute = AsyncMock()
+    assert await reader.run("requests.create", "k1", "alice", {}, execute) == {
+        "requestid": "R1"
+    }
+    execute.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_gives_up_waiting_for_other_worker(connection):
+    store = IdempotencyStore()
+    key = store.record_key("requests.create", "alice", "k1")
+    connection.rows[key] = {
+        "request_hash": hash_request({}),
+        "status_code": None,
+        "response": None,
+        "expires_at": None,
+    }
+    with patch("models.requests.idempotency.IDEMPOTENCY_WAIT_SECONDS", 0):
+        with pytest.raises(HTTPException) as excinfo:
+            await store.run("requests.create", "k1", "alice", {}, AsyncMock())
+    assert excinfo.value.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_cache_is_bounded(connection):
+    store = IdempotencyStore(cache_size=2)
+    for key in ("k1", "k2", "k3"):
+        await store.run("requests.create", key, "alice", {}, AsyncMock(return_value={}))
+    assert len(store._cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_sweep():
+    store = IdempotencyStore()
+    store._remember("old", 0, "h", {})
+    connection = MagicMock()
+    connection.execute_query = AsyncMock(return_value=(4, []))
+    with patch("models.requests.idempotency.connections") as mock_connections:
+        mock_connections.get.return_value = connection
+        assert await store.sweep() == 4
+    assert store._cache == {}
@@ -0,0 +1,236 @@
+import asyncio
+from datetime import datetime, time, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from models.requests.periodic import (RECORD_RUN_SQL, TRY_LOCK_SQL, UNLOCK_SQL,
+                                      DailyTask, PeriodicTask,
+                                      WriteBehindBuffer)
+
+
+class Counter(PeriodicTask):
+    description = "count"
+
+    def __init__(self, interval, fail=0):
+        super().__init__(interval)
+        self.ticks = 0
+        self.fail = fail
+        self.stopped = False
+
+    async def tick(self):
+        self.ticks += 1
+        if self.ticks <= self.fail:
+            raise ConnectionError("db down")
+
+    async def on_stop(self):
+        self.stopped = True
+
+
+class Buffer(WriteBehindBuffer):
+    def __init__(self, interval=3600, fail=False):
+        super().__init__(interval)
+        self.fail = fail
+        self.written = []
+
+    async def write(self, pending):
+        if self.fail:
+            raise ConnectionError("db down")
+        self.written.append(dict(pending))
+
+
+@pytest.mark.asyncio
+async def test_ticks_every_interval_and_survives_failures(caplog):
+    task = Counter(interval=0.01, fail=2)
+    task.start()
+    await asyncio.sleep(0.06)
+    await task.stop()
+
+    assert task.ticks > 2
+    assert "Failed to count: db down" in caplog.text
+    assert task._task is None and task.stopped
+
+
+@pytest.mark.asyncio
+async def test_run_first_ticks_before_sleeping():
+    task = Counter(interval=3600)
+    task.run_first = True
+    task.start()
+    await asyncio.sleep(0)
+    await task.stop()
+    assert task.ticks == 1
+
+
+@pytest.mark.asyncio
+async def test_start_twice_runs_one_task():
+    task = Counter(interval=3600)
+    task.start()
+    first = task._task
+    task.start()
+    assert task._task is first
+    await task.stop()
+    # stop without start is fine
+    await task.stop()
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_pending_once():
+    buffer = Buffer()
+    buffer._pending = {"a": 1, "b": 2}
+    assert await buffer.flush() == 2
+    assert await buffer.flush() == 0
+    assert buffer.written == [{"a": 1, "b": 2}]
+    assert len(buffer) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_restores_without_overwriting_newer():
+    buffer = Buffer(fail=True)
+    buffer._pending = {"a": 1, "b": 2}
+
+    async def write(pending):
+        # A newer entry arrives while the write is in flight
+        buffer._pending["a"] = 10
+        raise ConnectionError("db down")
+
+    buffer.write = write
+    with pytest.raises(ConnectionError):
+        await buffer.flush()
+    assert buffer._pending == {"a": 10, "b": 2}
+
+
+@pytest.mark.asyncio
+async def test_stop_flushes_pending():
+    buffer = Buffer(interval=3600)
+    buffer.start()
+    buffer._pending["a"] = 1
+    await buffer.stop()
+    assert buffer.written == [{"a": 1}]
+
+
+@pytest.mark.asyncio
+async def test_background_task_flushes_periodically():
+    buffer = Buffer(interval=0.01)
+    buffer.start()
+    buffer._pending["a"] = 1
+    await asyncio.sleep(0.05)
+    await buffer.stop()
+    assert buffer.written == [{"a": 1}]
+
+
+class Nightly(DailyTask):
+    name = "nightly"
+    description = "run nightly"
+
+    def __init__(self, fail=False):
+        super().__init__(time(2, 0))
+        self.ticks = 0
+        self.fail = fail
+
+    async def tick(self):
+        self.ticks += 1
+        if self.fail:
+            raise ConnectionError("db down")
+
+
+def lock_connection(locked=True, last_run=None):
+    """A pooled connection for DailyTask: whether the lock is free, the last run."""
+    connection = MagicMock()
+    connection.fetchval = AsyncMock(side_effect=[locked, last_run, True])
+    connection.execute = AsyncMock()
+    acquire = MagicMock()
+    acquire.return_value.__aenter__ = AsyncMock(return_value=connection)
+    acquire.return_value.__aexit__ = AsyncMock(return_value=False)
+    client = MagicMock()
+    client.acquire_connection = acquire
+    return client, connection
+
+
+NOW = datetime(2026, 10, 20, 2, 30, tzinfo=timezone.utc)
+
+
+def test_due_is_the_latest_run_at_or_before_now():
+    task = Nightly()
+    assert task.due(NOW) == datetime(2026, 10, 20, 2, 0, tzinfo=timezone.utc)
+    assert task.due(datetime(2026, 10, 20, 1, 59, tzinfo=timezone.utc)) == datetime(
+        2026, 10, 19, 2, 0, tzinfo=timezone.utc
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("last_run", [None, datetime(2026, 10, 19, 2, 0, tzinfo=timezone.utc)])
+async def test_daily_task_runs_when_overdue_and_records_it(last_run):
+    task = Nightly()
+    client, connection = lock_connection(last_run=last_run)
+
+    with patch("models.requests.periodic.connections") as mock_connections:
+        mock_connections.get.return_value = client
+        assert await task.run_due(NOW) is True
+
+    assert task.ticks == 1
+    connection.execute.assert_awaited_once_with(RECORD_RUN_SQL, "nightly", NOW)
+    assert connection.fetchval.await_args_list[0].args == (TRY_LOCK_SQL, "nightly")
+    assert connection.fetchval.await_args_list[-1].args == (UNLOCK_SQL, "nightly")
+
+
+@pytest.mark.asyncio
+async def test_daily_task_skips_a_run_that_happened():
+    task = Nightly()
+    client, connection = lock_connection(last_run=datetime(2026, 10, 20, 2, 0, 5, tzinfo=timezone.utc))
+
+    with patch("models.requests.periodic.connections") as mock_connections:
+        mock_connections.get.return_value = client
+        assert await task.run_due(NOW) is False
+
+    assert task.ticks == 0
+    connection.execute.assert_not_awaited()
+    assert connection.fetchval.await_args_list[-1].args == (UNLOCK_SQL, "nightly")
+
+
+@pytest.mark.asyncio
+async def test_daily_task_skips_while_another_worker_runs_it():
+    task = Nightly()
+    client, connection = lock_connection(locked=False)
+
+    with patch("models.requests.periodic.connections") as mock_connections:
+        mock_connections.get.return_value = client
+        assert await task.run_due(NOW) is False
+
+    assert task.ticks == 0
+    assert connection.fetchval.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_daily_run_is_not_recorded(caplog):
+    task = Nightly(fail=True)
+    client, connection = lock_connection()
+
+    with patch("models.requests.periodic.connections") as mock_connections:
+        mock_connections.get.return_value = client
+        await task._tick()
+
+    assert "Failed to run nightly: db down" in caplog.text
+    connection.execute.assert_not_awaited()
+    assert connection.fetchval.await_args_list[-1].args == (UNLOCK_SQL, "nightly")
+
+
+@pytest.mark.asyncio
+async def test_daily_task_checks_on_start_then_sleeps_until_at():
+    task = Nightly()
+    task.run_due = AsyncMock(return_value=False)
+    sleeps = []
+
+    async def sleep(seconds):
+        sleeps.append(seconds)
+        raise asyncio.CancelledError
+
+    with patch("models.requests.periodic.datetime") as mock_datetime, patch(
+        "models.requests.periodic.asyncio.sleep", sleep
+    ):
+        mock_datetime.now.return_value = NOW
+        mock_datetime.combine = datetime.combine
+        with pytest.raises(asyncio.CancelledError):
+            await task._run()
+
+    task.run_due.assert_awaited_once()
+    assert sleeps == [23.5 * 3600]
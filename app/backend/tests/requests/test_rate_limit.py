@@ -0,0 +1,219 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from main import app, auth_handler
+from models.requests.rate_limit import (MIN_RETRY_SECONDS, PRUNE_SQL,
+                                        TAKE_SQL, MemoryBuckets,
+                                        PostgresBuckets, RateLimiter,
+                                        RouteLimit, TokenBucket)
+
+LIMITS = {
+    "login_ip": RouteLimit("login_ip", 60, 3),
+    "login_username": RouteLimit("login_username", 60, 2, key="username"),
+}
+
+
+def make_client(limiter, *names):
+    app = FastAPI()
+    handler = AsyncMock(return_value={"ok": True})
+
+    @app.post("/login", dependencies=[Depends(limiter.limit(*names))])
+    async def login(payload: dict):
+        return await handler(payload)
+
+    return TestClient(app), handler
+
+
+def test_token_bucket():
+    bucket = TokenBucket(60, burst=2)
+    now = bucket.updated
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == 0
+    assert bucket.take(now) == pytest.approx(1.0)
+    # one token a second
+    assert bucket.take(now + 1) == 0
+
+
+def test_token_bucket_allows_the_rate_after_draining():
+    bucket = TokenBucket(30, burst=1)
+    now = bucket.updated
+    assert bucket.take(now) == 0
+    # Retrying early costs nothing, so calls every 2 s keep getting in
+    assert bucket.take(now + 1) == pytest.approx(1.0)
+    for call in range(1, 6):
+        assert bucket.take(now + 2 * call) == 0
+        assert bucket.take(now + 2 * call + 0.5) > 0
+
+
+def test_rejected_postgres_take_leaves_the_bucket_alone():
+    # The update is conditional; the deficit comes from the unchanged row
+    assert 'WHERE LEAST($2, b."tokens"' in TAKE_SQL
+    assert "GREATEST(-1" not in TAKE_SQL
+    assert 'SELECT false' in TAKE_SQL
+
+
+@patch("models.requests.rate_limit.ROUTE_LIMITS", LIMITS)
+def test_rejects_before_endpoint_runs():
+    limiter = RateLimiter(backend="memory")
+    client, handler = make_client(limiter, "login_ip")
+
+    headers = {"X-Real-IP": "10.0.0.1"}
+    statuses = [
+        client.post("/login", json={}, headers=headers).status_code for _ in range(4)
+    ]
+
+    assert statuses == [200, 200, 200, 429]
+    assert handler.await_count == 3
+    response = client.post("/login", json={}, headers=headers)
+    assert int(response.headers["Retry-After"]) >= 1
+    assert limiter.get_metrics()["limits"]["login_ip"]["rejected"] == 2
+
+
+@patch("models.requests.rate_limit.ROUTE_LIMITS", LIMITS)
+def test_username_limit_is_per_username():
+    limiter = RateLimiter(backend="memory")
+    client, _ = make_client(limiter, "login_username")
+
+    alice = [
+        client.post("/login", json={"username": "Alice"}).status_code
+        for _ in range(3)
+    ]
+    bob = client.post("/login", json={"username": "bob"}).status_code
+
+    assert alice == [200, 200, 429]
+    assert bob == 200
+    # no username in the body: nothing to count by
+    assert client.post("/login", json={}).status_code == 200
+
+
+@patch("models.requests.rate_limit.ROUTE_LIMITS", LIMITS)
+def test_ip_comes_from_proxy_header():
+    limiter = RateLimiter(backend="memory")
+    client, _ = make_client(limiter, "login_ip")
+    for _ in range(3):
+        client.post("/login", json={}, headers={"X-Real-IP": "10.0.0.1"})
+    blocked = client.post("/login", json={}, headers={"X-Real-IP": "10.0.0.1"})
+    other = client.post("/login", json={}, headers={"X-Real-IP": "10.0.0.2"})
+    assert blocked.status_code == 429
+    assert other.status_code == 200
+
+
+def test_unknown_limit_name():
+    with pytest.raises(ValueError):
+        RateLimiter(backend="memory").limit("nope")
+
+
+@pytest.mark.asyncio
+async def test_memory_prune_drops_full_buckets():
+    buckets = MemoryBuckets()
+    limit = RouteLimit("write", 60, 2)
+    await buckets.take("write:a", limit)
+    await buckets.take("write:b", limit)
+    now = buckets._buckets["write:a"].updated
+    buckets._buckets["write:b"].updated = now - 10
+
+    assert await buckets.prune(now) == 1
+    assert list(buckets._buckets) == ["write:a"]
+
+
+@pytest.mark.asyncio
+async def test_postgres_take():
+    buckets = PostgresBuckets()
+    limit = RouteLimit("write", 120, 10)
+    connection = MagicMock()
+    connection.execute_query = AsyncMock(return_value=(1, [{"allowed": True, "tokens": 4.0}]))
+
+    with patch("models.requests.rate_limit.connections") as mock_connections:
+        mock_connections.get.return_value = connection
+        assert await buckets.take("write:10.0.0.1", limit) == 0
+        # 0.2 tokens refilled, 0.8 missing at 2 a second
+        connection.execute_query.return_value = (1, [{"allowed": False, "tokens": -0.8}])
+        assert await buckets.take("write:10.0.0.1", limit) == pytest.approx(0.4)
+        # Refilled by a concurrent call since the statement started
+        connection.execute_query.return_value = (1, [{"allowed": False, "tokens": 0.5}])
+        assert await buckets.take("write:10.0.0.1", limit) == MIN_RETRY_SECONDS
+
+    connection.execute_query.assert_awaited_with(TAKE_SQL, ["write:10.0.0.1", 10.0, 2.0])
+
+
+@pytest.mark.asyncio
+async def test_postgres_prune():
+    buckets = PostgresBuckets()
+    connection = MagicMock()
+    connection.execute_query = AsyncMock(return_value=(3, []))
+    with patch("models.requests.rate_limit.ROUTE_LIMITS", LIMITS), patch(
+        "models.requests.rate_limit.connections"
+    ) as mock_connections:
+        mock_connections.get.return_value = connection
+        assert await buckets.prune() == 3
+    connection.execute_query.assert_awaited_once_with(PRUNE_SQL, [3.0])
+
+
+@patch("models.requests.rate_limit.ROUTE_LIMITS", LIMITS)
+def test_shared_backend_failure_lets_requests_through():
+    limiter = RateLimiter(backend="postgres")
+    limiter.store.take = AsyncMock(side_effect=ConnectionError("db down"))
+    client, handler = make_client(limiter, "login_ip")
+    response = client.post("/login", json={}, headers={"X-Real-IP": "10.0.0.1"})
+    assert response.status_code == 200
+    handler.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_background_task_prunes():
+    limiter = RateLimiter(backend="memory", interval=0.01)
+    limiter.store.prune = AsyncMock(return_value=0)
+    limiter.start()
+    await asyncio.sleep(0.05)
+    await limiter.stop()
+    assert limiter.store.prune.await_count >= 1
+    assert limiter._task is None
+
+
+@patch(
+    "models.requests.rate_limit.ROUTE_LIMITS",
+    {"write": RouteLimit("write", 60, 2, key="principal")},
+)
+def test_write_limit_is_per_principal():
+    limiter = RateLimiter(backend="memory")
+    client, _ = make_client(limiter, "write")
+    token = auth_handler.encode_token("alice", ["ADMIN"])
+    # Same IP throughout, so only the principal tells the callers apart
+    ip = {"X-Real-IP": "10.0.0.1"}
+    alice = {**ip, "Authorization": f"Bearer {token}"}
+
+    assert [client.post("/login", json={}, headers=alice).status_code for _ in range(3)] == [
+        200,
+        200,
+        429,
+    ]
+    # API keys are held to their own rate_limit_per_minute instead
+    api_key = {**ip, "X-API-Key": "sct_a"}
+    assert [client.post("/login", json={}, headers=api_key).status_code for _ in range(3)] == [200] * 3
+    assert client.post("/login", json={}, headers=ip).status_code == 200
+    # A forged token is counted by IP, not as alice
+    forged = {**ip, "Authorization": "Bearer not.a.token"}
+    assert client.post("/login", json={}, headers=forged).status_code == 200
+    assert client.post("/login", json={}, headers=forged).status_code == 429
+
+
+def test_metrics_require_admin():
+    client = TestClient(app)
+    handler = auth_handler
+
+    assert client.get("/metrics/rate-limits").status_code == 403
+    fulfiller = handler.encode_token("bob", ["FULFILLER"])
+    response = client.get(
+        "/metrics/rate-limits", headers={"Authorization": f"Bearer {fulfiller}"}
+    )
+    assert response.status_code == 403
+    admin = handler.encode_token("alice", ["ADMIN"])
+    response = client.get(
+        "/metrics/rate-limits", headers={"Authorization": f"Bearer {admin}"}
+    )
+    assert response.status_code == 200
+    assert response.json()["limits"]["write"]["key"] == "principal"
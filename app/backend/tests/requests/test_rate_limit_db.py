@@ -0,0 +1,78 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+from tortoise import Tortoise, connections
+
+from models.requests.rate_limit import PostgresBuckets, RouteLimit
+
+# These tests need the real ratelimitbucket table, e.g. inside docker compose.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("DATABASE_TEST_URL"),
+    reason="DATABASE_TEST_URL is not set",
+)
+
+# Moves the bucket's clock back, as if ``$2`` seconds had passed
+ELAPSE_SQL = (
+    'UPDATE "ratelimitbucket" SET "updated_at" = "updated_at" - make_interval(secs => $2) '
+    'WHERE "key" = $1'
+)
+BUCKET_SQL = 'SELECT "tokens", "updated_at" FROM "ratelimitbucket" WHERE "key" = $1'
+
+
+@pytest.fixture(scope="module")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+async def db():
+    await Tortoise.init(
+        db_url=os.environ.get("DATABASE_TEST_URL"),
+        modules={"models": ["models.accounts.tortoise"]},
+    )
+    await Tortoise.generate_schemas()
+    yield connections.get("default")
+    await Tortoise.close_connections()
+
+
+@pytest.fixture
+async def key(db):
+    key = f"login_ip:test-{uuid.uuid4().hex[:12]}"
+    yield key
+    await db.execute_query('DELETE FROM "ratelimitbucket" WHERE "key" = $1', [key])
+
+
+@pytest.mark.asyncio
+async def test_calls_at_the_rate_get_in_after_draining(db, key):
+    buckets = PostgresBuckets()
+    limit = RouteLimit("login_ip", 30, 1)
+    assert await buckets.take(key, limit) == 0
+    assert await buckets.take(key, limit) > 0
+
+    for _ in range(5):
+        # Retrying early is rejected without touching the bucket
+        _, before = await db.execute_query(BUCKET_SQL, [key])
+        assert await buckets.take(key, limit) > 0
+        _, after = await db.execute_query(BUCKET_SQL, [key])
+        assert after == before
+
+        # One call every 2 s, the configured 30 a minute, always gets in
+        await db.execute_query(ELAPSE_SQL, [key, 2.0])
+        assert await buckets.take(key, limit) == 0
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_enough(db, key):
+    buckets = PostgresBuckets()
+    limit = RouteLimit("login_ip", 30, 1)
+    await buckets.take(key, limit)
+
+    retry_after = await buckets.take(key, limit)
+    await db.execute_query(ELAPSE_SQL, [key, retry_after])
+
+    assert retry_after == pytest.approx(2.0, abs=0.1)
+    assert await buckets.take(key, limit) == 0
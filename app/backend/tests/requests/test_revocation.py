@@ -0,0 +1,127 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from models.requests.revocation import CHANGES_SQL, RevocationList
+
+
+def make_row(id, jti, expires_at=datetime(2100, 1, 1, tzinfo=timezone.utc)):
+    return {"id": id, "jti": jti, "expires_at": expires_at}
+
+
+def test_is_revoked():
+    revoked = RevocationList()
+    revoked.add("abc", time.time() + 60)
+    assert revoked.is_revoked("abc")
+    assert "abc" in revoked
+    assert not revoked.is_revoked("def")
+    assert not revoked.is_revoked(None)
+
+
+def test_prune_drops_expired_entries():
+    revoked = RevocationList()
+    revoked.add("old", 100)
+    revoked.add("new", 300)
+    assert revoked.prune(now=200) == 1
+    assert not revoked.is_revoked("old")
+    assert revoked.is_revoked("new")
+
+
+@pytest.mark.asyncio
+async def test_refresh_loads_changes_since_last_id():
+    revoked = RevocationList(rescan=0)
+    connection = MagicMock()
+    connection.execute_query = AsyncMock(
+        return_value=(2, [make_row(4, "abc"), make_row(7, "def")])
+    )
+
+    with patch("models.requests.revocation.connections") as mock_connections:
+        mock_connections.get.return_value = connection
+        assert await revoked.refresh() == 2
+        connection.execute_query.return_value = (0, [])
+        assert await revoked.refresh() == 0
+
+    assert revoked.is_revoked("abc") and revoked.is_revoked("def")
+    assert revoked.last_id == 7
+    first, second = connection.execute_query.await_args_list
+    assert first.args[0] == CHANGES_SQL
+    assert first.args[1][0] == 0
+    assert second.args[1][0] == 7
+    # asyncpg needs an aware datetime for timestamptz
+    assert second.args[1][1].tzinfo is not None
+
+
+@pytest.mark.asyncio
+async def test_refresh_pages_through_large_feeds():
+    revoked = RevocationList(rescan=0)
+    connection = MagicMock()
+    pages = [
+        (2, [make_row(1, "a"), make_row(2, "b")]),
+        (1, [make_row(3, "c")]),
+    ]
+    connection.execute_query = AsyncMock(side_effect=pages)
+
+    with patch("models.requests.revocation.REVOCATION_BATCH_SIZE", 2), patch(
+        "models.requests.revocation.connections"
+    ) as mock_connections:
+        mock_connections.get.return_value = connection
+        assert await revoked.refresh() == 3
+
+    assert len(revoked) == 3
+    assert connection.execute_query.await_args_list[1].args[1][0] == 2
+
+
+@pytest.mark.asyncio
+async def test_refresh_picks_up_rows_committed_out_of_id_order():
+    revoked = RevocationList(rescan=60)
+    connection = MagicMock()
+    connection.execute_query = AsyncMock(
+        side_effect=[
+            # id 2 was allocated but not yet committed
+            (2, [make_row(1, "a"), make_row(3, "c")]),
+            (3, [make_row(1, "a"), make_row(2, "b"), make_row(3, "c")]),
+        ]
+    )
+
+    with patch("models.requests.revocation.connections") as mock_connections:
+        mock_connections.get.return_value = connection
+        assert await revoked.refresh() == 2
+        assert await revoked.refresh() == 1
+
+    assert revoked.is_revoked("b")
+    assert len(revoked) == 3
+    # Still inside the rescan window, so reading starts over
+    assert connection.execute_query.await_args_list[1].args[1][0] == 0
+
+
+def test_rescan_starts_at_the_last_id_of_an_old_enough_refresh():
+    revoked = RevocationList(rescan=60)
+    revoked._checkpoints.extend([(100.0, 5), (130.0, 9), (170.0, 12), (200.0, 15)])
+
+    assert revoked._rescan_from(150.0) == 0
+    assert revoked._rescan_from(195.0) == 9
+    assert revoked._rescan_from(300.0) == 15
+    # Checkpoints older than needed are dropped
+    assert list(revoked._checkpoints) == [(200.0, 15)]
+
+
+@pytest.mark.asyncio
+async def test_background_task_survives_db_errors():
+    revoked = RevocationList(interval=0.01)
+    connection = MagicMock()
+    connection.execute_query = AsyncMock(
+        side_effect=[ConnectionError("db down"), (1, [make_row(1, "abc")])]
+        + [(0, [])] * 100
+    )
+
+    with patch("models.requests.revocation.connections") as mock_connections:
+        mock_connections.get.return_value = connection
+        revoked.start()
+        await asyncio.sleep(0.05)
+        await revoked.stop()
+
+    assert revoked.is_revoked("abc")
+    assert revoked._task is None
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Response
+
+from models.requests.versioning import (VersionConflictError, expected_version,
+                                        parse_if_match, set_etag,
+                                        version_conflict)
+
+
+@pytest.mark.parametrize(
+    "header, version",
+    [(None, None), ("*", None), ("3", 3), ('"3"', 3), ('W/"3"', 3), (' "12" ', 12)],
+)
+def test_parse_if_match(header, version):
+    assert parse_if_match(header) == version
+
+
+@pytest.mark.parametrize("header", ['"abc"', '"1", "2"', "-1"])
+def test_parse_if_match_rejects_other_values(header):
+    with pytest.raises(HTTPException) as exc:
+        parse_if_match(header)
+    assert exc.value.status_code == 400
+
+
+def test_expected_version_from_header_or_body():
+    assert expected_version('"2"', None) == 2
+    assert expected_version(None, 5) == 5
+    assert expected_version('"2"', 2) == 2
+    assert expected_version(None, None) is None
+
+
+def test_expected_version_disagreement():
+    with pytest.raises(HTTPException) as exc:
+        expected_version('"2"', 3)
+    assert exc.value.status_code == 400
+
+
+def test_version_conflict_is_412():
+    exc = version_conflict(VersionConflictError("stale"))
+    assert exc.status_code == 412
+    assert exc.detail == "stale"
+
+
+@pytest.mark.parametrize(
+    "row, etag",
+    [({"version": 3}, '"3"'), (SimpleNamespace(version=7), '"7"'), ({}, None), ({"version": None}, None)],
+)
+def test_set_etag(row, etag):
+    response = Response()
+    set_etag(response, row)
+    assert response.headers.get("ETag") == etag
+    # Called directly, e.g. from tests, there may be no response
+    set_etag(None, row)
@@ -0,0 +1,175 @@
+from datetime import date, datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.summaries import crud, forecasting
+from api.summaries.forecasting import (DemandForecaster, croston, demand_matrix,
+                                       exponential_smoothing, forecast)
+from api.summaries.summaries import auth_handler, router
+from models.summaries.pydantic import ForecastMethod, ProductForecastSchema
+
+app = FastAPI()
+app.include_router(router, prefix="/summaries")
+client = TestClient(app)
+
+FORECAST_ROW = {
+    "productid": "P001",
+    "method": "CROSTON(间歇需求)",
+    "dailydemand": 0.5,
+    "demandstd": 1.2,
+    "leadtimedemand": 2.5,
+    "safetystock": 4.4,
+    "reorderpoint": 7,
+    "reorderlevel": 10,
+    "historydays": 1095,
+    "computedat": datetime(2026, 10, 19, tzinfo=timezone.utc),
+}
+
+
+def smoothed(values, alpha):
+    level = values[0]
+    for value in values[1:]:
+        level += alpha * (value - level)
+    return level
+
+
+def croston_by_hand(row, alpha):
+    size = interval = None
+    since = 1
+    for value in row:
+        if value > 0:
+            if size is None:
+                size, interval = value, since
+            else:
+                size += alpha * (value - size)
+                interval += alpha * (since - interval)
+            since = 0
+        since += 1
+    return 0.0 if size is None else (1 - alpha / 2) * size / interval
+
+
+@pytest.fixture
+def demand():
+    rng = np.random.default_rng(3)
+    matrix = rng.poisson(rng.uniform(0.05, 3, (40, 1)), (40, 200)).astype(np.float32)
+    matrix[0] = 0
+    return matrix
+
+
+def test_exponential_smoothing_matches_the_recursion(demand):
+    fitted = exponential_smoothing(demand, 0.2)
+    assert fitted == pytest.approx([smoothed(row.tolist(), 0.2) for row in demand], rel=1e-5)
+
+
+def test_croston_matches_the_recursion(demand):
+    fitted = croston(demand, 0.1)
+    assert fitted == pytest.approx([croston_by_hand(row.tolist(), 0.1) for row in demand], rel=1e-4)
+
+
+def test_demand_matrix_sums_requests_of_the_same_day():
+    history = {
+        "P2": (np.array([0, 0, 3]), np.array([1.0, 2.0, 5.0])),
+        "P9": (np.array([1]), np.array([4.0])),
+    }
+
+    matrix = demand_matrix(["P1", "P2"], history, 4)
+
+    assert matrix.tolist() == [[0, 0, 0, 0], [3, 0, 0, 5]]
+
+
+def test_forecast_picks_a_method_per_product():
+    steady = np.full(100, 2.0)
+    sparse = np.zeros(100)
+    # Every tenth day, the first ten days in
+    sparse[9::10] = 6
+    matrix = np.stack([steady, sparse, np.zeros(100)]).astype(np.float32)
+
+    result = forecast(matrix, [4, 9, 3], alpha=0.1, service_level=0.95)
+
+    assert result.method.tolist() == [
+        ForecastMethod.EXPONENTIAL_SMOOTHING.value,
+        ForecastMethod.CROSTON.value,
+        ForecastMethod.NO_DEMAND.value,
+    ]
+    assert result.daily[0] == pytest.approx(2.0)
+    # 6 every 10 days, less the Syntetos-Boylan correction
+    assert result.daily[1] == pytest.approx(0.6 * 0.95)
+    # Steady demand needs no safety stock
+    assert result.safety_stock[0] == pytest.approx(0, abs=1e-9)
+    assert result.reorder_point.tolist() == [
+        8,
+        int(np.ceil(0.57 * 9 + 1.6448536 * matrix[1].std() * 3)),
+        0,
+    ]
+
+
+@pytest.mark.asyncio
+async def test_run_stores_every_product_in_chunks(query_log):
+    query_log.returns(
+        [{"productid": "P1", "leadtime": 5}, {"productid": "P2", "leadtime": 2},
+         {"productid": "P3", "leadtime": 1}],
+        [{"productid": "P2", "days": [0, 9], "units": [3, 1]}],
+    )
+    forecaster = DemandForecaster(history_days=10, chunk_size=2)
+
+    assert await forecaster.run(today=date(2026, 10, 19)) == 3
+
+    assert query_log.statements[1] == (
+        forecasting.DEMAND_SQL, [date(2026, 10, 9), date(2026, 10, 19)]
+    )
+    first, second = query_log.statements[2], query_log.statements[3]
+    assert first[0] == second[0] == forecasting.UPSERT_SQL
+    assert first[1][0] == ["P1", "P2"]
+    assert first[1][1] == [ForecastMethod.NO_DEMAND.value, ForecastMethod.CROSTON.value]
+    assert second[1][0] == ["P3"]
+    assert first[1][7] == 10
+    # Forecasts of products that are gone are dropped after the run
+    sql, params = query_log.statements[4]
+    assert sql == forecasting.DELETE_STALE_SQL
+    assert params == [first[1][8]]
+
+
+@pytest.mark.asyncio
+async def test_get_product_forecast(query_log):
+    query_log.returns([FORECAST_ROW])
+
+    result = await crud.get_product_forecast("P001")
+
+    assert query_log.statements == [(crud.PRODUCT_FORECAST_SQL, ["P001"])]
+    assert result.method == ForecastMethod.CROSTON
+    assert result.reorderlevel == 10
+
+
+@pytest.mark.asyncio
+async def test_get_product_forecast_not_found(query_log):
+    with pytest.raises(ValueError):
+        await crud.get_product_forecast("P404")
+
+
+@patch("api.summaries.summaries.get_product_forecast", new_callable=AsyncMock)
+def test_product_forecast_endpoint(mock_get):
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: {
+        "username": "boss", "list_of_roles": ["ADMIN"]
+    }
+    mock_get.return_value = ProductForecastSchema(**FORECAST_ROW)
+    response = client.get("/summaries/forecasts/P001")
+    assert response.status_code == 200
+    assert response.json()["reorderpoint"] == 7
+
+    mock_get.side_effect = ValueError("No forecast for product P404")
+    response = client.get("/summaries/forecasts/P404")
+    assert response.status_code == 404
+    app.dependency_overrides.clear()
+
+
+def test_product_forecast_requires_a_manager():
+    app.dependency_overrides[auth_handler.auth_wrapper] = lambda: {
+        "username": "alice", "list_of_roles": ["REQUESTOR"]
+    }
+    response = client.get("/summaries/forecasts/P001")
+    assert response.status_code == 403
+    app.dependency_overrides.clear()
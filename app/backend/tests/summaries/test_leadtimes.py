@@ -0,0 +1,124 @@
+from datetime import date
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.productrequests.crud import REQUEST_DELETE_SQL, REQUEST_UPDATE_SQL
+from api.summaries import crud
+from api.summaries.summaries import auth_handler, router
+from models.summaries.pydantic import (LeadTimeGroupBy, LeadTimeSummarySchema,
+                                       TimeBucket)
+
+app = FastAPI()
+app.include_router(router, prefix="/summaries")
+client = TestClient(app)
+
+MANAGER = {"username": "boss", "list_of_roles": ["PRODUCTION_MANAGER"]}
+REQUESTOR = {"username": "alice", "list_of_roles": ["REQUESTOR"]}
+
+STATS = {
+    "count": 3,
+    "p50_hours": 20.0,
+    "p90_hours": 60.0,
+    "p95_hours": 65.0,
+    "mean_hours": 30.0,
+    "late": 1,
+    "urgent": 2,
+    "urgent_breached": 1,
+}
+GROUP = {**STATS, "is_group": True, "key": "P001", "bucket": None}
+POINT = {**STATS, "is_group": False, "key": None, "bucket": date(2026, 10, 12)}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    crud.leadtime_cache.invalidate()
+    yield
+    crud.leadtime_cache.invalidate()
+
+
+def test_request_writes_keep_the_lead_time_extract():
+    assert 'INSERT INTO "request_leadtime"' in REQUEST_UPDATE_SQL
+    assert 'DELETE FROM "request_leadtime"' in REQUEST_UPDATE_SQL
+    assert 'DELETE FROM "request_leadtime"' in REQUEST_DELETE_SQL
+
+
+@pytest.mark.asyncio
+async def test_lead_times_query(query_log):
+    query_log.returns([GROUP, POINT])
+
+    summary = await crud.get_lead_times(
+        LeadTimeGroupBy.PRODUCT, TimeBucket.WEEK, date(2026, 10, 1), date(2026, 10, 31)
+    )
+
+    sql, params = query_log.statements[0]
+    assert '"productid" AS "key"' in sql
+    assert 'GROUPING SETS (("key"), ("bucket"))' in sql
+    assert "percentile_cont(ARRAY[0.5, 0.9, 0.95])" in sql
+    # The end date is included, the query takes the day after it
+    assert params == [
+        date(2026, 10, 1), date(2026, 11, 1), None, None, crud.LEADTIME_URGENT_SLA_HOURS, "week"
+    ]
+    assert [g.key for g in summary.groups] == ["P001"]
+    assert [p.bucket for p in summary.trend] == [date(2026, 10, 12)]
+    assert summary.groups[0].urgent_breached == 1
+
+
+@pytest.mark.asyncio
+async def test_lead_times_are_cached_until_invalidated(query_log):
+    query_log.returns([GROUP], [GROUP])
+    args = (LeadTimeGroupBy.NONE, TimeBucket.DAY, date(2026, 10, 1), date(2026, 10, 7))
+
+    first = await crud.get_lead_times(*args)
+    second = await crud.get_lead_times(*args)
+    crud.leadtime_cache.invalidate()
+    await crud.get_lead_times(*args)
+
+    assert first is second
+    assert len(query_log) == 2
+
+
+@pytest.fixture
+def as_user():
+    def login(auth_details):
+        app.dependency_overrides[auth_handler.auth_wrapper] = lambda: auth_details
+
+    yield login
+    app.dependency_overrides.clear()
+
+
+def test_lead_times_require_a_manager(as_user):
+    as_user(REQUESTOR)
+
+    response = client.get("/summaries/leadtimes")
+
+    assert response.status_code == 403
+
+
+@patch("api.summaries.summaries.get_lead_times", new_callable=AsyncMock)
+def test_lead_times_endpoint(mock_get, as_user):
+    as_user(MANAGER)
+    mock_get.return_value = LeadTimeSummarySchema(
+        group_by="fulfiller", bucket="month", start=date(2026, 1, 1), end=date(2026, 10, 31),
+        urgent_sla_hours=48, groups=[{**STATS, "key": "bob"}], trend=[POINT],
+    )
+
+    response = client.get(
+        "/summaries/leadtimes?bucket=month&group_by=fulfiller&start=2026-01-01&end=2026-10-31"
+    )
+
+    assert response.status_code == 200
+    assert response.json()["groups"][0]["p90_hours"] == 60.0
+    mock_get.assert_awaited_once_with(
+        LeadTimeGroupBy.FULFILLER, TimeBucket.MONTH, date(2026, 1, 1), date(2026, 10, 31), None, None
+    )
+
+
+def test_lead_times_reject_bad_ranges(as_user):
+    as_user(MANAGER)
+
+    response = client.get("/summaries/leadtimes?start=2026-10-02&end=2026-10-01")
+
+    assert response.status_code == 400
@@ -0,0 +1,215 @@
+from datetime import date
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.summaries import crud
+from api.summaries.rollups import (CLAIM_DAYS_SQL, REBUILD_DAYS_SQL,
+                                   RequestRollupRefresher)
+from api.summaries.summaries import auth_handler, router
+from models.summaries.pydantic import (RequestGroupBy, RequestVolumeSeriesSchema,
+                                       TimeBucket)
+
+app = FastAPI()
+app.include_router(router, prefix="/summaries")
+client = TestClient(app)
+
+MANAGER = {"username": "boss", "list_of_roles": ["PRODUCTION_MANAGER"]}
+REQUESTOR = {"username": "alice", "list_of_roles": ["REQUESTOR"]}
+
+POINT = {
+    "bucket": date(2026, 10, 12),
+    "key": "P001",
+    "total": 4,
+    "urgent": 1,
+    "pending": 1,
+    "approved": 1,
+    "rejected": 1,
+    "fulfilled": 1,
+    "units": 9,
+    "urgent_ratio": 0.25,
+    "approval_rate": 2 / 3,
+    "rejection_rate": 1 / 3,
+    "previous_total": None,
+    "moving_average": 4.0,
+}
+
+
+def transaction_on(connection):
+    transaction = MagicMock()
+    transaction.return_value.__aenter__.return_value = connection
+    transaction.return_value.__aexit__.return_value = False
+    return transaction
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    crud.request_volume_cache.invalidate()
+    yield
+    crud.request_volume_cache.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_refresh_rebuilds_claimed_days_in_batches(query_log):
+    days = [date(2026, 10, d) for d in (1, 2, 3)]
+    query_log.returns([{"day": d} for d in days[:2]], [], [{"day": days[2]}], [])
+    refresher = RequestRollupRefresher(batch_size=2)
+
+    with patch("api.summaries.rollups.in_transaction", transaction_on(query_log)):
+        refreshed = await refresher.refresh()
+
+    assert refreshed == days
+    assert query_log.statements == [
+        (CLAIM_DAYS_SQL, [2]),
+        (REBUILD_DAYS_SQL, [days[:2]]),
+        (CLAIM_DAYS_SQL, [2]),
+        (REBUILD_DAYS_SQL, [days[2:]]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_refresh_without_marked_days_keeps_the_cache(query_log):
+    crud.request_volume_cache.put(("key",), "series", crud.request_volume_cache.generation)
+
+    with patch("api.summaries.rollups.in_transaction", transaction_on(query_log)):
+        refreshed = await RequestRollupRefresher().refresh()
+
+    assert refreshed == []
+    assert query_log.statements == [(CLAIM_DAYS_SQL, [31])]
+    assert crud.request_volume_cache.get(("key",)) == "series"
+
+
+@pytest.mark.asyncio
+async def test_refresh_drops_the_cache(query_log):
+    crud.request_volume_cache.put(("key",), "series", crud.request_volume_cache.generation)
+    query_log.returns([{"day": date(2026, 10, 1)}])
+
+    with patch("api.summaries.rollups.in_transaction", transaction_on(query_log)):
+        await RequestRollupRefresher().refresh()
+
+    assert len(crud.request_volume_cache) == 0
+
+
+def test_rollups_read_requests_by_day_range():
+    # A range on requestdate can use its index, a cast of the column cannot
+    assert 'r."requestdate" >= d."day"' in REBUILD_DAYS_SQL
+    assert "SKIP LOCKED" in CLAIM_DAYS_SQL
+
+
+@pytest.mark.asyncio
+async def test_request_volume_query(query_log):
+    query_log.returns([POINT])
+
+    series = await crud.get_request_volume(
+        TimeBucket.WEEK, RequestGroupBy.PRODUCT, date(2026, 10, 1), date(2026, 10, 31), "P001"
+    )
+
+    sql, params = query_log.statements[0]
+    assert '"requestproductid" AS "key"' in sql
+    assert "lag(\"total\") OVER w" in sql
+    # The end date is included, the query takes the day after it
+    assert params == ["week", date(2026, 10, 1), date(2026, 11, 1), "P001", None]
+    assert series.points[0].approval_rate == pytest.approx(2 / 3)
+    assert series.group_by == RequestGroupBy.PRODUCT
+
+
+@pytest.mark.asyncio
+async def test_request_volume_is_cached(query_log):
+    query_log.returns([POINT], [POINT])
+    args = (TimeBucket.DAY, RequestGroupBy.NONE, date(2026, 10, 1), date(2026, 10, 7))
+
+    first = await crud.get_request_volume(*args)
+    second = await crud.get_request_volume(*args)
+    await crud.get_request_volume(TimeBucket.MONTH, *args[1:])
+
+    assert first is second
+    assert len(query_log) == 2
+
+
+@pytest.mark.asyncio
+async def test_request_volume_racing_a_refresh_is_not_cached(query_log):
+    async def refresh_meanwhile(sql, params=None):
+        crud.request_volume_cache.invalidate()
+        return []
+
+    query_log.execute_query_dict.side_effect = refresh_meanwhile
+    args = (TimeBucket.DAY, RequestGroupBy.NONE, date(2026, 10, 1), date(2026, 10, 7))
+
+    await crud.get_request_volume(*args)
+
+    assert len(crud.request_volume_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_request_volume_cache_expires(query_log, monkeypatch):
+    monkeypatch.setattr(crud.request_volume_cache, "ttl", -1)
+    args = (TimeBucket.DAY, RequestGroupBy.NONE, date(2026, 10, 1), date(2026, 10, 7))
+
+    await crud.get_request_volume(*args)
+    await crud.get_request_volume(*args)
+
+    assert len(query_log) == 2
+
+
+@pytest.fixture
+def as_user():
+    def login(auth_details):
+        app.dependency_overrides[auth_handler.auth_wrapper] = lambda: auth_details
+
+    yield login
+    app.dependency_overrides.clear()
+
+
+def test_request_volume_requires_a_manager(as_user):
+    as_user(REQUESTOR)
+
+    response = client.get("/summaries/requests")
+
+    assert response.status_code == 403
+
+
+@patch("api.summaries.summaries.get_request_volume", new_callable=AsyncMock)
+def test_request_volume_endpoint(mock_get, as_user):
+    as_user(MANAGER)
+    mock_get.return_value = RequestVolumeSeriesSchema(
+        bucket="week", group_by="product", start=date(2026, 10, 1),
+        end=date(2026, 10, 31), points=[POINT],
+    )
+
+    response = client.get(
+        "/summaries/requests?bucket=week&group_by=product&start=2026-10-01&end=2026-10-31"
+    )
+
+    assert response.status_code == 200
+    assert response.json()["points"][0]["key"] == "P001"
+    mock_get.assert_awaited_once_with(
+        TimeBucket.WEEK, RequestGroupBy.PRODUCT, date(2026, 10, 1), date(2026, 10, 31), None, None
+    )
+
+
+@patch("api.summaries.summaries.get_request_volume", new_callable=AsyncMock)
+def test_request_volume_defaults_to_twelve_weeks(mock_get, as_user):
+    as_user(MANAGER)
+    mock_get.return_value = RequestVolumeSeriesSchema(
+        bucket="week", group_by="none", start=date(2026, 7, 28), end=date(2026, 10, 19), points=[]
+    )
+
+    response = client.get("/summaries/requests?end=2026-10-19")
+
+    assert response.status_code == 200
+    _, _, start, end, _, _ = mock_get.await_args.args
+    assert (start, end) == (date(2026, 7, 28), date(2026, 10, 19))
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["start=2026-10-02&end=2026-10-01", "bucket=day&start=2020-01-01&end=2026-10-01"],
+)
+def test_request_volume_rejects_bad_ranges(as_user, query):
+    as_user(MANAGER)
+
+    response = client.get(f"/summaries/requests?{query}")
+
+    assert response.status_code == 400
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import uuid
+from datetime import date, datetime, timezone
+
+import pytest
+from tortoise import Tortoise, connections
+
+from api.productrequests import crud as request_crud
+from api.summaries import crud
+from api.summaries.rollups import RequestRollupRefresher
+from models.productrequests.pydantic import RequestDetailsCreate, RequestStatusUpdate
+from models.summaries.pydantic import RequestGroupBy, TimeBucket
+
+# These tests need a real Postgres, e.g. inside docker compose.
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("DATABASE_TEST_URL"),
+    reason="DATABASE_TEST_URL is not set",
+)
+
+# Rollups are rebuilt from every request of a day, so they get their own schema
+SCHEMA = f"summaries_{uuid.uuid4().hex[:12]}"
+
+INSERT_PRODUCT_SQL = (
+    'INSERT INTO "productdetails" (productid, category, setsubcategory, source, '
+    "productnameen, productnamezh, specification, unit, components, is_sold_independently, "
+    "remarks_temperature, storage_temperature_duration, reorderlevel, targetstocklevel, "
+    "leadtime, version) VALUES ($1, 'C', 'S', 'H', 'EN', 'ZH', 'spec', 'Box(盒)', '[]', "
+    "true, '', '', 0, 0, 0, 1)"
+)
+
+
+@pytest.fixture(scope="module")
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="module")
+async def db():
+    db_url = os.environ.get("DATABASE_TEST_URL")
+    await Tortoise.init(
+        db_url=f"{db_url}{'&' if '?' in db_url else '?'}schema={SCHEMA}",
+        modules={
+            "models": [
+                "models.productlog.tortoise",
+                "models.productrequests.tortoise",
+                "models.summaries.tortoise",
+            ]
+        },
+    )
+    conn = connections.get("default")
+    await conn.execute_script(f'CREATE SCHEMA "{SCHEMA}"')
+    await Tortoise.generate_schemas()
+    await conn.execute_query(INSERT_PRODUCT_SQL, ["P-SUM1"])
+    await conn.execute_query(INSERT_PRODUCT_SQL, ["P-SUM2"])
+    yield conn
+    await conn.execute_script(f'DROP SCHEMA "{SCHEMA}" CASCADE')
+    await Tortoise.close_connections()
+
+
+async def raise_request(productid, requestor, day, urgent=False):
+    return await request_crud.create_request(
+        RequestDetailsCreate(
+            requestorname=requestor,
+            requestdate=datetime(day.year, day.month, day.day, 9, tzinfo=timezone.utc),
+            requestproductid=productid,
+            requestunit=2,
+            is_urgent=urgent,
+            remarks="",
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_only_touched_days_are_rebuilt_and_series_add_up(db):
+    refresher = RequestRollupRefresher()
+    first = await raise_request("P-SUM1", "alice", date(2026, 10, 5), urgent=True)
+    await raise_request("P-SUM1", "bob", date(2026, 10, 6))
+    await raise_request("P-SUM2", "alice", date(2026, 10, 14))
+    assert await refresher.refresh() == [date(2026, 10, 5), date(2026, 10, 6), date(2026, 10, 14)]
+    assert await refresher.refresh() == []
+
+    await request_crud.update_request(first.requestid, RequestStatusUpdate(status="REJECTED"))
+    assert await refresher.refresh() == [date(2026, 10, 5)]
+
+    series = await crud.get_request_volume(
+        TimeBucket.WEEK, RequestGroupBy.PRODUCT, date(2026, 10, 5), date(2026, 10, 25)
+    )
+    points = {(p.key, p.bucket): p for p in series.points}
+    # Every product gets every week, empty ones as zeros
+    assert len(points) == 6
+    week = points[("P-SUM1", date(2026, 10, 5))]
+    assert (week.total, week.urgent, week.rejected, week.pending, week.units) == (2, 1, 1, 1, 4)
+    assert week.rejection_rate == 1.0
+    assert points[("P-SUM1", date(2026, 10, 12))].previous_total == 2
+    assert points[("P-SUM2", date(2026, 10, 12))].total == 1
+
+    await request_crud.delete_request(first.requestid)
+    assert await refresher.refresh() == [date(2026, 10, 5)]
+    crud.request_volume_cache.invalidate()
+    series = await crud.get_request_volume(
+        TimeBucket.MONTH, RequestGroupBy.NONE, date(2026, 10, 1), date(2026, 10, 31)
+    )
+    assert [(p.key, p.total) for p in series.points] == [(None, 2)]